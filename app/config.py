@@ -15,6 +15,33 @@ class Settings(BaseSettings):
 
     # Claude API settings / Claude API設定
     claude_api_key: str = ""
+    claude_api_base_url: str = "https://api.anthropic.com"
+    claude_model: str = "claude-sonnet-4-5"
+    # Model routing: simple receipts try the fast model first / 模型路由：簡單收據先使用小模型
+    claude_fast_model: str = "claude-haiku-4-5"
+    claude_routing_enabled: bool = True
+    claude_routing_max_lines: int = 25
+    claude_routing_min_confidence: float = 0.8
+    claude_routing_amount_tolerance: float = 2.0
+
+    # Layout extractor: known chain receipts skip the AI (opt-in: items have no name_chinese)
+    # 版面規則：已知連鎖店收據略過AI（需手動啟用：商品沒有中文翻譯）
+    layout_extractor_enabled: bool = False
+    # Batched prompts: receipts per request and OCR-text token budget / 批次提示詞：每個請求的收據數與OCR文字token預算
+    claude_batch_max_receipts: int = 8
+    claude_batch_token_budget: int = 6000
+    # Claude retries and circuit breaker / Claude重試與斷路器設定
+    claude_max_retries: int = 4
+    claude_retry_base_delay: float = 1.0
+    claude_retry_max_delay: float = 60.0
+    claude_circuit_failure_threshold: int = 5
+    claude_circuit_reset_seconds: float = 30.0
+    # Streamed responses; the timeout bounds inactivity between chunks / 串流回應；逾時為片段之間的閒置秒數
+    claude_streaming_enabled: bool = True
+    claude_stream_idle_timeout: float = 30.0
+    # Offline Message Batches polling / 離線Message Batches輪詢設定
+    claude_message_batch_poll_interval: float = 30.0
+    claude_message_batch_timeout: float = 86400.0
 
     # Application settings / 應用程式設定
     debug: bool = True
@@ -28,6 +55,48 @@ class Settings(BaseSettings):
     max_file_size: int = 10485760  # 10MB
     allowed_extensions: str = "jpg,jpeg,png,pdf"
 
+    # HTTP connection pool settings / HTTP連線池設定
+    http_max_connections: int = 20
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry: float = 30.0
+    http_request_timeout: float = 30.0
+    http2_enabled: bool = True
+
+    # Azure Read polling settings / Azure Read輪詢設定
+    ocr_poll_first_delay: float = 0.25
+    ocr_poll_min_interval: float = 0.5
+    ocr_poll_max_interval: float = 5.0
+    ocr_poll_backoff_factor: float = 1.5
+    ocr_poll_timeout: float = 60.0
+
+    # Rate limit settings (0 = use tier default) / 頻率限制設定（0表示使用層級預設值）
+    azure_tier: str = "F0"
+    azure_requests_per_minute: int = 0
+    azure_burst: int = 0
+    claude_requests_per_minute: int = 0
+    claude_burst: int = 0
+
+    # In-memory cache tier settings / 記憶體快取層設定
+    cache_memory_max_entries: int = 512
+    cache_memory_ttl: float = 3600.0
+
+    # Image worker process pool (0 = one per CPU core) / 圖片工作程序池（0表示每個CPU核心一個）
+    image_workers: int = 0
+
+    # Crop and deskew the receipt region before OCR upload / OCR上傳前裁切並校正收據區域
+    receipt_crop_enabled: bool = True
+    # Max receipts detected in one photo by /process-multi / /process-multi 單張照片最多偵測的收據數
+    max_receipts_per_image: int = 6
+
+    # Near-duplicate detection settings; linking reuses AI results only after OCR text matches
+    # 近似重複偵測設定；連結僅在OCR文字一致後才沿用AI結果（預設只標記）
+    duplicate_hash_threshold: int = 6
+    duplicate_link_results: bool = False
+
+    # Background job settings / 背景工作設定
+    jobs_dir: str = "./data/jobs"
+    job_workers: int = 1
+
     @property
     def allowed_extensions_list(self) -> List[str]:
         """
@@ -4,7 +4,13 @@ import shutil
 from datetime import datetime
 from typing import List, Optional
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, Response
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    HTMLResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
@@ -18,7 +24,17 @@ from app.services.azure_usage_tracker import azure_usage_tracker
 from app.services.batch_processor import batch_processor
 from app.services.optimized_batch_processor import optimized_batch_processor
 from app.services.cache_service import cache_service
-from app.utils.image_utils import image_utils
+from app.services.content_hash import (
+    content_hasher,
+    PREPROCESS_ENHANCE,
+    PREPROCESS_RAW,
+)
+from app.services.duplicate_detector import duplicate_detector
+from app.services.image_worker_pool import image_worker_pool
+from app.services.multi_receipt import multi_receipt_processor
+from app.services.job_queue import job_queue
+from app.services.polling_strategy import polling_metrics
+from app.services.rate_limiter import rate_limiter
 
 # Configure logging / 配置日誌
 logger.add("logs/app.log", rotation="1 day", retention="7 days", level="INFO")
@@ -49,6 +65,27 @@ os.makedirs("static", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.on_event("startup")
+async def startup_event():
+    """
+    Start background job workers (resumes unfinished jobs)
+    啟動背景工作者（恢復未完成的工作）
+    """
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop job workers and release pooled HTTP connections on shutdown
+    應用程式關閉時停止工作者並釋放連線池
+    """
+    await job_queue.stop()
+    await ocr_service.aclose()
+    await ai_service.aclose()
+    image_worker_pool.shutdown()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """
@@ -59,8 +96,7 @@ async def root():
         with open("static/index.html", "r", encoding="utf-8") as f:
             return HTMLResponse(content=f.read())
     except FileNotFoundError:
-        return HTMLResponse(
-            content="""
+        return HTMLResponse(content="""
         <html>
         <head><title>日本收據識別系統</title></head>
         <body>
@@ -69,8 +105,7 @@ async def root():
             <p><a href="/docs">API文檔</a></p>
         </body>
         </html>
-        """
-        )
+        """)
 
 
 @app.get("/health")
@@ -98,38 +133,76 @@ async def check_api_status():
     """
     status = {
         "azure_vision": {
-            "configured": bool(settings.azure_vision_endpoint and settings.azure_vision_key),
-            "endpoint": settings.azure_vision_endpoint[:50] + "..." if settings.azure_vision_endpoint and len(settings.azure_vision_endpoint) > 50 else settings.azure_vision_endpoint,
-            "endpoint_full": settings.azure_vision_endpoint if settings.azure_vision_endpoint else None,
+            "configured": bool(
+                settings.azure_vision_endpoint and settings.azure_vision_key
+            ),
+            "endpoint": (
+                settings.azure_vision_endpoint[:50] + "..."
+                if settings.azure_vision_endpoint
+                and len(settings.azure_vision_endpoint) > 50
+                else settings.azure_vision_endpoint
+            ),
+            "endpoint_full": (
+                settings.azure_vision_endpoint
+                if settings.azure_vision_endpoint
+                else None
+            ),
             "key_set": bool(settings.azure_vision_key),
-            "key_preview": settings.azure_vision_key[:10] + "..." if settings.azure_vision_key and len(settings.azure_vision_key) > 10 else None,
+            "key_preview": (
+                settings.azure_vision_key[:10] + "..."
+                if settings.azure_vision_key and len(settings.azure_vision_key) > 10
+                else None
+            ),
             "test_mode": ocr_service.test_mode,
         },
         "claude_api": {
             "configured": bool(settings.claude_api_key),
             "key_set": bool(settings.claude_api_key),
-            "key_preview": settings.claude_api_key[:10] + "..." if settings.claude_api_key and len(settings.claude_api_key) > 10 else None,
+            "key_preview": (
+                settings.claude_api_key[:10] + "..."
+                if settings.claude_api_key and len(settings.claude_api_key) > 10
+                else None
+            ),
             "test_mode": ai_service.test_mode,
         },
         "diagnostics": {
             "upload_dir_exists": os.path.exists(settings.upload_dir),
             "output_dir_exists": os.path.exists(settings.output_dir),
-        }
+        },
     }
-    
+
     # Try to parse Azure endpoint (no actual connection, only format check) / 嘗試解析 Azure 端點（不實際連接，只檢查格式）
     if settings.azure_vision_endpoint:
         endpoint = settings.azure_vision_endpoint.strip().rstrip("/")
         if not endpoint.startswith("https://"):
-            status["azure_vision"]["warning"] = "Endpoint URL should start with https:// / 端點 URL 應該以 https:// 開頭"
+            status["azure_vision"][
+                "warning"
+            ] = "Endpoint URL should start with https:// / 端點 URL 應該以 https:// 開頭"
         elif not endpoint.endswith(".cognitiveservices.azure.com"):
-            status["azure_vision"]["warning"] = "Endpoint URL format may be incorrect (should include .cognitiveservices.azure.com) / 端點 URL 格式可能不正確（應包含 .cognitiveservices.azure.com）"
+            status["azure_vision"][
+                "warning"
+            ] = "Endpoint URL format may be incorrect (should include .cognitiveservices.azure.com) / 端點 URL 格式可能不正確（應包含 .cognitiveservices.azure.com）"
         else:
             status["azure_vision"]["endpoint_valid"] = True
-    
+
     return status
 
 
+async def _check_duplicate(file_path: str, filename: str) -> Optional[dict]:
+    """
+    Near-duplicate check for an upload (never fails the upload)
+    上傳圖片的近似重複檢查（失敗時不影響上傳）
+    """
+    try:
+        # 雜湊計算在圖片工作程序池中執行
+        await image_worker_pool.image_digest(file_path)
+        dhash = await image_worker_pool.compute_dhash(file_path)
+        return duplicate_detector.check_and_register(file_path, filename, dhash=dhash)
+    except Exception as e:
+        logger.warning(f"重複檢查失敗: {filename}, 錯誤: {str(e)}")
+        return None
+
+
 @app.post("/upload", response_model=dict)
 async def upload_receipt(file: UploadFile = File(...)):
     """
@@ -154,7 +227,9 @@ async def upload_receipt(file: UploadFile = File(...)):
             )
 
         # Generate filename (add microseconds to avoid duplicates) / 生成檔案名稱（添加微秒避免重複）
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # Include milliseconds / 包含毫秒
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[
+            :-3
+        ]  # Include milliseconds / 包含毫秒
         filename = f"receipt_{timestamp}.{file_ext}"
         file_path = os.path.join(settings.upload_dir, filename)
 
@@ -163,9 +238,13 @@ async def upload_receipt(file: UploadFile = File(...)):
             shutil.copyfileobj(file.file, buffer)
 
         # Validate image / 驗證圖片
-        if not image_utils.validate_image(file_path, settings.max_file_size):
+        if not await image_worker_pool.validate_image(
+            file_path, settings.max_file_size
+        ):
             os.remove(file_path)  # Delete invalid file / 刪除無效檔案
-            raise HTTPException(status_code=400, detail="Invalid image file / 無效的圖片檔案")
+            raise HTTPException(
+                status_code=400, detail="Invalid image file / 無效的圖片檔案"
+            )
 
         logger.info(f"Image upload successful: {filename} / 圖片上傳成功: {filename}")
 
@@ -175,13 +254,16 @@ async def upload_receipt(file: UploadFile = File(...)):
             "file_path": file_path,
             "file_size": os.path.getsize(file_path),
             "upload_time": datetime.now().isoformat(),
+            "duplicate_of": await _check_duplicate(file_path, filename),
         }
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Image upload failed: {str(e)} / 圖片上傳失敗: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)} / 上傳失敗: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Upload failed: {str(e)} / 上傳失敗: {str(e)}"
+        )
 
 
 @app.post("/upload-batch")
@@ -198,6 +280,7 @@ async def upload_batch_receipts(files: List[UploadFile] = File(...)):
     try:
         uploaded_files = []
         failed_files = []
+        duplicates = []
 
         for file_index, file in enumerate(files):
             try:
@@ -223,7 +306,7 @@ async def upload_batch_receipts(files: List[UploadFile] = File(...)):
                 with open(file_path, "wb") as buffer:
                     shutil.copyfileobj(file.file, buffer)
                     buffer.flush()
-                    if hasattr(buffer, 'fileno'):
+                    if hasattr(buffer, "fileno"):
                         try:
                             os.fsync(buffer.fileno())
                         except:
@@ -231,27 +314,50 @@ async def upload_batch_receipts(files: List[UploadFile] = File(...)):
 
                 # Verify file exists (wait a short time to ensure file is written) / 驗證檔案是否存在（等待一小段時間確保檔案已寫入）
                 import time
-                time.sleep(0.01)  # Brief delay to ensure filesystem sync / 短暫延遲確保檔案系統同步
-                
+
+                time.sleep(
+                    0.01
+                )  # Brief delay to ensure filesystem sync / 短暫延遲確保檔案系統同步
+
                 if not os.path.exists(file_path):
                     failed_files.append(
-                        {"filename": file.filename, "error": "File save failed / 檔案儲存失敗"}
+                        {
+                            "filename": file.filename,
+                            "error": "File save failed / 檔案儲存失敗",
+                        }
+                    )
+                    logger.error(
+                        f"File does not exist: {file_path} / 檔案不存在: {file_path}"
                     )
-                    logger.error(f"File does not exist: {file_path} / 檔案不存在: {file_path}")
                     continue
 
                 # Validate image (PDF files skip image validation) / 驗證圖片（PDF 檔案跳過圖片驗證）
                 if file_ext.lower() != "pdf":
-                    if not image_utils.validate_image(file_path, settings.max_file_size):
+                    if not await image_worker_pool.validate_image(
+                        file_path, settings.max_file_size
+                    ):
                         if os.path.exists(file_path):
                             os.remove(file_path)  # Delete invalid file / 刪除無效檔案
                         failed_files.append(
-                            {"filename": file.filename, "error": "Invalid image file / 無效的圖片檔案"}
+                            {
+                                "filename": file.filename,
+                                "error": "Invalid image file / 無效的圖片檔案",
+                            }
                         )
                         continue
 
                 uploaded_files.append(filename)
-                logger.info(f"Batch upload successful: {filename} / 批量上傳成功: {filename}")
+                logger.info(
+                    f"Batch upload successful: {filename} / 批量上傳成功: {filename}"
+                )
+
+                # PDF 檔案無法計算感知雜湊，跳過重複檢查
+                if file_ext.lower() != "pdf":
+                    duplicate_of = await _check_duplicate(file_path, filename)
+                    if duplicate_of:
+                        duplicates.append(
+                            {"filename": filename, "duplicate_of": duplicate_of}
+                        )
 
             except Exception as e:
                 failed_files.append({"filename": file.filename, "error": str(e)})
@@ -263,6 +369,7 @@ async def upload_batch_receipts(files: List[UploadFile] = File(...)):
             "failed_count": len(failed_files),
             "uploaded_files": uploaded_files,
             "failed_files": failed_files,
+            "duplicates": duplicates,
             "message": f"批量上傳完成。成功: {len(uploaded_files)}, 失敗: {len(failed_files)}",
         }
 
@@ -300,83 +407,31 @@ async def process_receipt(
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found / 檔案不存在")
 
-        # 圖片預處理
-        processed_image_path = file_path
-        if enhance_image:
-            processed_image_path = image_utils.enhance_image_quality(file_path)
-
-        # OCR文字識別（檢查是否有暫存）
-        logger.info(f"開始OCR處理: {filename}")
-        
-        # 檢查是否有OCR暫存
-        cache_data = cache_service.load_ocr_result(filename)
-        if cache_data and cache_data.get("ocr_data"):
-            logger.info(f"使用OCR暫存資料: {filename}")
-            ocr_result = cache_data["ocr_data"]
-        else:
-            # 執行OCR
-            ocr_result = await ocr_service.extract_text(processed_image_path)
-            # 保存到暫存
-            cache_service.save_ocr_result(filename, ocr_result)
-
-        # 提取結構化資料
-        structured_data = ocr_service.extract_structured_data(ocr_result)
-
-        # AI整理和結構化（檢查是否有暫存）
-        logger.info(f"開始AI處理: {filename}")
-        
-        # 檢查是否有AI暫存
-        ai_cache_data = cache_service.load_ai_result(filename)
-        if ai_cache_data and ai_cache_data.get("receipt_data"):
-            logger.info(f"使用AI暫存資料: {filename}")
-            # 從暫存資料恢復ReceiptData對象
-            from app.models.receipt import ReceiptData
-            receipt_dict = ai_cache_data["receipt_data"]
-            # 處理日期字串
-            if isinstance(receipt_dict.get("date"), str):
-                from datetime import datetime
-                try:
-                    receipt_dict["date"] = datetime.fromisoformat(receipt_dict["date"])
-                except:
-                    pass
-            receipt_data = ReceiptData(**receipt_dict)
-        else:
-            # 執行AI處理
-            receipt_data = await ai_service.process_receipt_text(
-                ocr_result, structured_data
-            )
-            # 保存到暫存
-            cache_service.save_ai_result(filename, receipt_data, ocr_result)
-
-        # 設定來源圖片
-        receipt_data.source_image = filename
+        # 與批量處理共用管線：限流、連線池與內容定址的OCR/AI暫存
+        logger.info(f"開始處理: {filename}")
+        preprocessing = PREPROCESS_ENHANCE if enhance_image else PREPROCESS_RAW
+        result = await optimized_batch_processor.process_single(
+            filename, preprocessing=preprocessing
+        )
+        if not result.get("success"):
+            raise Exception(result.get("error") or "處理失敗")
+        receipt_data = result["data"]
 
         # 計算總處理時間
         total_time = time.time() - start_time
         receipt_data.processing_time = total_time
 
-        # 儲存CSV檔案
-        csv_filename = f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        csv_path = csv_service.save_receipt_to_csv(receipt_data, csv_filename)
+        # 與批量處理相同，追加到收據儲存（顯示於CSV檔案列表）
+        csv_service.append_receipts([receipt_data], source="process")
 
         # 如果需要詳細CSV，在背景任務中處理
         if save_detailed_csv:
+            csv_filename = f"receipt_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
             background_tasks.add_task(
                 csv_service.save_detailed_csv, receipt_data, f"detailed_{csv_filename}"
             )
 
-        # 清理臨時檔案
-        if enhance_image and processed_image_path != file_path:
-            background_tasks.add_task(os.remove, processed_image_path)
-
-        # 處理成功後刪除原始圖片（與批量處理保持一致）
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"🗑️ 已刪除處理成功的圖片: {filename}")
-        except Exception as e:
-            logger.warning(f"刪除圖片失敗: {str(e)}")
-
+        # 處理成功的圖片由管線依檔案管理設定刪除（與批量處理一致）
         logger.info(f"收據處理完成: {filename}, 耗時: {total_time:.2f}秒")
 
         return ReceiptResponse(
@@ -392,6 +447,88 @@ async def process_receipt(
         )
 
 
+@app.post("/process-multi")
+async def process_multi_receipt(
+    filename: str = Form(...),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    save_detailed_csv: bool = Form(False),
+):
+    """
+    Process a photo containing several receipts with a single OCR call
+    以一次OCR調用處理含多張收據的照片
+
+    Args:
+        filename: Image file name / 圖片檔案名稱
+        background_tasks: Background tasks / 背景任務
+        save_detailed_csv: Whether to save detailed CSV / 是否儲存詳細CSV
+
+    Returns:
+        One ReceiptData per detected receipt / 每張偵測到的收據各一筆資料
+    """
+    start_time = time.time()
+    try:
+        file_path = os.path.join(settings.upload_dir, filename)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="File not found / 檔案不存在")
+
+        result = await multi_receipt_processor.process_image(filename)
+        receipts = result["receipts"]
+
+        if not receipts:
+            # 沒有辨識出任何收據時保留圖片，回報失敗
+            logger.warning(f"多張收據處理未辨識出收據: {filename}")
+            return {
+                "success": False,
+                "error": "No receipts extracted / 未能辨識出任何收據",
+                "receipt_count": 0,
+                "regions_detected": result["regions"],
+                "ocr_calls": result["ocr_calls"],
+                "processing_time": time.time() - start_time,
+            }
+
+        csv_filename = f"receipts_multi_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        csv_files = csv_service.append_receipts(receipts, source="multi")
+        if save_detailed_csv:
+            for index, receipt_data in enumerate(receipts, start=1):
+                background_tasks.add_task(
+                    csv_service.save_detailed_csv,
+                    receipt_data,
+                    f"detailed_{index}_{csv_filename}",
+                )
+
+        # 處理成功後刪除原始圖片（與單張處理保持一致）
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"🗑️ 已刪除處理成功的圖片: {filename}")
+        except Exception as e:
+            logger.warning(f"刪除圖片失敗: {str(e)}")
+
+        total_time = time.time() - start_time
+        logger.info(
+            f"多張收據處理完成: {filename}, {len(receipts)} 張收據, OCR調用 {result['ocr_calls']} 次, 耗時: {total_time:.2f}秒"
+        )
+        return {
+            "success": True,
+            "receipt_count": len(receipts),
+            "regions_detected": result["regions"],
+            "ocr_calls": result["ocr_calls"],
+            "receipts": receipts,
+            "csv_file": os.path.basename(csv_files["summary_csv"]),
+            "processing_time": total_time,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"多張收據處理失敗: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e),
+            "processing_time": time.time() - start_time,
+        }
+
+
 @app.post("/process-batch")
 async def process_batch_receipts(
     filenames: List[str] = Form(...),
@@ -400,7 +537,7 @@ async def process_batch_receipts(
     save_detailed_csv: bool = Form(False),
 ):
     """
-    批量處理收據識別（包含頻率控制）
+    批量處理收據識別（包含頻率控制），以背景工作執行
 
     Args:
         filenames: 圖片檔案名稱列表
@@ -409,7 +546,7 @@ async def process_batch_receipts(
         save_detailed_csv: 是否儲存詳細CSV
 
     Returns:
-        批量處理結果
+        工作ID，處理結果請查詢 /jobs/{job_id}
     """
     try:
         logger.info(f"📋 收到批量處理請求:")
@@ -440,13 +577,20 @@ async def process_batch_receipts(
             else:
                 logger.info(f"檔案存在: {file_path}")
 
-        # 使用批次處理服務
-        result = await batch_processor.process_large_batch(
-            filenames, enhance_image, save_detailed_csv
+        # 提交背景工作，立即返回工作ID
+        job = job_queue.submit(
+            "standard",
+            {
+                "filenames": filenames,
+                "enhance_image": enhance_image,
+                "save_detailed_csv": save_detailed_csv,
+            },
         )
 
-        return result
+        return {"success": True, "job_id": job["job_id"], "status": job["status"]}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"批量處理失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"批量處理失敗: {str(e)}")
@@ -467,7 +611,7 @@ async def process_batch_optimized(
         save_detailed_csv: 是否儲存詳細CSV
 
     Returns:
-        優化批量處理結果
+        工作ID，處理結果請查詢 /jobs/{job_id}
     """
     try:
         logger.info(f"🚀 收到優化批量處理請求:")
@@ -497,18 +641,86 @@ async def process_batch_optimized(
             else:
                 logger.info(f"檔案存在: {file_path}")
 
-        # 使用優化批次處理服務
-        result = await optimized_batch_processor.process_large_batch_optimized(
-            filenames, save_detailed_csv
+        # 提交背景工作，立即返回工作ID
+        job = job_queue.submit(
+            "optimized",
+            {"filenames": filenames, "save_detailed_csv": save_detailed_csv},
         )
 
-        return result
+        return {"success": True, "job_id": job["job_id"], "status": job["status"]}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"優化批量處理失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"優化批量處理失敗: {str(e)}")
 
 
+@app.get("/jobs")
+async def list_jobs(job_type: Optional[str] = None, limit: int = 20):
+    """
+    列出最近的背景工作
+
+    Args:
+        job_type: 工作類型（standard / optimized / message_batch）
+        limit: 返回數量上限
+    """
+    return {"jobs": job_queue.list_jobs(job_type, limit)}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    獲取背景工作狀態、進度與結果
+
+    Args:
+        job_id: 工作ID
+    """
+    job = job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"工作不存在: {job_id}")
+    return job
+
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    """
+    重新執行失敗的背景工作（保留已保存的狀態，訊息批次工作會繼續輪詢已提交的批次）
+
+    Args:
+        job_id: 工作ID
+    """
+    try:
+        job = job_queue.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"工作不存在: {job_id}")
+    return {"success": True, "job_id": job_id, "status": job["status"]}
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    以Server-Sent Events推送背景工作的即時進度
+
+    事件類型：
+        status: 工作狀態（連線時先送出目前狀態，結束時送出done/failed與結果）
+        progress: 每個檔案完成時的進度、剩餘時間估算與頻率限制狀態
+
+    Args:
+        job_id: 工作ID
+    """
+    if job_queue.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"工作不存在: {job_id}")
+
+    return StreamingResponse(
+        job_queue.stream_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/ocr-only")
 async def process_ocr_only(
     filenames: List[str] = Form(...), enhance_image: bool = Form(True)
@@ -545,21 +757,42 @@ async def process_ocr_only(
 
 @app.post("/process-from-cache")
 async def process_from_cache(
-    batch_id: str = Form(...), save_detailed_csv: bool = Form(True)
+    batch_id: str = Form(...),
+    save_detailed_csv: bool = Form(True),
+    use_message_batches: bool = Form(False),
 ):
     """
     從暫存處理AI分析
+
+    use_message_batches時以背景工作執行（批次可能需要數小時），立即返回工作ID，
+    處理結果請查詢 /jobs/{job_id}。
     """
     try:
         logger.info(f"📋 收到從暫存處理請求:")
         logger.info(f"   批次ID: {batch_id}")
         logger.info(f"   儲存詳細CSV: {save_detailed_csv}")
+        logger.info(f"   Message Batches: {use_message_batches}")
+
+        if use_message_batches:
+            if not cache_service.load_processing_status(batch_id):
+                raise HTTPException(status_code=404, detail=f"找不到批次ID: {batch_id}")
+
+            # 提交背景工作，已提交的訊息批次ID保存在工作中，重新啟動後繼續輪詢
+            job = job_queue.submit(
+                "message_batch",
+                {"batch_id": batch_id, "save_detailed_csv": save_detailed_csv},
+            )
+            return {"success": True, "job_id": job["job_id"], "status": job["status"]}
 
         # 從暫存處理AI分析
-        result = await batch_processor.process_from_cache(batch_id, save_detailed_csv)
+        result = await batch_processor.process_from_cache(
+            batch_id, save_detailed_csv, use_message_batches
+        )
 
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"從暫存處理失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"從暫存處理失敗: {str(e)}")
@@ -587,13 +820,16 @@ async def get_batch_progress():
         當前批次處理進度
     """
     try:
-        progress = batch_processor.get_progress()
+        job = job_queue.latest_job("standard")
+        progress = job["progress"] if job else batch_processor.get_progress()
 
         # 添加頻率限制資訊
         usage_summary = azure_usage_tracker.get_usage_summary()
 
         return {
             "progress": progress,
+            "job_id": job["job_id"] if job else None,
+            "job_status": job["status"] if job else None,
             "rate_limit_info": {
                 "rate_limit": batch_processor.rate_limit,
                 "batch_size": batch_processor.batch_size,
@@ -601,6 +837,7 @@ async def get_batch_progress():
                 "delay_between_requests": batch_processor.delay_between_requests,
                 "current_hour_usage": usage_summary["current_hour_usage"],
                 "warnings": usage_summary["warnings"],
+                "limiter": rate_limiter.get_status(),
             },
         }
 
@@ -618,17 +855,23 @@ async def get_batch_progress_optimized():
         當前優化批次處理進度
     """
     try:
+        job = job_queue.latest_job("optimized")
         progress = optimized_batch_processor.get_progress()
+        if job:
+            progress.update(job["progress"])
 
         # 添加優化資訊
         usage_summary = azure_usage_tracker.get_usage_summary()
 
         return {
             "progress": progress,
+            "job_id": job["job_id"] if job else None,
+            "job_status": job["status"] if job else None,
             "optimization_info": {
                 "max_concurrent_azure": optimized_batch_processor.max_concurrent_azure,
                 "max_concurrent_claude": optimized_batch_processor.max_concurrent_claude,
                 "batch_size": optimized_batch_processor.batch_size,
+                "pipeline_queue_size": optimized_batch_processor.pipeline_queue_size,
                 "azure_delay": optimized_batch_processor.azure_delay,
                 "claude_delay": optimized_batch_processor.claude_delay,
                 "use_cache": optimized_batch_processor.use_cache,
@@ -637,6 +880,7 @@ async def get_batch_progress_optimized():
                 "keep_failed_files": optimized_batch_processor.keep_failed_files,
                 "current_hour_usage": usage_summary["current_hour_usage"],
                 "warnings": usage_summary["warnings"],
+                "limiter": rate_limiter.get_status(),
             },
         }
 
@@ -733,9 +977,15 @@ async def get_azure_usage():
             "summary": usage_summary,
             "daily_chart": daily_chart,
             "recent_calls": recent_calls,
+            "polling": polling_metrics.get_summary(),
+            "image_workers": image_worker_pool.get_stats(),
+            "claude": {
+                **ai_service.get_usage_stats(),
+                "circuit_breaker": ai_service.circuit_breaker.get_status(),
+            },
             "limits": {
                 "monthly_limit": 5000,
-                "rate_limit_per_minute": 20,
+                "rate_limit_per_minute": azure_usage_tracker.rate_limit,
                 "max_image_size_mb": 4,
                 "supported_formats": ["JPEG", "PNG", "GIF", "BMP"],
             },
@@ -765,7 +1015,8 @@ async def download_file(filename: str):
     try:
         file_path = os.path.join(settings.output_dir, filename)
 
-        if not os.path.exists(file_path):
+        # 執行紀錄的CSV在第一次下載時才匯出
+        if not csv_service.ensure_export(filename):
             raise HTTPException(status_code=404, detail="檔案不存在")
 
         # 讀取檔案內容
@@ -798,62 +1049,73 @@ async def get_uploaded_files():
     try:
         files = []
         allowed_extensions = (".jpg", ".jpeg", ".png", ".pdf")
-        
+
         if os.path.exists(settings.upload_dir):
             for filename in os.listdir(settings.upload_dir):
                 # 只顯示圖片檔案，排除處理過的檔案（如 _resized, _enhanced 等）
                 if any(filename.lower().endswith(ext) for ext in allowed_extensions):
                     file_path = os.path.join(settings.upload_dir, filename)
-                    
+
                     # 跳過處理過的檔案（包含 _resized, _enhanced 等後綴）
                     if any(suffix in filename for suffix in ["_resized", "_enhanced"]):
                         continue
-                    
+
                     try:
                         file_stat = os.stat(file_path)
-                        
+
                         # 檢查處理狀態
                         processing_status = "not_processed"  # 未處理
                         has_ocr_cache = False
-                        
+
                         # 檢查是否有OCR暫存
-                        cache_data = cache_service.load_ocr_result(filename)
+                        cache_data = cache_service.load_ocr_result(
+                            content_hasher.canonical_digest(file_path)
+                        )
                         if cache_data:
                             has_ocr_cache = True
                             processing_status = "ocr_completed"  # OCR已完成
-                        
+
                         # 檢查是否已有CSV輸出（表示已完成處理）
                         csv_files = []
                         if os.path.exists(settings.output_dir):
-                            csv_files = [f for f in os.listdir(settings.output_dir) 
-                                       if f.endswith(".csv") and not f.startswith("detailed_")]
-                        
+                            csv_files = [
+                                f
+                                for f in os.listdir(settings.output_dir)
+                                if f.endswith(".csv") and not f.startswith("detailed_")
+                            ]
+
                         # 簡單檢查：如果CSV檔案較新於上傳時間，可能已處理（這只是粗略判斷）
                         # 更準確的方法需要檢查CSV內容，但這裡先簡單判斷
-                        
-                        files.append({
-                            "filename": filename,
-                            "size": file_stat.st_size,
-                            "size_mb": round(file_stat.st_size / (1024 * 1024), 2),
-                            "upload_time": datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-                            "modified_time": datetime.fromtimestamp(file_stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
-                            "image_url": f"/receipt-image/{filename}",
-                            "processing_status": processing_status,
-                            "has_ocr_cache": has_ocr_cache,
-                        })
+
+                        files.append(
+                            {
+                                "filename": filename,
+                                "size": file_stat.st_size,
+                                "size_mb": round(file_stat.st_size / (1024 * 1024), 2),
+                                "upload_time": datetime.fromtimestamp(
+                                    file_stat.st_mtime
+                                ).isoformat(),
+                                "modified_time": datetime.fromtimestamp(
+                                    file_stat.st_mtime
+                                ).strftime("%Y-%m-%d %H:%M:%S"),
+                                "image_url": f"/receipt-image/{filename}",
+                                "processing_status": processing_status,
+                                "has_ocr_cache": has_ocr_cache,
+                            }
+                        )
                     except Exception as e:
                         logger.warning(f"讀取檔案資訊失敗: {filename}, 錯誤: {str(e)}")
                         continue
-        
+
         # 按修改時間排序（最新的在前）
         files.sort(key=lambda x: x["upload_time"], reverse=True)
-        
+
         return {
             "success": True,
             "files": files,
             "total_count": len(files),
         }
-    
+
     except Exception as e:
         logger.error(f"獲取上傳檔案列表失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"獲取檔案列表失敗: {str(e)}")
@@ -874,9 +1136,9 @@ async def get_file_status(filename: str):
         # 安全檢查：防止路徑遍歷攻擊
         if ".." in filename or "/" in filename:
             raise HTTPException(status_code=400, detail="無效的檔案名稱")
-        
+
         file_path = os.path.join(settings.upload_dir, filename)
-        
+
         result = {
             "filename": filename,
             "exists": os.path.exists(file_path),
@@ -884,24 +1146,26 @@ async def get_file_status(filename: str):
             "processing_status": "not_processed",
             "can_process": False,
         }
-        
+
         if not result["exists"]:
             return result
-        
-        # 檢查OCR暫存
-        cache_data = cache_service.load_ocr_result(filename)
+
+        # 檢查OCR暫存（任一預處理方式的暫存皆可）
+        cache_data = cache_service.load_ocr_result(
+            content_hasher.canonical_digest(file_path)
+        )
         if cache_data:
             result["has_ocr_cache"] = True
             result["processing_status"] = "ocr_completed"
             result["can_process"] = True  # 有OCR暫存，可以直接處理
-        
+
         # 如果檔案存在，也可以處理（即使沒有暫存）
         if not result["can_process"]:
             result["can_process"] = True
             result["processing_status"] = "not_processed"
-        
+
         return result
-    
+
     except Exception as e:
         logger.error(f"檢查檔案狀態失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"檢查檔案狀態失敗: {str(e)}")
@@ -922,12 +1186,12 @@ async def get_receipt_image(filename: str):
         # 安全檢查：防止路徑遍歷攻擊
         if ".." in filename or "/" in filename:
             raise HTTPException(status_code=400, detail="無效的檔案名稱")
-        
+
         file_path = os.path.join(settings.upload_dir, filename)
-        
+
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="圖片不存在")
-        
+
         # 根據檔案擴展名決定 MIME 類型
         ext = filename.split(".")[-1].lower()
         media_types = {
@@ -937,9 +1201,9 @@ async def get_receipt_image(filename: str):
             "pdf": "application/pdf",
         }
         media_type = media_types.get(ext, "application/octet-stream")
-        
+
         return FileResponse(file_path, media_type=media_type, filename=filename)
-    
+
     except HTTPException:
         raise
     except Exception as e:
@@ -960,62 +1224,18 @@ async def get_receipts(limit: int = 10, offset: int = 0):
         收據列表
     """
     try:
-        # 掃描輸出目錄中的CSV檔案
-        csv_files = []
-        for file in os.listdir(settings.output_dir):
-            if file.endswith(".csv") and not file.startswith("detailed_"):
-                csv_files.append(file)
-
-        # 按時間排序
-        csv_files.sort(reverse=True)
-
-        # 分頁
-        csv_files = csv_files[offset : offset + limit]
-
-        # 載入收據資料
-        receipts = []
-        for csv_file in csv_files:
-            try:
-                csv_path = os.path.join(settings.output_dir, csv_file)
-                file_receipts = csv_service.load_receipts_from_csv(csv_path)
-                receipts.extend(file_receipts)
-            except Exception as e:
-                logger.warning(f"載入CSV檔案失敗: {csv_file}, 錯誤: {str(e)}")
-                continue
+        # 由收據儲存分頁讀取（新到舊），不需掃描或解析CSV檔案
+        receipts = csv_service.store.load_receipts(limit=limit, offset=offset)
 
-        return ReceiptListResponse(receipts=receipts, total_count=len(receipts))
+        return ReceiptListResponse(
+            receipts=receipts, total_count=csv_service.store.count()
+        )
 
     except Exception as e:
         logger.error(f"獲取收據列表失敗: {str(e)}")
         raise HTTPException(status_code=500, detail=f"獲取收據列表失敗: {str(e)}")
 
 
-@app.get("/download/{filename}")
-async def download_csv(filename: str):
-    """
-    下載CSV檔案
-
-    Args:
-        filename: CSV檔案名稱
-
-    Returns:
-        CSV檔案
-    """
-    try:
-        file_path = os.path.join(settings.output_dir, filename)
-
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="檔案不存在")
-
-        return FileResponse(file_path, media_type="text/csv", filename=filename)
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"下載CSV檔案失敗: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"下載失敗: {str(e)}")
-
-
 @app.get("/csv-files-list")
 async def get_csv_files_list():
     """
@@ -1026,44 +1246,31 @@ async def get_csv_files_list():
     """
     try:
         if not os.path.exists(settings.output_dir):
-            return {
-                "success": False,
-                "message": "輸出目錄不存在",
-                "csv_files": []
-            }
-
-        # 查找所有summary CSV檔案
-        csv_files_list = [
-            f
-            for f in os.listdir(settings.output_dir)
-            if f.startswith("receipts_summary_") and f.endswith(".csv")
-        ]
+            return {"success": False, "message": "輸出目錄不存在", "csv_files": []}
 
-        csv_files_list.sort(reverse=True)  # 最新的在前
+        # 所有執行紀錄的summary CSV（最新的在前，尚未匯出的也列出）
+        csv_files_list = csv_service.list_summary_files()
 
         # 格式化檔案名稱為顯示名稱（提取時間戳）
         csv_files_with_info = []
         for csv_file in csv_files_list:
             # receipts_summary_20251230_164641.csv -> 2025-12-30 16:46:41
             try:
-                timestamp_str = csv_file.replace("receipts_summary_", "").replace(".csv", "")
+                timestamp_str = csv_file.replace("receipts_summary_", "").replace(
+                    ".csv", ""
+                )
                 date_str = timestamp_str[:8]  # 20251230
                 time_str = timestamp_str[9:]  # 164641
                 formatted_date = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:8]} {time_str[:2]}:{time_str[2:4]}:{time_str[4:6]}"
-                csv_files_with_info.append({
-                    "filename": csv_file,
-                    "display_name": formatted_date
-                })
+                csv_files_with_info.append(
+                    {"filename": csv_file, "display_name": formatted_date}
+                )
             except:
-                csv_files_with_info.append({
-                    "filename": csv_file,
-                    "display_name": csv_file
-                })
+                csv_files_with_info.append(
+                    {"filename": csv_file, "display_name": csv_file}
+                )
 
-        return {
-            "success": True,
-            "csv_files": csv_files_with_info
-        }
+        return {"success": True, "csv_files": csv_files_with_info}
 
     except Exception as e:
         logger.error(f"獲取CSV檔案列表失敗: {str(e)}")
@@ -1084,28 +1291,31 @@ async def get_csv_data(filename: str):
     """
     try:
         import csv
-        
+
         if not os.path.exists(settings.output_dir):
             return {
                 "success": False,
                 "message": "輸出目錄不存在",
                 "summary_data": [],
-                "details_data": []
+                "details_data": [],
             }
 
         # 驗證檔案名稱
-        if not filename.startswith("receipts_summary_") or not filename.endswith(".csv"):
+        if not filename.startswith("receipts_summary_") or not filename.endswith(
+            ".csv"
+        ):
             raise HTTPException(status_code=400, detail="無效的CSV檔案名稱")
 
         summary_path = os.path.join(settings.output_dir, filename)
-        if not os.path.exists(summary_path):
+        if not csv_service.ensure_export(filename):
             raise HTTPException(status_code=404, detail="CSV檔案不存在")
-        
+
         # 推斷對應的details CSV檔案名稱
         timestamp = filename.replace("receipts_summary_", "").replace(".csv", "")
         details_filename = f"receipts_details_{timestamp}.csv"
         details_path = os.path.join(settings.output_dir, details_filename)
-        
+        csv_service.ensure_export(details_filename)
+
         # 讀取summary CSV
         summary_data = []
         processed_images = set()  # 收集所有已處理的圖片檔名
@@ -1118,25 +1328,20 @@ async def get_csv_data(filename: str):
                     source_image = row.get("來源圖片", "").strip()
                     if source_image:
                         processed_images.add(source_image)
-        
+
         # 讀取details CSV
         details_data = []
         if os.path.exists(details_path):
             with open(details_path, "r", encoding="utf-8") as f:
                 reader = csv.DictReader(f)
                 details_data = list(reader)
-        
+
         # 只有在請求最新檔案時才刪除已處理的圖片
         deleted_count = 0
-        csv_files_list = [
-            f
-            for f in os.listdir(settings.output_dir)
-            if f.startswith("receipts_summary_") and f.endswith(".csv")
-        ]
+        csv_files_list = csv_service.list_summary_files()
         if csv_files_list:
-            csv_files_list.sort(reverse=True)
             is_latest = csv_files_list[0] == filename
-            
+
             if is_latest and processed_images and os.path.exists(settings.upload_dir):
                 for image_filename in processed_images:
                     image_path = os.path.join(settings.upload_dir, image_filename)
@@ -1147,10 +1352,10 @@ async def get_csv_data(filename: str):
                             deleted_count += 1
                         except Exception as e:
                             logger.warning(f"刪除圖片失敗 {image_filename}: {str(e)}")
-                
+
                 if deleted_count > 0:
                     logger.info(f"✅ 已清理 {deleted_count} 個已處理的圖片檔案")
-        
+
         return {
             "success": True,
             "summary_filename": filename,
@@ -1158,7 +1363,11 @@ async def get_csv_data(filename: str):
             "summary_data": summary_data,
             "details_data": details_data,
             "deleted_images_count": deleted_count,
-            "is_latest": csv_files_list and csv_files_list[0] == filename if csv_files_list else False
+            "is_latest": (
+                csv_files_list and csv_files_list[0] == filename
+                if csv_files_list
+                else False
+            ),
         }
 
     except HTTPException:
@@ -1183,38 +1392,36 @@ async def get_latest_csv_data():
                 "success": False,
                 "message": "輸出目錄不存在",
                 "summary_data": [],
-                "details_data": []
+                "details_data": [],
             }
 
-        # 查找最新的summary CSV檔案
-        csv_files_list = [
-            f
-            for f in os.listdir(settings.output_dir)
-            if f.startswith("receipts_summary_") and f.endswith(".csv")
-        ]
+        # 最新的執行紀錄
+        csv_files_list = csv_service.list_summary_files()
 
         if not csv_files_list:
             return {
                 "success": False,
                 "message": "沒有找到CSV檔案",
                 "summary_data": [],
-                "details_data": []
+                "details_data": [],
             }
 
-        csv_files_list.sort(reverse=True)
         latest_summary_csv = csv_files_list[0]
-        
+
         # 使用新的端點來獲取資料（通過內部調用）
         # 這裡需要重新實現邏輯，因為不能直接調用另一個路由處理函數
         import csv
-        
+
         summary_path = os.path.join(settings.output_dir, latest_summary_csv)
-        
+
         # 推斷對應的details CSV檔案名稱
-        timestamp = latest_summary_csv.replace("receipts_summary_", "").replace(".csv", "")
+        timestamp = latest_summary_csv.replace("receipts_summary_", "").replace(
+            ".csv", ""
+        )
         details_filename = f"receipts_details_{timestamp}.csv"
         details_path = os.path.join(settings.output_dir, details_filename)
-        
+        csv_service.ensure_export(latest_summary_csv)
+
         # 讀取summary CSV
         summary_data = []
         processed_images = set()
@@ -1226,14 +1433,14 @@ async def get_latest_csv_data():
                     source_image = row.get("來源圖片", "").strip()
                     if source_image:
                         processed_images.add(source_image)
-        
+
         # 讀取details CSV
         details_data = []
         if os.path.exists(details_path):
             with open(details_path, "r", encoding="utf-8") as f:
                 reader = csv.DictReader(f)
                 details_data = list(reader)
-        
+
         # 刪除已處理的圖片（僅限最新檔案）
         deleted_count = 0
         if processed_images and os.path.exists(settings.upload_dir):
@@ -1246,10 +1453,10 @@ async def get_latest_csv_data():
                         deleted_count += 1
                     except Exception as e:
                         logger.warning(f"刪除圖片失敗 {image_filename}: {str(e)}")
-        
+
         if deleted_count > 0:
             logger.info(f"✅ 已清理 {deleted_count} 個已處理的圖片檔案")
-        
+
         return {
             "success": True,
             "summary_filename": latest_summary_csv,
@@ -1257,7 +1464,7 @@ async def get_latest_csv_data():
             "summary_data": summary_data,
             "details_data": details_data,
             "deleted_images_count": deleted_count,
-            "is_latest": True
+            "is_latest": True,
         }
 
     except Exception as e:
@@ -1284,7 +1491,7 @@ async def get_summary():
                     if f.lower().endswith((".jpg", ".jpeg", ".png"))
                 ]
             )
-        
+
         csv_files = 0
         if os.path.exists(settings.output_dir):
             csv_files = len(
@@ -1295,19 +1502,11 @@ async def get_summary():
         latest_csv = None
         csv_summary = None
 
-        csv_files_list = []
-        if os.path.exists(settings.output_dir):
-            csv_files_list = [
-                f
-                for f in os.listdir(settings.output_dir)
-                if f.endswith(".csv") and not f.startswith("detailed_")
-            ]
-
+        csv_files_list = csv_service.list_summary_files()
         if csv_files_list:
-            csv_files_list.sort(reverse=True)
             latest_csv = csv_files_list[0]
-            csv_path = os.path.join(settings.output_dir, latest_csv)
-            csv_summary = csv_service.get_csv_summary(csv_path)
+            # 由收據儲存的彙總表計算，不需讀取CSV
+            csv_summary = csv_service.get_run_summary(latest_csv)
 
         return {
             "uploaded_receipts": receipt_files,
@@ -1337,7 +1536,7 @@ async def delete_uploaded_image(filename: str):
     try:
         # 刪除上傳的圖片
         image_path = os.path.join(settings.upload_dir, filename)
-        
+
         if not os.path.exists(image_path):
             raise HTTPException(status_code=404, detail="圖片檔案不存在")
 
@@ -1347,6 +1546,7 @@ async def delete_uploaded_image(filename: str):
         # 同時刪除相關的暫存檔案（OCR和AI暫存）
         try:
             from app.services.cache_service import cache_service
+
             cache_service.delete_ocr_cache(filename)
             cache_service.delete_ai_cache(filename)
         except Exception as e:
@@ -1355,7 +1555,7 @@ async def delete_uploaded_image(filename: str):
         return {
             "success": True,
             "deleted_image": filename,
-            "message": f"已刪除圖片: {filename}"
+            "message": f"已刪除圖片: {filename}",
         }
 
     except HTTPException:
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -45,6 +45,39 @@ class ReceiptData(BaseModel):
         json_encoders = {datetime: lambda v: v.isoformat()}
 
 
+class ReceiptExtraction(BaseModel):
+    """AI結構化輸出（工具輸入格式；不含處理資訊）"""
+
+    store_name: str = Field(..., description="商店名稱")
+    date: str = Field(
+        ..., description="收據日期（YYYY-MM-DD）", pattern=r"^\d{4}-\d{2}-\d{2}$"
+    )
+    time: Optional[str] = Field(None, description="收據時間（HH:MM）")
+    total_amount: float = Field(..., description="總金額")
+    subtotal: Optional[float] = Field(None, description="小計")
+    tax_amount: Optional[float] = Field(None, description="稅額")
+    tax_type: Optional[Literal["內含稅", "外加稅"]] = Field(
+        None, description="稅金類型：內含稅/外加稅"
+    )
+    items: List[ReceiptItem] = Field(default_factory=list, description="商品明細")
+    receipt_number: Optional[str] = Field(None, description="收據號碼")
+    payment_method: Optional[str] = Field(None, description="付款方式")
+
+
+class ReceiptBatchEntry(ReceiptExtraction):
+    """批次結構化輸出中的單張收據"""
+
+    id: str = Field(..., description="收據編號（例如 R1）")
+
+
+class ReceiptBatchExtraction(BaseModel):
+    """批次結構化輸出（每張收據一個項目）"""
+
+    receipts: List[ReceiptBatchEntry] = Field(
+        ..., description="收據列表，每張收據恰好一項"
+    )
+
+
 class ReceiptResponse(BaseModel):
     """收據識別回應"""
 
@@ -1,10 +1,96 @@
+import asyncio
 import json
 import time
+from datetime import datetime
 import httpx
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
 from loguru import logger
 from app.config import settings
-from app.models.receipt import ReceiptData, ReceiptItem
+from app.models.receipt import (
+    ReceiptBatchExtraction,
+    ReceiptData,
+    ReceiptExtraction,
+    ReceiptItem,
+)
+from app.services.http_client import PooledAsyncClient
+from app.services.layout_extractor import layout_extractor
+from app.services.model_router import (
+    ModelRouter,
+    ROUTE_ESCALATED,
+    ROUTE_FAST,
+    ROUTE_MAIN,
+)
+from app.services.polling_strategy import parse_retry_after
+from app.services.rate_limiter import rate_limiter
+from app.services.retry_policy import CircuitBreaker, RetryableError, RetryPolicy
+from app.services.stream_parser import IncrementalItemParser
+
+# 串流回應的進度回呼：參數為目前已解析完成的商品數
+StreamProgressCallback = Callable[[int], Any]
+
+# 結構化輸出工具：輸入格式由Pydantic模型產生，回應以同一模型一次驗證
+RECEIPT_TOOL = {
+    "name": "record_receipt",
+    "description": "記錄一張日本收據的結構化資料",
+    "input_schema": ReceiptExtraction.model_json_schema(),
+}
+RECEIPT_BATCH_TOOL = {
+    "name": "record_receipts",
+    "description": "記錄多張日本收據的結構化資料，每張收據一項並以id標示收據編號",
+    "input_schema": ReceiptBatchExtraction.model_json_schema(),
+}
+# 單張與批次請求送出相同的工具列表，使工具與系統區塊共用同一個快取前綴
+RECEIPT_TOOLS = [RECEIPT_TOOL, RECEIPT_BATCH_TOOL]
+
+# 系統提示詞：所有收據請求共用的固定說明（每次請求只變動使用者訊息；工具與系統區塊的前綴達到模型的最小長度時以prompt caching暫存）
+RECEIPT_SYSTEM_PROMPT = """你是日本收據的結構化助手，負責將OCR辨識出的收據文字整理為結構化資料，並以指定的工具返回結果。
+
+規則：
+1. 商品名稱以原文填入 name 與 name_japanese，並在 name_chinese 提供繁體中文翻譯
+2. 金額、稅額與數量都是數字（日圓），無法辨識的選填欄位留空
+3. tax_type 為 "內含稅" 或 "外加稅"
+4. 日期格式為 YYYY-MM-DD，時間格式為 HH:MM"""
+
+# 可重試的HTTP狀態碼（429限流、529過載與暫時性伺服器錯誤）
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+# 串流中途可重試的錯誤類型
+RETRYABLE_STREAM_ERRORS = {"overloaded_error", "api_error", "rate_limit_error"}
+
+# 每張收據的輸出token上限（批次請求依收據數放大）
+MAX_OUTPUT_TOKENS_PER_RECEIPT = 2000
+
+# prompt caching的最小可快取前綴（token），依模型名稱前綴比對；未列出的模型為1024
+# 前綴短於最小長度時API不會快取（也不回報錯誤），此時不標記cache_control
+PROMPT_CACHE_MIN_TOKENS = {
+    "claude-haiku-4-5": 4096,
+    "claude-opus-4-5": 4096,
+    "claude-3-5-haiku": 2048,
+    "claude-3-haiku": 2048,
+}
+DEFAULT_PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate (non-ASCII characters such as Japanese count as one token each)
+    粗略估計token數（日文等非ASCII字元每字約一個token，ASCII約四字元一個token）
+    """
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def prompt_cache_min_tokens(model: str) -> int:
+    """模型的最小可快取前綴長度（token）"""
+    for prefix, min_tokens in PROMPT_CACHE_MIN_TOKENS.items():
+        if model.startswith(prefix):
+            return min_tokens
+    return DEFAULT_PROMPT_CACHE_MIN_TOKENS
+
+
+# 收據請求的快取前綴（工具定義 + 系統提示詞）估計長度
+RECEIPT_PREFIX_TOKENS = estimate_tokens(
+    json.dumps(RECEIPT_TOOLS, ensure_ascii=False)
+) + estimate_tokens(RECEIPT_SYSTEM_PROMPT)
 
 
 class AIService:
@@ -15,38 +101,115 @@ class AIService:
 
     def __init__(self):
         self.api_key = settings.claude_api_key
-        self.base_url = "https://api.anthropic.com/v1/messages"
+        self.base_url = f"{settings.claude_api_base_url.rstrip('/')}/v1/messages"
+        self.model = settings.claude_model
+        # 分層路由：簡單收據先用小模型，檢查未通過時升級到 self.model
+        self.router = ModelRouter(main_model=self.model)
+        # 已知連鎖店版面以規則結構化，通過檢查時不呼叫Claude
+        self.layout_extractor = layout_extractor
+        # 提示詞版本：修改提示詞或解析邏輯時遞增，使舊的AI暫存失效
+        self.prompt_version = "3"
         self.headers = {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
             "content-type": "application/json",
         }
 
+        # Shared pooled client, retry policy and circuit breaker / 共用連線池、重試策略與斷路器
+        self.http = PooledAsyncClient("claude")
+        self.retry_policy = RetryPolicy(
+            max_retries=settings.claude_max_retries,
+            base_delay=settings.claude_retry_base_delay,
+            max_delay=settings.claude_retry_max_delay,
+        )
+        self.circuit_breaker = CircuitBreaker(
+            "claude",
+            failure_threshold=settings.claude_circuit_failure_threshold,
+            reset_seconds=settings.claude_circuit_reset_seconds,
+        )
+
+        # token使用量統計（含prompt caching的寫入與讀取）
+        self.usage = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        # 已標記cache_control但回應未寫入也未讀取快取的模型（只警告一次）
+        self._uncached_models = set()
+        # 結構化輸出驗證統計（驗證失敗的回應會觸發重新請求）
+        self.parse_stats = {"parsed": 0, "parse_failures": 0}
+
         # Check if in test mode / 檢查是否為測試模式
         self.test_mode = "your_claude_api_key_here" in self.api_key
 
         if self.test_mode:
-            logger.warning("🔧 AI service running in test mode - using mock data / AI服務運行在測試模式 - 使用模擬數據")
+            logger.warning(
+                "🔧 AI service running in test mode - using mock data / AI服務運行在測試模式 - 使用模擬數據"
+            )
+
+    async def aclose(self):
+        """
+        Close the pooled HTTP client
+        關閉連線池HTTP客戶端
+        """
+        await self.http.aclose()
 
     async def process_receipt_text(
-        self, ocr_data: Dict, structured_data: Dict
+        self,
+        ocr_data: Dict,
+        structured_data: Dict,
+        on_progress: Optional[StreamProgressCallback] = None,
     ) -> ReceiptData:
         """
         Process receipt text using AI and structure the data
         使用AI處理收據文字並結構化資料
+
+        on_progress is called with the number of items parsed so far while the
+        response streams in.
+        串流回應期間，每解析完成一個商品就以目前商品數調用 on_progress。
         """
         if self.test_mode:
             return self._get_mock_receipt_data(ocr_data, structured_data)
 
+        # Known chain layouts skip the AI / 已知連鎖店版面直接結構化
+        receipt_data = self.layout_extractor.extract(ocr_data)
+        if receipt_data is not None:
+            return receipt_data
+
         try:
             # Build prompt / 構建提示詞
             prompt = self._build_receipt_prompt(ocr_data, structured_data)
 
-            # Call Claude API / 調用Claude API
-            response_text = await self._call_claude_api(prompt)
-
-            # Parse response / 解析回應
-            receipt_data = self._parse_ai_response(response_text, ocr_data)
+            # Simple receipts try the fast model first / 簡單收據先以小模型處理
+            route_reasons = (
+                self.router.route_reasons(ocr_data) if self.router.enabled else []
+            )
+            if self.router.enabled and not route_reasons:
+                try:
+                    receipt_data = await self._extract_receipt(
+                        prompt, ocr_data, self.router.fast_model, on_progress
+                    )
+                    issues = self.router.check_receipt(receipt_data)
+                except Exception as e:
+                    logger.warning(f"小模型處理失敗，升級到 {self.model}: {str(e)}")
+                    issues = ["fast_model_error"]
+
+                if not issues:
+                    self.router.record(ROUTE_FAST)
+                    logger.info(
+                        f"AI processing completed ({self.router.fast_model}) / AI處理完成"
+                    )
+                    return receipt_data
+                self.router.record(ROUTE_ESCALATED, issues)
+                logger.info(f"小模型結果未通過檢查 {issues}，升級到 {self.model}")
+            elif self.router.enabled:
+                self.router.record(ROUTE_MAIN, route_reasons)
+
+            receipt_data = await self._extract_receipt(
+                prompt, ocr_data, self.model, on_progress
+            )
 
             logger.info("AI processing completed / AI處理完成")
             return receipt_data
@@ -55,6 +218,19 @@ class AIService:
             logger.error(f"AI processing failed: {str(e)} / AI處理失敗: {str(e)}")
             raise
 
+    async def _extract_receipt(
+        self,
+        prompt: str,
+        ocr_data: Dict,
+        model: str,
+        on_progress: Optional[StreamProgressCallback] = None,
+    ) -> ReceiptData:
+        """以指定模型調用結構化輸出工具並驗證回應"""
+        tool_input = await self._call_claude_tool(
+            prompt, RECEIPT_TOOL["name"], model=model, on_progress=on_progress
+        )
+        return self._receipt_from_tool_input(tool_input, ocr_data)
+
     def _get_mock_receipt_data(
         self, ocr_data: Dict, structured_data: Dict
     ) -> ReceiptData:
@@ -184,8 +360,38 @@ class AIService:
             source_image="test_receipt.jpg",
         )
 
+    def prompt_cache_enabled(self, model: Optional[str] = None) -> bool:
+        """工具與系統區塊的前綴是否達到模型的最小可快取長度"""
+        return RECEIPT_PREFIX_TOKENS >= prompt_cache_min_tokens(model or self.model)
+
+    def receipt_system(self, model: Optional[str] = None) -> List[Dict]:
+        """
+        Static instructions as the system block, marked cacheable when the
+        tools + system prefix reaches the model's minimum cacheable length
+        固定說明的系統區塊（工具與系統區塊的前綴達到模型的最小長度時才標記cache_control）
+        """
+        block = {"type": "text", "text": RECEIPT_SYSTEM_PROMPT}
+        if self.prompt_cache_enabled(model):
+            block["cache_control"] = {"type": "ephemeral"}
+        return [block]
+
+    def _check_prompt_cache(self, payload: Dict, usage: Optional[Dict]):
+        """已標記cache_control的請求，回應的快取寫入與讀取都為0時警告（每個模型一次）"""
+        marked = any("cache_control" in block for block in payload.get("system") or [])
+        model = payload.get("model")
+        if not marked or not usage or model in self._uncached_models:
+            return
+        if not usage.get("cache_creation_input_tokens") and not usage.get(
+            "cache_read_input_tokens"
+        ):
+            self._uncached_models.add(model)
+            logger.warning(
+                f"Prompt caching未生效: {model} 的回應沒有快取寫入或讀取"
+                f"（估計前綴 {RECEIPT_PREFIX_TOKENS} token，最小長度 {prompt_cache_min_tokens(model)}）"
+            )
+
     def _build_receipt_prompt(self, ocr_data: Dict, structured_data: Dict) -> str:
-        """構建AI提示詞"""
+        """構建AI提示詞（每張收據的使用者訊息；格式說明在系統區塊中）"""
         text = ocr_data.get("text", "")
         confidence = ocr_data.get("confidence", 0.0)
 
@@ -197,164 +403,547 @@ class AIService:
 
 識別信心度：{confidence:.2f}
 
-請嚴格按照以下JSON格式返回，不要添加任何其他文字說明：
+請以 record_receipt 工具返回結果。
+"""
+        return prompt
 
-{{
-  "store_name": "商店名稱",
-  "date": "YYYY-MM-DD",
-  "time": "HH:MM",
-  "total_amount": 數字,
-  "items": [
-    {{
-      "name": "原始商品名稱",
-      "name_japanese": "日文原名",
-      "name_chinese": "繁體中文翻譯",
-      "price": 數字,
-      "quantity": 數字,
-      "tax_included": true/false,
-      "tax_amount": 數字
-    }}
-  ],
-  "payment_method": "支付方式",
-  "receipt_number": "收據號碼",
-  "tax_amount": 數字,
-  "subtotal": 數字,
-  "tax_type": "內含稅" 或 "外加稅"
-}}
+    def _build_batch_prompt(self, entries: List[Dict]) -> str:
+        """
+        構建多張收據的批次提示詞（格式說明只出現一次）
 
-重要要求：
-1. 必須是有效的JSON格式
-2. tax_type 必須是字符串，不是對象
-3. 所有數字欄位必須是數字，不是字符串
-4. 不要包含任何註釋或說明文字
-5. 確保JSON語法正確，沒有多餘的逗號
+        Args:
+            entries: 收據列表，每項含 "ocr_data"
+
+        Returns:
+            提示詞；收據依序編號為 R1、R2 ...
+        """
+        receipts = "\n\n".join(
+            f"=== 收據 R{index} ===\n"
+            f"識別信心度：{entry['ocr_data'].get('confidence', 0.0):.2f}\n"
+            f"{entry['ocr_data'].get('text', '')}"
+            for index, entry in enumerate(entries, start=1)
+        )
+
+        prompt = f"""
+請分析以下 {len(entries)} 張日本收據的文字內容，並將每張收據結構化。
+
+{receipts}
+
+請以 record_receipts 工具返回結果：每張收據恰好一項，並以 "id" 欄位標示上方的收據編號（例如 "R1"）。
 """
         return prompt
 
-    async def _call_claude_api(self, prompt: str) -> str:
-        """調用Claude API"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json={
-                        "model": "claude-sonnet-4-5",
-                        "max_tokens": 2000,
-                        "messages": [{"role": "user", "content": prompt}],
-                    },
-                    timeout=30.0,
+    def plan_receipt_batches(self, entries: List[Dict]) -> List[List[Dict]]:
+        """
+        Group receipts into Claude requests by token budget and receipt count
+        依token預算與收據數量將收據分組為多個Claude請求
+
+        Args:
+            entries: Receipts, each with "ocr_data" / 收據列表，每項含 "ocr_data"
+
+        Returns:
+            Groups in input order / 依輸入順序的分組
+        """
+        max_receipts = max(1, settings.claude_batch_max_receipts)
+        budget = settings.claude_batch_token_budget
+
+        groups: List[List[Dict]] = []
+        current: List[Dict] = []
+        current_tokens = 0
+        for entry in entries:
+            tokens = estimate_tokens(entry["ocr_data"].get("text", ""))
+            if current and (
+                len(current) >= max_receipts or current_tokens + tokens > budget
+            ):
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(entry)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    async def process_receipt_group(
+        self, entries: List[Dict], on_progress: Optional[StreamProgressCallback] = None
+    ) -> List[Union[ReceiptData, Exception]]:
+        """
+        Structure several receipts with one Claude request
+        以一次Claude請求結構化多張收據
+
+        Receipts with a known chain layout are structured locally first and
+        left out of the request. Receipts missing from (or unparsable in) the
+        batched answer fall back to one request each.
+        已知連鎖店版面的收據先以規則結構化，不放入請求中；批次回應中缺少或無法解析的收據，改為逐張單獨請求。
+
+        Args:
+            entries: Receipts, each with "ocr_data" and "structured_data"
+                     收據列表，每項含 "ocr_data" 與 "structured_data"
+            on_progress: Streamed item count across the group / 整組串流中已解析的商品數
+
+        Returns:
+            ReceiptData or the exception, aligned with entries
+            與輸入對齊的ReceiptData或例外
+        """
+        results: List[Optional[Union[ReceiptData, Exception]]] = [None] * len(entries)
+        # 小模型結果未通過檢查的收據，逐張處理時直接使用大模型
+        escalated = set()
+        # 只有規則無法處理的收據送出批次請求（索引對應回entries）
+        pending = list(range(len(entries)))
+
+        if len(entries) > 1 and not self.test_mode:
+            for index, entry in enumerate(entries):
+                results[index] = self.layout_extractor.extract(entry["ocr_data"])
+            pending = [index for index, result in enumerate(results) if result is None]
+
+        if len(pending) > 1 and not self.test_mode:
+            pending_entries = [entries[index] for index in pending]
+            # 整組都是簡單收據時以小模型處理
+            use_fast = self.router.enabled and not any(
+                self.router.route_reasons(entry["ocr_data"])
+                for entry in pending_entries
+            )
+            try:
+                tool_input = await self._call_claude_tool(
+                    self._build_batch_prompt(pending_entries),
+                    RECEIPT_BATCH_TOOL["name"],
+                    max_tokens=MAX_OUTPUT_TOKENS_PER_RECEIPT * len(pending_entries),
+                    model=self.router.fast_model if use_fast else self.model,
+                    on_progress=on_progress,
                 )
+                parsed = {
+                    pending[position]: receipt_data
+                    for position, receipt_data in self._parse_batch_response(
+                        tool_input, pending_entries
+                    ).items()
+                }
+                for index, receipt_data in parsed.items():
+                    issues = self.router.check_receipt(receipt_data) if use_fast else []
+                    if issues:
+                        self.router.record(ROUTE_ESCALATED, issues)
+                        escalated.add(index)
+                        continue
+                    if self.router.enabled:
+                        self.router.record(ROUTE_FAST if use_fast else ROUTE_MAIN)
+                    results[index] = receipt_data
+                logger.info(
+                    f"批次AI處理完成: {len(parsed) - len(escalated)}/{len(pending_entries)} 張收據"
+                )
+            except Exception as e:
+                logger.warning(f"批次AI處理失敗，改為逐張處理: {str(e)}")
 
-                if response.status_code == 200:
-                    result = response.json()
-                    return result["content"][0]["text"]
+        for index, entry in enumerate(entries):
+            if results[index] is not None:
+                continue
+            try:
+                if index in escalated:
+                    results[index] = await self._extract_receipt(
+                        self._build_receipt_prompt(
+                            entry["ocr_data"], entry["structured_data"]
+                        ),
+                        entry["ocr_data"],
+                        self.model,
+                    )
                 else:
-                    raise Exception(
-                        f"Claude API調用失敗: {response.status_code} - {response.text}"
+                    results[index] = await self.process_receipt_text(
+                        entry["ocr_data"], entry["structured_data"]
                     )
+            except Exception as e:
+                results[index] = e
+        return results
+
+    def _parse_batch_response(
+        self, tool_input: Dict, entries: List[Dict]
+    ) -> Dict[int, ReceiptData]:
+        """
+        解析批次工具輸入，依 "id" 對應回輸入的收據（每張收據分別驗證）
+
+        Returns:
+            {輸入索引: ReceiptData}，只包含驗證成功的收據
+        """
+        receipts = tool_input.get("receipts") if isinstance(tool_input, dict) else None
+        if not isinstance(receipts, list):
+            self.parse_stats["parse_failures"] += 1
+            raise Exception("批次工具輸入缺少receipts列表")
+
+        parsed: Dict[int, ReceiptData] = {}
+        for item in receipts:
+            if not isinstance(item, dict):
+                continue
+            receipt_id = str(item.get("id", "")).strip().upper().lstrip("R")
+            if not receipt_id.isdigit():
+                continue
+            index = int(receipt_id) - 1
+            if 0 <= index < len(entries) and index not in parsed:
+                try:
+                    parsed[index] = self._receipt_from_tool_input(
+                        item, entries[index]["ocr_data"]
+                    )
+                except Exception as e:
+                    logger.warning(f"批次回應中的收據 R{index + 1} 解析失敗: {str(e)}")
+        return parsed
+
+    def record_usage(self, usage: Optional[Dict]):
+        """
+        Accumulate token usage, including prompt-cache writes and reads
+        累計token使用量（含prompt caching的寫入與讀取）
+        """
+        if not usage:
+            return
+        self.usage["requests"] += 1
+        for field in (
+            "input_tokens",
+            "output_tokens",
+            "cache_creation_input_tokens",
+            "cache_read_input_tokens",
+        ):
+            self.usage[field] += usage.get(field) or 0
+
+    def get_usage_stats(self) -> Dict:
+        """獲取token使用量統計與快取命中率"""
+        prompt_tokens = (
+            self.usage["input_tokens"]
+            + self.usage["cache_creation_input_tokens"]
+            + self.usage["cache_read_input_tokens"]
+        )
+        return {
+            **self.usage,
+            "structured_output": dict(self.parse_stats),
+            "routing": self.router.get_stats(),
+            "layout": self.layout_extractor.get_stats(),
+            "prompt_cache": {
+                model: {
+                    "prefix_tokens": RECEIPT_PREFIX_TOKENS,
+                    "min_tokens": prompt_cache_min_tokens(model),
+                    "enabled": self.prompt_cache_enabled(model),
+                }
+                for model in dict.fromkeys([self.model, self.router.fast_model])
+            },
+            "cache_hit_ratio": (
+                round(self.usage["cache_read_input_tokens"] / prompt_tokens, 3)
+                if prompt_tokens
+                else 0.0
+            ),
+        }
+
+    async def _call_claude_api(
+        self, prompt: str, max_tokens: int = 2000, system: Optional[List[Dict]] = None
+    ) -> str:
+        """
+        調用Claude API
+
+        Args:
+            prompt: 使用者訊息
+            max_tokens: 輸出token上限
+            system: 系統區塊（可含cache_control）
+        """
+        payload = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if system:
+            payload["system"] = system
+
+        result = await self._post_message(payload)
+        return result["content"][0]["text"]
+
+    async def _call_claude_tool(
+        self,
+        prompt: str,
+        tool_name: str,
+        max_tokens: int = MAX_OUTPUT_TOKENS_PER_RECEIPT,
+        model: Optional[str] = None,
+        on_progress: Optional[StreamProgressCallback] = None,
+    ) -> Dict:
+        """
+        Call Claude forcing one of the receipt tools and return its input
+        強制使用指定的收據工具調用Claude，返回工具輸入
+
+        Args:
+            prompt: 使用者訊息
+            tool_name: RECEIPT_TOOLS 中的工具名稱
+            max_tokens: 輸出token上限
+            model: 使用的模型（預設為 self.model）
+            on_progress: 串流中已解析商品數的回呼
+        """
+        result = await self._post_message(
+            {
+                "model": model or self.model,
+                "max_tokens": max_tokens,
+                "system": self.receipt_system(model),
+                "tools": RECEIPT_TOOLS,
+                "tool_choice": {"type": "tool", "name": tool_name},
+                "messages": [{"role": "user", "content": prompt}],
+            },
+            on_progress=on_progress,
+        )
+        return self.tool_input(result, tool_name)
+
+    async def _post_message(
+        self, payload: Dict, on_progress: Optional[StreamProgressCallback] = None
+    ) -> Dict:
+        """送出Messages API請求（啟用時以串流接收），記錄token使用量並返回回應內容"""
+        try:
+            if settings.claude_streaming_enabled:
+                result = await self.send_request(
+                    "POST",
+                    self.base_url,
+                    body={**payload, "stream": True},
+                    rate_limited=True,
+                    consume=lambda response: self._read_stream(response, on_progress),
+                )
+            else:
+                response = await self.send_request(
+                    "POST", self.base_url, body=payload, rate_limited=True
+                )
+                result = response.json()
+            self.record_usage(result.get("usage"))
+            self._check_prompt_cache(payload, result.get("usage"))
+            return result
 
         except Exception as e:
             logger.error(f"Claude API調用錯誤: {str(e)}")
             raise
 
-    def _parse_ai_response(self, response: str, ocr_data: Dict) -> ReceiptData:
-        """解析AI回應"""
-        try:
-            # 由於使用了JSON模式，直接解析整個回應
-            try:
-                data = json.loads(response)
-            except json.JSONDecodeError as e:
-                # 如果直接解析失敗，嘗試提取JSON部分
-                import re
-
-                json_match = re.search(r"\{.*\}", response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group()
-                    data = json.loads(json_str)
-                else:
-                    raise Exception(f"無法找到有效的JSON格式: {str(e)}")
-
-            # 安全的數值轉換函數
-            def safe_float(value, default=0.0):
-                if isinstance(value, (int, float)):
-                    return float(value)
-                elif isinstance(value, str):
-                    try:
-                        return float(value)
-                    except (ValueError, TypeError):
-                        return default
-                else:
-                    return default
+    async def _read_stream(
+        self,
+        response: httpx.Response,
+        on_progress: Optional[StreamProgressCallback] = None,
+    ) -> Dict:
+        """
+        Rebuild a Messages API response from its server-sent events
+        由伺服器推送事件（SSE）重組Messages API回應
 
-            def safe_int(value, default=1):
-                if isinstance(value, (int, float)):
-                    return int(value)
-                elif isinstance(value, str):
-                    try:
-                        return int(float(value))
-                    except (ValueError, TypeError):
-                        return default
-                else:
-                    return default
+        Tool input arrives as partial_json deltas; completed items are parsed
+        on the way and reported through on_progress.
+        工具輸入以partial_json片段到達，過程中解析完成的商品並透過 on_progress 回報。
+        """
+        if "text/event-stream" not in response.headers.get("content-type", ""):
+            # 伺服器未以串流回應時直接讀取完整JSON
+            await response.aread()
+            return response.json()
+
+        message: Dict = {"content": [], "usage": {}}
+        partial_json: Dict[int, List[str]] = {}
+        parser = IncrementalItemParser()
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:].strip())
+            event_type = event.get("type")
+
+            if event_type == "message_start":
+                started = event.get("message", {})
+                message.update(
+                    {k: v for k, v in started.items() if k not in ("content", "usage")}
+                )
+                message["usage"].update(started.get("usage") or {})
+            elif event_type == "content_block_start":
+                message["content"].append(dict(event["content_block"]))
+            elif event_type == "content_block_delta":
+                index = event["index"]
+                delta = event.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    block = message["content"][index]
+                    block["text"] = block.get("text", "") + delta.get("text", "")
+                elif delta.get("type") == "input_json_delta":
+                    fragment = delta.get("partial_json", "")
+                    partial_json.setdefault(index, []).append(fragment)
+                    if parser.feed(fragment) and on_progress is not None:
+                        on_progress(parser.items_parsed)
+            elif event_type == "content_block_stop":
+                index = event["index"]
+                if index in partial_json:
+                    message["content"][index]["input"] = json.loads(
+                        "".join(partial_json.pop(index)) or "{}"
+                    )
+            elif event_type == "message_delta":
+                message.update(event.get("delta", {}))
+                message["usage"].update(event.get("usage") or {})
+            elif event_type == "error":
+                error = event.get("error", {})
+                error_message = (
+                    f"Claude串流錯誤: {error.get('type')} - {error.get('message', '')}"
+                )
+                if error.get("type") in RETRYABLE_STREAM_ERRORS:
+                    raise RetryableError(error_message)
+                raise Exception(error_message)
+
+        return message
+
+    def tool_input(self, message: Dict, tool_name: str) -> Dict:
+        """取出回應中指定工具的輸入（沒有工具調用時拋出例外）"""
+        for block in message.get("content", []):
+            if block.get("type") == "tool_use" and block.get("name") == tool_name:
+                return block.get("input", {})
+        self.parse_stats["parse_failures"] += 1
+        raise Exception(
+            f"回應中沒有 {tool_name} 工具調用 (stop_reason: {message.get('stop_reason')})"
+        )
 
-            # 解析日期
-            from datetime import datetime
+    async def send_request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[Dict] = None,
+        rate_limited: bool = False,
+        consume: Optional[Callable[[httpx.Response], Awaitable[Any]]] = None,
+    ) -> Any:
+        """
+        Send a Claude API request with retries and the circuit breaker
+        以重試策略與斷路器送出Claude API請求
+
+        429/529/5xx, overloaded errors and connection errors are retried with
+        jittered exponential backoff (honoring retry-after). Other 4xx responses
+        fail immediately. With consume, the response is streamed and the read
+        timeout bounds inactivity between chunks instead of the total duration;
+        errors while consuming are retried the same way.
+        429/529/5xx、overloaded與連線錯誤以含抖動的指數退避重試（遵循retry-after）；
+        其他4xx回應直接失敗。提供consume時以串流接收，讀取逾時限制的是片段之間的閒置時間而非總時間；
+        讀取過程中的錯誤同樣重試。
+
+        Args:
+            method: HTTP method / HTTP方法
+            url: Request URL / 請求網址
+            body: JSON body / JSON內容
+            rate_limited: Take a token from the shared Claude rate limiter per attempt
+                          每次嘗試前是否取得共用的Claude調用配額
+            consume: Stream the response into this coroutine / 以串流方式交給此協程讀取
+
+        Returns:
+            The successful (2xx) response, or consume's result
+            成功（2xx）的回應；提供consume時為其返回值
+        """
+        client = await self.http.get_client()
+        attempt = 0
+        while True:
+            self.circuit_breaker.before_request()
+            consumed = None
+            try:
+                if rate_limited:
+                    # 取得Claude調用配額（全程序共用的token bucket）
+                    await rate_limiter.acquire("claude")
 
-            date_str = data.get("date", "")
-            receipt_date = datetime.now()
-            if date_str:
-                try:
-                    receipt_date = datetime.strptime(date_str, "%Y-%m-%d")
-                except:
-                    pass
-
-            # 解析商品項目
-            items = []
-            for item_data in data.get("items", []):
-                items.append(
-                    ReceiptItem(
-                        name=item_data.get("name", ""),
-                        name_japanese=item_data.get("name_japanese"),
-                        name_chinese=item_data.get("name_chinese"),
-                        price=safe_float(item_data.get("price", 0)),
-                        quantity=safe_int(item_data.get("quantity", 1)),
-                        tax_included=item_data.get("tax_included"),
-                        tax_amount=safe_float(item_data.get("tax_amount", 0)),
+                if consume is None:
+                    response = await client.request(
+                        method, url, headers=self.headers, json=body
                     )
+                    error = self._retryable_error(response)
+                else:
+                    request = client.build_request(
+                        method,
+                        url,
+                        headers=self.headers,
+                        json=body,
+                        timeout=httpx.Timeout(
+                            self.http.timeout, read=settings.claude_stream_idle_timeout
+                        ),
+                    )
+                    response = await client.send(request, stream=True)
+                    try:
+                        if not response.is_success:
+                            await response.aread()
+                        error = self._retryable_error(response)
+                        if error is None and response.is_success:
+                            consumed = await consume(response)
+                    finally:
+                        await response.aclose()
+            except httpx.TransportError as e:
+                error = RetryableError(
+                    f"Claude API連線錯誤: {type(e).__name__} {str(e)}"
+                )
+            except RetryableError as e:
+                error = e
+            except BaseException:
+                # 串流error事件、解析失敗或工作取消：結束half-open的試探請求，
+                # 否則斷路器會停在試探中並拒絕之後所有請求
+                self.circuit_breaker.release_trial()
+                raise
+
+            if error is None:
+                self.circuit_breaker.record_success()
+                if response.is_success:
+                    return response if consume is None else consumed
+                raise Exception(
+                    f"Claude API調用失敗: {response.status_code} - {response.text}"
                 )
 
-            # 處理tax_type，確保它是字符串
-            tax_type = data.get("tax_type", "")
-            if isinstance(tax_type, dict):
-                # 如果是字典，嘗試提取有用信息
-                if "standard_rate" in tax_type:
-                    tax_type = "內含稅"
-                elif "reduced_rate" in tax_type:
-                    tax_type = "內含稅"
-                else:
-                    tax_type = "內含稅"
-            elif not isinstance(tax_type, str):
-                tax_type = str(tax_type) if tax_type else "內含稅"
-
-            return ReceiptData(
-                store_name=data.get("store_name", ""),
-                date=receipt_date,
-                total_amount=safe_float(data.get("total_amount", 0)),
-                items=items,
-                payment_method=data.get("payment_method", ""),
-                receipt_number=data.get("receipt_number", ""),
-                tax_amount=safe_float(data.get("tax_amount", 0)),
-                subtotal=safe_float(data.get("subtotal", 0)),
-                tax_type=tax_type,
-                confidence_score=ocr_data.get("confidence", 0.0),
-                processing_time=0.0,
-                source_image="",
+            if error.status_code == 429:
+                # 暫停所有Claude調用，避免其他工作者繼續觸發429
+                rate_limiter.pause(
+                    "claude",
+                    (
+                        error.retry_after
+                        if error.retry_after is not None
+                        else rate_limiter.seconds_per_request("claude")
+                    ),
+                )
+            else:
+                self.circuit_breaker.record_failure()
+
+            if attempt >= self.retry_policy.max_retries:
+                raise error
+            delay = self.retry_policy.next_delay(attempt, error.retry_after)
+            attempt += 1
+            logger.warning(
+                f"Claude API重試 {attempt}/{self.retry_policy.max_retries}，{delay:.1f} 秒後: {str(error)}"
             )
+            await asyncio.sleep(delay)
+
+    def _retryable_error(self, response: httpx.Response) -> Optional[RetryableError]:
+        """回應為可重試的錯誤時返回RetryableError，否則返回None"""
+        overloaded = response.status_code >= 500 and "overloaded_error" in response.text
+        if response.status_code not in RETRYABLE_STATUS_CODES and not overloaded:
+            return None
+        return RetryableError(
+            f"Claude API調用失敗: {response.status_code} - {response.text}",
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers.get("retry-after")),
+        )
 
-        except Exception as e:
+    def _parse_ai_response(self, response: str, ocr_data: Dict) -> ReceiptData:
+        """解析JSON文字格式的AI回應（以結構化輸出模型驗證）"""
+        try:
+            data = json.loads(response)
+        except json.JSONDecodeError as e:
+            self.parse_stats["parse_failures"] += 1
             logger.error(f"解析AI回應失敗: {str(e)}")
-            raise
+            raise Exception(f"AI回應不是有效的JSON: {str(e)}")
+        return self._receipt_from_tool_input(data, ocr_data)
+
+    def _receipt_from_tool_input(self, data: Dict, ocr_data: Dict) -> ReceiptData:
+        """
+        Validate a tool input against ReceiptExtraction and build ReceiptData
+        以ReceiptExtraction驗證工具輸入並轉換為ReceiptData
+        """
+        try:
+            extraction = ReceiptExtraction.model_validate(data)
+            receipt_date = datetime.strptime(extraction.date, "%Y-%m-%d")
+        except ValueError as e:
+            # pydantic的ValidationError也是ValueError
+            self.parse_stats["parse_failures"] += 1
+            logger.error(f"AI結構化輸出驗證失敗: {str(e)}")
+            raise Exception(f"AI結構化輸出驗證失敗: {str(e)}")
+
+        self.parse_stats["parsed"] += 1
+        return ReceiptData(
+            store_name=extraction.store_name,
+            date=receipt_date,
+            total_amount=extraction.total_amount,
+            items=[
+                item.model_copy(update={"quantity": item.quantity or 1})
+                for item in extraction.items
+            ],
+            payment_method=extraction.payment_method,
+            receipt_number=extraction.receipt_number,
+            tax_amount=extraction.tax_amount,
+            subtotal=extraction.subtotal,
+            tax_type=extraction.tax_type,
+            confidence_score=ocr_data.get("confidence", 0.0),
+            processing_time=0.0,
+            source_image="",
+        )
 
     async def validate_receipt_data(self, receipt_data: ReceiptData) -> Dict:
         """驗證收據數據"""
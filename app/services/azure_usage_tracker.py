@@ -5,9 +5,10 @@ Azure Computer Vision API 使用量追蹤服務
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
 from app.config import settings
+from app.services.rate_limiter import rate_limiter
 
 
 class AzureUsageTracker:
@@ -16,12 +17,19 @@ class AzureUsageTracker:
     def __init__(self):
         self.usage_file = os.path.join(settings.output_dir, "azure_usage.json")
         self.monthly_limit = 5000  # 每月免費額度
-        self.rate_limit = 20  # 每分鐘請求限制
         self.max_image_size = 4 * 1024 * 1024  # 4MB
 
+        # 已解析的使用量資料快取：(檔案修改時間, 資料)，檔案未變更時不重新解析
+        self._usage_cache: Optional[Tuple[float, Dict]] = None
+
         # 初始化使用量檔案
         self._init_usage_file()
 
+    @property
+    def rate_limit(self) -> int:
+        """每分鐘請求限制（來自共用限流器設定）"""
+        return int(rate_limiter.rate_per_minute("azure"))
+
     def _init_usage_file(self):
         """初始化使用量檔案"""
         if not os.path.exists(self.usage_file):
@@ -38,10 +46,16 @@ class AzureUsageTracker:
             self._save_usage(initial_usage)
 
     def _load_usage(self) -> Dict:
-        """載入使用量資料"""
+        """載入使用量資料（檔案未變更時使用快取）"""
         try:
+            mtime = os.path.getmtime(self.usage_file)
+            if self._usage_cache is not None and self._usage_cache[0] == mtime:
+                return self._usage_cache[1]
+
             with open(self.usage_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+                usage_data = json.load(f)
+            self._usage_cache = (mtime, usage_data)
+            return usage_data
         except Exception as e:
             logger.error(f"載入使用量資料失敗: {e}")
             return self._get_default_usage()
@@ -51,6 +65,7 @@ class AzureUsageTracker:
         try:
             with open(self.usage_file, "w", encoding="utf-8") as f:
                 json.dump(usage_data, f, ensure_ascii=False, indent=2)
+            self._usage_cache = (os.path.getmtime(self.usage_file), usage_data)
         except Exception as e:
             logger.error(f"儲存使用量資料失敗: {e}")
 
@@ -79,9 +94,13 @@ class AzureUsageTracker:
             logger.info("月度使用量已重置")
 
     def record_api_call(
-        self, image_size: int, processing_time: float, success: bool = True
+        self,
+        image_size: int,
+        processing_time: float,
+        success: bool = True,
+        poll_count: int = 0,
     ):
-        """記錄API調用"""
+        """記錄API調用（poll_count：Operation-Location輪詢次數）"""
         usage_data = self._load_usage()
 
         # 檢查月度重置
@@ -113,6 +132,7 @@ class AzureUsageTracker:
             "image_size_mb": round(image_size / (1024 * 1024), 2),
             "processing_time": round(processing_time, 2),
             "success": success,
+            "poll_count": poll_count,
             "cost_estimate": self._calculate_cost_estimate(image_size),
         }
         usage_data["api_calls"].append(api_call)
@@ -166,7 +186,9 @@ class AzureUsageTracker:
 
         # 檢查使用量警告
         if monthly_usage >= self.monthly_limit * 0.8:
-            logger.warning(f"⚠️ 月度使用量已達80%: {monthly_usage}/{self.monthly_limit}")
+            logger.warning(
+                f"⚠️ 月度使用量已達80%: {monthly_usage}/{self.monthly_limit}"
+            )
 
     def get_usage_summary(self) -> Dict:
         """獲取使用量摘要"""
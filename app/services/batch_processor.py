@@ -2,157 +2,144 @@
 批次處理服務 - 處理大量圖片時的頻率控制和分批處理
 """
 
-import asyncio
+import functools
 import os
 import time
 import uuid
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional
 from loguru import logger
 from app.services.ocr_service import ocr_service
 from app.services.ai_service import ai_service
 from app.services.csv_service import csv_service
 from app.services.cache_service import cache_service
+from app.services.duplicate_detector import duplicate_detector
 from app.services.azure_usage_tracker import azure_usage_tracker
-from app.utils.image_utils import image_utils
+from app.services.rate_limiter import rate_limiter
+from app.services.batch_progress import BatchProgress
+from app.services.image_worker_pool import image_worker_pool
+from app.services.message_batches import message_batch_backend
+from app.services.cache_store import key_digest
+from app.services.content_hash import (
+    content_hasher,
+    PREPROCESS_ENHANCE,
+    PREPROCESS_RAW,
+)
 
 
 class BatchProcessor:
     """批次處理器 - 處理大量圖片時的頻率控制"""
 
     def __init__(self):
-        self.rate_limit = 20  # 每分鐘最多20次請求
+        # 請求節奏由共用的rate_limiter控制，不再使用固定延遲
         self.batch_size = 20  # 每批最多20個圖片
-        self.delay_between_batches = 60  # 批次間隔60秒
-        self.delay_between_requests = 3  # 請求間隔3秒
 
-        # 進度追蹤
-        self.current_progress = 0
-        self.total_items = 0
-        self.current_batch = 0
-        self.total_batches = 0
-        self.start_time = None
-        self.estimated_completion_time = None
+        # 最近一次處理的進度（每次處理使用獨立的BatchProgress）
+        self.last_progress = BatchProgress()
 
         # 檔案管理
         self.auto_delete_successful = True  # 處理成功後自動刪除圖片
         self.keep_failed_files = True  # 保留失敗的檔案以便重試
 
-    def _calculate_batch_delay(self, batch_size: int) -> float:
-        """計算批次間需要的延遲時間"""
-        # 確保每分鐘不超過20次請求
-        requests_per_minute = batch_size
-        if requests_per_minute > self.rate_limit:
-            # 需要延遲以符合限制
-            delay_needed = (requests_per_minute / self.rate_limit - 1) * 60
-            return max(delay_needed, self.delay_between_batches)
-        else:
-            return self.delay_between_requests * batch_size
-
-    def _estimate_completion_time(self, total_items: int) -> str:
-        """估算完成時間"""
-        if self.start_time is None:
-            return "計算中..."
-
-        elapsed_time = time.time() - self.start_time
-        if self.current_progress == 0:
-            return "計算中..."
+    @property
+    def rate_limit(self) -> int:
+        """每分鐘最多請求數（來自共用限流器）"""
+        return int(rate_limiter.rate_per_minute("azure"))
 
-        # 計算每項平均處理時間
-        avg_time_per_item = elapsed_time / self.current_progress
-        remaining_items = total_items - self.current_progress
-        estimated_remaining_time = remaining_items * avg_time_per_item
+    @property
+    def delay_between_requests(self) -> float:
+        """穩定狀態下的請求間隔秒數（來自共用限流器）"""
+        return round(rate_limiter.seconds_per_request("azure"), 2)
 
-        # 加上批次延遲時間
-        remaining_batches = self.total_batches - self.current_batch
-        batch_delay_time = remaining_batches * self.delay_between_batches
-
-        total_remaining_time = estimated_remaining_time + batch_delay_time
-
-        if total_remaining_time < 60:
-            return f"{int(total_remaining_time)}秒"
-        elif total_remaining_time < 3600:
-            return f"{int(total_remaining_time / 60)}分鐘"
-        else:
-            return f"{int(total_remaining_time / 3600)}小時{int((total_remaining_time % 3600) / 60)}分鐘"
+    @property
+    def delay_between_batches(self) -> float:
+        """批次間不再額外等待，節奏由限流器控制"""
+        return 0
 
     def get_progress(self) -> Dict:
-        """獲取當前進度"""
-        if self.total_items == 0:
-            return {
-                "current_progress": 0,
-                "total_items": 0,
-                "percentage": 0,
-                "current_batch": 0,
-                "total_batches": 0,
-                "estimated_completion": "計算中...",
-                "elapsed_time": 0,
-            }
-
-        percentage = (self.current_progress / self.total_items) * 100
-        elapsed_time = time.time() - self.start_time if self.start_time else 0
-
-        return {
-            "current_progress": self.current_progress,
-            "total_items": self.total_items,
-            "percentage": round(percentage, 1),
-            "current_batch": self.current_batch,
-            "total_batches": self.total_batches,
-            "estimated_completion": self._estimate_completion_time(self.total_items),
-            "elapsed_time": round(elapsed_time, 1),
-        }
+        """獲取最近一次處理的進度"""
+        return self.last_progress.get_progress()
 
     async def process_single_item(
-        self, filename: str, enhance_image: bool = True, save_detailed_csv: bool = False
+        self,
+        filename: str,
+        enhance_image: bool = True,
+        save_detailed_csv: bool = False,
+        progress: Optional[BatchProgress] = None,
     ) -> Dict:
-        """處理單個圖片"""
+        """處理單個圖片（progress：串流中已解析的商品數會即時反映在進度中）"""
         try:
             # 構建檔案路徑
             file_path = f"./data/receipts/{filename}"
 
-            if not image_utils.validate_image(file_path):
+            if not await image_worker_pool.validate_image(file_path):
                 return {
                     "filename": filename,
                     "success": False,
                     "error": "無效的圖片檔案",
                 }
 
-            # 圖片預處理
-            processed_image_path = file_path
-            if enhance_image:
-                processed_image_path = image_utils.enhance_image_quality(file_path)
+            # 以圖片內容雜湊作為暫存鍵（雜湊在圖片工作程序池中計算）
+            await image_worker_pool.image_digest(file_path)
+            preprocessing = PREPROCESS_ENHANCE if enhance_image else PREPROCESS_RAW
+            ocr_cache_key = content_hasher.ocr_key(file_path, preprocessing)
 
-            # OCR文字識別
+            # OCR文字識別（檢查是否有暫存）
             logger.info(f"批次處理 - OCR: {filename}")
-            ocr_result = await ocr_service.extract_text(processed_image_path)
+            cache_data = cache_service.load_ocr_result(ocr_cache_key)
+            if cache_data and cache_data.get("ocr_data"):
+                logger.info(f"使用OCR暫存資料: {filename}")
+                ocr_result = cache_data["ocr_data"]
+            else:
+                # 圖片預處理（在記憶體中完成，直接上傳位元組）
+                image_data = None
+                if enhance_image:
+                    image_data = await image_worker_pool.prepare_for_ocr(
+                        file_path, enhance=True
+                    )
+
+                ocr_result = await ocr_service.extract_text(
+                    file_path, image_data=image_data
+                )
+                if not ocr_result.get("success"):
+                    # 失敗的結果不暫存，重新上傳時會重新識別
+                    return {
+                        "filename": filename,
+                        "success": False,
+                        "error": ocr_result.get("error", "OCR失敗"),
+                    }
+                cache_service.save_ocr_result(
+                    filename, ocr_result, cache_key=ocr_cache_key
+                )
+
+            # 近似重複的圖片OCR文字一致時連結，AI暫存鍵隨之指向先前的結果
+            duplicate_detector.confirm_duplicate(file_path, ocr_result)
+            ai_cache_key = content_hasher.ai_key(file_path, preprocessing)
 
             # 提取結構化資料
             structured_data = ocr_service.extract_structured_data(ocr_result)
 
             # AI整理和結構化（檢查是否有暫存）
             logger.info(f"批次處理 - AI: {filename}")
-            
+
             # 檢查是否有AI暫存
-            ai_cache_data = cache_service.load_ai_result(filename)
-            if ai_cache_data and ai_cache_data.get("receipt_data"):
+            receipt_data = cache_service.load_receipt_data(ai_cache_key)
+            if receipt_data is not None:
                 logger.info(f"使用AI暫存資料: {filename}")
-                # 從暫存資料恢復ReceiptData對象
-                from app.models.receipt import ReceiptData
-                receipt_dict = ai_cache_data["receipt_data"]
-                # 處理日期字串
-                if isinstance(receipt_dict.get("date"), str):
-                    from datetime import datetime
-                    try:
-                        receipt_dict["date"] = datetime.fromisoformat(receipt_dict["date"])
-                    except:
-                        pass
-                receipt_data = ReceiptData(**receipt_dict)
             else:
                 # 執行AI處理
                 receipt_data = await ai_service.process_receipt_text(
-                    ocr_result, structured_data
+                    ocr_result,
+                    structured_data,
+                    on_progress=(
+                        functools.partial(progress.update_partial, filename)
+                        if progress
+                        else None
+                    ),
                 )
                 # 保存到暫存
-                cache_service.save_ai_result(filename, receipt_data, ocr_result)
+                cache_service.save_ai_result(
+                    filename, receipt_data, ocr_result, cache_key=ai_cache_key
+                )
 
             # 設定來源圖片
             receipt_data.source_image = filename
@@ -207,8 +194,13 @@ class BatchProcessor:
         filenames: List[str],
         enhance_image: bool = True,
         save_detailed_csv: bool = False,
+        progress: Optional[BatchProgress] = None,
+        state: Optional[Dict] = None,
+        checkpoint: Optional[Callable[[Dict], Any]] = None,
     ) -> List[Dict]:
-        """處理一個批次"""
+        """處理一個批次（成功的收據在標記完成前追加到state中的執行紀錄）"""
+        progress = progress or BatchProgress()
+        state = state if state is not None else {}
         batch_results = []
 
         for i, filename in enumerate(filenames):
@@ -216,22 +208,24 @@ class BatchProcessor:
 
             # 處理單個圖片
             result = await self.process_single_item(
-                filename, enhance_image, save_detailed_csv
+                filename, enhance_image, save_detailed_csv, progress
             )
             batch_results.append(result)
 
+            # 先追加到收據儲存再標記完成，工作中斷後恢復時不會遺失已完成的收據
+            if result["success"]:
+                try:
+                    csv_service.append_to_run([result["data"]], state, checkpoint)
+                except Exception as e:
+                    logger.error(f"追加收據失敗: {filename}, 錯誤: {str(e)}")
+
             # 更新進度
-            self.current_progress += 1
+            progress.advance(filename, result["success"], result.get("error"))
 
             logger.info(
                 f"   檔案 {filename} 處理完成: {'成功' if result['success'] else '失敗'}"
             )
 
-            # 如果不是最後一個，添加請求間隔
-            if i < len(filenames) - 1:
-                logger.info(f"   等待 {self.delay_between_requests} 秒...")
-                await asyncio.sleep(self.delay_between_requests)
-
         return batch_results
 
     async def process_large_batch(
@@ -239,23 +233,30 @@ class BatchProcessor:
         filenames: List[str],
         enhance_image: bool = True,
         save_detailed_csv: bool = False,
+        progress: Optional[BatchProgress] = None,
+        state: Optional[Dict] = None,
+        checkpoint: Optional[Callable[[Dict], Any]] = None,
     ) -> Dict:
-        """處理大量圖片，包含頻率控制"""
-        self.start_time = time.time()
-        self.total_items = len(filenames)
-        self.current_progress = 0
-        self.current_batch = 0
+        """
+        處理大量圖片，包含頻率控制（progress：此次處理專用的進度物件）
+
+        每個成功的檔案立即追加到同一個執行紀錄；state/checkpoint 由工作佇列提供時，
+        run_id 保存在工作中，恢復後繼續追加到同一個執行紀錄。
+        """
+        progress = progress or BatchProgress()
+        state = state if state is not None else {}
+        self.last_progress = progress
 
         # 分批處理
         batches = [
             filenames[i : i + self.batch_size]
             for i in range(0, len(filenames), self.batch_size)
         ]
-        self.total_batches = len(batches)
+        progress.min_seconds_per_item = self.delay_between_requests
+        progress.start(len(filenames), len(batches))
 
         all_results = []
         failed_files = []
-        successful_receipts = []  # 收集成功的收據資料
 
         logger.info(f"開始批次處理 {len(filenames)} 個檔案，分為 {len(batches)} 個批次")
         logger.info(f"📊 批次分配:")
@@ -263,51 +264,42 @@ class BatchProcessor:
             logger.info(f"   批次 {i+1}: {len(batch)} 個檔案 - {batch}")
 
         for batch_index, batch_filenames in enumerate(batches):
-            self.current_batch = batch_index + 1
+            progress.set_batch(batch_index + 1)
 
             logger.info(
-                f"🔄 處理批次 {self.current_batch}/{self.total_batches}，包含 {len(batch_filenames)} 個檔案"
+                f"🔄 處理批次 {progress.current_batch}/{progress.total_batches}，包含 {len(batch_filenames)} 個檔案"
             )
             logger.info(f"   批次檔案: {batch_filenames}")
 
             # 處理當前批次
             batch_results = await self.process_batch(
-                batch_filenames, enhance_image, save_detailed_csv
+                batch_filenames,
+                enhance_image,
+                save_detailed_csv,
+                progress,
+                state,
+                checkpoint,
             )
             all_results.extend(batch_results)
 
-            # 收集失敗的檔案和成功的收據資料
+            # 收集失敗的檔案
             for result in batch_results:
-                if result["success"]:
-                    successful_receipts.append(result["data"])
-                else:
+                if not result["success"]:
                     failed_files.append(
                         {"filename": result["filename"], "error": result["error"]}
                     )
 
-            # 如果不是最後一個批次，添加延遲
-            if batch_index < len(batches) - 1:
-                delay_time = self._calculate_batch_delay(len(batch_filenames))
-                logger.info(
-                    f"批次 {self.current_batch} 完成，等待 {delay_time:.1f} 秒後處理下一批次..."
-                )
-                await asyncio.sleep(delay_time)
+            logger.info(f"批次 {progress.current_batch} 完成")
 
         # 計算總處理時間
-        total_time = time.time() - self.start_time
+        total_time = progress.elapsed_time
 
         # 統計結果
         processed_count = len([r for r in all_results if r["success"]])
         failed_count = len(failed_files)
 
-        # 創建整合CSV檔案
-        csv_files = {}
-        if successful_receipts:
-            try:
-                csv_files = csv_service.save_consolidated_csv(successful_receipts)
-                logger.info(f"整合CSV檔案已創建: {csv_files}")
-            except Exception as e:
-                logger.error(f"創建整合CSV失敗: {str(e)}")
+        # 收據已逐檔追加到收據儲存（CSV於讀取時匯出）
+        csv_files = csv_service.run_files(state.get("run_id"))
 
         logger.info(f"批次處理完成，總耗時: {total_time:.2f}秒")
         logger.info(f"成功: {processed_count}, 失敗: {failed_count}")
@@ -342,9 +334,10 @@ class BatchProcessor:
             處理結果
         """
         batch_id = str(uuid.uuid4())
-        self.start_time = time.time()
-        self.total_items = len(filenames)
-        self.current_progress = 0
+        progress = BatchProgress()
+        self.last_progress = progress
+        progress.min_seconds_per_item = self.delay_between_requests
+        progress.start(len(filenames))
 
         logger.info(f"開始OCR處理 {len(filenames)} 個檔案，批次ID: {batch_id}")
 
@@ -353,9 +346,6 @@ class BatchProcessor:
 
         for i, filename in enumerate(filenames):
             try:
-                # 更新進度
-                self.current_progress = i + 1
-
                 # 驗證圖片
                 from app.config import settings
 
@@ -363,21 +353,38 @@ class BatchProcessor:
                 if not os.path.exists(file_path):
                     raise FileNotFoundError(f"檔案不存在: {filename}")
 
-                image_utils.validate_image(file_path)
-
-                # 增強圖片品質
-                if enhance_image:
-                    enhanced_path = image_utils.enhance_image_quality(file_path)
-                    process_path = enhanced_path
+                await image_worker_pool.validate_image(file_path)
+
+                # 相同內容的圖片已有OCR暫存時直接使用（暫存鍵可直接用於載入）
+                await image_worker_pool.image_digest(file_path)
+                preprocessing = PREPROCESS_ENHANCE if enhance_image else PREPROCESS_RAW
+                ocr_cache_key = content_hasher.ocr_key(file_path, preprocessing)
+                cache_data = cache_service.load_ocr_result(ocr_cache_key)
+                if cache_data and cache_data.get("ocr_data"):
+                    logger.info(f"使用OCR暫存資料: {filename}")
+                    ocr_data = cache_data["ocr_data"]
+                    cache_path = ocr_cache_key
                 else:
-                    process_path = file_path
-
-                # 執行OCR
-                logger.info(f"OCR處理: {filename}")
-                ocr_data = ocr_service.extract_text(process_path)
+                    # 增強圖片品質（在記憶體中完成，直接上傳位元組）
+                    image_data = None
+                    if enhance_image:
+                        image_data = await image_worker_pool.prepare_for_ocr(
+                            file_path, enhance=True
+                        )
+
+                    # 執行OCR
+                    logger.info(f"OCR處理: {filename}")
+                    ocr_data = await ocr_service.extract_text(
+                        file_path, image_data=image_data
+                    )
+                    if not ocr_data.get("success"):
+                        # 失敗的結果不暫存，下次處理時會重新識別
+                        raise Exception(ocr_data.get("error", "OCR失敗"))
 
-                # 暫存OCR結果
-                cache_path = cache_service.save_ocr_result(filename, ocr_data)
+                    # 暫存OCR結果
+                    cache_path = cache_service.save_ocr_result(
+                        filename, ocr_data, cache_key=ocr_cache_key
+                    )
 
                 ocr_results.append(
                     {
@@ -389,6 +396,7 @@ class BatchProcessor:
                 )
 
                 logger.info(f"OCR完成並暫存: {filename}")
+                progress.advance(filename, True)
 
             except Exception as e:
                 logger.error(f"OCR處理失敗: {filename}, 錯誤: {str(e)}")
@@ -396,10 +404,7 @@ class BatchProcessor:
                 ocr_results.append(
                     {"filename": filename, "success": False, "error": str(e)}
                 )
-
-            # 添加請求間隔
-            if i < len(filenames) - 1:
-                await asyncio.sleep(self.delay_between_requests)
+                progress.advance(filename, False, str(e))
 
         # 儲存處理狀態
         status = {
@@ -408,11 +413,15 @@ class BatchProcessor:
             "ocr_success": len([r for r in ocr_results if r["success"]]),
             "ocr_failed": len(failed_files),
             "cache_files": [r["cache_path"] for r in ocr_results if r["success"]],
+            # 與cache_files對應的上傳檔名（相同內容的暫存可能來自其他上傳）
+            "source_files": [r["filename"] for r in ocr_results if r["success"]],
+            # OCR預處理方式（用於推導AI暫存鍵）
+            "preprocessing": PREPROCESS_ENHANCE if enhance_image else PREPROCESS_RAW,
             "timestamp": time.time(),
         }
         cache_service.save_processing_status(batch_id, status)
 
-        total_time = time.time() - self.start_time
+        total_time = progress.elapsed_time
 
         return {
             "success": True,
@@ -426,7 +435,13 @@ class BatchProcessor:
         }
 
     async def process_from_cache(
-        self, batch_id: str, save_detailed_csv: bool = False
+        self,
+        batch_id: str,
+        save_detailed_csv: bool = False,
+        use_message_batches: bool = False,
+        progress: Optional[BatchProgress] = None,
+        state: Optional[Dict] = None,
+        checkpoint: Optional[Callable[[Dict], Any]] = None,
     ) -> Dict:
         """
         從暫存處理AI分析
@@ -434,6 +449,10 @@ class BatchProcessor:
         Args:
             batch_id: 批量處理ID
             save_detailed_csv: 是否儲存詳細CSV
+            use_message_batches: 以Message Batches API離線批量處理（等待批次完成）
+            progress: 此次處理專用的進度物件
+            state: 先前保存的狀態（已提交的訊息批次ID），用於恢復輪詢
+            checkpoint: 提交訊息批次後以狀態呼叫，供背景工作保存
 
         Returns:
             處理結果
@@ -444,64 +463,129 @@ class BatchProcessor:
             return {"success": False, "error": f"找不到批次ID: {batch_id}"}
 
         cache_files = status_data["status"]["cache_files"]
+        source_files = status_data["status"].get("source_files", [])
+        preprocessing = status_data["status"].get("preprocessing", PREPROCESS_ENHANCE)
         logger.info(
             f"從暫存處理AI分析，批次ID: {batch_id}, 暫存檔案數: {len(cache_files)}"
         )
 
-        self.start_time = time.time()
-        self.total_items = len(cache_files)
-        self.current_progress = 0
+        progress = progress or BatchProgress()
+        self.last_progress = progress
+        progress.min_seconds_per_item = rate_limiter.seconds_per_request("claude")
+        progress.start(len(cache_files))
 
         ai_results = []
         successful_receipts = []
         failed_files = []
 
-        for i, cache_path in enumerate(cache_files):
-            try:
-                # 更新進度
-                self.current_progress = i + 1
-
-                # 載入OCR結果
-                cache_data = cache_service.load_ocr_result(cache_path)
-                if not cache_data:
-                    raise Exception(f"無法載入暫存資料: {cache_path}")
-
-                filename = cache_data["filename"]
-                ocr_data = cache_data["ocr_data"]
-
-                # AI處理
-                logger.info(f"AI處理: {filename}")
-                receipt_data = ai_service.process_receipt_text(ocr_data["text"])
-                receipt_data.source_image = filename
+        def record_failure(name: str, error: str):
+            logger.error(f"AI處理失敗: {name}, 錯誤: {error}")
+            failed_files.append({"filename": name, "error": error})
+            ai_results.append({"filename": name, "success": False, "error": error})
+            progress.advance(name, False, error)
 
-                successful_receipts.append(receipt_data)
-                ai_results.append(
-                    {"filename": filename, "success": True, "data": receipt_data}
-                )
-
-                logger.info(f"AI處理完成: {filename}")
+        def record_success(entry: Dict, receipt_data):
+            filename = entry["filename"]
+            receipt_data.source_image = filename
+            successful_receipts.append(receipt_data)
+            ai_results.append(
+                {"filename": filename, "success": True, "data": receipt_data}
+            )
+            progress.advance(filename, True)
 
-            except Exception as e:
-                logger.error(f"AI處理失敗: {cache_path}, 錯誤: {str(e)}")
-                failed_files.append({"filename": cache_path, "error": str(e)})
-                ai_results.append(
-                    {"filename": cache_path, "success": False, "error": str(e)}
+        # 載入OCR結果（已有AI暫存的收據直接使用）
+        entries = []
+        for i, cache_path in enumerate(cache_files):
+            cache_data = cache_service.load_ocr_result(cache_path)
+            if not cache_data:
+                record_failure(cache_path, f"無法載入暫存資料: {cache_path}")
+                continue
+
+            digest = key_digest(cache_path)
+            ai_cache_key = (
+                content_hasher.key_for_digest(digest, "ai", preprocessing)
+                if digest
+                else None
+            )
+            entry = {
+                "filename": (
+                    source_files[i] if i < len(source_files) else cache_data["filename"]
+                ),
+                "ai_cache_key": ai_cache_key,
+            }
+            receipt_data = (
+                cache_service.load_receipt_data(ai_cache_key) if ai_cache_key else None
+            )
+            if receipt_data is not None:
+                logger.info(f"使用AI暫存資料: {entry['filename']}")
+                record_success(entry, receipt_data)
+                continue
+
+            ocr_data = cache_data["ocr_data"]
+            entry["ocr_data"] = ocr_data
+            entry["structured_data"] = ocr_service.extract_structured_data(ocr_data)
+            entries.append(entry)
+
+        def handle_results(group: List[Dict], results: List):
+            for entry, result in zip(group, results):
+                if isinstance(result, Exception):
+                    record_failure(entry["filename"], str(result))
+                    continue
+
+                if entry["ai_cache_key"]:
+                    cache_service.save_ai_result(
+                        entry["filename"],
+                        result,
+                        entry["ocr_data"],
+                        cache_key=entry["ai_cache_key"],
+                    )
+                record_success(entry, result)
+                logger.info(f"AI處理完成: {entry['filename']}")
+
+        if use_message_batches and entries:
+            # 離線批量：所有收據以一個Message Batch提交，等待完成後寫入AI暫存
+            logger.info(f"以Message Batches處理 {len(entries)} 張收據")
+            filenames = [entry["filename"] for entry in entries]
+            state = state or {}
+            # 已提交的批次只在待處理收據相同時沿用（恢復中斷的工作時不重複提交）
+            batch_ids = (
+                state.get("message_batch_ids")
+                if state.get("filenames") == filenames
+                else None
+            )
+            if state.get("message_batch_ids") and batch_ids is None:
+                logger.warning(f"待處理的收據已變更，重新提交訊息批次: {batch_id}")
+
+            def on_submit(ids: List[Optional[str]]):
+                if checkpoint is not None:
+                    checkpoint({"filenames": filenames, "message_batch_ids": ids})
+
+            handle_results(
+                entries,
+                await message_batch_backend.process_receipts(
+                    entries, batch_ids=batch_ids, on_submit=on_submit
+                ),
+            )
+        else:
+            # AI處理：多張收據合併為一次請求（依token預算分組，解析失敗時逐張處理）
+            for group in ai_service.plan_receipt_batches(entries):
+                label = ", ".join(e["filename"] for e in group)
+                logger.info(f"AI處理 {len(group)} 張收據: {label}")
+                results = await ai_service.process_receipt_group(
+                    group, on_progress=functools.partial(progress.update_partial, label)
                 )
+                progress.clear_partial(label)
+                handle_results(group, results)
 
-            # 添加請求間隔
-            if i < len(cache_files) - 1:
-                await asyncio.sleep(self.delay_between_requests)
-
-        # 創建整合CSV檔案
+        # 追加到收據儲存（CSV於讀取時匯出）
         csv_files = {}
         if successful_receipts:
             try:
-                csv_files = csv_service.save_consolidated_csv(successful_receipts)
-                logger.info(f"整合CSV檔案已創建: {csv_files}")
+                csv_files = csv_service.append_receipts(successful_receipts)
             except Exception as e:
-                logger.error(f"創建整合CSV失敗: {str(e)}")
+                logger.error(f"追加收據失敗: {str(e)}")
 
-        total_time = time.time() - self.start_time
+        total_time = progress.elapsed_time
 
         return {
             "success": True,
@@ -519,38 +603,33 @@ class BatchProcessor:
         self, new_receipts: List, existing_csv_path: str = None
     ) -> Dict:
         """
-        將新的收據資料合併到現有CSV檔案
+        將新的收據資料合併到收據儲存
+
+        收據儲存為僅追加，合併只寫入新收據，不會重新讀寫既有資料。
 
         Args:
             new_receipts: 新的收據資料列表
-            existing_csv_path: 現有CSV檔案路徑（可選）
+            existing_csv_path: 尚未匯入的舊版CSV檔案路徑（可選，已匯入的快照會略過）
 
         Returns:
             合併結果
         """
         try:
-            # 載入現有收據資料
-            existing_receipts = []
+            # 尚未匯入的現有CSV匯入為一個執行紀錄（只匯入一次）
             if existing_csv_path and os.path.exists(existing_csv_path):
-                existing_receipts = csv_service.load_receipts_from_csv(
-                    existing_csv_path
-                )
-                logger.info(f"載入現有收據: {len(existing_receipts)} 筆")
-
-            # 合併收據資料
-            all_receipts = existing_receipts + new_receipts
-            logger.info(f"合併後總收據數: {len(all_receipts)} 筆")
+                csv_service.import_csv_file(existing_csv_path)
 
-            # 創建新的整合CSV
-            csv_files = csv_service.save_consolidated_csv(all_receipts)
+            existing_count = csv_service.store.count()
+            csv_files = csv_service.append_receipts(new_receipts)
+            total_count = csv_service.store.count()
 
             return {
                 "success": True,
-                "existing_count": len(existing_receipts),
-                "new_count": len(new_receipts),
-                "total_count": len(all_receipts),
+                "existing_count": existing_count,
+                "new_count": total_count - existing_count,
+                "total_count": total_count,
                 "csv_files": csv_files,
-                "message": f"合併完成。原有: {len(existing_receipts)}, 新增: {len(new_receipts)}, 總計: {len(all_receipts)}",
+                "message": f"合併完成。原有: {existing_count}, 新增: {total_count - existing_count}, 總計: {total_count}",
             }
 
         except Exception as e:
@@ -0,0 +1,145 @@
+"""
+批次進度服務 - 每次批次處理獨立的進度狀態
+Batch progress service - per-run progress state for batch processing
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format remaining seconds for display
+    格式化剩餘時間
+    """
+    if seconds < 60:
+        return f"{int(seconds)}秒"
+    elif seconds < 3600:
+        return f"{int(seconds / 60)}分鐘"
+    else:
+        return f"{int(seconds / 3600)}小時{int((seconds % 3600) / 60)}分鐘"
+
+
+class BatchProgress:
+    """
+    Progress of one batch run (one per job, never shared between runs)
+    單次批次處理的進度（每個工作一份，不在多次處理間共用）
+    """
+
+    def __init__(
+        self,
+        on_update: Optional[Callable[["BatchProgress"], Any]] = None,
+        on_partial: Optional[Callable[["BatchProgress"], Any]] = None,
+    ):
+        self.current_progress = 0
+        self.total_items = 0
+        self.current_batch = 0
+        self.total_batches = 0
+        self.start_time: Optional[float] = None
+        self.file_results: List[Dict] = []
+        # 限流器允許的最快節奏（每個項目秒數），作為剩餘時間估算的下限
+        self.min_seconds_per_item = 0.0
+        # 串流中的AI回應：項目名稱 -> 已解析的商品數
+        self.streaming: Dict[str, int] = {}
+        self.on_update = on_update
+        # 串流中的部分進度另行通知（高頻率，不應觸發持久化）
+        self.on_partial = on_partial
+
+    def start(self, total_items: int, total_batches: int = 1):
+        """開始追蹤進度"""
+        self.start_time = time.time()
+        self.total_items = total_items
+        self.total_batches = total_batches
+        self.current_progress = 0
+        self.current_batch = 0
+        self.file_results = []
+        self.streaming = {}
+        self._notify()
+
+    def set_batch(self, batch_number: int):
+        """設定目前批次"""
+        self.current_batch = batch_number
+        self._notify()
+
+    def update_partial(self, name: str, items_parsed: int):
+        """
+        Record partial progress of a streaming AI response
+        記錄串流中AI回應的部分進度（已解析的商品數）
+        """
+        self.streaming[name] = items_parsed
+        if self.on_partial is not None:
+            self.on_partial(self)
+
+    def clear_partial(self, name: str):
+        """移除串流中的項目"""
+        self.streaming.pop(name, None)
+
+    def advance(self, filename: str, success: bool, error: Optional[str] = None):
+        """
+        Record one finished file
+        記錄一個已完成的檔案
+        """
+        self.streaming.pop(filename, None)
+        self.current_progress += 1
+        entry = {"filename": filename, "success": success}
+        if error:
+            entry["error"] = error
+        self.file_results.append(entry)
+        self._notify()
+
+    def _notify(self):
+        if self.on_update is not None:
+            self.on_update(self)
+
+    @property
+    def elapsed_time(self) -> float:
+        return time.time() - self.start_time if self.start_time else 0.0
+
+    def estimate_remaining(
+        self, min_seconds_per_item: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Estimate remaining seconds, never below the rate limiter's pace
+        估算剩餘秒數（不低於限流器允許的節奏）
+        """
+        if self.start_time is None or self.current_progress == 0:
+            return None
+
+        if min_seconds_per_item is None:
+            min_seconds_per_item = self.min_seconds_per_item
+
+        remaining_items = self.total_items - self.current_progress
+        avg_time_per_item = self.elapsed_time / self.current_progress
+        return max(
+            remaining_items * avg_time_per_item, remaining_items * min_seconds_per_item
+        )
+
+    def get_progress(self, min_seconds_per_item: Optional[float] = None) -> Dict:
+        """獲取進度字典"""
+        if self.total_items == 0:
+            return {
+                "current_progress": 0,
+                "total_items": 0,
+                "percentage": 0,
+                "current_batch": 0,
+                "total_batches": 0,
+                "estimated_completion": "計算中...",
+                "elapsed_time": 0,
+            }
+
+        remaining = self.estimate_remaining(min_seconds_per_item)
+        return {
+            "current_progress": self.current_progress,
+            "total_items": self.total_items,
+            "percentage": round((self.current_progress / self.total_items) * 100, 1),
+            "current_batch": self.current_batch,
+            "total_batches": self.total_batches,
+            "estimated_completion": (
+                format_duration(remaining) if remaining is not None else "計算中..."
+            ),
+            "elapsed_time": round(self.elapsed_time, 1),
+            "streaming": [
+                {"filename": name, "items_parsed": items}
+                for name, items in self.streaming.items()
+            ],
+        }
@@ -10,18 +10,33 @@ import time
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from loguru import logger
+from app.config import settings
 from app.models.receipt import ReceiptData
+from app.services.cache_store import SQLiteCacheStore, key_digest, parse_legacy_filename
+from app.services.memory_cache import MemoryLRUCache
 
 
 class CacheService:
     """
     Cache service that manages OCR results and processing status
     暫存服務，管理OCR結果和處理狀態
+
+    Entries live in an indexed SQLite store (cache_dir/cache.db); legacy
+    per-entry JSON files found in cache_dir are migrated on startup. A
+    bounded in-memory LRU tier in front of it holds parsed OCR dicts and
+    validated ReceiptData objects, so hot entries skip disk and validation.
+    暫存項目存於有索引的SQLite（cache_dir/cache.db），啟動時自動遷移舊版JSON暫存檔案。
+    前方的記憶體LRU層保存已解析的OCR資料與已驗證的ReceiptData，熱門項目不需讀取磁碟與重新驗證。
     """
 
     def __init__(self, cache_dir: str = "./data/cache"):
         self.cache_dir = cache_dir
         self._ensure_cache_dir()
+        self.store = SQLiteCacheStore(os.path.join(self.cache_dir, "cache.db"))
+        self.store.migrate_json_dir(self.cache_dir)
+        self.memory = MemoryLRUCache(
+            settings.cache_memory_max_entries, settings.cache_memory_ttl
+        )
 
     def _ensure_cache_dir(self):
         """
@@ -30,133 +45,155 @@ class CacheService:
         """
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
-            logger.info(f"Created cache directory: {self.cache_dir} / 創建暫存目錄: {self.cache_dir}")
+            logger.info(
+                f"Created cache directory: {self.cache_dir} / 創建暫存目錄: {self.cache_dir}"
+            )
+
+    def _resolve_reference(self, reference: str, cache_type: str) -> Optional[Any]:
+        """
+        Resolve a legacy cache file path to its data or cache key
+        將舊版暫存檔案路徑解析為資料或暫存鍵
 
-    def save_ocr_result(self, filename: str, ocr_data: Dict[str, Any]) -> str:
+        Returns:
+            Loaded dict if the JSON file still exists, the cache key if the path
+            names a migrated entry, otherwise the reference unchanged
+            JSON檔案仍存在時返回資料；已遷移時返回暫存鍵；否則原樣返回
         """
-        Save OCR result to cache file
-        儲存OCR結果到暫存檔案
+        if not reference.endswith(".json"):
+            return reference
+
+        if os.path.exists(reference):
+            with open(reference, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        parsed = parse_legacy_filename(os.path.basename(reference))
+        if parsed and parsed[0] == cache_type:
+            return parsed[1]
+        return reference
+
+    def _forget(self, cache_type: str, cache_key: str):
+        """
+        Drop memory-tier entries that may refer to a changed key
+        移除可能對應到已變更暫存鍵的記憶體項目
+        """
+        self.memory.delete((cache_type, cache_key))
+        digest = key_digest(cache_key)
+        if digest:
+            self.memory.delete((cache_type, digest))
+        if cache_type == "ai":
+            self.memory.delete(("receipt", cache_key))
+
+    def _load_entry(self, cache_type: str, reference: str) -> Optional[Dict[str, Any]]:
+        """從記憶體層或SQLite載入暫存項目（返回的資料請勿修改）"""
+        cache_data = self.memory.get((cache_type, reference))
+        if cache_data is not None:
+            return cache_data
+
+        cache_data = self.store.get(cache_type, reference)
+        if cache_data is not None:
+            self.memory.put((cache_type, reference), cache_data)
+        return cache_data
+
+    def save_ocr_result(
+        self, filename: str, ocr_data: Dict[str, Any], cache_key: Optional[str] = None
+    ) -> str:
+        """
+        Save OCR result to cache
+        儲存OCR結果到暫存
 
         Args:
             filename: Original file name / 原始檔案名稱
             ocr_data: OCR result data / OCR結果資料
+            cache_key: Content-addressed key; defaults to the file name / 內容定址暫存鍵，預設使用檔案名稱
 
         Returns:
-            Cache file path / 暫存檔案路徑
+            Cache reference accepted by load_ocr_result / 可傳給load_ocr_result的暫存參照
         """
         try:
-            # Create cache data / 創建暫存資料
+            cache_key = cache_key or filename
             cache_data = {
                 "filename": filename,
                 "ocr_data": ocr_data,
                 "timestamp": datetime.now().isoformat(),
                 "status": "ocr_completed",
             }
+            self.store.put("ocr", cache_key, cache_data, filename=filename)
+            self._forget("ocr", cache_key)
+            self.memory.put(("ocr", cache_key), cache_data)
 
-            # Generate cache filename / 生成暫存檔案名稱
-            cache_filename = f"ocr_{filename}_{int(time.time())}.json"
-            cache_path = os.path.join(self.cache_dir, cache_filename)
-
-            # Save to JSON file / 儲存到JSON檔案
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-
-            logger.info(f"OCR result cached: {cache_path} / OCR結果已暫存: {cache_path}")
-            return cache_path
+            logger.info(f"OCR result cached: {cache_key} / OCR結果已暫存: {cache_key}")
+            return cache_key
 
         except Exception as e:
-            logger.error(f"Failed to save OCR result: {str(e)} / 儲存OCR結果失敗: {str(e)}")
+            logger.error(
+                f"Failed to save OCR result: {str(e)} / 儲存OCR結果失敗: {str(e)}"
+            )
             raise
 
     def load_ocr_result(self, filename_or_path: str) -> Optional[Dict[str, Any]]:
         """
-        Load OCR result from cache file
-        從暫存檔案載入OCR結果
+        Load OCR result from cache
+        從暫存載入OCR結果
 
         Args:
-            filename_or_path: Original file name or cache file path / 原始檔案名稱或暫存檔案路徑
+            filename_or_path: Cache key, image digest, original file name or legacy cache file path / 暫存鍵、圖片雜湊、原始檔案名稱或舊版暫存檔案路徑
 
         Returns:
             OCR result data / OCR結果資料
         """
         try:
-            # If it's a full path, use it directly / 如果是完整路徑，直接使用
-            if os.path.isabs(filename_or_path) or filename_or_path.startswith("./"):
-                cache_path = filename_or_path
-            else:
-                # If it's a filename, find the corresponding cache file / 如果是檔案名稱，查找對應的暫存檔案
-                cache_path = self._find_cache_file(filename_or_path)
-                if not cache_path:
-                    logger.warning(f"Cache file not found: {filename_or_path} / 找不到對應的暫存檔案: {filename_or_path}")
-                    return None
-
-            if not os.path.exists(cache_path):
-                logger.warning(f"Cache file does not exist: {cache_path} / 暫存檔案不存在: {cache_path}")
+            reference = self._resolve_reference(filename_or_path, "ocr")
+            if isinstance(reference, dict):
+                return reference
+
+            cache_data = self._load_entry("ocr", reference)
+            if cache_data is None:
+                logger.debug(
+                    f"Cache entry not found: {filename_or_path} / 找不到對應的暫存: {filename_or_path}"
+                )
                 return None
 
-            with open(cache_path, "r", encoding="utf-8") as f:
-                cache_data = json.load(f)
-
-            logger.info(f"Loaded OCR result: {cache_path} / 載入OCR結果: {cache_path}")
+            logger.info(f"Loaded OCR result: {reference} / 載入OCR結果: {reference}")
             return cache_data
 
         except Exception as e:
-            logger.error(f"Failed to load OCR result: {str(e)} / 載入OCR結果失敗: {str(e)}")
-            return None
-
-    def _find_cache_file(self, filename: str, cache_type: str = "ocr") -> Optional[str]:
-        """
-        Find corresponding cache file based on original file name
-        根據原始檔案名稱查找對應的暫存檔案
-
-        Args:
-            filename: Original file name / 原始檔案名稱
-            cache_type: Cache type ("ocr" or "ai") / 暫存類型 ("ocr" 或 "ai")
-
-        Returns:
-            Cache file path, or None if not found / 暫存檔案路徑，如果找不到則返回None
-        """
-        try:
-            # 查找以 "{cache_type}_{filename}_" 開頭的暫存檔案
-            cache_prefix = f"{cache_type}_{filename}_"
-
-            for cache_filename in os.listdir(self.cache_dir):
-                if cache_filename.startswith(cache_prefix) and cache_filename.endswith(
-                    ".json"
-                ):
-                    return os.path.join(self.cache_dir, cache_filename)
-
-            return None
-
-        except Exception as e:
-            logger.error(f"查找暫存檔案失敗: {str(e)}")
+            logger.error(
+                f"Failed to load OCR result: {str(e)} / 載入OCR結果失敗: {str(e)}"
+            )
             return None
 
-    def save_ai_result(self, filename: str, receipt_data: ReceiptData, ocr_result: Dict[str, Any]) -> str:
+    def save_ai_result(
+        self,
+        filename: str,
+        receipt_data: ReceiptData,
+        ocr_result: Dict[str, Any],
+        cache_key: Optional[str] = None,
+    ) -> str:
         """
-        儲存AI處理結果到暫存檔案
+        儲存AI處理結果到暫存
 
         Args:
             filename: 原始檔案名稱
             receipt_data: ReceiptData 對象
             ocr_result: OCR結果資料（用於關聯）
+            cache_key: 內容定址暫存鍵，預設使用檔案名稱
 
         Returns:
-            暫存檔案路徑
+            暫存參照（可傳給load_ai_result）
         """
         try:
             # 將ReceiptData轉換為字典（使用Pydantic的dict方法）
-            if hasattr(receipt_data, 'dict'):
+            if hasattr(receipt_data, "dict"):
                 # Pydantic v1
                 receipt_dict = receipt_data.dict()
-            elif hasattr(receipt_data, 'model_dump'):
+            elif hasattr(receipt_data, "model_dump"):
                 # Pydantic v2
                 receipt_dict = receipt_data.model_dump()
             else:
                 # 如果已經是字典，直接使用
                 receipt_dict = receipt_data
 
-            # 創建暫存資料
+            cache_key = cache_key or filename
             cache_data = {
                 "filename": filename,
                 "receipt_data": receipt_dict,
@@ -164,17 +201,13 @@ class CacheService:
                 "timestamp": datetime.now().isoformat(),
                 "status": "ai_completed",
             }
+            self.store.put("ai", cache_key, cache_data, filename=filename)
+            self._forget("ai", cache_key)
+            if isinstance(receipt_data, ReceiptData):
+                self.memory.put(("receipt", cache_key), receipt_data.model_copy())
 
-            # 生成暫存檔案名稱
-            cache_filename = f"ai_{filename}_{int(time.time())}.json"
-            cache_path = os.path.join(self.cache_dir, cache_filename)
-
-            # 儲存到JSON檔案
-            with open(cache_path, "w", encoding="utf-8") as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2, default=str)
-
-            logger.info(f"AI結果已暫存: {cache_path}")
-            return cache_path
+            logger.info(f"AI結果已暫存: {cache_key}")
+            return cache_key
 
         except Exception as e:
             logger.error(f"儲存AI結果失敗: {str(e)}")
@@ -182,35 +215,66 @@ class CacheService:
 
     def load_ai_result(self, filename: str) -> Optional[Dict[str, Any]]:
         """
-        從暫存檔案載入AI處理結果
+        從暫存載入AI處理結果
 
         Args:
-            filename: 原始檔案名稱
+            filename: 暫存鍵或原始檔案名稱
 
         Returns:
             AI結果資料（包含receipt_data和ocr_result），可以直接用ReceiptData.parse_obj()轉換
         """
         try:
-            # 查找對應的暫存檔案
-            cache_path = self._find_cache_file(filename, "ai")
-            if not cache_path:
-                logger.debug(f"找不到對應的AI暫存檔案: {filename}")
-                return None
+            reference = self._resolve_reference(filename, "ai")
+            if isinstance(reference, dict):
+                return reference
 
-            if not os.path.exists(cache_path):
-                logger.warning(f"AI暫存檔案不存在: {cache_path}")
+            cache_data = self._load_entry("ai", reference)
+            if cache_data is None:
+                logger.debug(f"找不到對應的AI暫存: {filename}")
                 return None
 
-            with open(cache_path, "r", encoding="utf-8") as f:
-                cache_data = json.load(f)
-
-            logger.info(f"載入AI結果: {cache_path}")
+            logger.info(f"載入AI結果: {reference}")
             return cache_data
 
         except Exception as e:
             logger.error(f"載入AI結果失敗: {str(e)}")
             return None
 
+    def load_receipt_data(self, cache_key: str) -> Optional[ReceiptData]:
+        """
+        Load a cached AI result as a validated ReceiptData
+        載入AI暫存並轉換為已驗證的ReceiptData
+
+        Args:
+            cache_key: AI cache key or original file name / AI暫存鍵或原始檔案名稱
+
+        Returns:
+            A fresh copy the caller may modify, or None / 可供呼叫者修改的副本，找不到時返回None
+        """
+        receipt_data = self.memory.get(("receipt", cache_key))
+        if receipt_data is None:
+            ai_cache_data = self.load_ai_result(cache_key)
+            if not ai_cache_data or not ai_cache_data.get("receipt_data"):
+                return None
+
+            receipt_dict = dict(ai_cache_data["receipt_data"])
+            # 處理日期字串
+            if isinstance(receipt_dict.get("date"), str):
+                try:
+                    receipt_dict["date"] = datetime.fromisoformat(receipt_dict["date"])
+                except ValueError:
+                    pass
+
+            try:
+                receipt_data = ReceiptData(**receipt_dict)
+            except Exception as e:
+                logger.warning(f"AI暫存資料無效，忽略暫存: {cache_key}, 錯誤: {str(e)}")
+                return None
+            self.memory.put(("receipt", cache_key), receipt_data)
+
+        # 呼叫者會設定source_image等欄位，返回副本避免修改快取中的物件
+        return receipt_data.model_copy()
+
     def save_processing_status(self, batch_id: str, status: Dict[str, Any]) -> str:
         """
         儲存批量處理狀態
@@ -220,7 +284,7 @@ class CacheService:
             status: 處理狀態資料
 
         Returns:
-            狀態檔案路徑
+            批量處理ID
         """
         try:
             status_data = {
@@ -228,15 +292,10 @@ class CacheService:
                 "status": status,
                 "timestamp": datetime.now().isoformat(),
             }
+            self.store.put("status", batch_id, status_data)
 
-            status_filename = f"status_{batch_id}.json"
-            status_path = os.path.join(self.cache_dir, status_filename)
-
-            with open(status_path, "w", encoding="utf-8") as f:
-                json.dump(status_data, f, ensure_ascii=False, indent=2)
-
-            logger.info(f"處理狀態已儲存: {status_path}")
-            return status_path
+            logger.info(f"處理狀態已儲存: {batch_id}")
+            return batch_id
 
         except Exception as e:
             logger.error(f"儲存處理狀態失敗: {str(e)}")
@@ -253,16 +312,7 @@ class CacheService:
             處理狀態資料
         """
         try:
-            status_filename = f"status_{batch_id}.json"
-            status_path = os.path.join(self.cache_dir, status_filename)
-
-            if not os.path.exists(status_path):
-                return None
-
-            with open(status_path, "r", encoding="utf-8") as f:
-                status_data = json.load(f)
-
-            return status_data
+            return self.store.get("status", batch_id)
 
         except Exception as e:
             logger.error(f"載入處理狀態失敗: {str(e)}")
@@ -270,118 +320,86 @@ class CacheService:
 
     def list_cache_files(self) -> List[Dict[str, Any]]:
         """
-        列出所有暫存檔案
+        列出所有暫存項目
 
         Returns:
-            暫存檔案列表
+            暫存項目列表（新到舊）
         """
         try:
-            cache_files = []
-
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith(".json"):
-                    file_path = os.path.join(self.cache_dir, filename)
-                    file_stat = os.stat(file_path)
-
-                    # 判斷暫存類型
-                    if filename.startswith("ocr_"):
-                        cache_type = "ocr"
-                    elif filename.startswith("ai_"):
-                        cache_type = "ai"
-                    else:
-                        cache_type = "status"
-                    
-                    cache_files.append(
-                        {
-                            "filename": filename,
-                            "path": file_path,
-                            "size": file_stat.st_size,
-                            "modified": datetime.fromtimestamp(
-                                file_stat.st_mtime
-                            ).isoformat(),
-                            "type": cache_type,
-                        }
-                    )
-
-            return sorted(cache_files, key=lambda x: x["modified"], reverse=True)
+            return [
+                {
+                    "filename": f"{entry['type']}_{entry['key']}.json",
+                    "key": entry["key"],
+                    "source_filename": entry["filename"],
+                    "size": entry["size"],
+                    "modified": datetime.fromtimestamp(entry["created_at"]).isoformat(),
+                    "type": entry["type"],
+                }
+                for entry in self.store.list_entries()
+            ]
 
         except Exception as e:
-            logger.error(f"列出暫存檔案失敗: {str(e)}")
+            logger.error(f"列出暫存項目失敗: {str(e)}")
             return []
 
     def cleanup_old_cache(self, max_age_hours: int = 24) -> int:
         """
-        清理舊的暫存檔案
+        清理舊的暫存項目
 
         Args:
             max_age_hours: 最大保留時間（小時）
 
         Returns:
-            清理的檔案數量
+            清理的項目數量
         """
         try:
-            cleaned_count = 0
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith(".json"):
-                    file_path = os.path.join(self.cache_dir, filename)
-                    file_age = current_time - os.path.getmtime(file_path)
-
-                    if file_age > max_age_seconds:
-                        try:
-                            os.remove(file_path)
-                            cleaned_count += 1
-                            logger.info(f"清理舊暫存檔案: {filename}")
-                        except Exception as e:
-                            logger.error(f"清理檔案失敗: {filename}, 錯誤: {str(e)}")
-
-            logger.info(f"清理完成，共清理 {cleaned_count} 個檔案")
+            cleaned_count = self.store.delete_older_than(
+                time.time() - max_age_hours * 3600
+            )
+            self.memory.clear()
+            logger.info(f"清理完成，共清理 {cleaned_count} 個暫存項目")
             return cleaned_count
 
         except Exception as e:
-            logger.error(f"清理暫存檔案失敗: {str(e)}")
+            logger.error(f"清理暫存失敗: {str(e)}")
             return 0
 
     def delete_ocr_cache(self, filename: str) -> bool:
         """
-        刪除指定檔案的OCR暫存
+        刪除指定暫存鍵（或檔案名稱）的OCR暫存
 
         Args:
-            filename: 原始檔案名稱
+            filename: 暫存鍵或原始檔案名稱
 
         Returns:
             是否成功刪除
         """
         try:
-            cache_path = self._find_cache_file(filename, "ocr")
-            if cache_path and os.path.exists(cache_path):
-                os.remove(cache_path)
-                logger.info(f"已刪除OCR暫存: {cache_path}")
-                return True
-            return False
+            deleted = self.store.delete("ocr", filename)
+            self._forget("ocr", filename)
+            if deleted:
+                logger.info(f"已刪除OCR暫存: {filename}")
+            return deleted
         except Exception as e:
             logger.error(f"刪除OCR暫存失敗: {str(e)}")
             return False
 
     def delete_ai_cache(self, filename: str) -> bool:
         """
-        刪除指定檔案的AI暫存
+        刪除指定暫存鍵（或檔案名稱）的AI暫存
 
         Args:
-            filename: 原始檔案名稱
+            filename: 暫存鍵或原始檔案名稱
 
         Returns:
             是否成功刪除
         """
         try:
-            cache_path = self._find_cache_file(filename, "ai")
-            if cache_path and os.path.exists(cache_path):
-                os.remove(cache_path)
-                logger.info(f"已刪除AI暫存: {cache_path}")
-                return True
-            return False
+            deleted = self.store.delete("ai", filename)
+            self._forget("ai", filename)
+            if deleted:
+                logger.info(f"已刪除AI暫存: {filename}")
+            return deleted
         except Exception as e:
             logger.error(f"刪除AI暫存失敗: {str(e)}")
             return False
@@ -394,22 +412,24 @@ class CacheService:
             暫存摘要資訊
         """
         try:
-            cache_files = self.list_cache_files()
+            counts = self.store.count_by_type()
 
-            ocr_files = [f for f in cache_files if f["type"] == "ocr"]
-            ai_files = [f for f in cache_files if f["type"] == "ai"]
-            status_files = [f for f in cache_files if f["type"] == "status"]
+            def count(cache_type: str) -> int:
+                return counts.get(cache_type, {}).get("count", 0)
 
-            total_size = sum(f["size"] for f in cache_files)
+            total_size = sum(entry["size"] for entry in counts.values())
 
             return {
-                "total_files": len(cache_files),
-                "ocr_files": len(ocr_files),
-                "ai_files": len(ai_files),
-                "status_files": len(status_files),
+                "total_files": sum(entry["count"] for entry in counts.values()),
+                "ocr_files": count("ocr"),
+                "ai_files": count("ai"),
+                "status_files": count("status"),
                 "total_size_bytes": total_size,
                 "total_size_mb": round(total_size / (1024 * 1024), 2),
                 "cache_dir": self.cache_dir,
+                "backend": "sqlite",
+                "db_path": self.store.db_path,
+                "memory": self.memory.get_stats(),
             }
 
         except Exception as e:
@@ -0,0 +1,280 @@
+"""
+暫存儲存後端 - 以SQLite索引儲存OCR/AI暫存與處理狀態
+Cache store backend - SQLite-indexed storage for OCR/AI cache entries and processing status
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+# 內容定址暫存鍵：64位sha256 + "_" + 管線版本雜湊
+_CONTENT_KEY_PATTERN = re.compile(r"^([0-9a-f]{64})_[0-9a-f]+$")
+# 舊版JSON暫存檔名：{類型}_{鍵}_{時間戳}.json 或 status_{批次ID}.json
+_LEGACY_FILE_PATTERN = re.compile(r"^(ocr|ai)_(.+)_(\d+)\.json$")
+_LEGACY_STATUS_PATTERN = re.compile(r"^status_(.+)\.json$")
+
+
+def key_digest(cache_key: str) -> Optional[str]:
+    """
+    Image digest part of a content-addressed key (None for filename keys)
+    內容定址鍵中的圖片雜湊部分（檔名鍵返回None）
+    """
+    match = _CONTENT_KEY_PATTERN.match(cache_key)
+    return match.group(1) if match else None
+
+
+def parse_legacy_filename(name: str) -> Optional[Tuple[str, str, Optional[int]]]:
+    """
+    Parse a legacy cache file name into (type, key, timestamp)
+    解析舊版暫存檔名為 (類型, 鍵, 時間戳)
+    """
+    match = _LEGACY_FILE_PATTERN.match(name)
+    if match:
+        return match.group(1), match.group(2), int(match.group(3))
+    match = _LEGACY_STATUS_PATTERN.match(name)
+    if match:
+        return "status", match.group(1), None
+    return None
+
+
+class SQLiteCacheStore:
+    """
+    Cache entries in one SQLite table indexed by (type, key) and image digest
+    所有暫存項目存於單一SQLite表，以 (類型, 鍵) 與圖片雜湊建立索引
+
+    Lookups are single indexed queries instead of directory scans, and each
+    write is one transaction, so a crash never leaves a half-written entry.
+    查詢為單次索引查詢而非目錄掃描；每次寫入為單一交易，中斷時不會留下寫到一半的項目。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache_type TEXT NOT NULL,
+                cache_key TEXT NOT NULL,
+                digest TEXT,
+                filename TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (cache_type, cache_key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_digest
+                ON cache_entries (cache_type, digest);
+            CREATE INDEX IF NOT EXISTS idx_cache_created
+                ON cache_entries (created_at);
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                digest TEXT PRIMARY KEY,
+                dhash TEXT NOT NULL,
+                canonical_digest TEXT NOT NULL,
+                filename TEXT,
+                created_at REAL NOT NULL,
+                verified INTEGER NOT NULL DEFAULT 0
+            );
+            """)
+        # 舊版資料庫沒有verified欄位；既有的連結未經文字確認，一律視為未確認
+        columns = [
+            row[1] for row in self._conn.execute("PRAGMA table_info(image_hashes)")
+        ]
+        if "verified" not in columns:
+            self._conn.execute(
+                "ALTER TABLE image_hashes ADD COLUMN verified INTEGER NOT NULL DEFAULT 0"
+            )
+        self._conn.commit()
+
+    def put(
+        self,
+        cache_type: str,
+        cache_key: str,
+        data: Dict[str, Any],
+        filename: Optional[str] = None,
+        created_at: Optional[float] = None,
+    ):
+        """
+        Insert or replace one entry atomically
+        以單一交易新增或取代項目
+        """
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries "
+                "(cache_type, cache_key, digest, filename, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    cache_type,
+                    cache_key,
+                    key_digest(cache_key),
+                    filename,
+                    payload,
+                    created_at if created_at is not None else time.time(),
+                ),
+            )
+
+    def get(self, cache_type: str, key_or_digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up by exact key, falling back to the newest entry for an image digest
+        依完整鍵查詢，找不到時以圖片雜湊查詢最新的項目
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM cache_entries WHERE cache_type = ? AND cache_key = ?",
+                (cache_type, key_or_digest),
+            ).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT data FROM cache_entries WHERE cache_type = ? AND digest = ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (cache_type, key_or_digest),
+                ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, cache_type: str, cache_key: str) -> bool:
+        """刪除項目，返回是否有刪除"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM cache_entries WHERE cache_type = ? AND cache_key = ?",
+                (cache_type, cache_key),
+            )
+        return cursor.rowcount > 0
+
+    def delete_older_than(self, cutoff: float) -> int:
+        """刪除早於指定時間的項目，返回刪除數量"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM cache_entries WHERE created_at < ?", (cutoff,)
+            )
+        return cursor.rowcount
+
+    def list_entries(self) -> List[Dict[str, Any]]:
+        """列出所有項目的中繼資料（不含內容）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cache_type, cache_key, filename, LENGTH(data), created_at "
+                "FROM cache_entries ORDER BY created_at DESC"
+            ).fetchall()
+        return [
+            {
+                "type": row[0],
+                "key": row[1],
+                "filename": row[2],
+                "size": row[3],
+                "created_at": row[4],
+            }
+            for row in rows
+        ]
+
+    def count_by_type(self) -> Dict[str, Dict[str, int]]:
+        """各類型的項目數量與大小"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cache_type, COUNT(*), COALESCE(SUM(LENGTH(data)), 0) "
+                "FROM cache_entries GROUP BY cache_type"
+            ).fetchall()
+        return {row[0]: {"count": row[1], "size": row[2]} for row in rows}
+
+    def put_image_hash(
+        self,
+        digest: str,
+        dhash: int,
+        canonical_digest: str,
+        filename: Optional[str] = None,
+    ):
+        """
+        Record an image's perceptual hash and the digest whose results it shares
+        記錄圖片的感知雜湊，以及共用結果的代表圖片雜湊
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO image_hashes "
+                "(digest, dhash, canonical_digest, filename, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    digest,
+                    format(dhash, "016x"),
+                    canonical_digest,
+                    filename,
+                    time.time(),
+                ),
+            )
+
+    def confirm_image_link(self, digest: str, canonical_digest: str):
+        """
+        Record a link confirmed by matching OCR text
+        記錄經OCR文字確認的連結
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE image_hashes SET canonical_digest = ?, verified = 1 WHERE digest = ?",
+                (canonical_digest, digest),
+            )
+
+    def list_image_hashes(self) -> List[Dict[str, Any]]:
+        """列出所有已記錄的感知雜湊（舊到新）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT digest, dhash, canonical_digest, filename, verified "
+                "FROM image_hashes ORDER BY created_at"
+            ).fetchall()
+        return [
+            {
+                "digest": row[0],
+                "dhash": int(row[1], 16),
+                # 未確認的連結不使用
+                "canonical_digest": row[2] if row[4] else row[0],
+                "filename": row[3],
+                "verified": bool(row[4]),
+            }
+            for row in rows
+        ]
+
+    def migrate_json_dir(self, cache_dir: str) -> int:
+        """
+        Import legacy per-entry JSON files, then move them to cache_dir/migrated
+        匯入舊版的單檔JSON暫存，完成後移至 cache_dir/migrated
+
+        Returns:
+            Number of imported files / 匯入的檔案數量
+        """
+        migrated_dir = os.path.join(cache_dir, "migrated")
+        imported = 0
+
+        for name in sorted(os.listdir(cache_dir)):
+            parsed = parse_legacy_filename(name)
+            if parsed is None:
+                continue
+
+            cache_type, cache_key, _ = parsed
+            path = os.path.join(cache_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.put(
+                    cache_type,
+                    cache_key,
+                    data,
+                    filename=data.get("filename"),
+                    created_at=os.path.getmtime(path),
+                )
+                os.makedirs(migrated_dir, exist_ok=True)
+                os.replace(path, os.path.join(migrated_dir, name))
+                imported += 1
+            except Exception as e:
+                logger.error(f"遷移暫存檔案失敗: {name}, 錯誤: {str(e)}")
+
+        if imported:
+            logger.info(f"已將 {imported} 個JSON暫存檔案遷移至 {self.db_path}")
+        return imported
+
+    def close(self):
+        """關閉資料庫連線"""
+        with self._lock:
+            self._conn.close()
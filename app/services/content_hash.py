@@ -0,0 +1,172 @@
+"""
+內容雜湊服務 - 以圖片內容雜湊與處理管線版本產生暫存鍵
+Content hash service - cache keys from image content hash plus pipeline version
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Tuple
+from app.config import settings
+from app.services.ai_service import ai_service
+from app.services.ocr_service import ocr_service
+
+# 預處理方式（影響OCR輸入，因此屬於管線版本的一部分；含EXIF方向修正）
+PREPROCESS_RAW = "raw"
+PREPROCESS_ENHANCE = "enhance-oriented"
+PREPROCESS_RESIZE = "resize-1200x1600-oriented"
+PREPROCESS_MULTI = "multi-receipt-oriented"
+
+
+def file_sha256(image_path: str) -> str:
+    """
+    sha256 of a file, read in 1 MB chunks (picklable for worker processes)
+    檔案的sha256（以1MB區塊讀取，可在工作程序中執行）
+    """
+    sha256 = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ContentHasher:
+    """
+    Builds content-addressed cache keys
+    產生以內容定址的暫存鍵
+
+    Key = sha256(image bytes) + short hash of the pipeline version. The same
+    receipt uploaded twice (under any filename) maps to the same key, while
+    changing preprocessing, the OCR API version, the model or the prompt
+    version produces a new key so stale results are never reused.
+    鍵 = 圖片位元組的sha256 + 管線版本的短雜湊。相同收據不論檔名都對應同一個鍵；
+    預處理、OCR API版本、模型或提示詞版本變更時產生新鍵，避免重用過期結果。
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        # 檔案雜湊快取：路徑 -> (大小, 修改時間, 雜湊)
+        self.max_entries = max_entries
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        # 近似重複圖片的連結：圖片雜湊 -> 共用結果的代表圖片雜湊
+        self._aliases: Dict[str, str] = {}
+
+    def cached_digest(self, image_path: str) -> Optional[str]:
+        """
+        Memoized digest if the file is unchanged, otherwise None
+        檔案未變更時返回已快取的雜湊，否則返回None
+        """
+        stat = os.stat(image_path)
+        cached = self._digests.get(image_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        return None
+
+    def remember_digest(self, image_path: str, stat: os.stat_result, digest: str):
+        """
+        Store a digest computed elsewhere (e.g. in a worker process)
+        記錄在其他地方（例如工作程序）計算的雜湊
+        """
+        if len(self._digests) >= self.max_entries:
+            self._digests.clear()
+        self._digests[image_path] = (stat.st_size, stat.st_mtime_ns, digest)
+
+    def image_digest(self, image_path: str) -> str:
+        """
+        sha256 of the image file, memoized by path, size and mtime
+        圖片檔案的sha256（依路徑、大小與修改時間快取）
+        """
+        cached = self.cached_digest(image_path)
+        if cached:
+            return cached
+
+        stat = os.stat(image_path)
+        digest = file_sha256(image_path)
+        self.remember_digest(image_path, stat, digest)
+        return digest
+
+    def link_digest(self, digest: str, canonical_digest: str):
+        """
+        Make an image share cache entries with another image
+        讓圖片與另一張圖片共用暫存項目（用於近似重複的收據）
+        """
+        if digest != canonical_digest:
+            self._aliases[digest] = canonical_digest
+
+    def canonical_digest(self, image_path: str) -> str:
+        """
+        Digest whose cache entries this image uses (its own unless linked)
+        此圖片使用的暫存雜湊（未連結時為自身雜湊）
+        """
+        digest = self.image_digest(image_path)
+        return self._aliases.get(digest, digest)
+
+    def pipeline_version(self, stage: str, preprocessing: str) -> Dict:
+        """
+        Components that change the output of a stage
+        影響該階段輸出的所有設定
+
+        Args:
+            stage: "ocr" or "ai" / 階段
+            preprocessing: Preprocessing applied before OCR / OCR前的預處理方式
+        """
+        version = {
+            "preprocessing": preprocessing,
+            "ocr_api": ocr_service.read_api_version,
+            "ocr_mock": ocr_service.test_mode,
+        }
+        if preprocessing != PREPROCESS_RAW:
+            # 預處理時是否裁切收據區域
+            version["crop"] = settings.receipt_crop_enabled
+        if stage == "ai":
+            version.update(
+                {
+                    "model": ai_service.model,
+                    # 啟用路由時結果可能來自小模型
+                    "fast_model": (
+                        ai_service.router.fast_model
+                        if ai_service.router.enabled
+                        else None
+                    ),
+                    # 啟用版面規則時結果可能不經過AI
+                    "layout": (
+                        ai_service.layout_extractor.version
+                        if ai_service.layout_extractor.enabled
+                        else None
+                    ),
+                    "prompt_version": ai_service.prompt_version,
+                    "ai_mock": ai_service.test_mode,
+                }
+            )
+        return version
+
+    def cache_key(self, image_path: str, stage: str, preprocessing: str) -> str:
+        """
+        Cache key for one stage of one image
+        單張圖片某一階段的暫存鍵
+        """
+        return self.key_for_digest(
+            self.canonical_digest(image_path), stage, preprocessing
+        )
+
+    def key_for_digest(self, digest: str, stage: str, preprocessing: str) -> str:
+        """
+        Cache key from an already known image digest (no file access)
+        以已知的圖片雜湊產生暫存鍵（不需讀取檔案）
+        """
+        version = json.dumps(
+            self.pipeline_version(stage, preprocessing), sort_keys=True
+        )
+        version_hash = hashlib.sha256(version.encode("utf-8")).hexdigest()[:12]
+        return f"{digest}_{version_hash}"
+
+    def ocr_key(self, image_path: str, preprocessing: str) -> str:
+        """OCR結果的暫存鍵"""
+        return self.cache_key(image_path, "ocr", preprocessing)
+
+    def ai_key(self, image_path: str, preprocessing: str) -> str:
+        """AI結果的暫存鍵"""
+        return self.cache_key(image_path, "ai", preprocessing)
+
+
+# 全局實例
+content_hasher = ContentHasher()
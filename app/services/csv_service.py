@@ -1,22 +1,38 @@
 import os
+import re
 import csv
 import json
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from loguru import logger
 from app.config import settings
 from app.models.receipt import ReceiptData, ReceiptItem
+from app.services.receipt_store import SQLiteReceiptStore
+
+# 執行紀錄的匯出檔名：receipts_summary_{run_id}.csv / receipts_details_{run_id}.csv
+_EXPORT_FILE_PATTERN = re.compile(
+    r"^receipts_(summary|details)_(\d{8}_\d{6}(?:_\d+)?)\.csv$"
+)
 
 
 class CSVService:
     """
     CSV file processing service
     CSV檔案處理服務
+
+    Processed receipts are appended to an append-only SQLite store
+    (output_dir/receipts.db); the summary/details CSV files of a run are
+    export views written the first time they are requested. Existing
+    timestamped CSV snapshots are imported as runs on startup.
+    處理完成的收據追加到僅追加的SQLite儲存（output_dir/receipts.db）；執行紀錄的摘要/明細CSV
+    為匯出檢視，在第一次被讀取時才寫出。啟動時會將既有的時間戳CSV快照匯入為執行紀錄。
     """
 
-    def __init__(self):
-        self.output_dir = settings.output_dir
+    def __init__(self, output_dir: Optional[str] = None):
+        self.output_dir = output_dir or settings.output_dir
         self._ensure_output_dir()
+        self.store = SQLiteReceiptStore(os.path.join(self.output_dir, "receipts.db"))
+        self._import_csv_snapshots()
 
     def _ensure_output_dir(self):
         """
@@ -185,57 +201,7 @@ class CSVService:
             包含兩個CSV檔案路徑的字典
         """
         try:
-            # 類型檢查和轉換
-            safe_receipts = []
-            for receipt in receipts:
-                if isinstance(receipt, dict):
-                    logger.warning(f"發現字典類型數據，嘗試轉換: {type(receipt)}")
-                    # 嘗試從字典創建ReceiptData對象
-                    try:
-                        from app.models.receipt import ReceiptItem
-                        from datetime import datetime as dt
-
-                        # 創建ReceiptItem列表
-                        items = []
-                        for item_data in receipt.get("items", []):
-                            if isinstance(item_data, dict):
-                                item = ReceiptItem(
-                                    name=item_data.get("name", ""),
-                                    name_japanese=item_data.get("name_japanese", ""),
-                                    name_chinese=item_data.get("name_chinese", ""),
-                                    price=float(item_data.get("price", 0)),
-                                    quantity=int(item_data.get("quantity", 1)),
-                                    tax_included=item_data.get("tax_included", True),
-                                    tax_amount=(
-                                        float(item_data.get("tax_amount", 0))
-                                        if item_data.get("tax_amount")
-                                        else None
-                                    ),
-                                )
-                                items.append(item)
-
-                        # 創建ReceiptData對象
-                        receipt_obj = ReceiptData(
-                            store_name=receipt.get("store_name", ""),
-                            date=receipt.get("date", dt.now()),
-                            total_amount=float(receipt.get("total_amount", 0)),
-                            items=items,
-                            source_image=receipt.get("source_image", ""),
-                            confidence_score=float(
-                                receipt.get("confidence_score", 0.9)
-                            ),
-                            processing_time=float(receipt.get("processing_time", 1.0)),
-                        )
-                        safe_receipts.append(receipt_obj)
-                        logger.info(f"成功轉換字典為ReceiptData對象")
-                    except Exception as e:
-                        logger.error(f"轉換失敗: {e}")
-                        continue
-                elif isinstance(receipt, ReceiptData):
-                    safe_receipts.append(receipt)
-                else:
-                    logger.warning(f"未知類型: {type(receipt)}")
-                    continue
+            safe_receipts = self._to_receipt_data(receipts)
 
             if not safe_receipts:
                 raise Exception("沒有有效的收據數據")
@@ -270,6 +236,335 @@ class CSVService:
             logger.error(f"創建整合CSV失敗: {str(e)}")
             raise
 
+    def _to_receipt_data(self, receipts: List) -> List[ReceiptData]:
+        """類型檢查和轉換（字典轉為ReceiptData，其他類型略過）"""
+        safe_receipts = []
+        for receipt in receipts:
+            if isinstance(receipt, dict):
+                logger.warning(f"發現字典類型數據，嘗試轉換: {type(receipt)}")
+                # 嘗試從字典創建ReceiptData對象
+                try:
+                    from app.models.receipt import ReceiptItem
+                    from datetime import datetime as dt
+
+                    # 創建ReceiptItem列表
+                    items = []
+                    for item_data in receipt.get("items", []):
+                        if isinstance(item_data, dict):
+                            item = ReceiptItem(
+                                name=item_data.get("name", ""),
+                                name_japanese=item_data.get("name_japanese", ""),
+                                name_chinese=item_data.get("name_chinese", ""),
+                                price=float(item_data.get("price", 0)),
+                                quantity=int(item_data.get("quantity", 1)),
+                                tax_included=item_data.get("tax_included", True),
+                                tax_amount=(
+                                    float(item_data.get("tax_amount", 0))
+                                    if item_data.get("tax_amount")
+                                    else None
+                                ),
+                            )
+                            items.append(item)
+
+                    # 創建ReceiptData對象
+                    receipt_obj = ReceiptData(
+                        store_name=receipt.get("store_name", ""),
+                        date=receipt.get("date", dt.now()),
+                        total_amount=float(receipt.get("total_amount", 0)),
+                        items=items,
+                        source_image=receipt.get("source_image", ""),
+                        confidence_score=float(receipt.get("confidence_score", 0.9)),
+                        processing_time=float(receipt.get("processing_time", 1.0)),
+                    )
+                    safe_receipts.append(receipt_obj)
+                    logger.info(f"成功轉換字典為ReceiptData對象")
+                except Exception as e:
+                    logger.error(f"轉換失敗: {e}")
+                    continue
+            elif isinstance(receipt, ReceiptData):
+                safe_receipts.append(receipt)
+            else:
+                logger.warning(f"未知類型: {type(receipt)}")
+                continue
+        return safe_receipts
+
+    def append_receipts(
+        self, receipts: List, source: str = "batch", run_id: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        將收據追加到收據儲存（一次處理為一個執行紀錄）
+
+        Args:
+            receipts: 收據資料列表
+            source: 來源說明（batch、process、multi等）
+            run_id: 追加到既有的執行紀錄（可選，已匯出的CSV會在下次讀取時重新匯出）
+
+        Returns:
+            執行紀錄ID與匯出CSV的路徑（第一次讀取時才寫出）
+        """
+        safe_receipts = self._to_receipt_data(receipts)
+        if not safe_receipts:
+            raise Exception("沒有有效的收據數據")
+
+        if run_id:
+            for path in self._export_paths(run_id).values():
+                if os.path.exists(path):
+                    os.remove(path)
+        run_id = self.store.append(safe_receipts, source=source, run_id=run_id)
+        logger.info(
+            f"已追加 {len(safe_receipts)} 筆收據到收據儲存（執行紀錄 {run_id}）"
+        )
+        return {"run_id": run_id, **self._export_paths(run_id)}
+
+    def append_to_run(
+        self,
+        receipts: List,
+        state: Dict,
+        checkpoint: Optional[Callable[[Dict], Any]] = None,
+        source: str = "batch",
+    ) -> Dict[str, str]:
+        """
+        將處理完成的收據立即追加到此次處理的執行紀錄
+
+        第一次追加時建立執行紀錄並把run_id存入state（透過checkpoint保存到工作），
+        工作中斷後恢復時繼續追加到同一個執行紀錄，先前完成的收據不會遺失。
+
+        Args:
+            receipts: 收據資料列表
+            state: 此次處理的狀態（保存run_id）
+            checkpoint: 保存狀態的回呼（可選）
+            source: 來源說明
+
+        Returns:
+            執行紀錄ID與匯出CSV的路徑
+        """
+        csv_files = self.append_receipts(
+            receipts, source=source, run_id=state.get("run_id")
+        )
+        if state.get("run_id") != csv_files["run_id"]:
+            state["run_id"] = csv_files["run_id"]
+            if checkpoint is not None:
+                checkpoint({"run_id": csv_files["run_id"]})
+        return csv_files
+
+    def run_files(self, run_id: Optional[str]) -> Dict[str, str]:
+        """執行紀錄ID與匯出CSV的路徑（執行紀錄不存在時返回空字典）"""
+        if not run_id or not self.store.has_run(run_id):
+            return {}
+        return {"run_id": run_id, **self._export_paths(run_id)}
+
+    def _export_paths(self, run_id: str) -> Dict[str, str]:
+        """執行紀錄的摘要/明細CSV路徑"""
+        return {
+            "summary_csv": os.path.join(
+                self.output_dir, f"receipts_summary_{run_id}.csv"
+            ),
+            "details_csv": os.path.join(
+                self.output_dir, f"receipts_details_{run_id}.csv"
+            ),
+        }
+
+    def export_run(self, run_id: str) -> Dict[str, str]:
+        """
+        將執行紀錄匯出為摘要/明細CSV（執行紀錄不會改變，已存在的檔案直接沿用）
+
+        Returns:
+            包含兩個CSV檔案路徑的字典
+        """
+        paths = self._export_paths(run_id)
+        if not all(os.path.exists(path) for path in paths.values()):
+            receipts = self.store.load_receipts(run_id)
+            self.save_receipts_to_csv(receipts, os.path.basename(paths["summary_csv"]))
+            self.save_detailed_items_csv(
+                receipts, os.path.basename(paths["details_csv"])
+            )
+        return paths
+
+    def ensure_export(self, filename: str) -> bool:
+        """
+        需要時由收據儲存產生匯出CSV
+
+        Args:
+            filename: receipts_summary_{run_id}.csv 或 receipts_details_{run_id}.csv
+
+        Returns:
+            檔案是否存在
+        """
+        if os.path.exists(os.path.join(self.output_dir, filename)):
+            return True
+        match = _EXPORT_FILE_PATTERN.match(filename)
+        if not match or not self.store.has_run(match.group(2)):
+            return False
+        self.export_run(match.group(2))
+        return True
+
+    def list_summary_files(self) -> List[str]:
+        """所有執行紀錄的摘要CSV檔名（新到舊，不論是否已匯出）"""
+        return [
+            f"receipts_summary_{run['run_id']}.csv" for run in self.store.list_runs()
+        ]
+
+    def get_run_summary(self, summary_filename: str) -> Optional[Dict]:
+        """由收據儲存彙總表取得執行紀錄的摘要（非執行紀錄的檔名返回None）"""
+        match = _EXPORT_FILE_PATTERN.match(summary_filename)
+        if not match or not self.store.has_run(match.group(2)):
+            return None
+        return self.store.summary(match.group(2))
+
+    def import_csv_file(self, filepath: str) -> Optional[str]:
+        """
+        將輸出目錄以外的CSV檔案匯入為執行紀錄（已匯入過的檔案略過）
+
+        Args:
+            filepath: CSV檔案路徑
+
+        Returns:
+            新的執行紀錄ID，已匯入或無資料時返回None
+        """
+        filename = os.path.basename(filepath)
+        if _EXPORT_FILE_PATTERN.match(filename) and os.path.dirname(
+            os.path.abspath(filepath)
+        ) == os.path.abspath(self.output_dir):
+            # 輸出目錄內的快照已在啟動時匯入
+            return None
+        source = os.path.abspath(filepath)
+        if self.store.has_source(source):
+            return None
+
+        receipts = self.load_receipts_from_csv(filepath)
+        if not receipts:
+            return None
+        run_id = self.store.append(receipts, source=source)
+        logger.info(f"已將CSV檔案匯入收據儲存: {filepath}, {len(receipts)} 筆")
+        return run_id
+
+    def _import_csv_snapshots(self) -> int:
+        """
+        將舊版的時間戳CSV快照匯入為執行紀錄（明細依列順序對應回收據）
+
+        Returns:
+            匯入的快照數量
+        """
+        imported = 0
+        for name in sorted(os.listdir(self.output_dir)):
+            match = _EXPORT_FILE_PATTERN.match(name)
+            if (
+                not match
+                or match.group(1) != "summary"
+                or self.store.has_run(match.group(2))
+            ):
+                continue
+
+            run_id = match.group(2)
+            summary_path = os.path.join(self.output_dir, name)
+            receipts = self.load_receipts_from_csv(summary_path)
+            details_path = self._export_paths(run_id)["details_csv"]
+            if os.path.exists(details_path):
+                receipts = self._assign_detail_items(
+                    receipts, self._load_detail_rows(details_path)
+                )
+            try:
+                self.store.append(
+                    receipts,
+                    source="csv",
+                    run_id=run_id,
+                    created_at=os.path.getmtime(summary_path),
+                )
+                imported += 1
+            except Exception as e:
+                logger.error(f"匯入CSV快照失敗: {name}, 錯誤: {str(e)}")
+
+        if imported:
+            logger.info(f"已將 {imported} 個CSV快照匯入收據儲存")
+        return imported
+
+    def _load_detail_rows(
+        self, filepath: str
+    ) -> List[Tuple[Tuple[str, datetime], ReceiptItem]]:
+        """
+        依檔案順序讀取商品明細CSV
+
+        Returns:
+            ((商店名稱, 日期), 商品項目) 的列表
+        """
+        rows = []
+        with open(filepath, "r", encoding="utf-8") as csvfile:
+            for row in csv.DictReader(csvfile):
+                try:
+                    store_name, _, parsed_date, item = self._parse_detail_row(row)
+                except Exception as e:
+                    logger.error(f"解析商品明細資料失敗: {str(e)}, 行: {row}")
+                    continue
+                rows.append(((store_name, parsed_date), item))
+        return rows
+
+    def _assign_detail_items(
+        self,
+        receipts: List[ReceiptData],
+        rows: List[Tuple[Tuple[str, datetime], ReceiptItem]],
+    ) -> List[ReceiptData]:
+        """
+        依列順序將商品明細分配回收據
+
+        明細CSV依收據順序寫入，每張收據的商品為連續的列，因此同店同日的收據
+        不會互相合併。相鄰兩張收據同店同日時，以商品小計累加到收據金額的位置切分。
+
+        Args:
+            receipts: 摘要CSV中的收據（依檔案順序）
+            rows: 明細CSV的列（依檔案順序）
+
+        Returns:
+            帶有商品項目的收據列表
+        """
+        assigned = []
+        position = 0
+        for index, receipt in enumerate(receipts):
+            key = (receipt.store_name, receipt.date)
+            end = position
+            while end < len(rows) and rows[end][0] == key:
+                end += 1
+
+            following = receipts[index + 1] if index + 1 < len(receipts) else None
+            if (
+                end > position
+                and following
+                and (following.store_name, following.date) == key
+            ):
+                end = position + self._split_by_amount(
+                    receipt, [item for _, item in rows[position:end]]
+                )
+
+            assigned.append(
+                receipt.model_copy(
+                    update={"items": [item for _, item in rows[position:end]]}
+                )
+            )
+            position = end
+
+        if position < len(rows):
+            logger.warning(f"有 {len(rows) - position} 列商品明細無法對應到收據")
+        return assigned
+
+    def _split_by_amount(self, receipt: ReceiptData, items: List[ReceiptItem]) -> int:
+        """
+        找出連續商品中屬於這張收據的數量（小計累加等於收據小計或總金額）
+
+        Returns:
+            屬於這張收據的商品數；無法判斷時返回全部
+        """
+        targets = [
+            amount for amount in (receipt.subtotal, receipt.total_amount) if amount
+        ]
+        running = 0.0
+        for count, item in enumerate(items, start=1):
+            running += item.price * item.quantity
+            if any(abs(running - target) <= 0.5 for target in targets):
+                return count
+        logger.warning(
+            f"無法依金額切分同店同日的收據明細: {receipt.store_name} {receipt.date}"
+        )
+        return len(items)
+
     def save_detailed_items_csv(
         self, receipts: List[ReceiptData], filename: str = None
     ) -> str:
@@ -436,6 +731,52 @@ class CSVService:
             logger.error(f"儲存詳細CSV檔案失敗: {str(e)}")
             raise
 
+    def _parse_detail_row(self, row: Dict) -> Tuple[str, str, datetime, ReceiptItem]:
+        """
+        解析商品明細CSV的一行
+
+        Returns:
+            (商店名稱, 原始日期字串, 解析後的日期, 商品項目)
+        """
+        store_name = row.get("商店名稱", "")
+
+        # 解析日期
+        date_str = row.get("收據日期", "")
+        if date_str:
+            try:
+                for fmt in [
+                    "%Y-%m-%d %H:%M:%S",
+                    "%Y-%m-%d",
+                    "%Y/%m/%d",
+                ]:
+                    try:
+                        parsed_date = datetime.strptime(date_str, fmt)
+                        break
+                    except ValueError:
+                        continue
+                else:
+                    parsed_date = datetime.now()
+            except:
+                parsed_date = datetime.now()
+        else:
+            parsed_date = datetime.now()
+
+        # 創建商品項目
+        tax_included = row.get("含稅", "") == "含稅"
+        tax_amount = float(row.get("稅額", 0)) if row.get("稅額", "") else None
+
+        item = ReceiptItem(
+            name=row.get("商品名稱（原始）", ""),
+            name_japanese=row.get("商品名稱（日文）", ""),
+            name_chinese=row.get("商品名稱（中文）", ""),
+            price=float(row.get("單價", 0)),
+            quantity=int(row.get("數量", 1)),
+            tax_included=tax_included,
+            tax_amount=tax_amount,
+        )
+
+        return store_name, date_str, parsed_date, item
+
     def load_receipts_from_csv(self, filepath: str) -> List[ReceiptData]:
         """
         從CSV檔案載入收據資料
@@ -524,47 +865,8 @@ class CSVService:
 
                     for row in reader:
                         try:
-                            store_name = row.get("商店名稱", "")
-
-                            # 解析日期
-                            date_str = row.get("收據日期", "")
-                            if date_str:
-                                try:
-                                    for fmt in [
-                                        "%Y-%m-%d %H:%M:%S",
-                                        "%Y-%m-%d",
-                                        "%Y/%m/%d",
-                                    ]:
-                                        try:
-                                            parsed_date = datetime.strptime(
-                                                date_str, fmt
-                                            )
-                                            break
-                                        except ValueError:
-                                            continue
-                                    else:
-                                        parsed_date = datetime.now()
-                                except:
-                                    parsed_date = datetime.now()
-                            else:
-                                parsed_date = datetime.now()
-
-                            # 創建商品項目
-                            tax_included = row.get("含稅", "") == "含稅"
-                            tax_amount = (
-                                float(row.get("稅額", 0))
-                                if row.get("稅額", "")
-                                else None
-                            )
-
-                            item = ReceiptItem(
-                                name=row.get("商品名稱（原始）", ""),
-                                name_japanese=row.get("商品名稱（日文）", ""),
-                                name_chinese=row.get("商品名稱（中文）", ""),
-                                price=float(row.get("單價", 0)),
-                                quantity=int(row.get("數量", 1)),
-                                tax_included=tax_included,
-                                tax_amount=tax_amount,
+                            store_name, date_str, parsed_date, item = (
+                                self._parse_detail_row(row)
                             )
 
                             # 按商店名稱和日期分組
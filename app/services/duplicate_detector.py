@@ -0,0 +1,191 @@
+"""
+重複偵測服務 - 以感知雜湊在OCR前找出近似重複的收據圖片
+Duplicate detector service - flags near-duplicate receipt images by perceptual hash before OCR
+"""
+
+import threading
+from typing import Dict, List, Optional
+from loguru import logger
+from app.config import settings
+from app.services.cache_service import cache_service
+from app.services.cache_store import SQLiteCacheStore
+from app.services.content_hash import ContentHasher, content_hasher
+from app.utils.image_utils import image_utils
+
+
+class DuplicateDetector:
+    """
+    Near-duplicate detection using a 64-bit difference hash (dHash)
+    以64位元差異雜湊（dHash）偵測近似重複的圖片
+
+    Re-photographed or re-compressed copies of the same receipt have different
+    bytes (so a different sha256) but nearly identical dHashes. Different
+    receipts of the same layout can hash just as close, so an upload is only
+    flagged. When linking is enabled, a near-duplicate is linked to the earlier
+    upload after its own OCR text matches the earlier OCR text exactly, and
+    then reuses the existing AI result. Identical bytes already share results
+    through the content-addressed cache.
+    同一張收據重新拍攝或重新壓縮後位元組不同（sha256不同），但dHash幾乎相同；版面相同的不同收據雜湊也可能同樣接近，
+    因此上傳時只標記。啟用連結時，近似重複的圖片在自身OCR文字與先前的OCR文字完全一致後才連結，之後沿用既有的AI結果。
+    位元組相同的圖片已透過內容定址暫存共用結果。
+    """
+
+    def __init__(
+        self,
+        store: Optional[SQLiteCacheStore] = None,
+        hasher: Optional[ContentHasher] = None,
+        threshold: Optional[int] = None,
+        link_results: Optional[bool] = None,
+    ):
+        self.store = store or cache_service.store
+        self.hasher = hasher or content_hasher
+        self.threshold = (
+            settings.duplicate_hash_threshold if threshold is None else threshold
+        )
+        self.link_results = (
+            settings.duplicate_link_results if link_results is None else link_results
+        )
+        self._lock = threading.Lock()
+
+        # 已登記的圖片（記憶體中線性比對，數量為上傳張數等級）
+        self._entries: List[Dict] = self.store.list_image_hashes()
+        self._by_digest: Dict[str, Dict] = {
+            entry["digest"]: entry for entry in self._entries
+        }
+        if self.link_results:
+            for entry in self._entries:
+                if entry["verified"]:
+                    self.hasher.link_digest(entry["digest"], entry["canonical_digest"])
+
+    def _candidates(self, dhash: int, exclude: Optional[str] = None) -> List[Dict]:
+        """門檻內的已登記圖片（由近到遠）"""
+        candidates = []
+        for entry in self._entries:
+            if entry["digest"] == exclude:
+                continue
+            distance = image_utils.hamming_distance(dhash, entry["dhash"])
+            if distance <= self.threshold:
+                candidates.append({**entry, "distance": distance, "exact": False})
+        candidates.sort(key=lambda candidate: candidate["distance"])
+        return candidates
+
+    def find_match(self, dhash: int, digest: str) -> Optional[Dict]:
+        """
+        Closest registered image within the threshold (exact content first)
+        門檻內最接近的已登記圖片（優先比對完全相同的內容）
+        """
+        exact = self._by_digest.get(digest)
+        if exact:
+            return {**exact, "distance": 0, "exact": True}
+
+        candidates = self._candidates(dhash)
+        return candidates[0] if candidates else None
+
+    def check_and_register(
+        self, file_path: str, filename: str, dhash: Optional[int] = None
+    ) -> Optional[Dict]:
+        """
+        Check an uploaded image against earlier uploads, then register it
+        將上傳的圖片與先前上傳的圖片比對後登記（只標記，不連結結果）
+
+        Args:
+            file_path: Path of the saved upload / 已儲存的上傳檔案路徑
+            filename: Stored filename / 儲存的檔案名稱
+            dhash: Precomputed perceptual hash / 已計算的感知雜湊（可選）
+
+        Returns:
+            Info about the earlier upload it duplicates, or None
+            重複的先前上傳資訊；非重複時返回None
+        """
+        digest = self.hasher.image_digest(file_path)
+        if dhash is None:
+            dhash = image_utils.compute_dhash(file_path)
+
+        with self._lock:
+            match = self.find_match(dhash, digest)
+
+            if digest not in self._by_digest:
+                entry = {
+                    "digest": digest,
+                    "dhash": dhash,
+                    "canonical_digest": digest,
+                    "filename": filename,
+                    "verified": False,
+                }
+                self.store.put_image_hash(digest, dhash, digest, filename)
+                self._entries.append(entry)
+                self._by_digest[digest] = entry
+
+        if match is None:
+            return None
+
+        duplicate = {
+            "filename": match["filename"],
+            "distance": match["distance"],
+            "exact": match["exact"],
+            "linked": match["exact"],
+            "has_result": self.store.get("ocr", match["canonical_digest"]) is not None,
+        }
+        logger.info(
+            f"Near-duplicate upload: {filename} ~ {match['filename']} (distance {match['distance']}) "
+            f"/ 偵測到近似重複的上傳: {filename} ~ {match['filename']}（距離 {match['distance']}）"
+        )
+        return duplicate
+
+    @staticmethod
+    def _normalize_text(ocr_data: Optional[Dict]) -> str:
+        """比對用的OCR文字（去除所有空白）"""
+        return "".join(((ocr_data or {}).get("text") or "").split())
+
+    def confirm_duplicate(self, file_path: str, ocr_result: Dict) -> Optional[str]:
+        """
+        Link a flagged near-duplicate once its OCR text matches an earlier upload
+        近似重複的圖片OCR文字與先前上傳完全一致時建立連結
+
+        Called after OCR and before the AI cache key is computed, so a
+        confirmed duplicate reuses the earlier AI result.
+        在OCR之後、計算AI暫存鍵之前呼叫，確認後即沿用先前的AI結果。
+
+        Args:
+            file_path: Image path / 圖片路徑
+            ocr_result: OCR result of this image / 此圖片的OCR結果
+
+        Returns:
+            Filename of the linked upload, or None / 連結的先前上傳檔名；未連結時返回None
+        """
+        if not self.link_results or not ocr_result.get("success"):
+            return None
+        text = self._normalize_text(ocr_result)
+        if not text:
+            return None
+
+        digest = self.hasher.image_digest(file_path)
+        with self._lock:
+            entry = self._by_digest.get(digest)
+            if entry is None or entry["verified"]:
+                return None
+            candidates = self._candidates(entry["dhash"], exclude=digest)
+
+        for candidate in candidates:
+            canonical = candidate["canonical_digest"]
+            if canonical == digest:
+                continue
+            cached = self.store.get("ocr", canonical)
+            if not cached or self._normalize_text(cached.get("ocr_data")) != text:
+                continue
+
+            with self._lock:
+                self.store.confirm_image_link(digest, canonical)
+                entry["canonical_digest"] = canonical
+                entry["verified"] = True
+                self.hasher.link_digest(digest, canonical)
+            logger.info(
+                f"Near-duplicate confirmed by OCR text: {entry['filename']} -> {candidate['filename']} "
+                f"/ OCR文字一致，沿用既有結果: {entry['filename']} -> {candidate['filename']}"
+            )
+            return candidate["filename"]
+        return None
+
+
+# 全局實例
+duplicate_detector = DuplicateDetector()
@@ -0,0 +1,117 @@
+"""
+共用HTTP客戶端服務 - 提供具連線池的非同步HTTP客戶端
+Shared HTTP client service - pooled async HTTP clients
+"""
+
+import asyncio
+from typing import Optional
+import httpx
+from loguru import logger
+from app.config import settings
+
+
+def is_http2_available() -> bool:
+    """
+    Check whether HTTP/2 support (h2 package) is installed
+    檢查是否已安裝HTTP/2支援（h2套件）
+    """
+    try:
+        import h2  # noqa: F401
+
+        return True
+    except ImportError:
+        return False
+
+
+class PooledAsyncClient:
+    """
+    Long-lived pooled httpx.AsyncClient bound to the running event loop
+    綁定事件迴圈的長期共用httpx.AsyncClient（keep-alive連線池）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        http2: Optional[bool] = None,
+    ):
+        self.name = name
+        self.max_connections = max_connections or settings.http_max_connections
+        self.max_keepalive_connections = (
+            max_keepalive_connections or settings.http_max_keepalive_connections
+        )
+        self.keepalive_expiry = keepalive_expiry or settings.http_keepalive_expiry
+        self.timeout = timeout or settings.http_request_timeout
+
+        # HTTP/2 only when requested and the h2 package exists / 只有在設定啟用且安裝h2時才使用HTTP/2
+        wants_http2 = settings.http2_enabled if http2 is None else http2
+        self.http2 = wants_http2 and is_http2_available()
+        if wants_http2 and not self.http2:
+            logger.info(
+                f"[{self.name}] h2 not installed, falling back to HTTP/1.1 / 未安裝h2，使用HTTP/1.1"
+            )
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        """
+        Build a new pooled client
+        建立新的連線池客戶端
+        """
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        logger.info(
+            f"[{self.name}] Created pooled HTTP client (http2={self.http2}, max_connections={self.max_connections}) "
+            f"/ 已建立連線池HTTP客戶端"
+        )
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, http2=self.http2)
+
+    async def get_client(self) -> httpx.AsyncClient:
+        """
+        Get the shared client, creating it on first use in the current event loop
+        獲取共用客戶端，於目前事件迴圈首次使用時建立
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            self._client is not None
+            and self._loop is loop
+            and not self._client.is_closed
+        ):
+            return self._client
+
+        # Connections cannot be shared across event loops, so rebuild on loop change
+        # 連線無法跨事件迴圈共用，事件迴圈改變時重新建立
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+
+        async with self._lock:
+            if self._client is None or self._loop is not loop or self._client.is_closed:
+                self._client = self._build_client()
+                self._loop = loop
+            return self._client
+
+    async def aclose(self):
+        """
+        Close the pooled client (called on application shutdown)
+        關閉連線池客戶端（應用程式關閉時調用）
+        """
+        if self._client is not None and not self._client.is_closed:
+            try:
+                await self._client.aclose()
+                logger.info(f"[{self.name}] HTTP client closed / HTTP客戶端已關閉")
+            except Exception as e:
+                logger.warning(
+                    f"[{self.name}] Failed to close HTTP client: {e} / 關閉HTTP客戶端失敗"
+                )
+        self._client = None
+        self._loop = None
@@ -0,0 +1,158 @@
+"""
+圖片工作程序池 - 將CPU密集的圖片處理移出事件迴圈並分散到多核心
+Image worker pool - runs CPU-bound image work off the event loop across all cores
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+from loguru import logger
+from app.config import settings
+from app.services.content_hash import content_hasher, file_sha256
+from app.utils.image_utils import ImageUtils
+
+
+def _timed_call(func: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float]:
+    """在工作程序中執行並返回 (結果, 執行秒數)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class ImageWorkerPool:
+    """
+    Dedicated, sized process pool for decode/resize/enhance/validate/hash work
+    專用且可設定大小的程序池，處理解碼、縮放、增強、驗證與雜湊
+
+    Shared by /upload, /process and both batch processors so a 12 MP photo is
+    decoded on a worker core instead of blocking the async server. Each task
+    records its queue wait and execution time by task name.
+    由 /upload、/process 與兩種批次處理器共用；12MP照片在工作核心上解碼，不阻塞非同步伺服器。
+    每個任務依名稱記錄排隊等待與執行時間。
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        configured = settings.image_workers if workers is None else workers
+        self.workers = configured if configured > 0 else (os.cpu_count() or 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """延遲建立程序池（第一個任務時才啟動工作程序）"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                logger.info(f"圖片工作程序池已啟動，工作程序數: {self.workers}")
+            return self._executor
+
+    def _record(self, task: str, wait: float, run: float):
+        """記錄單一任務的等待與執行時間"""
+        with self._lock:
+            stats = self._stats.setdefault(
+                task,
+                {
+                    "count": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "total_wait_seconds": 0.0,
+                },
+            )
+            stats["count"] += 1
+            stats["total_seconds"] += run
+            stats["max_seconds"] = max(stats["max_seconds"], run)
+            stats["total_wait_seconds"] += wait
+
+    async def run(self, task: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a picklable function in the pool and record its timing
+        在程序池中執行可序列化的函式，並記錄耗時
+
+        Args:
+            task: Task name for statistics / 統計用的任務名稱
+            func: Module-level function / 模組層級函式
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            result, run_time = await loop.run_in_executor(
+                self._get_executor(), _timed_call, func, args, kwargs
+            )
+        except BrokenProcessPool:
+            # 工作程序異常終止（例如記憶體不足），重建程序池後重試一次
+            logger.warning(f"圖片工作程序池已中斷，重新建立: {task}")
+            self.shutdown(wait=False)
+            result, run_time = await loop.run_in_executor(
+                self._get_executor(), _timed_call, func, args, kwargs
+            )
+
+        self._record(task, max(0.0, time.perf_counter() - start - run_time), run_time)
+        return result
+
+    async def validate_image(self, file_path: str, max_size: int = 10485760) -> bool:
+        """驗證圖片"""
+        return await self.run(
+            "validate", ImageUtils.validate_image, file_path, max_size
+        )
+
+    async def prepare_for_ocr(self, file_path: str, **kwargs) -> bytes:
+        """解碼、裁切收據區域、縮放、增強並編碼為OCR上傳用的位元組"""
+        kwargs.setdefault("crop", settings.receipt_crop_enabled)
+        task = "enhance" if kwargs.get("enhance") else "resize"
+        return await self.run(
+            task, functools.partial(ImageUtils.prepare_for_ocr, file_path, **kwargs)
+        )
+
+    async def compute_dhash(self, file_path: str) -> int:
+        """計算感知雜湊"""
+        return await self.run("dhash", ImageUtils.compute_dhash, file_path)
+
+    async def image_digest(self, file_path: str) -> str:
+        """
+        Content digest, computed in the pool and memoized in content_hasher
+        內容雜湊（在程序池計算，並記錄到 content_hasher 的快取）
+        """
+        cached = content_hasher.cached_digest(file_path)
+        if cached:
+            return cached
+
+        stat = os.stat(file_path)
+        digest = await self.run("hash", file_sha256, file_path)
+        content_hasher.remember_digest(file_path, stat, digest)
+        return digest
+
+    def get_stats(self) -> Dict:
+        """獲取各任務的耗時統計"""
+        with self._lock:
+            tasks = {
+                task: {
+                    "count": int(stats["count"]),
+                    "avg_seconds": round(stats["total_seconds"] / stats["count"], 4),
+                    "max_seconds": round(stats["max_seconds"], 4),
+                    "avg_wait_seconds": round(
+                        stats["total_wait_seconds"] / stats["count"], 4
+                    ),
+                }
+                for task, stats in self._stats.items()
+            }
+            return {
+                "workers": self.workers,
+                "started": self._executor is not None,
+                "tasks": tasks,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """關閉程序池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# 全局實例
+image_worker_pool = ImageWorkerPool()
@@ -0,0 +1,426 @@
+"""
+背景工作佇列服務 - 批次處理以工作ID在背景執行，狀態持久化於磁碟
+Job queue service - batch runs execute in the background under a job ID, with state persisted to disk
+"""
+
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+from app.config import settings
+from app.services.azure_usage_tracker import azure_usage_tracker
+from app.services.batch_progress import BatchProgress
+from app.services.progress_events import ProgressEventBus, progress_event_bus
+from app.services.rate_limiter import rate_limiter
+from app.services.batch_processor import batch_processor
+from app.services.optimized_batch_processor import optimized_batch_processor
+
+# 工作狀態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# 工作執行函數：接收工作參數與進度物件，返回處理結果
+# 參數另含 "state"（先前保存的狀態）與 "checkpoint"（保存狀態的函數），供需要恢復的工作使用
+JobRunner = Callable[[Dict, BatchProgress], Awaitable[Dict]]
+
+# 結果中不持久化的欄位（含ReceiptData物件，無法序列化）
+_UNPERSISTED_RESULT_KEYS = ("results",)
+
+
+class JobStore:
+    """
+    One JSON file per job, written atomically
+    每個工作一個JSON檔案，以原子方式寫入
+    """
+
+    def __init__(self, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"job_{job_id}.json")
+
+    def save(self, job: Dict):
+        """儲存工作狀態（先寫暫存檔再取代，避免中途中斷造成檔案損毀）"""
+        path = self._job_path(job["job_id"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        """載入工作狀態"""
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"載入工作失敗: {job_id}, 錯誤: {str(e)}")
+            return None
+
+    def load_all(self) -> List[Dict]:
+        """載入所有工作（依建立時間排序）"""
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.startswith("job_") and name.endswith(".json"):
+                job = self.load(name[len("job_") : -len(".json")])
+                if job:
+                    jobs.append(job)
+        jobs.sort(key=lambda job: job.get("created_at", ""))
+        return jobs
+
+
+class JobQueue:
+    """
+    Background job queue for batch processing
+    批次處理的背景工作佇列
+
+    Submitting returns a job ID immediately; workers run the batch and keep
+    the job file up to date. Jobs still queued or running when the process
+    stops are picked up again on the next start, skipping files that had
+    already finished. Runners can checkpoint extra state (such as submitted
+    Message Batch ids) into the job file and get it back when resumed.
+    提交後立即返回工作ID；工作者在背景執行並持續更新工作檔案。程序停止時尚未完成的工作，
+    會在下次啟動時重新排入佇列，並跳過已完成的檔案。執行函數可將額外狀態（如已提交的訊息批次ID）
+    保存到工作檔案，恢復時再取回。
+    """
+
+    def __init__(
+        self,
+        jobs_dir: Optional[str] = None,
+        workers: Optional[int] = None,
+        event_bus: Optional[ProgressEventBus] = None,
+    ):
+        self.store = JobStore(jobs_dir or settings.jobs_dir)
+        self.event_bus = event_bus or progress_event_bus
+        self.workers = max(1, workers if workers is not None else settings.job_workers)
+        self.runners: Dict[str, JobRunner] = {}
+        self.jobs: Dict[str, Dict] = {}
+        self.progress: Dict[str, BatchProgress] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def register_runner(self, job_type: str, runner: JobRunner):
+        """註冊工作類型的執行函數"""
+        self.runners[job_type] = runner
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    async def start(self):
+        """
+        Start workers and requeue unfinished jobs from disk
+        啟動工作者，並將磁碟上未完成的工作重新排入佇列
+        """
+        if self.is_running:
+            return
+
+        self._queue = asyncio.Queue()
+        for job in self.store.load_all():
+            self.jobs[job["job_id"]] = job
+            if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+                if job["status"] == JOB_RUNNING:
+                    logger.info(f"恢復中斷的工作: {job['job_id']}")
+                job["status"] = JOB_QUEUED
+                self.store.save(job)
+                self._queue.put_nowait(job["job_id"])
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        logger.info(
+            f"工作佇列已啟動: {self.workers} 個工作者，待處理 {self._queue.qsize()} 個工作"
+        )
+
+    async def stop(self):
+        """
+        Stop workers; running jobs stay "running" on disk and resume on next start
+        停止工作者；執行中的工作在磁碟上保持running狀態，下次啟動時恢復
+        """
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+
+    def submit(self, job_type: str, params: Dict) -> Dict:
+        """
+        Create a job and queue it
+        建立工作並排入佇列
+
+        Args:
+            job_type: Registered runner name / 已註冊的執行類型
+            params: Runner parameters; "filenames" are skipped on resume once finished
+                    執行參數；filenames中已完成的檔案在恢復時會跳過
+
+        Returns:
+            The new job record / 新建立的工作記錄
+        """
+        if job_type not in self.runners:
+            raise ValueError(f"未知的工作類型: {job_type}")
+        if not self.is_running:
+            raise RuntimeError("工作佇列尚未啟動")
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "type": job_type,
+            "status": JOB_QUEUED,
+            "params": params,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": BatchProgress().get_progress(),
+            "file_results": [],
+            "state": {},
+            "csv_files": {},
+            "result": None,
+            "error": None,
+        }
+        self.jobs[job["job_id"]] = job
+        self.store.save(job)
+        self._queue.put_nowait(job["job_id"])
+        logger.info(
+            f"📥 工作已排入佇列: {job['job_id']} ({job_type}, {len(params.get('filenames', []))} 個檔案)"
+        )
+        return job
+
+    def retry(self, job_id: str) -> Optional[Dict]:
+        """
+        Requeue a failed job, keeping its checkpointed state
+        將失敗的工作重新排入佇列（保留已保存的狀態，例如已提交的訊息批次ID）
+
+        Returns:
+            The job record, or None if it does not exist / 工作記錄（不存在時返回None）
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] != JOB_FAILED:
+            raise ValueError(f"只有失敗的工作可以重新執行: {job_id}")
+        if not self.is_running:
+            raise RuntimeError("工作佇列尚未啟動")
+
+        job["status"] = JOB_QUEUED
+        job["error"] = None
+        job["finished_at"] = None
+        self.store.save(job)
+        self._publish_status(job)
+        self._queue.put_nowait(job_id)
+        logger.info(f"🔁 工作重新排入佇列: {job_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """獲取工作狀態（執行中的工作附帶即時進度）"""
+        job = self.jobs.get(job_id) or self.store.load(job_id)
+        if job is None:
+            return None
+        progress = self.progress.get(job_id)
+        if progress is not None:
+            job["progress"] = progress.get_progress()
+        return job
+
+    def list_jobs(self, job_type: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """列出最近的工作（新到舊）"""
+        jobs = [
+            job
+            for job in self.jobs.values()
+            if job_type is None or job["type"] == job_type
+        ]
+        jobs.sort(key=lambda job: job.get("created_at", ""), reverse=True)
+        return [self.get_job(job["job_id"]) for job in jobs[:limit]]
+
+    def latest_job(self, job_type: str) -> Optional[Dict]:
+        """獲取指定類型最近的工作"""
+        jobs = self.list_jobs(job_type, limit=1)
+        return jobs[0] if jobs else None
+
+    def stream_events(self, job_id: str) -> AsyncIterator[str]:
+        """
+        SSE stream of a job: current state first, then live progress until it finishes
+        工作的SSE串流：先送出目前狀態，之後推送即時進度直到工作結束
+        """
+        return self.event_bus.stream(job_id, snapshot=self.get_job(job_id))
+
+    def _publish_status(self, job: Dict):
+        self.event_bus.publish(
+            job["job_id"],
+            "status",
+            {
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "progress": job["progress"],
+                "csv_files": job["csv_files"],
+                "result": job["result"],
+                "error": job["error"],
+            },
+        )
+
+    def _publish_progress(
+        self, job: Dict, progress: BatchProgress, rate_limit_info: Optional[Dict] = None
+    ) -> Optional[Dict]:
+        """
+        Publish a progress event; returns the rate limit info it sent
+        推送進度事件（可沿用上次的限流資訊，避免重建使用量摘要）
+        """
+        if not self.event_bus.has_subscribers(job["job_id"]):
+            return None
+
+        if rate_limit_info is None:
+            usage_summary = azure_usage_tracker.get_usage_summary()
+            rate_limit_info = {
+                "rate_limit": usage_summary["rate_limit"],
+                "current_hour_usage": usage_summary["current_hour_usage"],
+                "warnings": usage_summary["warnings"],
+                "limiter": rate_limiter.get_status(),
+            }
+        self.event_bus.publish(
+            job["job_id"],
+            "progress",
+            {
+                "job_id": job["job_id"],
+                "progress": job["progress"],
+                "last_file": (
+                    progress.file_results[-1] if progress.file_results else None
+                ),
+                "rate_limit_info": rate_limit_info,
+            },
+        )
+        return rate_limit_info
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(self.jobs[job_id])
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: Dict):
+        job_id = job["job_id"]
+        # 恢復的工作只處理尚未完成的檔案
+        finished = {entry["filename"] for entry in job["file_results"]}
+        pending = [f for f in job["params"].get("filenames", []) if f not in finished]
+        # 沒有檔案列表的工作（如訊息批次）恢復時重新計算全部進度
+        previous_results = (
+            list(job["file_results"]) if "filenames" in job["params"] else []
+        )
+
+        last_rate_limit_info: Dict = {}
+
+        def on_update(progress: BatchProgress):
+            job["file_results"] = previous_results + progress.file_results
+            job["progress"] = progress.get_progress()
+            self.store.save(job)
+            last_rate_limit_info["value"] = self._publish_progress(job, progress)
+
+        def on_partial(progress: BatchProgress):
+            # 串流中的部分進度只推送事件；工作檔案在項目完成時才寫入
+            job["progress"] = progress.get_progress()
+            self._publish_progress(job, progress, last_rate_limit_info.get("value"))
+
+        def checkpoint(state: Dict):
+            job["state"] = dict(job.get("state") or {}, **state)
+            self.store.save(job)
+
+        progress = BatchProgress(on_update=on_update, on_partial=on_partial)
+        self.progress[job_id] = progress
+        job["status"] = JOB_RUNNING
+        job["started_at"] = job["started_at"] or datetime.now().isoformat()
+        self.store.save(job)
+        self._publish_status(job)
+        logger.info(
+            f"▶️ 開始執行工作: {job_id} ({job['type']}, 待處理 {len(pending)} 個檔案)"
+        )
+
+        try:
+            params = dict(
+                job["params"],
+                filenames=pending,
+                state=job.get("state") or {},
+                checkpoint=checkpoint,
+            )
+            result = await self.runners[job["type"]](params, progress)
+            if previous_results and "processed_count" in result:
+                # 恢復的工作：統計包含中斷前已完成的檔案
+                result = dict(
+                    result,
+                    processed_count=sum(
+                        1 for entry in job["file_results"] if entry["success"]
+                    ),
+                    failed_count=sum(
+                        1 for entry in job["file_results"] if not entry["success"]
+                    ),
+                )
+            job["result"] = {
+                key: value
+                for key, value in result.items()
+                if key not in _UNPERSISTED_RESULT_KEYS
+            }
+            job["csv_files"] = result.get("csv_files", {})
+            job["status"] = JOB_DONE
+            logger.info(f"✅ 工作完成: {job_id}")
+        except asyncio.CancelledError:
+            # 程序關閉：保持running狀態，下次啟動時恢復
+            logger.warning(f"工作被中斷，將於下次啟動時恢復: {job_id}")
+            raise
+        except Exception as e:
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+            logger.error(f"❌ 工作失敗: {job_id}, 錯誤: {str(e)}")
+        finally:
+            self.progress.pop(job_id, None)
+            job["progress"] = progress.get_progress()
+            if job["status"] in (JOB_DONE, JOB_FAILED):
+                job["finished_at"] = datetime.now().isoformat()
+            self.store.save(job)
+            self._publish_status(job)
+
+
+async def _run_standard_batch(params: Dict, progress: BatchProgress) -> Dict:
+    """標準批次處理"""
+    return await batch_processor.process_large_batch(
+        params["filenames"],
+        params.get("enhance_image", True),
+        params.get("save_detailed_csv", False),
+        progress=progress,
+        state=params.get("state"),
+        checkpoint=params.get("checkpoint"),
+    )
+
+
+async def _run_optimized_batch(params: Dict, progress: BatchProgress) -> Dict:
+    """優化批次處理"""
+    return await optimized_batch_processor.process_large_batch_optimized(
+        params["filenames"],
+        params.get("save_detailed_csv", False),
+        progress=progress,
+        state=params.get("state"),
+        checkpoint=params.get("checkpoint"),
+    )
+
+
+async def _run_message_batch(params: Dict, progress: BatchProgress) -> Dict:
+    """以Message Batches從OCR暫存處理AI分析（已提交的批次ID保存在工作中，恢復時繼續輪詢）"""
+    return await batch_processor.process_from_cache(
+        params["batch_id"],
+        params.get("save_detailed_csv", False),
+        use_message_batches=True,
+        progress=progress,
+        state=params.get("state"),
+        checkpoint=params.get("checkpoint"),
+    )
+
+
+# 全局實例
+job_queue = JobQueue()
+job_queue.register_runner("standard", _run_standard_batch)
+job_queue.register_runner("optimized", _run_optimized_batch)
+job_queue.register_runner("message_batch", _run_message_batch)
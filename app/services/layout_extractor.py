@@ -0,0 +1,412 @@
+"""
+版面規則結構化服務 - 已知連鎖店收據直接由OCR結果建立ReceiptData，不經過AI
+Layout extractor service - builds ReceiptData for known chain layouts straight from OCR, skipping the AI
+"""
+
+import re
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from loguru import logger
+from app.config import settings
+from app.models.receipt import ReceiptData, ReceiptItem
+
+# 連鎖店版面模板：keywords 出現在前幾行時套用，tax_type 為沒有稅額行時的預設
+LAYOUT_TEMPLATES = [
+    {
+        "chain": "セブン-イレブン",
+        "keywords": ["セブン-イレブン", "セブンイレブン", "7-ELEVEN", "7-Eleven"],
+        "tax_type": "內含稅",
+    },
+    {
+        "chain": "ファミリーマート",
+        "keywords": ["ファミリーマート", "FamilyMart", "ファミマ"],
+        "tax_type": "內含稅",
+    },
+    {
+        "chain": "ローソン",
+        "keywords": ["ローソン", "LAWSON"],
+        "tax_type": "內含稅",
+    },
+    {
+        "chain": "ミニストップ",
+        "keywords": ["ミニストップ", "MINISTOP"],
+        "tax_type": "內含稅",
+    },
+    {
+        "chain": "イオン",
+        "keywords": ["イオン", "AEON", "マックスバリュ"],
+        "tax_type": "外加稅",
+    },
+    {
+        "chain": "イトーヨーカドー",
+        "keywords": ["イトーヨーカドー", "ヨーカドー"],
+        "tax_type": "外加稅",
+    },
+    {
+        "chain": "西友",
+        "keywords": ["西友", "SEIYU"],
+        "tax_type": "內含稅",
+    },
+]
+
+# 店名只在收據開頭幾行中比對
+HEADER_LINES = 5
+
+# 行末金額：¥1,234 / 1,234円 / ￥120軽 / -¥50（群組：負號、¥、數字、円）
+AMOUNT_AT_END = re.compile(
+    r"([-▲△])?\s*([¥￥])?\s*(\d{1,3}(?:,\d{3})+|\d+)\s*(円)?\s*[軽※*＊外内]?\s*[)）]?\s*$"
+)
+# 數量行：2コX単150 / 2個 × @150 / 3点 x ¥98
+QUANTITY_LINE = re.compile(
+    r"(\d+)\s*[個コ点]\s*[xX×]\s*[単@＠]?\s*[¥￥]?\s*(\d{1,3}(?:,\d{3})+|\d+)"
+)
+DATE_PATTERNS = [
+    re.compile(r"(\d{4})年\s*(\d{1,2})月\s*(\d{1,2})日"),
+    re.compile(r"(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})"),
+]
+TIME_PATTERN = re.compile(r"\d{1,2}[:：時]\d{2}")
+RECEIPT_NUMBER = re.compile(
+    r"(?:レシート|取引|伝票)?(?:No|NO|№|番号)[.:：]?\s*(\d{3,})"
+)
+
+TOTAL_LABELS = ["合計", "合 計", "総合計", "お買上計"]
+SUBTOTAL_LABELS = ["小計", "小 計"]
+TAX_LABELS = ["消費税", "内税", "外税", "税額", "内消費税"]
+# 合計後的付款資訊（不是商品）
+PAYMENT_LABELS = {
+    "現金": ["現金", "お預り", "お預かり"],
+    "クレジットカード": ["クレジット", "カード"],
+    "電子マネー": [
+        "電子マネー",
+        "交通系",
+        "nanaco",
+        "WAON",
+        "Suica",
+        "PASMO",
+        "iD",
+        "QUICPay",
+        "PayPay",
+    ],
+}
+# 商品區中需要略過的行（稅率對象額、點數等）
+SKIP_LABELS = ["お釣", "釣銭", "ポイント", "点数", "登録番号", "領収", "TEL", "電話"]
+
+
+def _to_amount(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+class LayoutExtractor:
+    """
+    Template-based extractor for common convenience-store and supermarket layouts
+    常見便利商店與超市收據的模板結構化器
+
+    OCR lines are grouped into rows by their bounding boxes (name and price
+    columns may be read as separate lines). Rows before the subtotal/total
+    become items, and labelled rows give subtotal, tax, total and payment.
+    The result is used only if it passes the consistency checks: the items
+    must add up to the subtotal (or total), subtotal + external tax must equal
+    the total, and the tax must fall within the 8%-10% range. Anything else
+    returns None so the receipt goes to the AI as before. Item names are kept
+    as printed and have no name_chinese translation, so the extractor is off
+    unless layout_extractor_enabled is set.
+    依 boundingBox 將OCR行合併成橫列（品名與金額可能被辨識為不同行）。小計/合計之前的橫列為商品，
+    帶標籤的橫列提供小計、稅額、合計與付款方式。只有通過一致性檢查時才採用結果：商品合計等於小計（或合計）、
+    小計加外加稅等於合計、稅額落在8%~10%範圍內；否則返回None，收據照常交給AI處理。
+    商品名稱保留原文、沒有 name_chinese 翻譯，因此需設定 layout_extractor_enabled 才啟用。
+    """
+
+    # 規則版本：修改模板或檢查邏輯時遞增，使舊的AI暫存失效
+    version = "1"
+
+    def __init__(
+        self, enabled: Optional[bool] = None, templates: Optional[List[Dict]] = None
+    ):
+        self.enabled = settings.layout_extractor_enabled if enabled is None else enabled
+        self.templates = templates or LAYOUT_TEMPLATES
+
+        self._lock = threading.Lock()
+        self.stats = {"attempted": 0, "matched": 0, "accepted": 0}
+        self._by_chain: Dict[str, int] = {}
+        self._rejections: Dict[str, int] = {}
+
+    def match_template(self, ocr_data: Dict) -> Optional[Dict]:
+        """依收據開頭幾行的店名找出模板"""
+        header = "\n".join(ocr_data.get("text", "").splitlines()[:HEADER_LINES])
+        for template in self.templates:
+            if any(keyword in header for keyword in template["keywords"]):
+                return template
+        return None
+
+    def store_name(self, template: Dict, ocr_data: Dict) -> str:
+        """
+        Store name as printed on the receipt (header line with the chain keyword)
+        收據上印出的店名（含連鎖店關鍵字的開頭行，例如「イオン 幕張店」）
+        """
+        for line in ocr_data.get("text", "").splitlines()[:HEADER_LINES]:
+            if any(keyword in line for keyword in template["keywords"]):
+                return line.strip()
+        return template["chain"]
+
+    def _rows(self, ocr_data: Dict) -> List[str]:
+        """
+        Merge OCR lines that share a baseline into rows, left to right
+        將同一高度的OCR行合併為橫列（由左至右）
+        """
+        lines = ocr_data.get("lines") or []
+        boxed = [line for line in lines if len(line.get("boundingBox") or []) >= 4]
+        if not boxed or len(boxed) != len(lines):
+            return [row for row in ocr_data.get("text", "").splitlines() if row.strip()]
+
+        def span(line):
+            ys = line["boundingBox"][1::2]
+            return min(ys), max(ys), min(line["boundingBox"][0::2])
+
+        rows: List[List] = []
+        for line in sorted(boxed, key=lambda line: sum(span(line)[:2])):
+            top, bottom, left = span(line)
+            center = (top + bottom) / 2
+            if rows:
+                row_top, row_bottom = rows[-1][0], rows[-1][1]
+                if row_top <= center <= row_bottom:
+                    rows[-1][2].append((left, line.get("text", "")))
+                    continue
+            rows.append([top, bottom, [(left, line.get("text", ""))]])
+
+        return [
+            " ".join(text for _, text in sorted(parts)).strip()
+            for _, _, parts in rows
+            if any(text.strip() for _, text in parts)
+        ]
+
+    def _parse(self, template: Dict, rows: List[str]) -> Dict:
+        """將橫列解析為收據欄位（不做一致性檢查）"""
+        parsed = {
+            "date": None,
+            "items": [],
+            "subtotal": None,
+            "tax_amount": None,
+            "tax_type": template["tax_type"],
+            "total_amount": None,
+            "payment_method": None,
+            "receipt_number": None,
+        }
+        pending_quantity = None
+        # 品名與「數量×單價 金額」分兩列印出時，先記下品名
+        pending_name = None
+
+        for row in rows:
+            compact = row.replace(" ", "")
+            if parsed["date"] is None:
+                for pattern in DATE_PATTERNS:
+                    match = pattern.search(row)
+                    if match:
+                        try:
+                            parsed["date"] = datetime(
+                                *(int(part) for part in match.groups())
+                            )
+                        except ValueError:
+                            pass
+                        break
+                if parsed["date"] is not None:
+                    continue
+            if parsed["receipt_number"] is None:
+                match = RECEIPT_NUMBER.search(row)
+                if match:
+                    parsed["receipt_number"] = match.group(1)
+                    continue
+
+            amount_match = AMOUNT_AT_END.search(row)
+            quantity_match = QUANTITY_LINE.search(row)
+
+            if "対象" in compact:
+                # 稅率對象額不是稅額；「8%対象 ¥270 内消費税 ¥20」這類同列的稅額才採用
+                after = compact[compact.index("対象") :]
+                if "外" in compact:
+                    parsed["tax_type"] = "外加稅"
+                if not any(label in after for label in TAX_LABELS):
+                    continue
+            if any(label in compact for label in TAX_LABELS):
+                if "外" in compact:
+                    parsed["tax_type"] = "外加稅"
+                elif "内" in compact:
+                    parsed["tax_type"] = "內含稅"
+                if amount_match:
+                    # 8%與10%分列時累加
+                    parsed["tax_amount"] = (parsed["tax_amount"] or 0) + _to_amount(
+                        amount_match.group(3)
+                    )
+                continue
+            if parsed["total_amount"] is not None:
+                # 合計之後只讀稅額與付款方式
+                if parsed["payment_method"] is None and "ポイント" not in row:
+                    for method, labels in PAYMENT_LABELS.items():
+                        if any(label in row for label in labels):
+                            parsed["payment_method"] = method
+                            break
+                continue
+            if any(label in compact for label in SKIP_LABELS):
+                continue
+            if any(label in compact for label in SUBTOTAL_LABELS):
+                if amount_match:
+                    parsed["subtotal"] = _to_amount(amount_match.group(3))
+                continue
+            if any(label in compact for label in TOTAL_LABELS):
+                if amount_match:
+                    parsed["total_amount"] = _to_amount(amount_match.group(3))
+                continue
+
+            if quantity_match:
+                quantity = int(quantity_match.group(1))
+                rest = row[quantity_match.end() :]
+                rest_amount = AMOUNT_AT_END.search(rest)
+                if rest_amount and pending_name:
+                    parsed["items"].append(
+                        {
+                            "name": pending_name,
+                            "price": _to_amount(rest_amount.group(3)),
+                            "quantity": quantity,
+                        }
+                    )
+                elif rest_amount and parsed["items"]:
+                    # 數量行在商品之後並帶有該行金額
+                    item = parsed["items"][-1]
+                    item["quantity"] = quantity
+                    item["price"] = _to_amount(rest_amount.group(3))
+                else:
+                    pending_quantity = quantity
+                pending_name = None
+                continue
+
+            if TIME_PATTERN.search(row):
+                continue
+            # 商品金額必須帶有¥或円（排除電話與編號）
+            if not amount_match or not (amount_match.group(2) or amount_match.group(4)):
+                pending_name = row.strip()
+                continue
+            pending_name = None
+            name = re.sub(r"\s*税込\s*$", "", row[: amount_match.start()]).strip()
+            amount = _to_amount(amount_match.group(3))
+            if amount_match.group(1):
+                # 值引/割引：折抵前一項商品
+                if parsed["items"]:
+                    parsed["items"][-1]["price"] -= amount
+                continue
+            if not name or name.isdigit():
+                continue
+            parsed["items"].append(
+                {"name": name, "price": amount, "quantity": pending_quantity or 1}
+            )
+            pending_quantity = None
+
+        return parsed
+
+    def check(self, parsed: Dict) -> List[str]:
+        """
+        Consistency checks for a parsed receipt (empty list = accepted)
+        檢查解析結果的一致性（空列表表示通過）
+        """
+        total = parsed["total_amount"]
+        if not total or total <= 0:
+            return ["missing_total"]
+        if parsed["date"] is None:
+            return ["missing_date"]
+        if not parsed["items"]:
+            return ["no_items"]
+
+        items_sum = sum(item["price"] for item in parsed["items"])
+        subtotal = parsed["subtotal"]
+        tax = parsed["tax_amount"]
+
+        if parsed["tax_type"] == "外加稅":
+            base = subtotal if subtotal is not None else items_sum
+            if tax is None or abs(base + tax - total) > 0.5:
+                return ["total_mismatch"]
+            if abs(items_sum - base) > 0.5:
+                return ["items_mismatch"]
+            low, high = base * 0.08, base * 0.10
+        else:
+            if abs(items_sum - total) > 0.5 or (
+                subtotal is not None and abs(subtotal - total) > 0.5
+            ):
+                return ["items_mismatch"]
+            low, high = total * 8 / 108, total * 10 / 110
+
+        # 稅額需落在8%~10%之間（容許四捨五入）
+        if tax is not None and not (low - 1 <= tax <= high + 1):
+            return ["tax_out_of_range"]
+        return []
+
+    def extract(self, ocr_data: Dict) -> Optional[ReceiptData]:
+        """
+        ReceiptData for a known layout that passes the checks, otherwise None
+        已知版面且通過檢查時返回ReceiptData，否則返回None
+        """
+        if not self.enabled or not ocr_data.get("success", True):
+            return None
+
+        template = self.match_template(ocr_data)
+        with self._lock:
+            self.stats["attempted"] += 1
+            if template:
+                self.stats["matched"] += 1
+        if template is None:
+            return None
+
+        parsed = self._parse(template, self._rows(ocr_data))
+        issues = self.check(parsed)
+        with self._lock:
+            for issue in issues:
+                self._rejections[issue] = self._rejections.get(issue, 0) + 1
+            if not issues:
+                self.stats["accepted"] += 1
+                self._by_chain[template["chain"]] = (
+                    self._by_chain.get(template["chain"], 0) + 1
+                )
+        if issues:
+            logger.debug(f"版面規則未通過檢查（{template['chain']}）: {issues}")
+            return None
+
+        logger.info(f"版面規則結構化完成: {template['chain']}，略過AI處理")
+        return ReceiptData(
+            store_name=self.store_name(template, ocr_data),
+            date=parsed["date"],
+            total_amount=parsed["total_amount"],
+            subtotal=parsed["subtotal"],
+            tax_amount=parsed["tax_amount"],
+            tax_type=parsed["tax_type"],
+            items=[
+                ReceiptItem(
+                    name=item["name"],
+                    name_japanese=item["name"],
+                    price=item["price"],
+                    quantity=item["quantity"],
+                    tax_included=parsed["tax_type"] == "內含稅",
+                )
+                for item in parsed["items"]
+            ],
+            receipt_number=parsed["receipt_number"],
+            payment_method=parsed["payment_method"],
+            confidence_score=ocr_data.get("confidence", 0.0),
+            processing_time=0.0,
+            source_image="",
+        )
+
+    def get_stats(self) -> Dict:
+        """獲取版面規則統計"""
+        with self._lock:
+            attempted = self.stats["attempted"]
+            return {
+                "enabled": self.enabled,
+                **self.stats,
+                "by_chain": dict(self._by_chain),
+                "rejections": dict(self._rejections),
+                "skip_ratio": (
+                    round(self.stats["accepted"] / attempted, 3) if attempted else 0.0
+                ),
+            }
+
+
+# 全局實例
+layout_extractor = LayoutExtractor()
@@ -0,0 +1,267 @@
+"""
+離線批量AI服務 - 以Anthropic Message Batches API非同步處理大量收據
+Offline bulk AI service - structures many receipts through the Anthropic Message Batches API
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+from loguru import logger
+from app.config import settings
+from app.models.receipt import ReceiptData
+from app.services.ai_service import (
+    ai_service,
+    AIService,
+    MAX_OUTPUT_TOKENS_PER_RECEIPT,
+    RECEIPT_TOOL,
+    RECEIPT_TOOLS,
+)
+
+# 單一批次的請求數上限（API上限為100,000筆或256MB）
+MAX_REQUESTS_PER_BATCH = 10000
+
+
+class MessageBatchPendingError(Exception):
+    """
+    A submitted batch could not be polled or its results fetched
+    已提交的批次無法輪詢或取得結果（批次ID已保存，重新執行工作時繼續輪詢）
+    """
+
+    def __init__(self, batch_id: str, error: Exception):
+        super().__init__(
+            f"訊息批次 {batch_id} 尚未取得結果，重新執行工作時將繼續輪詢: {str(error)}"
+        )
+        self.batch_id = batch_id
+
+
+class MessageBatchBackend:
+    """
+    Bulk receipt structuring via the asynchronous Message Batches endpoint
+    透過非同步Message Batches端點批量結構化收據
+
+    Intended for OCR-only runs followed by one AI pass: every receipt becomes
+    one request in a batch, the batch is polled until it ends, and the JSONL
+    results are parsed with the same code as the synchronous path. Batches are
+    billed at a discount and do not count against the per-minute request limit.
+    適用於先執行OCR、再一次完成AI處理的流程：每張收據為批次中的一個請求，輪詢至批次結束後，
+    以與同步流程相同的邏輯解析JSONL結果。批次計費較低，且不佔用每分鐘請求配額。
+    """
+
+    def __init__(
+        self,
+        ai: Optional[AIService] = None,
+        base_url: Optional[str] = None,
+        poll_interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.ai = ai or ai_service
+        self.base_url = (base_url or settings.claude_api_base_url).rstrip("/")
+        self.poll_interval = (
+            settings.claude_message_batch_poll_interval
+            if poll_interval is None
+            else poll_interval
+        )
+        self.timeout = (
+            settings.claude_message_batch_timeout if timeout is None else timeout
+        )
+
+    @property
+    def batches_url(self) -> str:
+        return f"{self.base_url}/v1/messages/batches"
+
+    def build_requests(self, entries: List[Dict]) -> List[Dict]:
+        """
+        One batch request per receipt, using the single-receipt prompt
+        每張收據一個批次請求（使用單張收據的提示詞）
+        """
+        return [
+            {
+                "custom_id": f"receipt-{index}",
+                "params": {
+                    "model": self.ai.model,
+                    "max_tokens": MAX_OUTPUT_TOKENS_PER_RECEIPT,
+                    "system": self.ai.receipt_system(),
+                    "tools": RECEIPT_TOOLS,
+                    "tool_choice": {"type": "tool", "name": RECEIPT_TOOL["name"]},
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": self.ai._build_receipt_prompt(
+                                entry["ocr_data"], entry["structured_data"]
+                            ),
+                        }
+                    ],
+                },
+            }
+            for index, entry in enumerate(entries)
+        ]
+
+    async def submit(self, requests: List[Dict]) -> Dict:
+        """建立訊息批次，返回批次物件"""
+        response = await self.ai.send_request(
+            "POST", self.batches_url, body={"requests": requests}
+        )
+        batch = response.json()
+        logger.info(f"已建立訊息批次: {batch['id']}（{len(requests)} 個請求）")
+        return batch
+
+    async def wait(self, batch_id: str) -> Dict:
+        """
+        Poll a batch until its processing_status is "ended"
+        輪詢批次直到 processing_status 為 "ended"
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            response = await self.ai.send_request(
+                "GET", f"{self.batches_url}/{batch_id}", rate_limited=True
+            )
+            batch = response.json()
+            if batch.get("processing_status") == "ended":
+                logger.info(
+                    f"訊息批次已完成: {batch_id}, 統計: {batch.get('request_counts')}"
+                )
+                return batch
+            if time.monotonic() >= deadline:
+                raise Exception(f"訊息批次逾時: {batch_id}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def fetch_results(self, batch: Dict) -> Dict[str, Dict]:
+        """
+        Download the JSONL results of an ended batch
+        下載已結束批次的JSONL結果
+
+        Returns:
+            {custom_id: result}
+        """
+        results_url = (
+            batch.get("results_url") or f"{self.batches_url}/{batch['id']}/results"
+        )
+        response = await self.ai.send_request("GET", results_url)
+
+        results = {}
+        for line in response.text.splitlines():
+            if line.strip():
+                item = json.loads(line)
+                results[item["custom_id"]] = item["result"]
+        return results
+
+    def _result_to_receipt(self, result: Optional[Dict], entry: Dict) -> ReceiptData:
+        """將單一批次結果轉換為ReceiptData（失敗時拋出例外）"""
+        if result is None:
+            raise Exception("訊息批次結果中缺少此收據")
+        if result.get("type") != "succeeded":
+            error = result.get("error", {})
+            message = (
+                error.get("error", error).get("message", "")
+                if isinstance(error, dict)
+                else ""
+            )
+            raise Exception(
+                f"訊息批次請求未成功: {result.get('type')} {message}".strip()
+            )
+
+        self.ai.record_usage(result["message"].get("usage"))
+        tool_input = self.ai.tool_input(result["message"], RECEIPT_TOOL["name"])
+        return self.ai._receipt_from_tool_input(tool_input, entry["ocr_data"])
+
+    async def process_receipts(
+        self,
+        entries: List[Dict],
+        batch_ids: Optional[List[Optional[str]]] = None,
+        on_submit: Optional[Callable[[List[Optional[str]]], Any]] = None,
+    ) -> List[Union[ReceiptData, Exception]]:
+        """
+        Structure receipts with Message Batches and wait for the results
+        以Message Batches結構化收據並等待結果
+
+        Args:
+            entries: Receipts, each with "ocr_data" and "structured_data"
+                     收據列表，每項含 "ocr_data" 與 "structured_data"
+            batch_ids: Batch ids already submitted for these entries, one per chunk;
+                       those chunks are polled instead of submitted again
+                       先前已為相同收據提交的批次ID（每段一個），這些段落只輪詢不重新提交
+            on_submit: Called with the batch ids after each submission, so the
+                       caller can persist them / 每次提交後以批次ID呼叫，供呼叫端保存
+
+        Returns:
+            ReceiptData or the exception, aligned with entries
+            與輸入對齊的ReceiptData或例外
+
+        Raises:
+            MessageBatchPendingError: A submitted batch could not be polled; pass
+                the saved batch ids again to resume / 已提交的批次無法輪詢，以保存的批次ID重新執行即可恢復
+        """
+        if self.ai.test_mode:
+            return [
+                self.ai._get_mock_receipt_data(
+                    entry["ocr_data"], entry["structured_data"]
+                )
+                for entry in entries
+            ]
+
+        # 已知連鎖店版面以規則結構化，其餘才提交批次
+        results: List[Optional[Union[ReceiptData, Exception]]] = [
+            self.ai.layout_extractor.extract(entry["ocr_data"]) for entry in entries
+        ]
+        pending = [index for index, result in enumerate(results) if result is None]
+        if pending:
+            batched = await self._process_batches(
+                [entries[index] for index in pending], batch_ids, on_submit
+            )
+            for index, result in zip(pending, batched):
+                results[index] = result
+        return results
+
+    async def _process_batches(
+        self,
+        entries: List[Dict],
+        batch_ids: Optional[List[Optional[str]]] = None,
+        on_submit: Optional[Callable[[List[Optional[str]]], Any]] = None,
+    ) -> List[Union[ReceiptData, Exception]]:
+        """以每批最多MAX_REQUESTS_PER_BATCH個請求提交並收集結果（已有批次ID的段落只輪詢）"""
+        requests = self.build_requests(entries)
+        starts = range(0, len(requests), MAX_REQUESTS_PER_BATCH)
+        batch_ids = list(batch_ids or [])[: len(starts)]
+        batch_ids += [None] * (len(starts) - len(batch_ids))
+
+        results: List[Union[ReceiptData, Exception]] = []
+        for chunk_index, start in enumerate(starts):
+            chunk = requests[start : start + MAX_REQUESTS_PER_BATCH]
+            try:
+                if batch_ids[chunk_index]:
+                    logger.info(f"恢復輪詢訊息批次: {batch_ids[chunk_index]}")
+                else:
+                    batch_ids[chunk_index] = (await self.submit(chunk))["id"]
+                    if on_submit is not None:
+                        on_submit(list(batch_ids))
+            except Exception as e:
+                logger.error(f"訊息批次提交失敗: {str(e)}")
+                results.extend(e for _ in chunk)
+                continue
+
+            try:
+                batch = await self.wait(batch_ids[chunk_index])
+                batch_results = await self.fetch_results(batch)
+            except Exception as e:
+                # 批次已提交且ID已保存：不把收據標記為失敗，重新執行時繼續輪詢同一個批次
+                logger.error(
+                    f"訊息批次輪詢失敗: {batch_ids[chunk_index]}, 錯誤: {str(e)}"
+                )
+                raise MessageBatchPendingError(batch_ids[chunk_index], e) from e
+
+            for offset, request in enumerate(chunk):
+                try:
+                    results.append(
+                        self._result_to_receipt(
+                            batch_results.get(request["custom_id"]),
+                            entries[start + offset],
+                        )
+                    )
+                except Exception as e:
+                    results.append(e)
+        return results
+
+
+# 全局實例
+message_batch_backend = MessageBatchBackend()
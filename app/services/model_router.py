@@ -0,0 +1,110 @@
+"""
+模型路由服務 - 簡單收據先用小模型，檢查未通過時才升級到大模型
+Model router service - simple receipts go to a small model first, escalating only when checks fail
+"""
+
+import threading
+from typing import Dict, List, Optional
+from app.config import settings
+from app.models.receipt import ReceiptData
+
+# 路由決策
+ROUTE_FAST = "fast"
+ROUTE_MAIN = "main"
+ROUTE_ESCALATED = "escalated"
+
+
+class ModelRouter:
+    """
+    Tiered extraction router
+    分層結構化路由
+
+    A receipt is "simple" when its OCR text is short and its OCR confidence is
+    high; simple receipts are sent to the fast model. The fast model's answer
+    is accepted only if the items add up to subtotal/total (within a yen
+    tolerance); otherwise the receipt is re-extracted with the main model.
+    OCR文字行數少且OCR信心度高的收據視為簡單收據，交由小模型處理；
+    只有商品金額與小計/總金額相符（在容許誤差內）時才採用小模型的結果，否則以大模型重新結構化。
+    """
+
+    def __init__(
+        self,
+        main_model: Optional[str] = None,
+        fast_model: Optional[str] = None,
+        enabled: Optional[bool] = None,
+    ):
+        self.main_model = main_model or settings.claude_model
+        self.fast_model = fast_model or settings.claude_fast_model
+        self.enabled = (
+            settings.claude_routing_enabled if enabled is None else enabled
+        ) and self.fast_model != self.main_model
+        self.max_lines = settings.claude_routing_max_lines
+        self.min_confidence = settings.claude_routing_min_confidence
+        self.amount_tolerance = settings.claude_routing_amount_tolerance
+
+        self._lock = threading.Lock()
+        self._decisions = {ROUTE_FAST: 0, ROUTE_MAIN: 0, ROUTE_ESCALATED: 0}
+        self._reasons: Dict[str, int] = {}
+
+    def route_reasons(self, ocr_data: Dict) -> List[str]:
+        """
+        Reasons to skip the fast model (empty list = simple receipt)
+        不適合小模型的原因（空列表表示簡單收據）
+        """
+        reasons = []
+        lines = [line for line in ocr_data.get("text", "").splitlines() if line.strip()]
+        if len(lines) > self.max_lines:
+            reasons.append("too_many_lines")
+        if ocr_data.get("confidence", 0.0) < self.min_confidence:
+            reasons.append("low_ocr_confidence")
+        return reasons
+
+    def check_receipt(self, receipt_data: ReceiptData) -> List[str]:
+        """
+        Arithmetic consistency of a fast-model answer (empty list = accepted)
+        檢查小模型結果的金額一致性（空列表表示通過）
+        """
+        if receipt_data.total_amount <= 0:
+            return ["missing_total"]
+        if not receipt_data.items:
+            return ["no_items"]
+
+        # 商品價格可能是單價或該行小計，兩種加總都接受
+        line_sum = sum(item.price for item in receipt_data.items)
+        unit_sum = sum(item.price * (item.quantity or 1) for item in receipt_data.items)
+
+        targets = [receipt_data.total_amount]
+        if receipt_data.subtotal:
+            targets.append(receipt_data.subtotal)
+        if receipt_data.tax_amount:
+            targets.append(receipt_data.total_amount - receipt_data.tax_amount)
+
+        if any(
+            abs(items_sum - target) <= self.amount_tolerance
+            for items_sum in (line_sum, unit_sum)
+            for target in targets
+        ):
+            return []
+        return ["items_total_mismatch"]
+
+    def record(self, decision: str, reasons: Optional[List[str]] = None):
+        """記錄一次路由決策與原因"""
+        with self._lock:
+            self._decisions[decision] += 1
+            for reason in reasons or []:
+                self._reasons[reason] = self._reasons.get(reason, 0) + 1
+
+    def get_stats(self) -> Dict:
+        """獲取路由統計"""
+        with self._lock:
+            total = sum(self._decisions.values())
+            return {
+                "enabled": self.enabled,
+                "main_model": self.main_model,
+                "fast_model": self.fast_model,
+                "decisions": dict(self._decisions),
+                "reasons": dict(self._reasons),
+                "fast_ratio": (
+                    round(self._decisions[ROUTE_FAST] / total, 3) if total else 0.0
+                ),
+            }
@@ -0,0 +1,105 @@
+"""
+多張收據處理服務 - 一張照片中的多張收據只需一次OCR調用
+Multi-receipt service - one OCR call serves every receipt in a photo
+"""
+
+import os
+import time
+from typing import Dict
+from loguru import logger
+from app.config import settings
+from app.services.ai_service import ai_service
+from app.services.cache_service import cache_service
+from app.services.content_hash import content_hasher, PREPROCESS_MULTI
+from app.services.image_worker_pool import image_worker_pool
+from app.services.ocr_service import ocr_service
+from app.utils.image_utils import ImageUtils
+
+
+class MultiReceiptProcessor:
+    """
+    Processes photos of several receipts laid out side by side
+    處理多張收據並排拍攝的照片
+
+    The photo is segmented into receipt regions, OCR'd once as a whole, and the
+    OCR lines are split by region into separate ReceiptData records, so the
+    Azure transaction count is divided by the number of receipts per photo.
+    照片先分割出各收據區域，整張只做一次OCR，再依區域拆分文字行並分別產生ReceiptData，
+    Azure調用次數因此除以每張照片的收據數。
+    """
+
+    async def process_image(self, filename: str) -> Dict:
+        """
+        Process one photo that may contain several receipts
+        處理可能含多張收據的單張照片
+
+        Args:
+            filename: Uploaded image filename / 上傳的圖片檔案名稱
+
+        Returns:
+            {"receipts": [ReceiptData], "regions": 偵測到的區域數, "ocr_calls": OCR調用次數}
+        """
+        file_path = os.path.join(settings.upload_dir, filename)
+        await image_worker_pool.image_digest(file_path)
+
+        # 整張照片的OCR結果（含區域）以內容雜湊暫存
+        ocr_cache_key = content_hasher.ocr_key(file_path, PREPROCESS_MULTI)
+        cache_data = cache_service.load_ocr_result(ocr_cache_key)
+        ocr_calls = 0
+        if cache_data and "regions" in cache_data.get("ocr_data", {}):
+            logger.info(f"使用OCR暫存資料: {filename}")
+            ocr_result = cache_data["ocr_data"]
+        else:
+            prepared = await image_worker_pool.run(
+                "segment",
+                ImageUtils.prepare_multi_receipt,
+                file_path,
+                settings.max_receipts_per_image,
+            )
+            ocr_result = await ocr_service.extract_text(
+                file_path, image_data=prepared["image_data"]
+            )
+            ocr_calls = 1
+            if not ocr_result.get("success"):
+                raise Exception(f"OCR處理失敗: {ocr_result.get('error', '未知錯誤')}")
+            # 複製後再加上區域，不修改OCR服務返回的結果
+            ocr_result = {**ocr_result, "regions": prepared["regions"]}
+            cache_service.save_ocr_result(filename, ocr_result, cache_key=ocr_cache_key)
+
+        parts = ocr_service.split_by_regions(ocr_result, ocr_result["regions"])
+        logger.info(
+            f"偵測到 {len(ocr_result['regions'])} 個收據區域，拆分為 {len(parts)} 張收據: {filename}"
+        )
+
+        receipts = []
+        for part in parts:
+            region = part.get("region", 0)
+            ai_cache_key = content_hasher.ai_key(
+                file_path, f"{PREPROCESS_MULTI}#{region}"
+            )
+
+            receipt_data = cache_service.load_receipt_data(ai_cache_key)
+            if receipt_data is None:
+                start_time = time.time()
+                receipt_data = await ai_service.process_receipt_text(
+                    part, ocr_service.extract_structured_data(part)
+                )
+                receipt_data.processing_time = time.time() - start_time
+                cache_service.save_ai_result(
+                    filename, receipt_data, part, cache_key=ai_cache_key
+                )
+
+            receipt_data.source_image = (
+                f"{filename}#{region + 1}" if len(parts) > 1 else filename
+            )
+            receipts.append(receipt_data)
+
+        return {
+            "receipts": receipts,
+            "regions": len(ocr_result["regions"]),
+            "ocr_calls": ocr_calls,
+        }
+
+
+# 全局實例
+multi_receipt_processor = MultiReceiptProcessor()
@@ -1,12 +1,37 @@
 import os
+import re
 import time
-import requests
 import json
 from typing import Dict, List, Optional, Tuple
+import httpx
 from loguru import logger
 from app.config import settings
 import asyncio
 from app.services.azure_usage_tracker import azure_usage_tracker
+from app.services.http_client import PooledAsyncClient
+from app.services.polling_strategy import (
+    polling_strategy,
+    polling_metrics,
+    parse_retry_after,
+)
+from app.services.rate_limiter import rate_limiter
+from app.utils.image_utils import ImageUtils
+
+# 全形數字與符號轉為半形（￥統一為¥）
+FULLWIDTH_TABLE = str.maketrans("０１２３４５６７８９￥，．：／－", "0123456789¥,.:/-")
+
+# 單次掃描的實體樣式：日期、時間與日圓金額（依文字順序逐一取出）
+ENTITY_PATTERN = re.compile(
+    r"(?P<date_jp>(?P<jp_y>\d{4})年(?P<jp_m>\d{1,2})月(?P<jp_d>\d{1,2})日)"
+    r"|(?P<date_ymd>(?P<ymd_y>\d{4})[-/](?P<ymd_m>\d{1,2})[-/](?P<ymd_d>\d{1,2}))"
+    r"|(?P<date_mdy>(?P<mdy_m>\d{1,2})/(?P<mdy_d>\d{1,2})/(?P<mdy_y>\d{4}))"
+    r"|(?P<time>(?P<hour>\d{1,2})(?::|時)(?P<minute>\d{2}))"
+    r"|¥\s*(?P<yen_prefix>\d{1,3}(?:,\d{3})+|\d+)"
+    r"|(?P<yen_suffix>\d{1,3}(?:,\d{3})+|\d+)円"
+)
+
+# 商店名稱關鍵字（只檢查前3行）
+STORE_KEYWORDS = re.compile("セブン|イレブン|ファミマ|ローソン|コンビニ|スーパー")
 
 
 class OCRService:
@@ -21,6 +46,7 @@ class OCRService:
         endpoint = settings.azure_vision_endpoint.strip()
         self.endpoint = endpoint.rstrip("/")
         self.key = settings.azure_vision_key
+        self.read_api_version = "v3.2"
         self.headers = {
             "Ocp-Apim-Subscription-Key": self.key,
             "Content-Type": "application/octet-stream",
@@ -34,16 +60,32 @@ class OCRService:
             or not self.key
         )
 
+        # Shared pooled async HTTP client / 共用的非同步連線池HTTP客戶端
+        self.http = PooledAsyncClient("azure-read")
+
         if self.test_mode:
-            logger.warning("🔧 OCR service running in test mode - using mock data / OCR服務運行在測試模式 - 使用模擬數據")
+            logger.warning(
+                "🔧 OCR service running in test mode - using mock data / OCR服務運行在測試模式 - 使用模擬數據"
+            )
 
-    async def extract_text(self, image_path: str) -> Dict:
+    async def aclose(self):
+        """
+        Close the pooled HTTP client
+        關閉連線池HTTP客戶端
+        """
+        await self.http.aclose()
+
+    async def extract_text(
+        self, image_path: str, image_data: Optional[bytes] = None
+    ) -> Dict:
         """
         Extract text from image
         從圖片中提取文字
 
         Args:
             image_path: Image file path / 圖片檔案路徑
+            image_data: Preprocessed image bytes to upload instead of reading the file
+                        已預處理的圖片位元組（提供時不再讀取檔案）
 
         Returns:
             Dictionary containing text and position information
@@ -53,11 +95,15 @@ class OCRService:
             return self._get_mock_ocr_result(image_path)
 
         try:
+            # 取得Azure調用配額（全程序共用的token bucket）
+            await rate_limiter.acquire("azure")
+
             start_time = time.time()
 
-            # 讀取圖片檔案
-            with open(image_path, "rb") as image_file:
-                image_data = image_file.read()
+            # 讀取圖片檔案（已提供預處理位元組時直接上傳）
+            if image_data is None:
+                with open(image_path, "rb") as image_file:
+                    image_data = image_file.read()
 
             # 檢查圖片大小限制
             image_size = len(image_data)
@@ -66,56 +112,91 @@ class OCRService:
 
             # 發送OCR請求
             logger.info(f"發送OCR請求到Azure: {image_path}")
-            response = requests.post(
-                f"{self.endpoint}/vision/v3.2/read/analyze",
+            client = await self.http.get_client()
+            response = await client.post(
+                f"{self.endpoint}/vision/{self.read_api_version}/read/analyze",
                 headers=self.headers,
-                data=image_data,
+                content=image_data,
             )
 
             if response.status_code == 202:
                 # 獲取操作位置
                 operation_location = response.headers["Operation-Location"]
 
-                # 等待處理完成
+                # 等待處理完成（短暫首次探測，之後依Retry-After或指數退避）
                 logger.info("等待OCR處理完成...")
+                session = polling_strategy.start()
+                retry_after = response.headers.get("Retry-After")
+                image_name = os.path.basename(image_path)
                 while True:
-                    await asyncio.sleep(1)
-                    result_response = requests.get(
+                    try:
+                        await session.wait(retry_after)
+                    except Exception:
+                        polling_metrics.record(
+                            image_name,
+                            session.poll_count,
+                            session.elapsed,
+                            timed_out=True,
+                        )
+                        raise
+
+                    result_response = await client.get(
                         operation_location, headers=self.headers
                     )
+                    retry_after = result_response.headers.get("Retry-After")
 
                     if result_response.status_code == 200:
                         result = result_response.json()
                         if result["status"] == "succeeded":
                             processing_time = time.time() - start_time
-                            logger.info("OCR處理完成")
+                            logger.info(f"OCR處理完成（輪詢 {session.poll_count} 次）")
+                            polling_metrics.record(
+                                image_name, session.poll_count, session.elapsed
+                            )
 
                             # 記錄API使用量
                             azure_usage_tracker.record_api_call(
                                 image_size=image_size,
                                 processing_time=processing_time,
                                 success=True,
+                                poll_count=session.poll_count,
                             )
 
                             return self._parse_ocr_result(result, processing_time)
                         elif result["status"] == "failed":
                             processing_time = time.time() - start_time
+                            polling_metrics.record(
+                                image_name, session.poll_count, session.elapsed
+                            )
 
                             # 記錄失敗的API調用
                             azure_usage_tracker.record_api_call(
                                 image_size=image_size,
                                 processing_time=processing_time,
                                 success=False,
+                                poll_count=session.poll_count,
                             )
 
                             raise Exception(
                                 f"OCR處理失敗: {result.get('error', {}).get('message', '未知錯誤')}"
                             )
+                    elif result_response.status_code == 429:
+                        # 輪詢被限流：依Retry-After等待後繼續輪詢
+                        logger.warning(
+                            f"OCR結果輪詢被限流 (429)，Retry-After: {retry_after or '未提供'}"
+                        )
                     else:
                         raise Exception(
                             f"獲取OCR結果失敗: {result_response.status_code}"
                         )
             else:
+                if response.status_code == 429:
+                    # 暫停所有Azure調用，避免其他工作者繼續觸發429
+                    rate_limiter.pause(
+                        "azure",
+                        parse_retry_after(response.headers.get("Retry-After"))
+                        or rate_limiter.seconds_per_request("azure"),
+                    )
                 raise Exception(
                     f"OCR請求失敗: {response.status_code} - {response.text}"
                 )
@@ -131,14 +212,21 @@ class OCRService:
                 # 拋出特殊的429錯誤，讓調用方知道需要等待
                 raise Exception(f"RATE_LIMIT_EXCEEDED: {error_msg}")
             # 處理 DNS 解析錯誤（無法連接）
-            elif "NameResolutionError" in error_msg or "Failed to resolve" in error_msg or "nodename nor servname" in error_msg:
+            elif (
+                isinstance(e, httpx.ConnectError)
+                or "NameResolutionError" in error_msg
+                or "Failed to resolve" in error_msg
+                or "nodename nor servname" in error_msg
+            ):
                 logger.error(f"無法連接到 Azure 端點: {self.endpoint}")
                 logger.error(f"DNS 解析失敗，請檢查：")
                 logger.error(f"  1. 端點 URL 是否正確: {self.endpoint}")
                 logger.error(f"  2. 網路連接是否正常")
                 logger.error(f"  3. Azure 資源是否已刪除或暫停")
                 logger.error(f"  4. API 金鑰是否有效")
-                raise Exception(f"CONNECTION_ERROR: 無法連接到 Azure 端點 '{self.endpoint}'。請檢查端點 URL、網路連接和 Azure 資源狀態。")
+                raise Exception(
+                    f"CONNECTION_ERROR: 無法連接到 Azure 端點 '{self.endpoint}'。請檢查端點 URL、網路連接和 Azure 資源狀態。"
+                )
             else:
                 logger.error(f"OCR處理錯誤: {error_msg}")
                 raise
@@ -232,25 +320,35 @@ class OCRService:
             # 提取所有文字
             all_text = []
             all_words = []
+            all_lines = []
 
             for page in read_results:
                 for line in page.get("lines", []):
                     line_text = line.get("text", "")
                     all_text.append(line_text)
 
-                    for word in line.get("words", []):
-                        all_words.append(
-                            {
-                                "text": word.get("text", ""),
-                                "confidence": word.get("confidence", 0.0),
-                                "boundingBox": word.get("boundingBox", []),
-                            }
-                        )
+                    line_words = [
+                        {
+                            "text": word.get("text", ""),
+                            "confidence": word.get("confidence", 0.0),
+                            "boundingBox": word.get("boundingBox", []),
+                        }
+                        for word in line.get("words", [])
+                    ]
+                    all_words.extend(line_words)
+                    all_lines.append(
+                        {
+                            "text": line_text,
+                            "boundingBox": line.get("boundingBox", []),
+                            "words": line_words,
+                        }
+                    )
 
             return {
                 "success": True,
                 "text": "\n".join(all_text),
                 "words": all_words,
+                "lines": all_lines,
                 "processing_time": processing_time,
                 "confidence": (
                     sum(w.get("confidence", 0) for w in all_words) / len(all_words)
@@ -270,10 +368,70 @@ class OCRService:
                 "confidence": 0.0,
             }
 
+    def split_by_regions(
+        self, ocr_result: Dict, regions: List[List[List[float]]]
+    ) -> List[Dict]:
+        """
+        Split one OCR result into one result per receipt region
+        將一次OCR的結果依收據區域拆分為多份結果
+
+        Each line goes to the region containing its bounding-box center (or the
+        nearest region when it falls between receipts); regions without any
+        text are dropped.
+        每一行依其 boundingBox 中心分配到所在（或最接近）的區域；沒有文字的區域會被略過。
+
+        Args:
+            ocr_result: Parsed OCR result with "lines" / 含 "lines" 的OCR結果
+            regions: Region corner lists in image pixels / 各區域角點（圖片像素座標）
+
+        Returns:
+            OCR results in region order, each with "region" and "boundingRegion"
+            依區域順序的OCR結果，各自包含 "region" 與 "boundingRegion"
+        """
+        if not ocr_result.get("success") or not regions:
+            return [ocr_result]
+
+        grouped: List[List[Dict]] = [[] for _ in regions]
+        for line in ocr_result.get("lines", []):
+            box = line.get("boundingBox") or []
+            if len(box) < 4:
+                continue
+            center_x = sum(box[0::2]) / len(box[0::2])
+            center_y = sum(box[1::2]) / len(box[1::2])
+            grouped[ImageUtils.region_for_point(center_x, center_y, regions)].append(
+                line
+            )
+
+        parts = []
+        for index, lines in enumerate(grouped):
+            if not lines:
+                continue
+            words = [word for line in lines for word in line.get("words", [])]
+            parts.append(
+                {
+                    "success": True,
+                    "text": "\n".join(line.get("text", "") for line in lines),
+                    "words": words,
+                    "lines": lines,
+                    "processing_time": ocr_result.get("processing_time", 0.0),
+                    "confidence": (
+                        sum(w.get("confidence", 0) for w in words) / len(words)
+                        if words
+                        else 0.0
+                    ),
+                    "region": index,
+                    "boundingRegion": regions[index],
+                }
+            )
+        return parts
+
     def extract_structured_data(self, ocr_result: Dict) -> Dict:
         """
         從OCR結果中提取結構化資料
 
+        全形數字與￥先轉為半形，再以預先編譯的ENTITY_PATTERN單次掃描全文，
+        依出現順序取出日期（統一為YYYY-MM-DD）、時間（HH:MM）與日圓金額（¥前綴或円後綴，含千分位）。
+
         Args:
             ocr_result: OCR處理結果
 
@@ -283,59 +441,30 @@ class OCRService:
         if not ocr_result.get("success"):
             return {}
 
-        text = ocr_result.get("text", "")
-        words = ocr_result.get("words", [])
-
-        # 提取數字（金額）
-        import re
+        text = ocr_result.get("text", "").translate(FULLWIDTH_TABLE)
 
         numbers = []
-        for word in words:
-            word_text = word.get("text", "")
-            # 匹配日圓金額格式
-            yen_matches = re.findall(r"(\d+)円", word_text)
-            numbers.extend([int(match) for match in yen_matches])
-
-        # 提取日期
         dates = []
-        date_patterns = [
-            r"(\d{4})年(\d{1,2})月(\d{1,2})日",
-            r"(\d{1,2})/(\d{1,2})/(\d{4})",
-            r"(\d{4})-(\d{1,2})-(\d{1,2})",
-        ]
-
-        for pattern in date_patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                if len(match) == 3:
-                    dates.append(f"{match[0]}-{match[1].zfill(2)}-{match[2].zfill(2)}")
-
-        # 提取時間
         times = []
-        time_patterns = [r"(\d{1,2}):(\d{2})", r"(\d{1,2})時(\d{2})分"]
-
-        for pattern in time_patterns:
-            matches = re.findall(pattern, text)
-            for match in matches:
-                if len(match) == 2:
-                    times.append(f"{match[0].zfill(2)}:{match[1]}")
+        # 單次掃描：lastgroup 為該次匹配的最外層群組名稱
+        for match in ENTITY_PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind in ("yen_prefix", "yen_suffix"):
+                numbers.append(int(match.group(kind).replace(",", "")))
+            elif kind == "time":
+                times.append(f"{match.group('hour').zfill(2)}:{match.group('minute')}")
+            else:
+                name = kind[len("date_") :]
+                dates.append(
+                    f"{match.group(name + '_y')}-"
+                    f"{match.group(name + '_m').zfill(2)}-"
+                    f"{match.group(name + '_d').zfill(2)}"
+                )
 
-        # 提取商店名稱（通常是第一行或包含特定關鍵字的行）
-        store_names = []
-        lines = text.split("\n")
-        for line in lines[:3]:  # 檢查前3行
-            if any(
-                keyword in line
-                for keyword in [
-                    "セブン",
-                    "イレブン",
-                    "ファミマ",
-                    "ローソン",
-                    "コンビニ",
-                    "スーパー",
-                ]
-            ):
-                store_names.append(line.strip())
+        # 提取商店名稱（通常是前幾行中包含特定關鍵字的行）
+        store_names = [
+            line.strip() for line in text.split("\n")[:3] if STORE_KEYWORDS.search(line)
+        ]
 
         return {
             "numbers": numbers,
@@ -343,7 +472,7 @@ class OCRService:
             "times": times,
             "store_names": store_names,
             "total_amount": max(numbers) if numbers else 0,
-            "items_count": len([w for w in words if "円" in w.get("text", "")]),
+            "items_count": len(numbers),
         }
 
     def _extract_numbers(self, words: List[Dict]) -> List[float]:
@@ -352,7 +481,12 @@ class OCRService:
         for word in words:
             text = word["text"]
             # 移除日圓符號和逗號，提取數字
-            cleaned_text = text.replace("¥", "").replace(",", "").replace("円", "")
+            cleaned_text = (
+                text.translate(FULLWIDTH_TABLE)
+                .replace("¥", "")
+                .replace(",", "")
+                .replace("円", "")
+            )
             try:
                 if cleaned_text.replace(".", "").isdigit():
                     numbers.append(float(cleaned_text))
@@ -361,24 +495,13 @@ class OCRService:
         return numbers
 
     def _extract_dates(self, text: str) -> List[str]:
-        """提取日期"""
-        import re
-
-        # 日文日期格式：2024年1月1日、2024/1/1、2024-01-01等
-        date_patterns = [
-            r"\d{4}年\d{1,2}月\d{1,2}日",
-            r"\d{4}/\d{1,2}/\d{1,2}",
-            r"\d{4}-\d{1,2}-\d{1,2}",
-            r"\d{1,2}/\d{1,2}/\d{4}",
+        """提取日期（2024年1月1日、2024/1/1、2024-01-01、1/1/2024，保留原始格式）"""
+        return [
+            match.group(0)
+            for match in ENTITY_PATTERN.finditer(text.translate(FULLWIDTH_TABLE))
+            if match.lastgroup.startswith("date_")
         ]
 
-        dates = []
-        for pattern in date_patterns:
-            matches = re.findall(pattern, text)
-            dates.extend(matches)
-
-        return dates
-
     def _extract_store_names(self, text: str) -> List[str]:
         """提取可能的商店名稱"""
         # 簡單的商店名稱提取邏輯
@@ -3,43 +3,43 @@
 """
 
 import asyncio
+import functools
 import time
 import uuid
 import os
-from typing import List, Dict, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from loguru import logger
+from app.config import settings
 from app.services.ocr_service import ocr_service
 from app.services.ai_service import ai_service
 from app.services.csv_service import csv_service
 from app.services.cache_service import cache_service
+from app.services.duplicate_detector import duplicate_detector
 from app.services.azure_usage_tracker import azure_usage_tracker
-from app.utils.image_utils import image_utils
+from app.services.rate_limiter import rate_limiter
+from app.services.pipeline_engine import PipelineEngine, PipelineStage
+from app.services.batch_progress import BatchProgress
+from app.services.image_worker_pool import image_worker_pool
+from app.services.content_hash import (
+    content_hasher,
+    PREPROCESS_ENHANCE,
+    PREPROCESS_RAW,
+    PREPROCESS_RESIZE,
+)
 
 
 class OptimizedBatchProcessor:
     """優化批次處理器 - 智能並行處理和本地預處理"""
 
     def __init__(self):
-        # API限制設定
-        self.azure_rate_limit = 20  # Azure每分鐘20次
-        self.claude_rate_limit = 50  # Claude每分鐘50次
-
-        # 並行控制 - 符合Azure F0免費層限制
+        # 並行控制 - 請求頻率由共用的rate_limiter控制
         self.max_concurrent_azure = 1  # 降低到1個並行Azure請求，避免429錯誤
         self.max_concurrent_claude = 5  # 最大並行Claude請求
-        self.batch_size = 10  # 優化的批次大小
-
-        # 延遲控制 - 確保符合Azure限制
-        self.azure_delay = 4  # 增加到4秒，確保每分鐘不超過15次請求
-        self.claude_delay = 1  # Claude請求間隔
+        self.batch_size = 10  # 優化的批次大小（用於進度顯示）
+        self.pipeline_queue_size = 10  # OCR→AI佇列上限（背壓）
 
-        # 進度追蹤
-        self.current_progress = 0
-        self.total_items = 0
-        self.current_batch = 0
-        self.total_batches = 0
-        self.start_time = None
+        # 最近一次處理的進度（每次處理使用獨立的BatchProgress）
+        self.last_progress = BatchProgress()
 
         # 快取控制
         self.use_cache = True
@@ -52,50 +52,90 @@ class OptimizedBatchProcessor:
         self.auto_delete_successful = True  # 處理成功後自動刪除圖片
         self.keep_failed_files = True  # 保留失敗的檔案以便重試
 
-    async def _preprocess_image_local(self, image_path: str) -> str:
-        """本地圖片預處理 - 減少對Azure的依賴"""
-        try:
-            # 快速圖片優化
-            optimized_path = await asyncio.get_event_loop().run_in_executor(
-                None, self._optimize_image_sync, image_path
-            )
-            return optimized_path
-        except Exception as e:
-            logger.warning(f"本地預處理失敗: {e}")
-            return image_path
+    @property
+    def azure_rate_limit(self) -> int:
+        """Azure每分鐘請求數（來自共用限流器）"""
+        return int(rate_limiter.rate_per_minute("azure"))
 
-    def _optimize_image_sync(self, image_path: str) -> str:
-        """同步圖片優化"""
+    @property
+    def claude_rate_limit(self) -> int:
+        """Claude每分鐘請求數（來自共用限流器）"""
+        return int(rate_limiter.rate_per_minute("claude"))
+
+    @property
+    def azure_delay(self) -> float:
+        """Azure穩定狀態下的請求間隔秒數，也用作重試退避的基準"""
+        return round(rate_limiter.seconds_per_request("azure"), 2)
+
+    @property
+    def claude_delay(self) -> float:
+        """Claude穩定狀態下的請求間隔秒數（重試退避由AIService處理）"""
+        return round(rate_limiter.seconds_per_request("claude"), 2)
+
+    def _image_path(self, filename: str) -> str:
+        """上傳目錄中的圖片路徑"""
+        return os.path.join(settings.upload_dir, filename)
+
+    async def _preprocess_image_local(self, image_path: str) -> Optional[bytes]:
+        """本地圖片預處理 - 在圖片工作程序池中縮小尺寸，返回OCR上傳用的位元組"""
         try:
-            # 快速調整大小和格式
-            optimized_path = image_utils.resize_image(
+            return await image_worker_pool.prepare_for_ocr(
                 image_path, max_width=1200, max_height=1600
             )
-            return optimized_path
         except Exception as e:
-            logger.warning(f"圖片優化失敗: {e}")
-            return image_path
-
-    async def _process_ocr_with_retry(self, image_path: str, retries: int = 2) -> Dict:
-        """帶重試的OCR處理"""
+            logger.warning(f"本地預處理失敗: {e}")
+            return None
+
+    @property
+    def preprocessing(self) -> str:
+        """OCR前的預處理方式（屬於暫存鍵的管線版本）"""
+        return PREPROCESS_RESIZE if self.use_local_preprocessing else PREPROCESS_RAW
+
+    async def _prepare_image(
+        self, image_path: str, preprocessing: str
+    ) -> Optional[bytes]:
+        """依預處理方式準備OCR上傳用的位元組（raw時直接上傳原始檔案）"""
+        if preprocessing == PREPROCESS_ENHANCE:
+            return await image_worker_pool.prepare_for_ocr(image_path, enhance=True)
+        if preprocessing == PREPROCESS_RESIZE:
+            return await self._preprocess_image_local(image_path)
+        return None
+
+    def _load_cached_ocr(self, cache_key: Optional[str]) -> Optional[Dict]:
+        """載入內容定址的OCR暫存"""
+        if not self.use_cache or not cache_key:
+            return None
+        cached_result = cache_service.load_ocr_result(cache_key)
+        if cached_result and cached_result.get("ocr_data"):
+            return cached_result["ocr_data"]
+        return None
+
+    async def _process_ocr_with_retry(
+        self,
+        image_path: str,
+        retries: int = 2,
+        filename: Optional[str] = None,
+        cache_key: Optional[str] = None,
+        image_data: Optional[bytes] = None,
+    ) -> Dict:
+        """帶重試的OCR處理（cache_key：原始圖片的內容定址暫存鍵；image_data：預處理後的位元組）"""
+        filename = filename or os.path.basename(image_path)
         for attempt in range(retries + 1):
             try:
                 # 檢查快取
-                if self.use_cache:
-                    # 從圖片路徑中提取檔案名稱
-                    filename = os.path.basename(image_path)
-                    cached_result = cache_service.load_ocr_result(filename)
-                    if cached_result:
-                        logger.info(f"使用快取OCR結果: {filename}")
-                        return cached_result.get("ocr_data", {})
+                cached_result = self._load_cached_ocr(cache_key)
+                if cached_result:
+                    logger.info(f"使用快取OCR結果: {filename}")
+                    return cached_result
 
                 # 執行OCR
-                result = await ocr_service.extract_text(image_path)
+                result = await ocr_service.extract_text(
+                    image_path, image_data=image_data
+                )
 
                 # 保存到快取
-                if self.use_cache and result.get("success"):
-                    filename = os.path.basename(image_path)
-                    cache_service.save_ocr_result(filename, result)
+                if self.use_cache and cache_key and result.get("success"):
+                    cache_service.save_ocr_result(filename, result, cache_key=cache_key)
 
                 return result
 
@@ -125,84 +165,53 @@ class OptimizedBatchProcessor:
                         logger.error(f"OCR處理失敗: {error_msg}")
                         return {"success": False, "error": error_msg}
 
-    async def _process_ai_with_retry(self, ocr_result: Dict, filename: str, retries: int = 2) -> Dict:
-        """帶重試的AI處理（檢查暫存）"""
+    async def _process_ai_with_retry(
+        self,
+        ocr_result: Dict,
+        filename: str,
+        cache_key: Optional[str] = None,
+        progress: Optional[BatchProgress] = None,
+    ) -> Dict:
+        """
+        AI處理（檢查暫存，cache_key：內容定址暫存鍵）
+
+        限流、過載與連線錯誤的重試由AIService的重試策略與斷路器處理；
+        提供progress時，串流中已解析的商品數會即時反映在進度中。
+        """
+        cache_key = cache_key or filename
         # 檢查是否有AI暫存
-        ai_cache_data = cache_service.load_ai_result(filename)
-        if ai_cache_data and ai_cache_data.get("receipt_data"):
+        cached_receipt = cache_service.load_receipt_data(cache_key)
+        if cached_receipt is not None:
             logger.info(f"使用AI暫存資料: {filename}")
-            # 從暫存資料恢復ReceiptData對象
-            from app.models.receipt import ReceiptData
-            receipt_dict = ai_cache_data["receipt_data"]
-            # 處理日期字串
-            if isinstance(receipt_dict.get("date"), str):
-                from datetime import datetime
-                try:
-                    receipt_dict["date"] = datetime.fromisoformat(receipt_dict["date"])
-                except:
-                    pass
-            return ReceiptData(**receipt_dict)
-        
-        # 沒有暫存，執行AI處理
-        for attempt in range(retries + 1):
-            try:
-                # 提取結構化資料
-                structured_data = ocr_service.extract_structured_data(ocr_result)
-
-                result = await ai_service.process_receipt_text(
-                    ocr_result, structured_data
-                )
-                # 保存到暫存
-                cache_service.save_ai_result(filename, result, ocr_result)
-                return result
-
-            except Exception as e:
-                if attempt < retries:
-                    logger.warning(f"AI重試 {attempt + 1}/{retries}: {e}")
-                    await asyncio.sleep(self.claude_delay * (attempt + 1))
-                else:
-                    logger.error(f"AI處理失敗: {e}")
-                    return {"success": False, "error": str(e)}
+            return cached_receipt
 
-    async def _process_single_item_optimized(self, filename: str) -> Dict:
-        """優化的單個項目處理"""
+        # 沒有暫存，執行AI處理
         try:
-            image_path = f"./data/receipts/{filename}"
+            # 提取結構化資料
+            structured_data = ocr_service.extract_structured_data(ocr_result)
 
-            # 1. 本地預處理
-            if self.use_local_preprocessing:
-                image_path = await self._preprocess_image_local(image_path)
-
-            # 2. OCR處理（並行控制）
-            ocr_result = await self._process_ocr_with_retry(image_path)
-            if not ocr_result.get("success"):
-                return {"success": False, "error": ocr_result.get("error", "OCR失敗")}
-
-            # 3. AI處理（並行控制，檢查暫存）
-            ai_result = await self._process_ai_with_retry(ocr_result, filename)
-            if not ai_result or (isinstance(ai_result, dict) and not ai_result.get("success", True)):
-                return {"success": False, "error": "AI處理失敗"}
-
-            # 4. 處理成功後刪除圖片（如果啟用）
-            if self.auto_delete_successful:
-                await self._delete_successful_image(filename)
-
-            return {
-                "success": True,
-                "filename": filename,
-                "data": ai_result,
-                "ocr_result": ocr_result,
-                "processing_time": time.time(),
-            }
+            on_progress = (
+                functools.partial(progress.update_partial, filename)
+                if progress
+                else None
+            )
+            result = await ai_service.process_receipt_text(
+                ocr_result, structured_data, on_progress=on_progress
+            )
+            # 保存到暫存
+            cache_service.save_ai_result(
+                filename, result, ocr_result, cache_key=cache_key
+            )
+            return result
 
         except Exception as e:
-            logger.error(f"處理失敗 {filename}: {e}")
+            logger.error(f"AI處理失敗: {e}")
             return {"success": False, "error": str(e)}
 
     async def _delete_successful_image(self, filename: str):
         """刪除處理成功的圖片"""
         try:
-            image_path = f"./data/receipts/{filename}"
+            image_path = self._image_path(filename)
             if os.path.exists(image_path):
                 os.remove(image_path)
                 logger.info(f"🗑️ 已刪除處理成功的圖片: {filename}")
@@ -220,135 +229,178 @@ class OptimizedBatchProcessor:
             filename = failed_file.get("filename")
             if filename:
                 try:
-                    image_path = f"./data/receipts/{filename}"
+                    image_path = self._image_path(filename)
                     if os.path.exists(image_path):
                         os.remove(image_path)
                         logger.info(f"🗑️ 已刪除失敗的圖片: {filename}")
                 except Exception as e:
                     logger.error(f"刪除失敗圖片時出錯 {filename}: {e}")
 
-    async def _process_batch_parallel(self, filenames: List[str]) -> List[Dict]:
-        """並行處理批次"""
-        # 創建信號量來控制並行度
-        azure_semaphore = asyncio.Semaphore(self.max_concurrent_azure)
-        claude_semaphore = asyncio.Semaphore(self.max_concurrent_claude)
-
-        async def process_with_semaphore(filename: str) -> Dict:
-            async with azure_semaphore:
-                # OCR處理
-                image_path = f"./data/receipts/{filename}"
-                if self.use_local_preprocessing:
-                    image_path = await self._preprocess_image_local(image_path)
-
-                ocr_result = await self._process_ocr_with_retry(image_path)
-                if not ocr_result.get("success"):
-                    return {
-                        "success": False,
-                        "filename": filename,
-                        "error": ocr_result.get("error"),
-                    }
-
-                # 添加延遲以符合API限制
-                await asyncio.sleep(self.azure_delay)
-
-                async with claude_semaphore:
-                    # AI處理
-                    ai_result = await self._process_ai_with_retry(ocr_result, filename)
-                    await asyncio.sleep(self.claude_delay)
-
-                    if ai_result:
-                        return {
-                            "success": True,
-                            "filename": filename,
-                            "data": ai_result,
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "filename": filename,
-                            "error": "AI處理失敗",
-                        }
+    async def _ocr_stage(
+        self, filename: str, preprocessing: Optional[str] = None
+    ) -> Dict:
+        """
+        管線OCR階段：本地預處理 + OCR（以內容雜湊檢查暫存）
+
+        preprocessing 未指定時使用處理器的預設（縮小尺寸或原始檔案）。
+        """
+        preprocessing = preprocessing or self.preprocessing
+        image_path = self._image_path(filename)
+        await image_worker_pool.image_digest(image_path)
+        ocr_cache_key = content_hasher.ocr_key(image_path, preprocessing)
+
+        # 已有OCR暫存時跳過預處理
+        image_data = None
+        if not self._load_cached_ocr(ocr_cache_key):
+            image_data = await self._prepare_image(image_path, preprocessing)
+
+        ocr_result = await self._process_ocr_with_retry(
+            image_path,
+            filename=filename,
+            cache_key=ocr_cache_key,
+            image_data=image_data,
+        )
+        if not ocr_result or not ocr_result.get("success"):
+            return {
+                "success": False,
+                "filename": filename,
+                "error": (ocr_result or {}).get("error", "OCR失敗"),
+            }
 
-        # 並行執行所有任務
-        tasks = [process_with_semaphore(filename) for filename in filenames]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # 近似重複的圖片OCR文字一致時連結，AI暫存鍵隨之指向先前的結果
+        duplicate_detector.confirm_duplicate(image_path, ocr_result)
 
-        # 處理結果
-        processed_results = []
-        for result in results:
-            if isinstance(result, Exception):
-                processed_results.append({"success": False, "error": str(result)})
-            else:
-                processed_results.append(result)
+        return {
+            "success": True,
+            "filename": filename,
+            "ocr_result": ocr_result,
+            "ai_cache_key": content_hasher.ai_key(image_path, preprocessing),
+        }
 
-        return processed_results
+    async def _ai_stage(
+        self, ocr_output: Dict, progress: Optional[BatchProgress] = None
+    ) -> Dict:
+        """管線AI階段：AI結構化（檢查暫存）"""
+        filename = ocr_output["filename"]
+        ai_result = await self._process_ai_with_retry(
+            ocr_output["ocr_result"],
+            filename,
+            cache_key=ocr_output.get("ai_cache_key"),
+            progress=progress,
+        )
+
+        # 失敗時 _process_ai_with_retry 返回錯誤字典
+        if not ai_result or isinstance(ai_result, dict):
+            error = ai_result.get("error") if isinstance(ai_result, dict) else None
+            return {
+                "success": False,
+                "filename": filename,
+                "error": error or "AI處理失敗",
+            }
+
+        # 設定來源圖片（暫存結果可能來自相同內容的其他上傳）
+        ai_result.source_image = filename
+        return {"success": True, "filename": filename, "data": ai_result}
+
+    async def _process_batch_parallel(
+        self,
+        filenames: List[str],
+        on_result: Optional[Callable[[int, Dict], Any]] = None,
+        progress: Optional[BatchProgress] = None,
+        preprocessing: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        管線並行處理：OCR工作者填入有界佇列，AI工作者獨立消化
+
+        OCR與AI各自擁有並行數，佇列滿時OCR會暫停（背壓），
+        因此總耗時約為 max(OCR, AI) 而非兩者之和。
+        """
+        engine = PipelineEngine(
+            [
+                PipelineStage(
+                    "ocr",
+                    functools.partial(self._ocr_stage, preprocessing=preprocessing),
+                    self.max_concurrent_azure,
+                ),
+                PipelineStage(
+                    "ai",
+                    functools.partial(self._ai_stage, progress=progress),
+                    self.max_concurrent_claude,
+                ),
+            ],
+            queue_size=self.pipeline_queue_size,
+        )
+        results = await engine.run(filenames, on_result=on_result)
+
+        # 確保每個結果都帶有檔案名稱
+        for filename, result in zip(filenames, results):
+            result.setdefault("filename", filename)
+        return results
 
     async def process_large_batch_optimized(
-        self, filenames: List[str], save_detailed_csv: bool = True
+        self,
+        filenames: List[str],
+        save_detailed_csv: bool = True,
+        progress: Optional[BatchProgress] = None,
+        state: Optional[Dict] = None,
+        checkpoint: Optional[Callable[[Dict], Any]] = None,
     ) -> Dict:
-        """優化的大批量處理"""
-        start_time = time.time()
-        self.start_time = start_time
-        self.total_items = len(filenames)
-        self.current_progress = 0
+        """
+        優化的大批量處理（progress：此次處理專用的進度物件）
+
+        每個成功的檔案在標記完成前追加到同一個執行紀錄；state/checkpoint 由工作佇列提供時，
+        run_id 保存在工作中，恢復後繼續追加到同一個執行紀錄。
+        """
+        progress = progress or BatchProgress()
+        state = state if state is not None else {}
+        self.last_progress = progress
 
-        # 分批處理
-        batches = [
-            filenames[i : i + self.batch_size]
-            for i in range(0, len(filenames), self.batch_size)
-        ]
-        self.total_batches = len(batches)
+        # 批次僅用於進度顯示，所有檔案在同一條管線中連續處理
+        total_batches = (len(filenames) + self.batch_size - 1) // self.batch_size
+        progress.start(len(filenames), total_batches)
 
         logger.info(
-            f"🚀 開始優化批量處理: {len(filenames)} 個檔案，{len(batches)} 個批次"
+            f"🚀 開始優化批量處理: {len(filenames)} 個檔案（管線模式，"
+            f"OCR並行 {self.max_concurrent_azure}，AI並行 {self.max_concurrent_claude}）"
         )
 
         successful_receipts = []
         failed_files = []
 
-        for batch_idx, batch_filenames in enumerate(batches):
-            self.current_batch = batch_idx + 1
-            logger.info(
-                f"🔄 處理批次 {self.current_batch}/{self.total_batches}，包含 {len(batch_filenames)} 個檔案"
+        def on_result(index: int, result: Dict):
+            filename = result.get("filename", filenames[index])
+            progress.current_batch = min(
+                total_batches, progress.current_progress // self.batch_size + 1
             )
 
-            # 並行處理當前批次
-            batch_results = await self._process_batch_parallel(batch_filenames)
+            if result.get("success") and result.get("data"):
+                successful_receipts.append(result["data"])
+                logger.info(f"✅ {filename} 處理成功")
+                # 先追加到收據儲存再標記完成，工作中斷後恢復時不會遺失已完成的收據
+                try:
+                    csv_service.append_to_run([result["data"]], state, checkpoint)
+                except Exception as e:
+                    logger.error(f"追加收據失敗: {filename}, 錯誤: {str(e)}")
+                progress.advance(filename, True)
+            else:
+                error = result.get("error", "未知錯誤")
+                failed_files.append({"filename": filename, "error": error})
+                logger.error(f"❌ {filename} 處理失敗: {error}")
+                progress.advance(filename, False, error)
 
-            # 處理結果
-            for result in batch_results:
-                self.current_progress += 1
+        await self._process_batch_parallel(
+            filenames, on_result=on_result, progress=progress
+        )
 
-                if result.get("success") and result.get("data"):
-                    successful_receipts.append(result["data"])
-                    logger.info(f"✅ {result['filename']} 處理成功")
-                else:
-                    failed_files.append(
-                        {
-                            "filename": result.get("filename", "unknown"),
-                            "error": result.get("error", "未知錯誤"),
-                        }
-                    )
-                    logger.error(
-                        f"❌ {result.get('filename', 'unknown')} 處理失敗: {result.get('error')}"
-                    )
-
-            # 批次間延遲（動態調整）
-            if batch_idx < len(batches) - 1:
-                delay = self._calculate_adaptive_delay(len(batch_filenames))
-                logger.info(f"⏳ 批次間延遲: {delay}秒")
-                await asyncio.sleep(delay)
-
-        # 保存結果
-        csv_files = {}
+        # 收據已逐檔追加到收據儲存
+        csv_files = csv_service.run_files(state.get("run_id"))
         if successful_receipts:
-            csv_files = csv_service.save_consolidated_csv(successful_receipts)
-            logger.info(f"📊 保存了 {len(successful_receipts)} 個收據到CSV")
+            logger.info(f"📊 保存了 {len(successful_receipts)} 個收據到收據儲存")
 
         # 清理失敗的圖片（如果設定為不保留）
         await self._cleanup_failed_images(failed_files)
 
-        total_time = time.time() - start_time
+        total_time = progress.elapsed_time
 
         return {
             "success": True,
@@ -366,69 +418,47 @@ class OptimizedBatchProcessor:
             "deleted_failed": len(failed_files) if not self.keep_failed_files else 0,
         }
 
-    def _calculate_adaptive_delay(self, batch_size: int) -> float:
-        """計算自適應延遲 - 確保符合Azure F0免費層限制"""
-        # Azure F0免費層：每分鐘20次請求，即每3秒1次請求
-        # 為了安全起見，設定為每4秒1次請求（每分鐘15次）
-        min_delay_per_request = 4.0
-
-        # 根據批次大小計算所需延遲
-        required_delay = batch_size * min_delay_per_request
-
-        # 添加額外的安全邊際
-        safety_margin = 2.0
-        total_delay = required_delay + safety_margin
+    async def process_single(
+        self, filename: str, preprocessing: Optional[str] = None
+    ) -> Dict:
+        """
+        Process one interactive upload through the batch pipeline
+        以批量處理的管線處理單張互動上傳
+
+        The receipt goes through the same OCR/AI stages as batches, so it
+        shares the rate limiter, the pooled clients and the content-addressed
+        OCR/AI cache. The shared progress of batch runs is left untouched.
+        與批量處理經過相同的OCR/AI階段，共用限流器、連線池與內容定址暫存；不影響批量處理的進度。
+
+        Args:
+            filename: Image file name in the upload directory / 上傳目錄中的圖片檔案名稱
+            preprocessing: PREPROCESS_* constant, defaults to the processor's / 預處理方式（預設沿用處理器設定）
+
+        Returns:
+            Stage result with "data" (ReceiptData) on success / 成功時含 "data"（ReceiptData）的結果
+        """
+        start_time = time.time()
+        result = (
+            await self._process_batch_parallel([filename], preprocessing=preprocessing)
+        )[0]
+        result["processing_time"] = time.time() - start_time
 
-        # 確保延遲在合理範圍內
-        min_delay = 5.0  # 最少5秒
-        max_delay = 30.0  # 最多30秒
+        if result.get("success") and self.auto_delete_successful:
+            await self._delete_successful_image(filename)
+        return result
 
-        return max(min_delay, min(total_delay, max_delay))
+    def _calculate_adaptive_delay(self, batch_size: int) -> float:
+        """估算下一批次的限流等待時間 - 依共用限流器的實際可用配額計算"""
+        return rate_limiter.get_bucket("azure").estimate_wait(batch_size)
 
     def get_progress(self) -> Dict:
-        """獲取當前進度"""
-        if self.total_items == 0:
-            return {
-                "current_progress": 0,
-                "total_items": 0,
-                "percentage": 0,
-                "current_batch": 0,
-                "total_batches": 0,
-                "estimated_completion": "計算中...",
-                "elapsed_time": 0,
-                "optimization_status": "已啟用",
-            }
-
-        percentage = (self.current_progress / self.total_items) * 100
-        elapsed_time = time.time() - self.start_time if self.start_time else 0
-
-        # 估算剩餘時間
-        if self.current_progress > 0:
-            avg_time_per_item = elapsed_time / self.current_progress
-            remaining_items = self.total_items - self.current_progress
-            estimated_remaining = remaining_items * avg_time_per_item
-
-            if estimated_remaining < 60:
-                estimated_completion = f"{int(estimated_remaining)}秒"
-            elif estimated_remaining < 3600:
-                estimated_completion = f"{int(estimated_remaining / 60)}分鐘"
-            else:
-                estimated_completion = f"{int(estimated_remaining / 3600)}小時{int((estimated_remaining % 3600) / 60)}分鐘"
-        else:
-            estimated_completion = "計算中..."
-
-        return {
-            "current_progress": self.current_progress,
-            "total_items": self.total_items,
-            "percentage": round(percentage, 1),
-            "current_batch": self.current_batch,
-            "total_batches": self.total_batches,
-            "estimated_completion": estimated_completion,
-            "elapsed_time": round(elapsed_time, 1),
-            "optimization_status": "已啟用",
-            "parallel_azure": self.max_concurrent_azure,
-            "parallel_claude": self.max_concurrent_claude,
-        }
+        """獲取最近一次處理的進度"""
+        progress = self.last_progress.get_progress()
+        progress["optimization_status"] = "已啟用"
+        if progress["total_items"]:
+            progress["parallel_azure"] = self.max_concurrent_azure
+            progress["parallel_claude"] = self.max_concurrent_claude
+        return progress
 
 
 # 創建全局實例
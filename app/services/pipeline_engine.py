@@ -0,0 +1,120 @@
+"""
+管線處理引擎 - OCR與AI分階段的生產者/消費者管線
+Pipeline engine - staged producer/consumer pipeline for OCR and AI work
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+
+# 階段處理函數：接收上一階段的輸出，返回結果字典
+StageHandler = Callable[[Any], Awaitable[Dict]]
+ResultCallback = Callable[[int, Dict], Any]
+
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    One pipeline stage with its own worker concurrency
+    管線中的單一階段，擁有獨立的並行數
+    """
+
+    def __init__(self, name: str, handler: StageHandler, concurrency: int = 1):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+
+
+class PipelineEngine:
+    """
+    Run items through stages connected by bounded queues
+    透過有界佇列串接各階段並處理所有項目
+
+    A handler returns a dict. If it has ``success`` set to False the item
+    stops there; otherwise the dict is handed to the next stage. The last
+    stage's dict is the item's final result.
+    處理函數返回字典：success為False時該項目結束，否則傳給下一階段；最後階段的輸出即最終結果。
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 10):
+        if not stages:
+            raise ValueError("管線至少需要一個階段")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    async def run(
+        self, items: List[Any], on_result: Optional[ResultCallback] = None
+    ) -> List[Dict]:
+        """
+        Process all items and return results in input order
+        處理所有項目，並依輸入順序返回結果
+
+        Args:
+            items: Input items for the first stage / 第一階段的輸入項目
+            on_result: Called as (index, result) when an item finishes / 項目完成時的回調
+
+        Returns:
+            Result dicts in input order / 依輸入順序排列的結果
+        """
+        results: List[Optional[Dict]] = [None] * len(items)
+        # 每個階段一個有界佇列，佇列滿時上游會等待（背壓）
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+
+        async def finish(index: int, result: Dict):
+            results[index] = result
+            if on_result is not None:
+                callback_result = on_result(index, result)
+                if asyncio.iscoroutine(callback_result):
+                    await callback_result
+
+        async def worker(stage_index: int):
+            stage = self.stages[stage_index]
+            is_last = stage_index == len(self.stages) - 1
+            while True:
+                entry = await queues[stage_index].get()
+                if entry is _STOP:
+                    return
+
+                index, payload = entry
+                try:
+                    output = await stage.handler(payload)
+                except Exception as e:
+                    logger.error(f"管線階段 {stage.name} 處理失敗: {e}")
+                    output = {"success": False, "error": str(e)}
+
+                if output is None:
+                    output = {
+                        "success": False,
+                        "error": f"{stage.name} 階段沒有返回結果",
+                    }
+
+                if is_last or output.get("success") is False:
+                    await finish(index, output)
+                else:
+                    await queues[stage_index + 1].put((index, output))
+
+        async def run_stage(stage_index: int):
+            stage = self.stages[stage_index]
+            await asyncio.gather(
+                *[worker(stage_index) for _ in range(stage.concurrency)]
+            )
+            # 本階段全部完成後，通知下一階段的所有工作者結束
+            if stage_index + 1 < len(self.stages):
+                for _ in range(self.stages[stage_index + 1].concurrency):
+                    await queues[stage_index + 1].put(_STOP)
+
+        async def produce():
+            for index, item in enumerate(items):
+                await queues[0].put((index, item))
+            for _ in range(self.stages[0].concurrency):
+                await queues[0].put(_STOP)
+
+        await asyncio.gather(
+            produce(), *[run_stage(i) for i in range(len(self.stages))]
+        )
+
+        return [
+            result if result is not None else {"success": False, "error": "未處理"}
+            for result in results
+        ]
@@ -0,0 +1,199 @@
+"""
+輪詢策略服務 - Azure Read Operation-Location 的自適應輪詢
+Polling strategy service - adaptive polling for Azure Read Operation-Location
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from loguru import logger
+from app.config import settings
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date)
+    解析Retry-After標頭（秒數或HTTP日期）
+
+    Args:
+        value: Header value / 標頭值
+
+    Returns:
+        Seconds to wait, or None if missing/invalid / 需等待秒數，無效時返回None
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class PollingStrategy:
+    """
+    Polling interval policy: short first probe, then server hint or exponential backoff
+    輪詢間隔策略：短暫首次探測，之後使用伺服器提示或指數退避
+    """
+
+    def __init__(
+        self,
+        first_delay: Optional[float] = None,
+        min_interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+        backoff_factor: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.first_delay = (
+            first_delay if first_delay is not None else settings.ocr_poll_first_delay
+        )
+        self.min_interval = (
+            min_interval if min_interval is not None else settings.ocr_poll_min_interval
+        )
+        self.max_interval = (
+            max_interval if max_interval is not None else settings.ocr_poll_max_interval
+        )
+        self.backoff_factor = (
+            backoff_factor
+            if backoff_factor is not None
+            else settings.ocr_poll_backoff_factor
+        )
+        self.timeout = timeout if timeout is not None else settings.ocr_poll_timeout
+
+    def next_delay(self, poll_index: int, retry_after: Optional[float] = None) -> float:
+        """
+        Compute the delay before the given poll
+        計算下一次輪詢前的等待時間
+
+        Args:
+            poll_index: Zero-based poll number / 第幾次輪詢（從0開始）
+            retry_after: Server hint in seconds / 伺服器提示秒數
+
+        Returns:
+            Delay in seconds / 等待秒數
+        """
+        if retry_after is not None:
+            return min(max(retry_after, self.min_interval), self.max_interval)
+
+        if poll_index == 0:
+            return self.first_delay
+
+        delay = self.min_interval * (self.backoff_factor ** (poll_index - 1))
+        return min(max(delay, self.min_interval), self.max_interval)
+
+    def start(self) -> "PollingSession":
+        """
+        Start a polling session for one OCR job
+        為單一OCR工作開始輪詢
+        """
+        return PollingSession(self)
+
+
+class PollingSession:
+    """
+    State of one Operation-Location polling loop
+    單一Operation-Location輪詢迴圈的狀態
+    """
+
+    def __init__(self, strategy: PollingStrategy):
+        self.strategy = strategy
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + strategy.timeout
+        self.poll_count = 0
+
+    async def wait(self, retry_after_header: Optional[str] = None):
+        """
+        Sleep until the next poll, enforcing the overall deadline
+        等待到下一次輪詢，並檢查整體期限
+
+        Raises:
+            Exception: OCR_TIMEOUT when the job exceeds its deadline / 超過期限時拋出OCR_TIMEOUT
+        """
+        delay = self.strategy.next_delay(
+            self.poll_count, parse_retry_after(retry_after_header)
+        )
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0 or delay > remaining:
+            raise Exception(
+                f"OCR_TIMEOUT: OCR job exceeded {self.strategy.timeout:.0f}s after {self.poll_count} polls"
+            )
+
+        await asyncio.sleep(delay)
+        self.poll_count += 1
+
+    @property
+    def elapsed(self) -> float:
+        """已經過的秒數"""
+        return time.monotonic() - self.start_time
+
+
+class PollingMetrics:
+    """
+    Poll count statistics per OCR image
+    每張圖片的輪詢次數統計
+    """
+
+    def __init__(self, history_size: int = 100):
+        self.history_size = history_size
+        self.total_jobs = 0
+        self.total_polls = 0
+        self.max_polls = 0
+        self.timeouts = 0
+        self.recent: List[Dict] = []
+
+    def record(
+        self, image_name: str, poll_count: int, elapsed: float, timed_out: bool = False
+    ):
+        """
+        Record polling stats for one image
+        記錄單張圖片的輪詢統計
+        """
+        self.total_jobs += 1
+        self.total_polls += poll_count
+        self.max_polls = max(self.max_polls, poll_count)
+        if timed_out:
+            self.timeouts += 1
+
+        self.recent.append(
+            {
+                "image": image_name,
+                "poll_count": poll_count,
+                "elapsed": round(elapsed, 2),
+                "timed_out": timed_out,
+            }
+        )
+        if len(self.recent) > self.history_size:
+            self.recent = self.recent[-self.history_size :]
+
+        logger.debug(
+            f"OCR輪詢統計: {image_name} 輪詢 {poll_count} 次，耗時 {elapsed:.2f}秒"
+        )
+
+    def get_summary(self) -> Dict:
+        """獲取輪詢統計摘要"""
+        return {
+            "total_jobs": self.total_jobs,
+            "total_polls": self.total_polls,
+            "avg_polls_per_image": (
+                round(self.total_polls / self.total_jobs, 2) if self.total_jobs else 0
+            ),
+            "max_polls": self.max_polls,
+            "timeouts": self.timeouts,
+            "recent": self.recent[-10:],
+        }
+
+
+# 全局實例
+polling_strategy = PollingStrategy()
+polling_metrics = PollingMetrics()
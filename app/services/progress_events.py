@@ -0,0 +1,104 @@
+"""
+進度事件服務 - 以Server-Sent Events推送批次工作的即時進度
+Progress events service - pushes live batch job progress as Server-Sent Events
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Optional
+from loguru import logger
+
+# 工作結束的狀態（收到後關閉串流）
+FINAL_STATUSES = ("done", "failed")
+
+
+def format_sse(event_type: str, data: Dict) -> str:
+    """
+    Format one Server-Sent Events message
+    格式化單一SSE訊息
+    """
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event_type}\ndata: {payload}\n\n"
+
+
+class ProgressEventBus:
+    """
+    In-process fan-out of job events to SSE subscribers
+    程序內的工作事件分發，推送給所有SSE訂閱者
+
+    Each subscriber gets its own bounded queue. A slow client drops its
+    oldest events instead of slowing down the batch workers.
+    每個訂閱者有獨立的有界佇列；較慢的客戶端會丟棄最舊的事件，而不會拖慢批次處理。
+    """
+
+    def __init__(self, queue_size: int = 100, heartbeat_interval: float = 15.0):
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """訂閱工作事件"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        """取消訂閱"""
+        queues = self.subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self.subscribers.pop(job_id, None)
+
+    def has_subscribers(self, job_id: str) -> bool:
+        """該工作是否有訂閱者"""
+        return bool(self.subscribers.get(job_id))
+
+    def publish(self, job_id: str, event_type: str, data: Dict):
+        """
+        Publish an event to every subscriber of the job
+        發布事件給該工作的所有訂閱者
+        """
+        for queue in self.subscribers.get(job_id, []):
+            if queue.full():
+                queue.get_nowait()
+                logger.debug(f"進度事件佇列已滿，丟棄最舊事件: {job_id}")
+            queue.put_nowait((event_type, data))
+
+    async def stream(
+        self, job_id: str, snapshot: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        Yield SSE messages for a job until it finishes
+        產生工作的SSE訊息，直到工作結束
+
+        Args:
+            job_id: Job to follow / 要追蹤的工作
+            snapshot: Current job state, sent first so late subscribers catch up / 目前的工作狀態，最先送出
+        """
+        queue = self.subscribe(job_id)
+        try:
+            if snapshot is not None:
+                yield format_sse("status", snapshot)
+                if snapshot.get("status") in FINAL_STATUSES:
+                    return
+
+            while True:
+                try:
+                    event_type, data = await asyncio.wait_for(
+                        queue.get(), timeout=self.heartbeat_interval
+                    )
+                except asyncio.TimeoutError:
+                    # 保持連線，避免代理伺服器因閒置而中斷
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield format_sse(event_type, data)
+                if event_type == "status" and data.get("status") in FINAL_STATUSES:
+                    return
+        finally:
+            self.unsubscribe(job_id, queue)
+
+
+# 全局實例
+progress_event_bus = ProgressEventBus()
@@ -0,0 +1,178 @@
+"""
+頻率限制服務 - 全程序共用的Token Bucket限流器（Azure / Claude）
+Rate limiter service - process-wide token buckets for Azure and Claude calls
+"""
+
+import asyncio
+import time
+from typing import Dict, Tuple
+from loguru import logger
+from app.config import settings
+
+# 各服務層級的預設限制：(每分鐘請求數, 突發容量)
+AZURE_TIER_LIMITS: Dict[str, Tuple[int, int]] = {
+    "F0": (20, 1),  # 免費層：每分鐘20次
+    "S1": (600, 10),  # 標準層：每秒10次
+}
+CLAUDE_DEFAULT_LIMITS: Tuple[int, int] = (50, 5)
+
+
+class TokenBucket:
+    """
+    Token bucket with reservation semantics (FIFO, no busy waiting)
+    預約式Token Bucket（先到先服務，不忙等）
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, capacity: int = 1):
+        self.name = name
+        self.rate_per_minute = float(rate_per_minute)
+        self.capacity = max(1, int(capacity))
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+
+        # 統計
+        self.total_acquired = 0
+        self.total_wait_time = 0.0
+
+    @property
+    def rate_per_second(self) -> float:
+        return self.rate_per_minute / 60.0
+
+    def _refill(self):
+        """依經過時間補充token"""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(
+            float(self.capacity), self._tokens + elapsed * self.rate_per_second
+        )
+
+    def reserve(self, tokens: int = 1) -> float:
+        """
+        Reserve tokens and return how long the caller must wait
+        預約token並返回需等待的秒數
+
+        Tokens may go negative; the deficit is the queue of earlier reservations.
+        token可以為負數，負值代表前面已預約的請求。
+        """
+        self._refill()
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate_per_second
+
+    async def acquire(self, tokens: int = 1) -> float:
+        """
+        Wait until the requested tokens are available
+        等待直到取得所需的token
+
+        Returns:
+            Seconds waited / 實際等待秒數
+        """
+        wait_time = self.reserve(tokens)
+        if wait_time > 0:
+            logger.debug(f"[{self.name}] 頻率限制：等待 {wait_time:.2f} 秒")
+            await asyncio.sleep(wait_time)
+
+        self.total_acquired += tokens
+        self.total_wait_time += wait_time
+        return wait_time
+
+    def estimate_wait(self, tokens: int = 1) -> float:
+        """
+        Estimate the wait for the given tokens without reserving them
+        估算取得token所需的等待時間（不實際預約）
+        """
+        self._refill()
+        deficit = tokens - self._tokens
+        return max(0.0, deficit / self.rate_per_second)
+
+    def pause(self, seconds: float):
+        """
+        Drain the bucket so no caller proceeds for the given seconds (e.g. after a 429)
+        清空token，使所有呼叫者暫停指定秒數（例如收到429後）
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate_per_second
+        logger.warning(f"[{self.name}] 頻率限制暫停 {seconds:.1f} 秒")
+
+    def get_status(self) -> Dict:
+        """獲取限流器狀態"""
+        self._refill()
+        return {
+            "rate_per_minute": self.rate_per_minute,
+            "capacity": self.capacity,
+            "available_tokens": round(max(self._tokens, 0.0), 2),
+            "queued_wait_seconds": round(
+                max(-self._tokens, 0.0) / self.rate_per_second, 2
+            ),
+            "total_acquired": self.total_acquired,
+            "total_wait_time": round(self.total_wait_time, 2),
+        }
+
+
+class RateLimiter:
+    """
+    Registry of per-provider token buckets shared by every OCR and AI call
+    各服務供應商的Token Bucket註冊表，所有OCR與AI調用共用
+    """
+
+    def __init__(self):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.azure_tier = settings.azure_tier.upper()
+
+        azure_rate, azure_burst = AZURE_TIER_LIMITS.get(
+            self.azure_tier, AZURE_TIER_LIMITS["F0"]
+        )
+        self.configure(
+            "azure",
+            settings.azure_requests_per_minute or azure_rate,
+            settings.azure_burst or azure_burst,
+        )
+        self.configure(
+            "claude",
+            settings.claude_requests_per_minute or CLAUDE_DEFAULT_LIMITS[0],
+            settings.claude_burst or CLAUDE_DEFAULT_LIMITS[1],
+        )
+
+    def configure(self, provider: str, rate_per_minute: float, capacity: int = 1):
+        """
+        Configure (or reconfigure) a provider's bucket
+        設定（或重新設定）供應商的限流器
+        """
+        self.buckets[provider] = TokenBucket(provider, rate_per_minute, capacity)
+        logger.info(
+            f"頻率限制設定: {provider} = {rate_per_minute}/分鐘，突發 {capacity}"
+        )
+
+    def get_bucket(self, provider: str) -> TokenBucket:
+        """獲取供應商的限流器"""
+        if provider not in self.buckets:
+            raise KeyError(f"未設定的頻率限制供應商: {provider}")
+        return self.buckets[provider]
+
+    async def acquire(self, provider: str, tokens: int = 1) -> float:
+        """取得供應商的調用配額"""
+        return await self.get_bucket(provider).acquire(tokens)
+
+    def pause(self, provider: str, seconds: float):
+        """暫停供應商的所有調用"""
+        self.get_bucket(provider).pause(seconds)
+
+    def rate_per_minute(self, provider: str) -> float:
+        """獲取供應商每分鐘的請求數"""
+        return self.get_bucket(provider).rate_per_minute
+
+    def seconds_per_request(self, provider: str) -> float:
+        """獲取供應商穩定狀態下每次請求的間隔秒數"""
+        return 60.0 / self.get_bucket(provider).rate_per_minute
+
+    def get_status(self) -> Dict:
+        """獲取所有限流器狀態"""
+        status = {name: bucket.get_status() for name, bucket in self.buckets.items()}
+        status["azure"]["tier"] = self.azure_tier
+        return status
+
+
+# 全局實例
+rate_limiter = RateLimiter()
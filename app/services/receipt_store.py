@@ -0,0 +1,244 @@
+"""
+收據儲存後端 - 以僅追加的SQLite表保存所有處理完成的收據
+Receipt store backend - append-only SQLite tables holding every processed receipt
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app.models.receipt import ReceiptData
+
+
+class SQLiteReceiptStore:
+    """
+    Append-only receipt store, one run per processing batch
+    僅追加的收據儲存，每次處理（批次）為一個執行紀錄（run）
+
+    Receipts are never rewritten: each append is one transaction that inserts
+    the new rows and updates the per-run and per-store aggregates, so merging,
+    listing runs and the overall summary cost time proportional to the new
+    receipts rather than to the whole history. CSV files are export views of
+    a run, written on demand by CSVService.
+    收據寫入後不再改寫：每次追加以單一交易插入新資料並更新各執行紀錄與各商店的彙總，
+    因此合併、列出執行紀錄與整體摘要的成本只與新增收據成正比，而非整個歷史。CSV為執行紀錄的匯出檢視，由CSVService按需產生。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS receipt_runs (
+                run_id TEXT PRIMARY KEY,
+                source TEXT,
+                receipt_count INTEGER NOT NULL,
+                total_amount REAL NOT NULL,
+                earliest TEXT,
+                latest TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_created
+                ON receipt_runs (created_at);
+            CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                store_name TEXT,
+                receipt_date TEXT,
+                total_amount REAL,
+                source_image TEXT,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_receipts_run
+                ON receipts (run_id, id);
+            CREATE TABLE IF NOT EXISTS store_names (
+                store_name TEXT PRIMARY KEY,
+                receipt_count INTEGER NOT NULL
+            );
+            """)
+        self._conn.commit()
+
+    def _new_run_id(self, created_at: float) -> str:
+        """以時間戳命名執行紀錄（同一秒內重複時加上序號）"""
+        base = datetime.fromtimestamp(created_at).strftime("%Y%m%d_%H%M%S")
+        run_id, suffix = base, 2
+        while self._conn.execute(
+            "SELECT 1 FROM receipt_runs WHERE run_id = ?", (run_id,)
+        ).fetchone():
+            run_id = f"{base}_{suffix}"
+            suffix += 1
+        return run_id
+
+    def append(
+        self,
+        receipts: List[ReceiptData],
+        source: Optional[str] = None,
+        run_id: Optional[str] = None,
+        created_at: Optional[float] = None,
+    ) -> str:
+        """
+        Append receipts as a new run (or to an existing run) in one transaction
+        以單一交易將收據追加為新的執行紀錄（或追加到既有的執行紀錄）
+
+        Args:
+            receipts: Receipts to append / 要追加的收據
+            source: Where the run came from (e.g. "batch") / 來源說明
+            run_id: Explicit run id; an existing run is extended (imports, resumed jobs)
+                    指定執行紀錄ID；已存在時追加到該執行紀錄（匯入、恢復的工作）
+            created_at: Run timestamp, defaults to now / 執行紀錄時間（預設為現在）
+
+        Returns:
+            The run id / 執行紀錄ID
+        """
+        created_at = created_at if created_at is not None else time.time()
+        dates = [receipt.date.isoformat() for receipt in receipts]
+        with self._lock, self._conn:
+            run_id = run_id or self._new_run_id(created_at)
+            self._conn.executemany(
+                "INSERT INTO receipts "
+                "(run_id, store_name, receipt_date, total_amount, source_image, data, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        receipt.store_name,
+                        receipt_date,
+                        receipt.total_amount,
+                        receipt.source_image,
+                        receipt.model_dump_json(),
+                        created_at,
+                    )
+                    for receipt, receipt_date in zip(receipts, dates)
+                ],
+            )
+            self._conn.execute(
+                "INSERT INTO receipt_runs "
+                "(run_id, source, receipt_count, total_amount, earliest, latest, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET "
+                "receipt_count = receipt_count + excluded.receipt_count, "
+                "total_amount = total_amount + excluded.total_amount, "
+                "earliest = COALESCE(MIN(earliest, excluded.earliest), earliest, excluded.earliest), "
+                "latest = COALESCE(MAX(latest, excluded.latest), latest, excluded.latest)",
+                (
+                    run_id,
+                    source,
+                    len(receipts),
+                    sum(receipt.total_amount for receipt in receipts),
+                    min(dates) if dates else None,
+                    max(dates) if dates else None,
+                    created_at,
+                ),
+            )
+            self._conn.executemany(
+                "INSERT INTO store_names (store_name, receipt_count) VALUES (?, 1) "
+                "ON CONFLICT(store_name) DO UPDATE SET receipt_count = receipt_count + 1",
+                [(receipt.store_name,) for receipt in receipts],
+            )
+        return run_id
+
+    def has_run(self, run_id: str) -> bool:
+        """執行紀錄是否存在"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM receipt_runs WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row is not None
+
+    def has_source(self, source: str) -> bool:
+        """是否已有來自指定來源的執行紀錄"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM receipt_runs WHERE source = ? LIMIT 1", (source,)
+            ).fetchone()
+        return row is not None
+
+    def list_runs(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """列出執行紀錄（新到舊）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, source, receipt_count, total_amount, created_at "
+                "FROM receipt_runs ORDER BY created_at DESC, run_id DESC LIMIT ?",
+                (limit if limit is not None else -1,),
+            ).fetchall()
+        return [
+            {
+                "run_id": row[0],
+                "source": row[1],
+                "receipt_count": row[2],
+                "total_amount": row[3],
+                "created_at": row[4],
+            }
+            for row in rows
+        ]
+
+    def load_receipts(
+        self, run_id: Optional[str] = None, limit: Optional[int] = None, offset: int = 0
+    ) -> List[ReceiptData]:
+        """
+        Receipts of one run in insertion order, or of all runs newest first
+        指定執行紀錄的收據（依寫入順序），未指定時為所有收據（新到舊）
+        """
+        if run_id is not None:
+            query = "SELECT data FROM receipts WHERE run_id = ? ORDER BY id LIMIT ? OFFSET ?"
+            params = (run_id, limit if limit is not None else -1, offset)
+        else:
+            query = "SELECT data FROM receipts ORDER BY id DESC LIMIT ? OFFSET ?"
+            params = (limit if limit is not None else -1, offset)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [ReceiptData.model_validate_json(row[0]) for row in rows]
+
+    def count(self) -> int:
+        """收據總數（由執行紀錄彙總）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(receipt_count), 0) FROM receipt_runs"
+            ).fetchone()
+        return row[0]
+
+    def summary(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Totals for one run or for the whole store, from the aggregate tables
+        單一執行紀錄或整體的摘要（由彙總表計算）
+        """
+        with self._lock:
+            if run_id is not None:
+                row = self._conn.execute(
+                    "SELECT receipt_count, total_amount, earliest, latest "
+                    "FROM receipt_runs WHERE run_id = ?",
+                    (run_id,),
+                ).fetchone() or (0, 0.0, None, None)
+                stores = self._conn.execute(
+                    "SELECT COUNT(DISTINCT store_name) FROM receipts WHERE run_id = ?",
+                    (run_id,),
+                ).fetchone()[0]
+            else:
+                row = self._conn.execute(
+                    "SELECT COALESCE(SUM(receipt_count), 0), COALESCE(SUM(total_amount), 0), "
+                    "MIN(earliest), MAX(latest) FROM receipt_runs"
+                ).fetchone()
+                stores = self._conn.execute(
+                    "SELECT COUNT(*) FROM store_names"
+                ).fetchone()[0]
+
+        count, total_amount, earliest, latest = row
+        return {
+            "total_receipts": count,
+            "total_amount": total_amount,
+            "average_amount": total_amount / count if count else 0,
+            "unique_stores": stores,
+            "date_range": {
+                "earliest": datetime.fromisoformat(earliest) if earliest else None,
+                "latest": datetime.fromisoformat(latest) if latest else None,
+            },
+        }
+
+    def close(self):
+        """關閉資料庫連線"""
+        with self._lock:
+            self._conn.close()
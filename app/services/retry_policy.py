@@ -0,0 +1,128 @@
+"""
+重試策略服務 - 指數退避（含抖動）與斷路器
+Retry policy service - jittered exponential backoff and a circuit breaker
+"""
+
+import random
+import time
+from typing import Dict, Optional
+from loguru import logger
+
+
+class RetryableError(Exception):
+    """可重試的API錯誤（429、529、5xx、overloaded或連線錯誤）"""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟中，請求未送出"""
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff that honors server retry hints
+    依伺服器提示（Retry-After）調整的指數退避，並加入隨機抖動
+
+    Without a hint the delay is drawn uniformly from [0, base * 2^attempt]
+    ("full jitter"), so concurrent workers that failed together do not retry
+    in lockstep. A Retry-After hint is used as the minimum delay.
+    沒有提示時，延遲從 [0, base * 2^attempt] 均勻抽樣（full jitter），避免同時失敗的工作者同步重試；
+    有Retry-After提示時以其作為最小延遲。
+    """
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Delay before retry number attempt + 1
+        第 attempt + 1 次重試前的等待秒數
+
+        Args:
+            attempt: Zero-based attempt that just failed / 剛失敗的嘗試次序（從0開始）
+            retry_after: Server hint in seconds / 伺服器提示的秒數
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2**attempt))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated upstream failures
+    上游連續失敗後快速失敗
+
+    closed: requests flow; after failure_threshold consecutive failures the
+    breaker opens. open: requests are rejected until reset_seconds pass.
+    half-open: one trial request is allowed; success closes the breaker,
+    failure opens it again.
+    closed：正常送出；連續失敗達門檻後開啟。open：在reset_seconds內直接拒絕請求。
+    half-open：允許一個試探請求，成功則關閉，失敗則再次開啟。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        """請求前檢查；斷路器開啟時拋出CircuitOpenError"""
+        state = self.state
+        if state == "open" or (state == "half-open" and self.trial_in_flight):
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            raise CircuitOpenError(
+                f"{self.name} 斷路器開啟中，{max(0.0, remaining):.1f} 秒後重試"
+            )
+        if state == "half-open":
+            self.trial_in_flight = True
+
+    def record_success(self):
+        """請求成功：重置失敗次數並關閉斷路器"""
+        if self.opened_at is not None:
+            logger.info(f"{self.name} 斷路器已關閉")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def release_trial(self):
+        """請求未得出上游結果（取消或不可重試的錯誤）：結束試探，讓下一個請求再試探"""
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        """上游失敗：累計失敗次數，達門檻或試探失敗時開啟斷路器"""
+        self.failures += 1
+        half_open = self.state == "half-open"
+        self.trial_in_flight = False
+        if half_open or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(
+                f"{self.name} 斷路器開啟: 連續失敗 {self.failures} 次，{self.reset_seconds} 秒內暫停請求"
+            )
+
+    def get_status(self) -> Dict:
+        """獲取斷路器狀態"""
+        return {"state": self.state, "consecutive_failures": self.failures}
@@ -0,0 +1,99 @@
+"""
+串流解析服務 - 從逐段到達的JSON中取出已完成的商品項目
+Stream parser service - pulls completed items out of JSON that arrives in fragments
+"""
+
+import json
+from typing import Dict, List, Optional
+
+
+class IncrementalItemParser:
+    """
+    Incremental scanner for objects inside "items" arrays of streamed JSON
+    逐段掃描串流JSON，取出 "items" 陣列中已完整的物件
+
+    Claude streams tool input as partial_json fragments that are not valid
+    JSON until the block ends. The scanner tracks strings, nesting depth and
+    the key of each array, so every item object is parsed as soon as its
+    closing brace arrives (also inside batched "receipts").
+    Claude以partial_json片段串流工具輸入，區塊結束前都不是有效的JSON。
+    掃描器追蹤字串、巢狀深度與陣列的鍵，每個商品物件在右大括號到達時立即解析（批次的 "receipts" 內亦同）。
+    """
+
+    def __init__(self, array_key: str = "items"):
+        self.array_key = array_key
+        self.items: List[Dict] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars: List[str] = []
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        # 目標陣列開啟時的深度（支援多張收據各自的items）
+        self._array_depths: List[int] = []
+        self._item_depth: Optional[int] = None
+        self._item_chars: List[str] = []
+
+    @property
+    def items_parsed(self) -> int:
+        return len(self.items)
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Consume a fragment and return the items completed by it
+        讀入一個片段，返回因此完成的商品項目
+        """
+        completed = []
+        for char in chunk:
+            if self._item_depth is not None:
+                self._item_chars.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = "".join(self._string_chars)
+                else:
+                    self._string_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_chars = []
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char in "{[":
+                self._depth += 1
+                if char == "[" and self._pending_key == self.array_key:
+                    self._array_depths.append(self._depth)
+                elif (
+                    char == "{"
+                    and self._item_depth is None
+                    and self._array_depths
+                    and self._depth == self._array_depths[-1] + 1
+                ):
+                    self._item_depth = self._depth
+                    self._item_chars = ["{"]
+                self._pending_key = None
+            elif char in "}]":
+                if char == "}" and self._depth == self._item_depth:
+                    try:
+                        completed.append(json.loads("".join(self._item_chars)))
+                    except ValueError:
+                        pass
+                    self._item_depth = None
+                elif (
+                    char == "]"
+                    and self._array_depths
+                    and self._depth == self._array_depths[-1]
+                ):
+                    self._array_depths.pop()
+                self._depth -= 1
+            elif char == ",":
+                self._pending_key = None
+
+        self.items.extend(completed)
+        return completed
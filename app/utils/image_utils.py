@@ -1,10 +1,23 @@
+import io
 import os
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
-from typing import Tuple, Optional
+from PIL import Image, ImageEnhance, ImageOps
+from typing import List, Tuple, Optional
 from loguru import logger
 
+# JPEG編碼品質範圍（二分搜尋符合大小限制的最高品質）
+MAX_JPEG_QUALITY = 95
+MIN_JPEG_QUALITY = 70
+
+# 收據輪廓偵測：偵測時的最長邊、最小面積比例、視為已貼齊邊界的面積比例
+DETECTION_MAX_SIDE = 800
+MIN_RECEIPT_AREA_RATIO = 0.1
+MAX_CROP_AREA_RATIO = 0.9
+# 多張收據分割：單張照片最多的收據數量與每張收據的最小面積比例
+MAX_RECEIPTS_PER_IMAGE = 6
+MIN_SPLIT_AREA_RATIO = 0.02
+
 
 class ImageUtils:
     """圖片處理工具類"""
@@ -60,13 +73,198 @@ class ImageUtils:
             return False
 
     @staticmethod
-    def preprocess_image(file_path: str, output_path: Optional[str] = None) -> str:
+    def _order_corners(points: np.ndarray) -> np.ndarray:
+        """將四個角點排序為 左上、右上、右下、左下"""
+        points = points.reshape(4, 2).astype("float32")
+        sums = points.sum(axis=1)
+        diffs = np.diff(points, axis=1).reshape(4)
+        return np.array(
+            [
+                points[np.argmin(sums)],
+                points[np.argmin(diffs)],
+                points[np.argmax(sums)],
+                points[np.argmax(diffs)],
+            ],
+            dtype="float32",
+        )
+
+    @staticmethod
+    def find_receipt_quads(
+        image: np.ndarray,
+        max_regions: int = 1,
+        min_area_ratio: float = MIN_RECEIPT_AREA_RATIO,
+    ) -> List[np.ndarray]:
+        """
+        偵測收據（淺色紙張）的四邊形輪廓
+
+        在縮小的灰階圖上以Otsu閾值分離紙張與背景，取面積最大的外輪廓；
+        能近似為四邊形時使用其角點，否則使用最小外接旋轉矩形（可處理捲曲或撕裂的邊緣）。
+
+        Args:
+            image: BGR或灰階圖片
+            max_regions: 最多返回的區域數
+            min_area_ratio: 區域佔整張圖片的最小面積比例
+
+        Returns:
+            原圖座標的角點陣列列表（左上、右上、右下、左下），依面積由大到小
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        height, width = gray.shape[:2]
+        scale = min(1.0, DETECTION_MAX_SIDE / max(height, width))
+        small = cv2.resize(
+            gray,
+            (int(width * scale), int(height * scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+        blurred = cv2.GaussianBlur(small, (5, 5), 0)
+        _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # 閉運算填補紙張上的文字，避免輪廓沿文字破碎
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_area = min_area_ratio * small.shape[0] * small.shape[1]
+
+        quads = []
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+            if cv2.contourArea(contour) < min_area or len(quads) >= max_regions:
+                break
+            approx = cv2.approxPolyDP(
+                contour, 0.02 * cv2.arcLength(contour, True), True
+            )
+            if len(approx) == 4 and cv2.isContourConvex(approx):
+                corners = approx
+            else:
+                corners = cv2.boxPoints(cv2.minAreaRect(contour))
+            quads.append(ImageUtils._order_corners(np.asarray(corners) / scale))
+        return quads
+
+    @staticmethod
+    def warp_quad(image: np.ndarray, quad: np.ndarray) -> np.ndarray:
+        """以透視轉換將四邊形區域拉正為矩形（同時校正傾斜）"""
+        top_left, top_right, bottom_right, bottom_left = quad
+        width = int(
+            max(
+                np.linalg.norm(top_right - top_left),
+                np.linalg.norm(bottom_right - bottom_left),
+            )
+        )
+        height = int(
+            max(
+                np.linalg.norm(bottom_left - top_left),
+                np.linalg.norm(bottom_right - top_right),
+            )
+        )
+        target = np.array(
+            [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+            dtype="float32",
+        )
+        matrix = cv2.getPerspectiveTransform(quad, target)
+        return cv2.warpPerspective(
+            image, matrix, (width, height), flags=cv2.INTER_CUBIC
+        )
+
+    @staticmethod
+    def crop_receipt(image: np.ndarray) -> Tuple[np.ndarray, bool]:
+        """
+        裁切並校正收據區域
+
+        Args:
+            image: BGR、RGB或灰階圖片
+
+        Returns:
+            (處理後的圖片, 是否有裁切)；找不到收據或收據已佔滿畫面時返回原圖
+        """
+        quads = ImageUtils.find_receipt_quads(image)
+        if not quads:
+            return image, False
+
+        area = cv2.contourArea(quads[0])
+        if area > MAX_CROP_AREA_RATIO * image.shape[0] * image.shape[1]:
+            return image, False
+
+        return ImageUtils.warp_quad(image, quads[0]), True
+
+    @staticmethod
+    def prepare_multi_receipt(
+        file_path: str,
+        max_regions: int = MAX_RECEIPTS_PER_IMAGE,
+        max_size_mb: float = 4.0,
+    ) -> dict:
+        """
+        準備含多張收據的照片：單次解碼、修正方向、編碼上傳位元組並偵測各收據區域
+
+        區域座標以上傳圖片的像素為準，與OCR返回的 boundingBox 使用相同座標系。
+
+        Args:
+            file_path: 輸入圖片路徑
+            max_regions: 最多偵測的收據數量
+            max_size_mb: 最大上傳大小（MB）
+
+        Returns:
+            {"image_data": 位元組, "regions": 各區域角點列表（由左至右）, "size": (寬, 高)}
+        """
+        max_bytes = int(max_size_mb * 1024 * 1024)
+        with Image.open(file_path) as source:
+            img = ImageOps.exif_transpose(source)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+
+            # 超過大小限制時逐步縮小（收據區域需與上傳的圖片一致）
+            data = ImageUtils.encode_jpeg_within(img, max_bytes)
+            while data is None and min(img.size) > 600:
+                img = img.resize(
+                    (int(img.width * 0.7), int(img.height * 0.7)),
+                    Image.Resampling.LANCZOS,
+                )
+                data = ImageUtils.encode_jpeg_within(img, max_bytes)
+            if data is None:
+                raise Exception("無法在大小限制內編碼圖片")
+
+            quads = ImageUtils.find_receipt_quads(
+                np.asarray(img),
+                max_regions=max_regions,
+                min_area_ratio=MIN_SPLIT_AREA_RATIO,
+            )
+            quads.sort(key=lambda quad: (quad[:, 0].mean(), quad[:, 1].mean()))
+            return {
+                "image_data": data,
+                "regions": [quad.tolist() for quad in quads],
+                "size": img.size,
+            }
+
+    @staticmethod
+    def region_for_point(x: float, y: float, regions: List[List[List[float]]]) -> int:
+        """
+        返回包含該點的區域索引；不在任何區域內時返回最接近的區域
+
+        Args:
+            x, y: 點座標
+            regions: 各區域的角點列表
+
+        Returns:
+            區域索引
+        """
+        distances = [
+            cv2.pointPolygonTest(
+                np.array(region, dtype="float32"), (float(x), float(y)), True
+            )
+            for region in regions
+        ]
+        return int(np.argmax(distances))
+
+    @staticmethod
+    def preprocess_image(
+        file_path: str, output_path: Optional[str] = None, crop: bool = True
+    ) -> str:
         """
         預處理圖片以提高OCR準確性
 
         Args:
             file_path: 輸入圖片路徑
             output_path: 輸出圖片路徑（可選）
+            crop: 是否先裁切並校正收據區域
 
         Returns:
             處理後的圖片路徑
@@ -77,6 +275,10 @@ class ImageUtils:
             if image is None:
                 raise Exception("無法讀取圖片")
 
+            # 裁切收據區域並校正傾斜（移除背景）
+            if crop:
+                image, _ = ImageUtils.crop_receipt(image)
+
             # 轉換為灰度圖
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
@@ -108,78 +310,161 @@ class ImageUtils:
             raise
 
     @staticmethod
-    def enhance_image_quality(
-        file_path: str, output_path: Optional[str] = None, max_size_mb: float = 4.0
-    ) -> str:
+    def _enhance(img: Image.Image) -> Image.Image:
+        """增強對比度、銳度與亮度"""
+        img = ImageEnhance.Contrast(img).enhance(1.5)
+        img = ImageEnhance.Sharpness(img).enhance(1.2)
+        return ImageEnhance.Brightness(img).enhance(1.1)
+
+    @staticmethod
+    def encode_jpeg_within(img: Image.Image, max_bytes: int) -> Optional[bytes]:
         """
-        增強圖片品質
+        以二分搜尋找出不超過大小限制的最高JPEG品質
+
+        Args:
+            img: RGB圖片
+            max_bytes: 最大位元組數
+
+        Returns:
+            JPEG位元組；最低品質仍超過限制時返回None
+        """
+
+        def encode(quality: int) -> bytes:
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=quality, optimize=True)
+            return buffer.getvalue()
+
+        # 多數收據以最高品質即符合限制，只需編碼一次
+        best = encode(MAX_JPEG_QUALITY)
+        if len(best) <= max_bytes:
+            return best
+
+        best = None
+        low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY - 1
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode(quality)
+            if len(data) <= max_bytes:
+                best, low = data, quality + 1
+            else:
+                high = quality - 1
+        return best
+
+    @staticmethod
+    def prepare_for_ocr(
+        file_path: str,
+        enhance: bool = False,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        max_size_mb: float = 4.0,
+        crop: bool = False,
+    ) -> bytes:
+        """
+        單次解碼、在記憶體中完成預處理，直接輸出OCR上傳用的位元組
+
+        依EXIF修正方向、裁切收據區域、縮小尺寸、增強品質後編碼為JPEG，過程中不寫入暫存檔。
+        不需任何處理時返回原始檔案內容；增強後無法符合大小限制時也返回原始內容。
 
         Args:
             file_path: 輸入圖片路徑
-            output_path: 輸出圖片路徑（可選）
+            enhance: 是否增強對比度、銳度與亮度
+            max_width: 最大寬度（可選）
+            max_height: 最大高度（可選）
             max_size_mb: 最大檔案大小（MB）
+            crop: 是否裁切並校正收據區域（移除背景）
 
         Returns:
-            增強後的圖片路徑
+            OCR上傳用的圖片位元組
         """
-        try:
-            # 檢查原始檔案大小
-            original_size = os.path.getsize(file_path) / (1024 * 1024)  # MB
-            logger.info(f"原始圖片大小: {original_size:.2f}MB")
+        with open(file_path, "rb") as f:
+            original = f.read()
 
-            if original_size > max_size_mb:
-                logger.warning(f"原始圖片已超過{max_size_mb}MB限制，跳過增強處理")
-                return file_path
+        max_bytes = int(max_size_mb * 1024 * 1024)
+        if enhance and len(original) > max_bytes:
+            logger.warning(f"原始圖片已超過{max_size_mb}MB限制，跳過增強處理")
+            enhance = False
+
+        try:
+            with Image.open(io.BytesIO(original)) as source:
+                # EXIF方向標籤（0x0112）不是1時需要旋轉
+                changed = source.getexif().get(0x0112, 1) != 1
+                img = ImageOps.exif_transpose(source) if changed else source
+
+                if crop:
+                    if img.mode != "RGB":
+                        img = img.convert("RGB")
+                    cropped, was_cropped = ImageUtils.crop_receipt(np.asarray(img))
+                    if was_cropped:
+                        img = Image.fromarray(cropped)
+                        changed = True
+
+                if max_width and max_height:
+                    width, height = img.size
+                    scale = min(max_width / width, max_height / height, 1.0)
+                    if scale < 1.0:
+                        img = img.resize(
+                            (int(width * scale), int(height * scale)),
+                            Image.Resampling.LANCZOS,
+                        )
+                        changed = True
+
+                if not changed and not enhance:
+                    return original
 
-            # 使用PIL開啟圖片
-            with Image.open(file_path) as img:
-                # 轉換為RGB模式
                 if img.mode != "RGB":
                     img = img.convert("RGB")
+                if enhance:
+                    img = ImageUtils._enhance(img)
 
-                # 增強對比度
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.5)
+                data = ImageUtils.encode_jpeg_within(img, max_bytes)
 
-                # 增強銳度
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(1.2)
+        except Exception as e:
+            logger.error(f"圖片預處理失敗: {str(e)}")
+            return original
 
-                # 增強亮度
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(1.1)
+        if data is None:
+            logger.warning("無法在品質限制內達到檔案大小要求，使用原始圖片")
+            return original
 
-                # 確定輸出路徑
-                if output_path is None:
-                    base_name = os.path.splitext(file_path)[0]
-                    output_path = f"{base_name}_enhanced.jpg"
-
-                # 動態調整品質以控制檔案大小
-                quality = 95
-                while quality > 70:  # 最低品質限制
-                    img.save(output_path, "JPEG", quality=quality, optimize=True)
-
-                    # 檢查增強後的檔案大小
-                    enhanced_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
-                    logger.info(
-                        f"增強後圖片大小: {enhanced_size:.2f}MB (品質: {quality})"
-                    )
-
-                    # 如果檔案大小在限制內，使用這個版本
-                    if enhanced_size <= max_size_mb:
-                        logger.info(f"圖片品質增強完成: {output_path}")
-                        return output_path
-
-                    # 如果檔案太大，降低品質重試
-                    quality -= 5
-                    logger.info(f"檔案太大，降低品質到 {quality}")
-
-                # 如果所有品質都太大，使用原始圖片
-                logger.warning(f"無法在品質限制內達到檔案大小要求，使用原始圖片")
-                if os.path.exists(output_path):
-                    os.remove(output_path)
+        logger.info(
+            f"圖片預處理完成: {os.path.basename(file_path)} "
+            f"({len(original) / (1024 * 1024):.2f}MB -> {len(data) / (1024 * 1024):.2f}MB)"
+        )
+        return data
+
+    @staticmethod
+    def enhance_image_quality(
+        file_path: str, output_path: Optional[str] = None, max_size_mb: float = 4.0
+    ) -> str:
+        """
+        增強圖片品質（寫入檔案；OCR請使用 prepare_for_ocr 直接取得位元組）
+
+        Args:
+            file_path: 輸入圖片路徑
+            output_path: 輸出圖片路徑（可選）
+            max_size_mb: 最大檔案大小（MB）
+
+        Returns:
+            增強後的圖片路徑
+        """
+        try:
+            with open(file_path, "rb") as f:
+                original = f.read()
+            data = ImageUtils.prepare_for_ocr(
+                file_path, enhance=True, max_size_mb=max_size_mb
+            )
+            if data == original:
                 return file_path
 
+            if output_path is None:
+                base_name = os.path.splitext(file_path)[0]
+                output_path = f"{base_name}_enhanced.jpg"
+            with open(output_path, "wb") as f:
+                f.write(data)
+
+            logger.info(f"圖片品質增強完成: {output_path}")
+            return output_path
+
         except Exception as e:
             logger.error(f"圖片品質增強失敗: {str(e)}")
             return file_path
@@ -236,6 +521,38 @@ class ImageUtils:
             logger.error(f"圖片大小調整失敗: {str(e)}")
             raise
 
+    @staticmethod
+    def compute_dhash(file_path: str, hash_size: int = 8) -> int:
+        """
+        計算圖片的差異雜湊（dHash），用於偵測近似重複的圖片
+
+        Args:
+            file_path: 圖片檔案路徑
+            hash_size: 雜湊邊長（8 產生64位元雜湊）
+
+        Returns:
+            dHash整數值
+        """
+        image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise Exception(f"無法讀取圖片: {file_path}")
+
+        # 縮小為 (hash_size + 1) x hash_size，比較水平相鄰像素的明暗
+        resized = cv2.resize(
+            image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA
+        )
+        diff = resized[:, 1:] > resized[:, :-1]
+
+        value = 0
+        for bit in diff.flatten():
+            value = (value << 1) | int(bit)
+        return value
+
+    @staticmethod
+    def hamming_distance(hash_a: int, hash_b: int) -> int:
+        """計算兩個雜湊值的漢明距離"""
+        return bin(hash_a ^ hash_b).count("1")
+
     @staticmethod
     def get_image_info(file_path: str) -> dict:
         """
@@ -140,9 +140,7 @@ async def test_individual_files():
 
         try:
             # 測試單個檔案處理
-            result = await optimized_batch_processor._process_single_item_optimized(
-                filename
-            )
+            result = await optimized_batch_processor.process_single(filename)
 
             if result.get("success"):
                 print(f"   ✅ 處理成功")
@@ -0,0 +1,131 @@
+"""
+測試多張收據合併為一次Claude請求
+"""
+
+import sys
+import os
+import asyncio
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.models.receipt import ReceiptData
+from app.services.ai_service import ai_service, estimate_tokens
+
+
+def make_entry(store, total, text_length=0):
+    text = f"{store}\n合計 {total}円\n" + "あ" * text_length
+    return {
+        "filename": f"{store}.jpg",
+        "ocr_data": {"text": text, "confidence": 0.9},
+        "structured_data": {},
+    }
+
+
+def receipt_json(receipt_id, store, total):
+    return {
+        "id": receipt_id,
+        "store_name": store,
+        "date": "2024-08-17",
+        "total_amount": total,
+        "items": [],
+        "tax_type": "內含稅",
+    }
+
+
+def run_group(entries, response):
+    """以假的Claude回應執行分組處理，返回 (結果, 批次請求數, 單張請求數)"""
+    batch_calls = []
+    single_calls = []
+
+    async def fake_call(
+        prompt, tool_name, max_tokens=2000, model=None, on_progress=None
+    ):
+        batch_calls.append(max_tokens)
+        return response
+
+    async def fake_single(ocr_data, structured_data):
+        single_calls.append(ocr_data["text"])
+        return ReceiptData(
+            store_name="single",
+            date=datetime(2024, 1, 1),
+            total_amount=0,
+            confidence_score=0.9,
+            processing_time=0.0,
+            source_image="",
+        )
+
+    original = (
+        ai_service._call_claude_tool,
+        ai_service.process_receipt_text,
+        ai_service.test_mode,
+        ai_service.router.enabled,
+    )
+    ai_service._call_claude_tool = fake_call
+    ai_service.process_receipt_text = fake_single
+    ai_service.test_mode = False
+    ai_service.router.enabled = False
+    try:
+        results = asyncio.run(ai_service.process_receipt_group(entries))
+    finally:
+        (
+            ai_service._call_claude_tool,
+            ai_service.process_receipt_text,
+            ai_service.test_mode,
+            ai_service.router.enabled,
+        ) = original
+    return results, batch_calls, single_calls
+
+
+def test_plan_batches_by_count_and_budget():
+    """依收據數上限與token預算分組"""
+    original = (settings.claude_batch_max_receipts, settings.claude_batch_token_budget)
+    settings.claude_batch_max_receipts = 3
+    settings.claude_batch_token_budget = 500
+    try:
+        small = [make_entry(f"store{i}", 100) for i in range(7)]
+        assert [len(g) for g in ai_service.plan_receipt_batches(small)] == [3, 3, 1]
+
+        large = [make_entry("a", 1, 300), make_entry("b", 1, 300), make_entry("c", 1)]
+        assert [len(g) for g in ai_service.plan_receipt_batches(large)] == [1, 2]
+    finally:
+        settings.claude_batch_max_receipts, settings.claude_batch_token_budget = (
+            original
+        )
+
+    assert estimate_tokens("あいう") > estimate_tokens("abc")
+
+
+def test_batched_response_mapped_by_id():
+    """批次回應依id對應，缺少的收據改為單張請求"""
+    entries = [
+        make_entry("セブン", 270),
+        make_entry("ローソン", 500),
+        make_entry("ファミマ", 800),
+    ]
+    response = {
+        "receipts": [
+            receipt_json("R3", "ファミマ", 800),
+            receipt_json("R1", "セブン", 270),
+        ]
+    }
+
+    results, batch_calls, single_calls = run_group(entries, response)
+
+    assert len(batch_calls) == 1 and batch_calls[0] == 6000
+    assert [r.store_name for r in results] == ["セブン", "single", "ファミマ"]
+    assert len(single_calls) == 1 and "ローソン" in single_calls[0]
+
+
+def test_invalid_entries_fall_back():
+    """未通過模型驗證的收據改為單張請求"""
+    entries = [make_entry("セブン", 270), make_entry("ローソン", 500)]
+    invalid = {**receipt_json("R2", "ローソン", 500), "date": "2024/08/17"}
+    response = {"receipts": [receipt_json("R1", "セブン", "不明"), invalid]}
+
+    results, batch_calls, single_calls = run_group(entries, response)
+
+    assert len(batch_calls) == 1
+    assert len(single_calls) == 2
+    assert all(r.store_name == "single" for r in results)
@@ -0,0 +1,198 @@
+"""
+測試AIService的連線池、重試策略與斷路器（使用本機模擬伺服器）
+"""
+
+import sys
+import os
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ai_service import AIService
+from app.services.retry_policy import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+SUCCESS_BODY = {
+    "content": [{"type": "text", "text": "{}"}],
+    "usage": {"input_tokens": 10, "output_tokens": 5},
+}
+OVERLOADED_BODY = {
+    "type": "error",
+    "error": {"type": "overloaded_error", "message": "Overloaded"},
+}
+
+
+def start_stub_server(responses, requests):
+    """依序返回 (狀態碼, 內容, 標頭)；用完後重複最後一個回應"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["content-length"]))
+            requests.append(self.client_address[1])
+            status, body, headers = responses[min(len(requests), len(responses)) - 1]
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_service(server, max_retries=3, failure_threshold=5):
+    service = AIService()
+    service.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+    service.retry_policy = RetryPolicy(
+        max_retries=max_retries, base_delay=0.01, max_delay=0.05
+    )
+    service.circuit_breaker = CircuitBreaker(
+        "claude-test", failure_threshold, reset_seconds=60
+    )
+    return service
+
+
+def test_backoff_honors_retry_after_and_caps():
+    """退避延遲不超過上限，且不少於Retry-After"""
+    policy = RetryPolicy(max_retries=5, base_delay=1.0, max_delay=10.0)
+    for attempt in range(8):
+        assert 0 <= policy.next_delay(attempt) <= min(10.0, 2**attempt)
+    assert policy.next_delay(0, retry_after=3.0) >= 3.0
+    assert policy.next_delay(0, retry_after=120.0) == 10.0
+
+
+def test_retries_overloaded_and_rate_limited_on_pooled_connection():
+    """529與429（retry-after）後重試成功，所有嘗試共用同一條keep-alive連線"""
+    requests = []
+    server = start_stub_server(
+        [
+            (529, OVERLOADED_BODY, {}),
+            (429, {"type": "error"}, {"retry-after": "0"}),
+            (200, SUCCESS_BODY, {}),
+        ],
+        requests,
+    )
+    service = make_service(server)
+    try:
+
+        async def run():
+            text = await service._call_claude_api("prompt")
+            await service.aclose()
+            return text
+
+        text = asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert text == "{}"
+    assert len(requests) == 3
+    assert len(set(requests)) == 1
+    assert service.circuit_breaker.get_status() == {
+        "state": "closed",
+        "consecutive_failures": 0,
+    }
+    assert service.http._client is None
+
+
+def test_client_errors_fail_without_retry():
+    """400等用戶端錯誤不重試"""
+    requests = []
+    server = start_stub_server([(400, {"type": "error"}, {})], requests)
+    service = make_service(server)
+    try:
+        try:
+            asyncio.run(service._call_claude_api("prompt"))
+            raised = False
+        except Exception as e:
+            raised = "400" in str(e)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert raised
+    assert len(requests) == 1
+
+
+def test_circuit_breaker_opens_after_repeated_failures():
+    """連續失敗達門檻後斷路器開啟，之後的請求不再送出"""
+    requests = []
+    server = start_stub_server([(503, {"type": "error"}, {})], requests)
+    service = make_service(server, max_retries=1, failure_threshold=2)
+    try:
+
+        async def run():
+            try:
+                await service._call_claude_api("prompt")
+            except Exception:
+                pass
+            try:
+                await service._call_claude_api("prompt")
+            except CircuitOpenError:
+                return True
+            return False
+
+        rejected = asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert rejected
+    assert len(requests) == 2
+    assert service.circuit_breaker.state == "open"
+
+
+def test_half_open_trial_released_after_stream_error_or_cancel():
+    """試探請求因串流錯誤或取消而結束時，斷路器不會停在試探中"""
+    requests = []
+    server = start_stub_server([(200, SUCCESS_BODY, {})], requests)
+    service = make_service(server, max_retries=0, failure_threshold=1)
+    service.circuit_breaker.reset_seconds = 0
+    outcomes = []
+
+    async def stream_error(response):
+        raise Exception("Claude串流錯誤: invalid_request_error")
+
+    async def cancelled(response):
+        raise asyncio.CancelledError()
+
+    try:
+
+        async def run():
+            for consume in (stream_error, cancelled):
+                # 斷路器開啟後立即進入half-open（reset_seconds=0）
+                service.circuit_breaker.record_failure()
+                try:
+                    await service.send_request(
+                        "POST", service.base_url, {}, consume=consume
+                    )
+                except asyncio.CancelledError:
+                    outcomes.append("cancelled")
+                except CircuitOpenError:
+                    outcomes.append("rejected")
+                except Exception:
+                    outcomes.append("error")
+                assert not service.circuit_breaker.trial_in_flight
+            response = await service.send_request("POST", service.base_url, {})
+            await service.aclose()
+            return response.status_code
+
+        status = asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert outcomes == ["error", "cancelled"]
+    assert status == 200
+    assert service.circuit_breaker.state == "closed"
@@ -0,0 +1,94 @@
+"""
+測試SQLite暫存儲存與JSON暫存遷移
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.cache_service import CacheService
+from app.services.cache_store import key_digest, parse_legacy_filename
+
+DIGEST = "a" * 64
+CONTENT_KEY = f"{DIGEST}_0123456789ab"
+
+
+def test_key_parsing():
+    """解析內容定址鍵與舊版暫存檔名"""
+    assert key_digest(CONTENT_KEY) == DIGEST
+    assert key_digest("receipt_20240101_120000_001.jpg") is None
+    assert parse_legacy_filename("ocr_receipt_1.jpg_1700000000.json") == (
+        "ocr",
+        "receipt_1.jpg",
+        1700000000,
+    )
+    assert parse_legacy_filename("status_abc-123.json") == ("status", "abc-123", None)
+    assert parse_legacy_filename("cache.db") is None
+
+
+def test_save_and_load_roundtrip():
+    """儲存後可依鍵、圖片雜湊與返回的參照載入"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=tmp)
+        reference = cache.save_ocr_result(
+            "receipt_a.jpg", {"text": "セブン"}, cache_key=CONTENT_KEY
+        )
+
+        assert cache.load_ocr_result(reference)["ocr_data"]["text"] == "セブン"
+        assert cache.load_ocr_result(DIGEST)["filename"] == "receipt_a.jpg"
+        assert cache.load_ocr_result("missing.jpg") is None
+
+        # 覆寫同一個鍵只保留一筆
+        cache.save_ocr_result(
+            "receipt_b.jpg", {"text": "ローソン"}, cache_key=CONTENT_KEY
+        )
+        summary = cache.get_cache_summary()
+        assert summary["ocr_files"] == 1
+        assert summary["backend"] == "sqlite"
+
+        cache.save_processing_status("batch-1", {"cache_files": [reference]})
+        assert cache.load_processing_status("batch-1")["status"]["cache_files"] == [
+            reference
+        ]
+
+        assert cache.delete_ocr_cache(CONTENT_KEY)
+        assert cache.load_ocr_result(CONTENT_KEY) is None
+
+
+def test_migrates_legacy_json_files():
+    """啟動時匯入舊版JSON暫存，舊路徑仍可載入"""
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = {
+            "ocr_receipt_1.jpg_1700000000.json": {
+                "filename": "receipt_1.jpg",
+                "ocr_data": {"text": "舊資料"},
+            },
+            "ocr_receipt_1.jpg_1700000100.json": {
+                "filename": "receipt_1.jpg",
+                "ocr_data": {"text": "新資料"},
+            },
+            "status_batch-1.json": {
+                "batch_id": "batch-1",
+                "status": {
+                    "cache_files": [
+                        os.path.join(tmp, "ocr_receipt_1.jpg_1700000100.json")
+                    ]
+                },
+            },
+        }
+        for name, data in legacy.items():
+            with open(os.path.join(tmp, name), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+
+        cache = CacheService(cache_dir=tmp)
+
+        assert not [name for name in os.listdir(tmp) if name.endswith(".json")]
+        assert len(os.listdir(os.path.join(tmp, "migrated"))) == 3
+        assert cache.load_ocr_result("receipt_1.jpg")["ocr_data"]["text"] == "新資料"
+
+        status = cache.load_processing_status("batch-1")
+        old_path = status["status"]["cache_files"][0]
+        assert cache.load_ocr_result(old_path)["ocr_data"]["text"] == "新資料"
@@ -0,0 +1,188 @@
+"""
+測試以內容雜湊為鍵的OCR/AI暫存
+"""
+
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ai_service import ai_service
+from app.services.cache_service import CacheService
+from app.services.content_hash import (
+    ContentHasher,
+    PREPROCESS_ENHANCE,
+    PREPROCESS_RAW,
+)
+
+
+def write_file(directory, name, data):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_same_content_same_key():
+    """相同內容不同檔名應得到相同的暫存鍵"""
+    hasher = ContentHasher()
+    with tempfile.TemporaryDirectory() as tmp:
+        first = write_file(tmp, "receipt_20240101_000001.jpg", b"receipt-bytes")
+        second = write_file(tmp, "receipt_20240102_000002.jpg", b"receipt-bytes")
+        other = write_file(tmp, "receipt_20240103_000003.jpg", b"other-bytes")
+
+        assert hasher.ocr_key(first, PREPROCESS_RAW) == hasher.ocr_key(
+            second, PREPROCESS_RAW
+        )
+        assert hasher.ocr_key(first, PREPROCESS_RAW) != hasher.ocr_key(
+            other, PREPROCESS_RAW
+        )
+
+
+def test_pipeline_version_changes_key():
+    """預處理方式或提示詞版本變更時產生新的暫存鍵"""
+    hasher = ContentHasher()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, "receipt.jpg", b"receipt-bytes")
+
+        assert hasher.ocr_key(path, PREPROCESS_RAW) != hasher.ocr_key(
+            path, PREPROCESS_ENHANCE
+        )
+
+        ocr_key = hasher.ocr_key(path, PREPROCESS_RAW)
+        ai_key = hasher.ai_key(path, PREPROCESS_RAW)
+        original_version = ai_service.prompt_version
+        try:
+            ai_service.prompt_version = original_version + "-next"
+            assert hasher.ocr_key(path, PREPROCESS_RAW) == ocr_key
+            assert hasher.ai_key(path, PREPROCESS_RAW) != ai_key
+        finally:
+            ai_service.prompt_version = original_version
+
+
+def test_digest_recomputed_when_file_changes():
+    """檔案內容變更後重新計算雜湊"""
+    hasher = ContentHasher()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_file(tmp, "receipt.jpg", b"first")
+        first_digest = hasher.image_digest(path)
+        write_file(tmp, "receipt.jpg", b"second-version")
+
+        assert hasher.image_digest(path) != first_digest
+
+
+def test_cache_hit_across_uploads():
+    """重新上傳相同收據時可從暫存取得OCR結果，並保留原始檔名"""
+    hasher = ContentHasher()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        first = write_file(tmp, "receipt_a.jpg", b"receipt-bytes")
+        second = write_file(tmp, "receipt_b.jpg", b"receipt-bytes")
+
+        cache.save_ocr_result(
+            "receipt_a.jpg",
+            {"success": True, "text": "ローソン"},
+            cache_key=hasher.ocr_key(first, PREPROCESS_RAW),
+        )
+
+        cached = cache.load_ocr_result(hasher.ocr_key(second, PREPROCESS_RAW))
+        assert cached["ocr_data"]["text"] == "ローソン"
+        assert cached["filename"] == "receipt_a.jpg"
+
+        # 以圖片雜湊可查到任一預處理方式的暫存
+        assert cache.load_ocr_result(hasher.image_digest(second)) is not None
+        assert cache.load_ocr_result(hasher.ocr_key(second, PREPROCESS_ENHANCE)) is None
+
+
+def test_failed_ocr_not_cached():
+    """OCR失敗的結果不寫入暫存，重新上傳時會重新識別"""
+    import asyncio
+    from PIL import Image
+    from app.services import batch_processor as batch_module
+    from app.services.ocr_service import ocr_service
+
+    calls = []
+
+    async def failing_extract_text(image_path, image_data=None):
+        calls.append(image_path)
+        return {"success": False, "error": "InvalidImage"}
+
+    upload_dir = "./data/receipts"
+    created_dir = not os.path.exists(upload_dir)
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = "test_failed_ocr_not_cached.jpg"
+    path = os.path.join(upload_dir, filename)
+    Image.new("RGB", (60, 40), color="white").save(path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        original = (batch_module.cache_service, ocr_service.extract_text)
+        batch_module.cache_service = cache
+        ocr_service.extract_text = failing_extract_text
+        try:
+            first = asyncio.run(
+                batch_module.batch_processor.process_single_item(filename)
+            )
+            second = asyncio.run(
+                batch_module.batch_processor.process_single_item(filename)
+            )
+            cached = cache.load_ocr_result(ContentHasher().image_digest(path))
+        finally:
+            batch_module.cache_service, ocr_service.extract_text = original
+            cache.store.close()
+            os.remove(path)
+            if created_dir:
+                os.removedirs(upload_dir)
+
+    assert not first["success"] and first["error"] == "InvalidImage"
+    assert not second["success"]
+    assert len(calls) == 2
+    assert cached is None
+
+
+def test_failed_ocr_only_not_cached():
+    """只執行OCR時，失敗的OCR結果計為失敗且不寫入暫存"""
+    import asyncio
+    from PIL import Image
+    from app.services import batch_processor as batch_module
+    from app.services.ocr_service import ocr_service
+
+    calls = []
+
+    async def failing_extract_text(image_path, image_data=None):
+        calls.append(image_path)
+        return {"success": False, "error": "InvalidImage"}
+
+    upload_dir = "./data/receipts"
+    created_dir = not os.path.exists(upload_dir)
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = "test_failed_ocr_only_not_cached.jpg"
+    path = os.path.join(upload_dir, filename)
+    Image.new("RGB", (60, 40), color="white").save(path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        original = (batch_module.cache_service, ocr_service.extract_text)
+        batch_module.cache_service = cache
+        ocr_service.extract_text = failing_extract_text
+        try:
+            first = asyncio.run(
+                batch_module.batch_processor.process_ocr_only([filename])
+            )
+            second = asyncio.run(
+                batch_module.batch_processor.process_ocr_only([filename])
+            )
+            status = cache.load_processing_status(first["batch_id"])
+        finally:
+            batch_module.cache_service, ocr_service.extract_text = original
+            cache.store.close()
+            os.remove(path)
+            if created_dir:
+                os.removedirs(upload_dir)
+
+    assert first["processed_count"] == 0 and first["failed_count"] == 1
+    assert first["failed_files"][0]["error"] == "InvalidImage"
+    assert second["failed_count"] == 1
+    assert len(calls) == 2
+    assert status["status"]["cache_files"] == []
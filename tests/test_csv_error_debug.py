@@ -62,9 +62,7 @@ async def test_single_processing():
 
     try:
         # 測試單個處理
-        result = await optimized_batch_processor._process_single_item_optimized(
-            filename
-        )
+        result = await optimized_batch_processor.process_single(filename)
 
         print(f"\n📊 處理結果:")
         print(f"   成功: {result.get('success')}")
@@ -0,0 +1,147 @@
+"""
+測試以感知雜湊偵測近似重複的收據
+"""
+
+import sys
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.cache_service import CacheService
+from app.services.content_hash import ContentHasher, PREPROCESS_RAW
+from app.services.duplicate_detector import DuplicateDetector
+from app.utils.image_utils import image_utils
+
+
+def make_receipt_image(seed):
+    """產生帶有文字列的假收據圖片"""
+    rng = np.random.default_rng(seed)
+    image = np.full((400, 300), 255, dtype=np.uint8)
+    for row in range(20, 380, 24):
+        width = int(rng.integers(80, 260))
+        cv2.rectangle(image, (20, row), (20 + width, row + 10), 0, -1)
+    return image
+
+
+def write_image(directory, name, image, quality=95):
+    path = os.path.join(directory, name)
+    cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return path
+
+
+def make_detector(tmp, **kwargs):
+    cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+    hasher = ContentHasher()
+    return cache, hasher, DuplicateDetector(store=cache.store, hasher=hasher, **kwargs)
+
+
+def test_dhash_stable_under_recompression():
+    """重新壓縮的圖片dHash距離很小，不同收據距離大"""
+    with tempfile.TemporaryDirectory() as tmp:
+        original = write_image(tmp, "a.jpg", make_receipt_image(1), quality=95)
+        recompressed = write_image(tmp, "b.jpg", make_receipt_image(1), quality=40)
+        other = write_image(tmp, "c.jpg", make_receipt_image(2))
+
+        hash_a = image_utils.compute_dhash(original)
+        assert (
+            image_utils.hamming_distance(
+                hash_a, image_utils.compute_dhash(recompressed)
+            )
+            <= 6
+        )
+        assert (
+            image_utils.hamming_distance(hash_a, image_utils.compute_dhash(other)) > 6
+        )
+
+
+def test_link_requires_matching_ocr_text():
+    """上傳時只標記；OCR文字一致後才沿用第一次上傳的暫存，文字不同的收據不連結"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, hasher, detector = make_detector(tmp, threshold=6, link_results=True)
+        first = write_image(tmp, "receipt_1.jpg", make_receipt_image(1), quality=95)
+        copy = write_image(tmp, "receipt_2.jpg", make_receipt_image(1), quality=40)
+        lookalike = write_image(tmp, "receipt_3.jpg", make_receipt_image(1), quality=70)
+
+        assert detector.check_and_register(first, "receipt_1.jpg") is None
+        cache.save_ocr_result(
+            "receipt_1.jpg",
+            {"success": True, "text": "ローソン\n合計 ¥270"},
+            cache_key=hasher.ocr_key(first, PREPROCESS_RAW),
+        )
+
+        duplicate = detector.check_and_register(copy, "receipt_2.jpg")
+        assert duplicate["filename"] == "receipt_1.jpg"
+        assert duplicate["has_result"] is True
+        assert duplicate["linked"] is False
+        assert hasher.ocr_key(copy, PREPROCESS_RAW) != hasher.ocr_key(
+            first, PREPROCESS_RAW
+        )
+
+        # 版面相同但文字不同的收據：雜湊接近，仍不連結
+        detector.check_and_register(lookalike, "receipt_3.jpg")
+        assert (
+            detector.confirm_duplicate(
+                lookalike, {"success": True, "text": "ローソン\n合計 ¥370"}
+            )
+            is None
+        )
+        assert hasher.ai_key(lookalike, PREPROCESS_RAW) != hasher.ai_key(
+            first, PREPROCESS_RAW
+        )
+
+        # 文字一致（忽略空白）時連結
+        linked = detector.confirm_duplicate(
+            copy, {"success": True, "text": "ローソン 合計 ¥270"}
+        )
+        assert linked == "receipt_1.jpg"
+        assert hasher.ai_key(copy, PREPROCESS_RAW) == hasher.ai_key(
+            first, PREPROCESS_RAW
+        )
+
+        # 重新啟動後只保留經確認的連結
+        restarted_hasher = ContentHasher()
+        DuplicateDetector(store=cache.store, hasher=restarted_hasher, link_results=True)
+        assert restarted_hasher.canonical_digest(copy) == hasher.image_digest(first)
+        assert restarted_hasher.canonical_digest(lookalike) == hasher.image_digest(
+            lookalike
+        )
+
+
+def test_unverified_links_ignored():
+    """舊版未經文字確認的連結在載入時不使用"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache, hasher, _ = make_detector(tmp, threshold=6, link_results=True)
+        first = write_image(tmp, "receipt_1.jpg", make_receipt_image(1))
+        second = write_image(tmp, "receipt_2.jpg", make_receipt_image(2))
+        cache.store.put_image_hash(
+            hasher.image_digest(second), 0, hasher.image_digest(first), "receipt_2.jpg"
+        )
+
+        restarted_hasher = ContentHasher()
+        DuplicateDetector(store=cache.store, hasher=restarted_hasher, link_results=True)
+        assert restarted_hasher.canonical_digest(second) == hasher.image_digest(second)
+
+
+def test_flag_only_and_distinct_receipts():
+    """停用連結（預設）時只標記，不同收據不視為重複"""
+    with tempfile.TemporaryDirectory() as tmp:
+        _, hasher, detector = make_detector(tmp, threshold=6, link_results=False)
+        first = write_image(tmp, "receipt_1.jpg", make_receipt_image(1), quality=95)
+        second = write_image(tmp, "receipt_2.jpg", make_receipt_image(1), quality=40)
+        other = write_image(tmp, "receipt_3.jpg", make_receipt_image(2))
+
+        detector.check_and_register(first, "receipt_1.jpg")
+        duplicate = detector.check_and_register(second, "receipt_2.jpg")
+        assert duplicate["linked"] is False
+        assert duplicate["has_result"] is False
+        assert hasher.canonical_digest(second) == hasher.image_digest(second)
+        assert (
+            detector.confirm_duplicate(second, {"success": True, "text": "ローソン"})
+            is None
+        )
+
+        assert detector.check_and_register(other, "receipt_3.jpg") is None
@@ -0,0 +1,39 @@
+"""
+測試共用連線池HTTP客戶端
+"""
+
+import sys
+import os
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.http_client import PooledAsyncClient
+
+
+def test_client_reused_within_loop():
+    """同一事件迴圈內應重用同一個客戶端"""
+    pooled = PooledAsyncClient("test", max_connections=4, http2=False)
+
+    async def run():
+        first = await pooled.get_client()
+        second = await pooled.get_client()
+        same = first is second
+        await pooled.aclose()
+        return same, first.is_closed
+
+    same, closed = asyncio.run(run())
+    assert same
+    assert closed
+
+
+def test_client_rebuilt_for_new_loop():
+    """事件迴圈改變時應重新建立客戶端"""
+    pooled = PooledAsyncClient("test", http2=False)
+
+    async def get():
+        return await pooled.get_client()
+
+    first = asyncio.run(get())
+    second = asyncio.run(get())
+    assert first is not second
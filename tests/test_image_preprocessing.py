@@ -0,0 +1,82 @@
+"""
+測試單次解碼的記憶體內圖片預處理
+"""
+
+import sys
+import os
+import io
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.image_utils import image_utils, MIN_JPEG_QUALITY
+
+
+def write_image(directory, name, size=(600, 400), orientation=None, noise=False):
+    path = os.path.join(directory, name)
+    if noise:
+        pixels = np.random.default_rng(0).integers(
+            0, 255, (size[1], size[0], 3), dtype=np.uint8
+        )
+        img = Image.fromarray(pixels)
+    else:
+        img = Image.new("RGB", size, (240, 240, 240))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(path, "JPEG", quality=95, exif=exif.tobytes())
+    return path
+
+
+def test_untouched_image_returns_original_bytes():
+    """不需處理時直接返回原始檔案內容，且不產生暫存檔"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_image(tmp, "receipt.jpg")
+        with open(path, "rb") as f:
+            original = f.read()
+
+        assert (
+            image_utils.prepare_for_ocr(path, max_width=1200, max_height=1600)
+            == original
+        )
+        assert os.listdir(tmp) == ["receipt.jpg"]
+
+
+def test_resize_and_orientation_in_memory():
+    """依EXIF方向旋轉並縮小，全程不寫入磁碟"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_image(tmp, "receipt.jpg", size=(2400, 1200), orientation=6)
+
+        data = image_utils.prepare_for_ocr(path, max_width=1200, max_height=1600)
+        with Image.open(io.BytesIO(data)) as img:
+            # 旋轉90度後為 1200x2400，再縮放到 800x1600
+            assert img.size == (800, 1600)
+        assert os.listdir(tmp) == ["receipt.jpg"]
+
+
+def test_quality_search_fits_size_limit():
+    """二分搜尋找出符合大小限制的品質，無法符合時返回原始內容"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_image(tmp, "receipt.jpg", size=(800, 800), noise=True)
+        with open(path, "rb") as f:
+            original = f.read()
+
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=MIN_JPEG_QUALITY, optimize=True)
+            floor = len(buffer.getvalue())
+            limit = floor + (len(original) - floor) // 3
+
+            data = image_utils.encode_jpeg_within(img, limit)
+            assert floor <= len(data) <= limit
+            assert image_utils.encode_jpeg_within(img, floor - 1) is None
+
+        too_small_mb = (floor // 2) / (1024 * 1024)
+        assert (
+            image_utils.prepare_for_ocr(path, enhance=True, max_size_mb=too_small_mb)
+            == original
+        )
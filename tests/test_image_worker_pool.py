@@ -0,0 +1,67 @@
+"""
+測試圖片工作程序池
+"""
+
+import sys
+import os
+import asyncio
+import hashlib
+import tempfile
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.content_hash import content_hasher
+from app.services.image_worker_pool import ImageWorkerPool
+
+
+def write_image(directory, name, size=(1600, 1200)):
+    path = os.path.join(directory, name)
+    Image.new("RGB", size, (200, 200, 200)).save(path, "JPEG", quality=90)
+    return path
+
+
+def test_tasks_run_in_pool_with_timing():
+    """驗證、縮放與雜湊在程序池中執行並記錄耗時"""
+    pool = ImageWorkerPool(workers=2)
+
+    async def run(path):
+        valid = await pool.validate_image(path)
+        data = await pool.prepare_for_ocr(path, max_width=800, max_height=800)
+        dhash = await pool.compute_dhash(path)
+        return valid, data, dhash
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_image(tmp, "receipt.jpg")
+            valid, data, dhash = asyncio.run(run(path))
+
+            assert valid is True
+            assert data[:2] == b"\xff\xd8"
+            assert isinstance(dhash, int)
+
+            stats = pool.get_stats()
+            assert stats["workers"] == 2
+            assert stats["started"] is True
+            assert set(stats["tasks"]) == {"validate", "resize", "dhash"}
+            assert all(task["count"] == 1 for task in stats["tasks"].values())
+    finally:
+        pool.shutdown()
+
+
+def test_digest_memoized_in_content_hasher():
+    """程序池計算的雜湊記錄到 content_hasher，第二次不再送出任務"""
+    pool = ImageWorkerPool(workers=1)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_image(tmp, "receipt.jpg", size=(200, 200))
+            with open(path, "rb") as f:
+                expected = hashlib.sha256(f.read()).hexdigest()
+
+            assert asyncio.run(pool.image_digest(path)) == expected
+            assert content_hasher.cached_digest(path) == expected
+            assert asyncio.run(pool.image_digest(path)) == expected
+            assert pool.get_stats()["tasks"]["hash"]["count"] == 1
+    finally:
+        pool.shutdown()
@@ -0,0 +1,266 @@
+"""
+測試背景工作佇列與批次進度
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.batch_progress import BatchProgress, format_duration
+from app.services.job_queue import JobQueue, JOB_DONE, JOB_FAILED, JOB_QUEUED
+
+
+async def fake_runner(params, progress):
+    """模擬批次處理：每個檔案成功，'bad' 開頭的檔案失敗"""
+    progress.start(len(params["filenames"]))
+    for filename in params["filenames"]:
+        await asyncio.sleep(0)
+        if filename.startswith("bad"):
+            progress.advance(filename, False, "處理失敗")
+        else:
+            progress.advance(filename, True)
+    return {
+        "success": True,
+        "processed_count": sum(
+            1 for f in params["filenames"] if not f.startswith("bad")
+        ),
+        "csv_files": {"summary": "receipts_summary.csv"},
+        "results": [object()],
+    }
+
+
+async def wait_for(queue, job_id, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        job = queue.get_job(job_id)
+        if job["status"] in (JOB_DONE, JOB_FAILED):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("工作未在時限內完成")
+
+
+def test_batch_progress_is_per_run():
+    """每個BatchProgress獨立計算進度"""
+    first = BatchProgress()
+    second = BatchProgress()
+    first.start(4, 2)
+    second.start(10)
+    first.advance("a.jpg", True)
+    first.advance("b.jpg", False, "錯誤")
+
+    assert first.get_progress()["percentage"] == 50.0
+    assert second.get_progress()["current_progress"] == 0
+    assert first.file_results[1] == {
+        "filename": "b.jpg",
+        "success": False,
+        "error": "錯誤",
+    }
+    assert format_duration(30) == "30秒"
+    assert format_duration(3700) == "1小時1分鐘"
+
+
+def test_submit_runs_in_background_and_persists():
+    """提交後立即返回工作ID，完成後結果保存在磁碟"""
+
+    async def run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir, workers=1)
+        queue.register_runner("fake", fake_runner)
+        await queue.start()
+
+        job = queue.submit("fake", {"filenames": ["a.jpg", "bad.jpg", "c.jpg"]})
+        assert job["status"] == JOB_QUEUED
+
+        job = await wait_for(queue, job["job_id"])
+        await queue.stop()
+        return job
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        job = asyncio.run(run(jobs_dir))
+
+        assert job["status"] == JOB_DONE
+        assert job["csv_files"] == {"summary": "receipts_summary.csv"}
+        assert "results" not in job["result"]
+        assert [r["success"] for r in job["file_results"]] == [True, False, True]
+
+        stored = JobQueue(jobs_dir=jobs_dir).store.load(job["job_id"])
+        assert stored["status"] == JOB_DONE
+        assert stored["progress"]["current_progress"] == 3
+
+
+def test_interrupted_job_resumes_remaining_files():
+    """重啟後恢復中斷的工作，只處理尚未完成的檔案"""
+    seen = []
+
+    async def recording_runner(params, progress):
+        seen.extend(params["filenames"])
+        return await fake_runner(params, progress)
+
+    async def run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("fake", recording_runner)
+        queue.store.save(
+            {
+                "job_id": "interrupted",
+                "type": "fake",
+                "status": "running",
+                "params": {"filenames": ["a.jpg", "b.jpg", "c.jpg"]},
+                "created_at": "2024-01-01T00:00:00",
+                "started_at": "2024-01-01T00:00:01",
+                "finished_at": None,
+                "progress": {},
+                "file_results": [{"filename": "a.jpg", "success": True}],
+                "csv_files": {},
+                "result": None,
+                "error": None,
+            }
+        )
+        await queue.start()
+        job = await wait_for(queue, "interrupted")
+        await queue.stop()
+        return job
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        job = asyncio.run(run(jobs_dir))
+
+    assert seen == ["b.jpg", "c.jpg"]
+    assert job["status"] == JOB_DONE
+    assert [r["filename"] for r in job["file_results"]] == ["a.jpg", "b.jpg", "c.jpg"]
+
+
+def test_runner_error_marks_job_failed():
+    """執行失敗時工作狀態為failed並記錄錯誤"""
+
+    async def broken_runner(params, progress):
+        raise Exception("RATE_LIMIT_EXCEEDED: 測試錯誤")
+
+    async def run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("broken", broken_runner)
+        await queue.start()
+        job = queue.submit("broken", {"filenames": ["a.jpg"]})
+        job = await wait_for(queue, job["job_id"])
+        await queue.stop()
+        return job
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        job = asyncio.run(run(jobs_dir))
+
+    assert job["status"] == JOB_FAILED
+    assert "RATE_LIMIT_EXCEEDED" in job["error"]
+    assert job["finished_at"] is not None
+
+
+def test_checkpointed_state_survives_restart():
+    """執行函數保存的狀態寫入工作檔案，恢復時傳回給執行函數"""
+    seen_states = []
+
+    async def checkpointing_runner(params, progress):
+        seen_states.append(dict(params["state"]))
+        if "message_batch_ids" not in params["state"]:
+            params["checkpoint"]({"message_batch_ids": ["msgbatch_1"]})
+            # 模擬程序在等待批次時被中斷
+            await asyncio.sleep(10)
+        return {"success": True, "csv_files": {}}
+
+    async def first_run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("batch", checkpointing_runner)
+        await queue.start()
+        job = queue.submit("batch", {"batch_id": "batch-1"})
+        for _ in range(200):
+            if queue.store.load(job["job_id"])["state"]:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return job["job_id"]
+
+    async def second_run(jobs_dir, job_id):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("batch", checkpointing_runner)
+        await queue.start()
+        job = await wait_for(queue, job_id)
+        await queue.stop()
+        return job
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        job_id = asyncio.run(first_run(jobs_dir))
+        job = asyncio.run(second_run(jobs_dir, job_id))
+
+    assert seen_states == [{}, {"message_batch_ids": ["msgbatch_1"]}]
+    assert job["status"] == JOB_DONE
+    assert "checkpoint" not in job["params"]
+
+
+def test_resumed_batch_keeps_receipts_from_before_restart():
+    """中斷後恢復的批次工作：中斷前完成的收據已追加到收據儲存，全部歸入同一個執行紀錄"""
+    from datetime import datetime
+    from app.models.receipt import ReceiptData
+    from app.services import batch_processor as batch_module
+    from app.services.csv_service import CSVService
+    from app.services.job_queue import _run_standard_batch
+
+    filenames = ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    blocked = {"filename": "c.jpg"}
+
+    async def fake_item(
+        filename, enhance_image=True, save_detailed_csv=False, progress=None
+    ):
+        if filename == blocked["filename"]:
+            # 模擬程序在處理第三個檔案時被中斷
+            await asyncio.sleep(10)
+        receipt = ReceiptData(
+            store_name=filename,
+            date=datetime(2024, 8, 17),
+            total_amount=100,
+            confidence_score=0.9,
+            processing_time=0.0,
+            source_image=filename,
+        )
+        return {"filename": filename, "success": True, "data": receipt}
+
+    async def first_run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("standard", _run_standard_batch)
+        await queue.start()
+        job = queue.submit("standard", {"filenames": filenames})
+        for _ in range(200):
+            if len(queue.store.load(job["job_id"])["file_results"]) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return job["job_id"]
+
+    async def second_run(jobs_dir, job_id):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("standard", _run_standard_batch)
+        await queue.start()
+        job = await wait_for(queue, job_id)
+        await queue.stop()
+        return job
+
+    original_item = batch_module.batch_processor.process_single_item
+    original_service = batch_module.csv_service
+    with tempfile.TemporaryDirectory() as tmp:
+        service = CSVService(output_dir=tmp)
+        batch_module.batch_processor.process_single_item = fake_item
+        batch_module.csv_service = service
+        try:
+            jobs_dir = os.path.join(tmp, "jobs")
+            job_id = asyncio.run(first_run(jobs_dir))
+            stored_before_resume = service.store.count()
+            blocked["filename"] = None
+            job = asyncio.run(second_run(jobs_dir, job_id))
+            runs = service.store.list_runs()
+            stored = service.store.load_receipts(job["csv_files"]["run_id"])
+        finally:
+            batch_module.batch_processor.process_single_item = original_item
+            batch_module.csv_service = original_service
+            service.store.close()
+
+    assert stored_before_resume == 2
+    assert job["status"] == JOB_DONE
+    assert len(runs) == 1
+    assert [receipt.store_name for receipt in stored] == filenames
+    assert job["result"]["processed_count"] == 4
@@ -0,0 +1,162 @@
+"""
+測試版面規則結構化：已知連鎖店收據通過檢查時不呼叫AI
+"""
+
+import sys
+import os
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ai_service import AIService
+from app.services.layout_extractor import LayoutExtractor
+
+
+def make_ocr(rows, confidence=0.95):
+    """
+    由 [(y, [(x, 文字), ...]), ...] 建立OCR結果；同一列的每段文字是獨立的OCR行
+    """
+    lines = []
+    for y, parts in rows:
+        for x, text in parts:
+            lines.append(
+                {
+                    "text": text,
+                    "boundingBox": [x, y, x + 80, y, x + 80, y + 10, x, y + 10],
+                    "words": [{"text": text, "confidence": confidence}],
+                }
+            )
+    return {
+        "success": True,
+        "text": "\n".join(line["text"] for line in lines),
+        "lines": lines,
+        "confidence": confidence,
+    }
+
+
+SEVEN = make_ocr(
+    [
+        (0, [(10, "セブン-イレブン")]),
+        (20, [(10, "東京駅前店")]),
+        (40, [(10, "2024年8月17日(土) 14:30")]),
+        (60, [(10, "レシートNo.0123")]),
+        (80, [(10, "おにぎり 鮭"), (200, "¥150軽")]),
+        (100, [(10, "緑茶 500ml")]),
+        (120, [(10, "2コX単120"), (200, "¥240軽")]),
+        (140, [(10, "値引"), (200, "-¥20")]),
+        (160, [(10, "合計"), (200, "¥370")]),
+        (180, [(10, "(8%対象 ¥370 内消費税等 ¥27)")]),
+        (200, [(10, "現金"), (200, "¥500")]),
+        (220, [(10, "お釣"), (200, "¥130")]),
+    ]
+)
+
+AEON = make_ocr(
+    [
+        (0, [(10, "イオン 幕張店")]),
+        (20, [(10, "2024/08/18 10:05")]),
+        (40, [(10, "牛乳"), (200, "¥198")]),
+        (60, [(10, "食パン"), (200, "¥302")]),
+        (80, [(10, "小計"), (200, "¥500")]),
+        (100, [(10, "外税8%対象額"), (200, "¥500")]),
+        (120, [(10, "外税"), (200, "¥40")]),
+        (140, [(10, "合計"), (200, "¥540")]),
+        (160, [(10, "WAON支払"), (200, "¥540")]),
+    ]
+)
+
+
+def test_convenience_store_layout():
+    """內含稅版面：列合併、數量行、折扣、合計後的稅額與付款方式"""
+    extractor = LayoutExtractor(enabled=True)
+    receipt = extractor.extract(SEVEN)
+
+    assert receipt is not None
+    assert receipt.store_name == "セブン-イレブン"
+    assert receipt.date.strftime("%Y-%m-%d") == "2024-08-17"
+    assert [(item.name, item.price, item.quantity) for item in receipt.items] == [
+        ("おにぎり 鮭", 150, 1),
+        ("緑茶 500ml", 220, 2),
+    ]
+    assert receipt.total_amount == 370
+    assert receipt.tax_amount == 27
+    assert receipt.tax_type == "內含稅"
+    assert receipt.payment_method == "現金"
+    assert receipt.receipt_number == "0123"
+
+
+def test_supermarket_external_tax():
+    """外加稅版面：小計加稅額等於合計，稅率對象額不算稅額"""
+    extractor = LayoutExtractor(enabled=True)
+    receipt = extractor.extract(AEON)
+
+    assert receipt is not None
+    assert receipt.store_name == "イオン 幕張店"
+    assert receipt.subtotal == 500
+    assert receipt.tax_amount == 40
+    assert receipt.tax_type == "外加稅"
+    assert receipt.payment_method == "電子マネー"
+
+
+def test_inconsistent_or_unknown_receipts_rejected():
+    """金額不一致或未知店家返回None，並記錄原因"""
+    extractor = LayoutExtractor(enabled=True)
+    broken = make_ocr(
+        [
+            (0, [(10, "ローソン")]),
+            (20, [(10, "2024年8月17日")]),
+            (40, [(10, "からあげクン"), (200, "¥238")]),
+            (60, [(10, "合計"), (200, "¥999")]),
+        ]
+    )
+    unknown = make_ocr([(0, [(10, "個人商店")]), (20, [(10, "合計 ¥100")])])
+
+    assert extractor.extract(broken) is None
+    assert extractor.extract(unknown) is None
+    assert LayoutExtractor(enabled=False).extract(SEVEN) is None
+    # 規則結果沒有中文翻譯，預設不啟用
+    assert LayoutExtractor().extract(SEVEN) is None
+
+    stats = extractor.get_stats()
+    assert stats["attempted"] == 2
+    assert stats["matched"] == 1
+    assert stats["accepted"] == 0
+    assert stats["rejections"] == {"items_mismatch": 1}
+
+
+def test_ai_service_skips_claude_for_known_layouts():
+    """規則通過的收據不呼叫Claude，分組時也不放入批次請求"""
+    service = AIService()
+    service.test_mode = False
+    service.layout_extractor = LayoutExtractor(enabled=True)
+    service.router.enabled = False
+    prompts = []
+
+    async def fake_call(
+        prompt, tool_name, max_tokens=2000, model=None, on_progress=None
+    ):
+        prompts.append(prompt)
+        return {"store_name": "個人商店", "date": "2024-08-17", "total_amount": 100}
+
+    service._call_claude_tool = fake_call
+    unknown = {"ocr_data": make_ocr([(0, [(10, "個人商店")])]), "structured_data": {}}
+
+    receipt = asyncio.run(service.process_receipt_text(SEVEN, {}))
+    results = asyncio.run(
+        service.process_receipt_group(
+            [
+                {"ocr_data": AEON, "structured_data": {}},
+                unknown,
+                {"ocr_data": SEVEN, "structured_data": {}},
+            ]
+        )
+    )
+
+    assert receipt.store_name == "セブン-イレブン"
+    assert [r.store_name for r in results] == [
+        "イオン 幕張店",
+        "個人商店",
+        "セブン-イレブン",
+    ]
+    assert len(prompts) == 1 and "イオン" not in prompts[0]
+    assert service.get_usage_stats()["layout"]["accepted"] == 3
@@ -0,0 +1,91 @@
+"""
+測試記憶體LRU快取層
+"""
+
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.receipt import ReceiptData
+from app.services.cache_service import CacheService
+from app.services.memory_cache import MemoryLRUCache
+
+CONTENT_KEY = f"{'b' * 64}_0123456789ab"
+
+
+def make_receipt():
+    return ReceiptData(
+        store_name="ファミリーマート",
+        date=datetime(2024, 1, 1, 12, 0),
+        total_amount=540,
+        confidence_score=0.9,
+        processing_time=1.0,
+        source_image="receipt_a.jpg",
+    )
+
+
+def test_lru_eviction_and_stats():
+    """超過上限時淘汰最久未使用的項目"""
+    cache = MemoryLRUCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a 變成最近使用
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_ttl_expiry():
+    """超過存活時間的項目視為未命中"""
+    cache = MemoryLRUCache(max_entries=10, ttl_seconds=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_receipt_hits_skip_disk_and_return_copies():
+    """命中時不讀取SQLite，且返回的ReceiptData可安全修改"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=tmp)
+        cache.save_ai_result(
+            "receipt_a.jpg", make_receipt(), {"text": ""}, cache_key=CONTENT_KEY
+        )
+
+        store_reads = []
+        original_get = cache.store.get
+        cache.store.get = lambda *args: store_reads.append(args) or original_get(*args)
+
+        first = cache.load_receipt_data(CONTENT_KEY)
+        first.source_image = "receipt_b.jpg"
+        second = cache.load_receipt_data(CONTENT_KEY)
+
+        assert store_reads == []
+        assert second.source_image == "receipt_a.jpg"
+        assert cache.get_cache_summary()["memory"]["hits"] >= 2
+
+
+def test_receipt_rebuilt_from_disk_after_restart():
+    """記憶體層為空時從SQLite重建並驗證ReceiptData"""
+    with tempfile.TemporaryDirectory() as tmp:
+        CacheService(cache_dir=tmp).save_ai_result(
+            "receipt_a.jpg", make_receipt(), {"text": ""}, cache_key=CONTENT_KEY
+        )
+
+        restarted = CacheService(cache_dir=tmp)
+        receipt = restarted.load_receipt_data(CONTENT_KEY)
+
+        assert isinstance(receipt, ReceiptData)
+        assert receipt.date == datetime(2024, 1, 1, 12, 0)
+        assert restarted.load_receipt_data("missing") is None
@@ -0,0 +1,348 @@
+"""
+測試以Message Batches API離線批量處理（使用本機模擬伺服器）
+"""
+
+import sys
+import os
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import batch_processor as batch_module
+from app.services.ai_service import ai_service
+from app.services.batch_processor import batch_processor
+from app.services.cache_service import CacheService
+from app.services.content_hash import content_hasher, PREPROCESS_ENHANCE
+from app.services.csv_service import CSVService
+from app.services.job_queue import JobQueue, JOB_DONE, JOB_FAILED, _run_message_batch
+from app.services.message_batches import MessageBatchBackend
+
+
+class StubBatchServer:
+    """模擬 /v1/messages/batches 的本機HTTP伺服器（第一次查詢回傳處理中）"""
+
+    def __init__(self, fail_ids=()):
+        self.submitted = []
+        self.polls = 0
+        # 設定時查詢批次狀態返回此錯誤狀態碼
+        self.poll_error = None
+        self.fail_ids = set(fail_ids)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", content_type)
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers["content-length"])
+                stub.submitted.append(json.loads(self.rfile.read(length)))
+                self._send(
+                    200,
+                    json.dumps(
+                        {"id": "msgbatch_1", "processing_status": "in_progress"}
+                    ),
+                )
+
+            def do_GET(self):
+                if self.path.endswith("/results"):
+                    self._send(200, stub.results_jsonl(), "application/binary")
+                    return
+                stub.polls += 1
+                if stub.poll_error:
+                    self._send(stub.poll_error, json.dumps({"type": "error"}))
+                    return
+                status = "ended" if stub.polls > 1 else "in_progress"
+                self._send(
+                    200,
+                    json.dumps(
+                        {
+                            "id": "msgbatch_1",
+                            "processing_status": status,
+                            "results_url": f"{stub.url}/v1/messages/batches/msgbatch_1/results",
+                        }
+                    ),
+                )
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def results_jsonl(self):
+        lines = []
+        for request in self.submitted[-1]["requests"]:
+            custom_id = request["custom_id"]
+            if custom_id in self.fail_ids:
+                result = {
+                    "type": "errored",
+                    "error": {
+                        "type": "error",
+                        "error": {"type": "overloaded_error", "message": "busy"},
+                    },
+                }
+            else:
+                prompt = request["params"]["messages"][0]["content"]
+                store = "ローソン" if "ローソン" in prompt else "セブン"
+                tool_use = {
+                    "type": "tool_use",
+                    "name": "record_receipt",
+                    "input": {
+                        "store_name": store,
+                        "date": "2024-08-17",
+                        "total_amount": 500,
+                    },
+                }
+                result = {"type": "succeeded", "message": {"content": [tool_use]}}
+            lines.append(
+                json.dumps(
+                    {"custom_id": custom_id, "result": result}, ensure_ascii=False
+                )
+            )
+        # 結果順序不保證與提交順序相同
+        return "\n".join(reversed(lines)) + "\n"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_entry(store):
+    return {
+        "filename": f"{store}.jpg",
+        "ocr_data": {"text": f"{store}\n合計 500円", "confidence": 0.9},
+        "structured_data": {},
+    }
+
+
+def test_process_receipts_against_stub_server():
+    """提交、輪詢並依custom_id對應結果；失敗的請求返回例外"""
+    stub = StubBatchServer(fail_ids={"receipt-2"})
+    original_mode = ai_service.test_mode
+    ai_service.test_mode = False
+    try:
+        backend = MessageBatchBackend(base_url=stub.url, poll_interval=0.01, timeout=5)
+        entries = [make_entry("セブン"), make_entry("ローソン"), make_entry("ファミマ")]
+        results = asyncio.run(backend.process_receipts(entries))
+    finally:
+        ai_service.test_mode = original_mode
+        stub.close()
+
+    assert [r.store_name for r in results[:2]] == ["セブン", "ローソン"]
+    assert isinstance(results[2], Exception)
+    assert "errored" in str(results[2])
+    assert stub.polls == 2
+    params = stub.submitted[0]["requests"][0]["params"]
+    assert params["model"] == ai_service.model
+    assert params["tool_choice"] == {"type": "tool", "name": "record_receipt"}
+    assert len(stub.submitted[0]["requests"]) == 3
+
+
+def test_process_from_cache_writes_ai_cache():
+    """OCR暫存後以一次批量處理寫入AI暫存，再次處理時不再提交批次"""
+    stub = StubBatchServer()
+    digests = ["c" * 64, "d" * 64]
+    original = (
+        batch_module.cache_service,
+        batch_module.message_batch_backend,
+        ai_service.test_mode,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=tmp)
+        batch_module.cache_service = cache
+        batch_module.message_batch_backend = MessageBatchBackend(
+            base_url=stub.url, poll_interval=0.01, timeout=5
+        )
+        ai_service.test_mode = False
+        try:
+            cache_files = []
+            for digest, store in zip(digests, ["セブン", "ローソン"]):
+                key = content_hasher.key_for_digest(digest, "ocr", PREPROCESS_ENHANCE)
+                cache.save_ocr_result(
+                    f"{store}.jpg", make_entry(store)["ocr_data"], cache_key=key
+                )
+                cache_files.append(key)
+            cache.save_processing_status(
+                "batch-1",
+                {
+                    "batch_id": "batch-1",
+                    "cache_files": cache_files,
+                    "source_files": ["a.jpg", "b.jpg"],
+                    "preprocessing": PREPROCESS_ENHANCE,
+                    "timestamp": time.time(),
+                },
+            )
+
+            first = asyncio.run(
+                batch_processor.process_from_cache("batch-1", use_message_batches=True)
+            )
+            second = asyncio.run(
+                batch_processor.process_from_cache("batch-1", use_message_batches=True)
+            )
+
+            ai_key = content_hasher.key_for_digest(digests[1], "ai", PREPROCESS_ENHANCE)
+            cached = cache.load_receipt_data(ai_key)
+        finally:
+            (
+                batch_module.cache_service,
+                batch_module.message_batch_backend,
+                ai_service.test_mode,
+            ) = original
+            cache.store.close()
+            stub.close()
+
+    assert first["processed_count"] == 2
+    assert second["processed_count"] == 2
+    assert len(stub.submitted) == 1
+    assert cached.store_name == "ローソン"
+    assert [r["data"].source_image for r in second["results"]] == ["a.jpg", "b.jpg"]
+
+
+def test_process_from_cache_resumes_submitted_batch():
+    """提交後保存批次ID；中斷後以保存的ID恢復時只輪詢，不重新提交"""
+    stub = StubBatchServer()
+    original = (
+        batch_module.cache_service,
+        batch_module.message_batch_backend,
+        ai_service.test_mode,
+    )
+    checkpoints = []
+    with tempfile.TemporaryDirectory() as tmp:
+        caches = [
+            CacheService(cache_dir=os.path.join(tmp, name))
+            for name in ("first", "second")
+        ]
+        batch_module.message_batch_backend = MessageBatchBackend(
+            base_url=stub.url, poll_interval=0.01, timeout=5
+        )
+        ai_service.test_mode = False
+        try:
+            results = []
+            for cache, state in zip(caches, [None, "resume"]):
+                key = content_hasher.key_for_digest("e" * 64, "ocr", PREPROCESS_ENHANCE)
+                cache.save_ocr_result(
+                    "セブン.jpg", make_entry("セブン")["ocr_data"], cache_key=key
+                )
+                cache.save_processing_status(
+                    "batch-1",
+                    {
+                        "batch_id": "batch-1",
+                        "cache_files": [key],
+                        "source_files": ["a.jpg"],
+                        "preprocessing": PREPROCESS_ENHANCE,
+                        "timestamp": time.time(),
+                    },
+                )
+                batch_module.cache_service = cache
+                results.append(
+                    asyncio.run(
+                        batch_processor.process_from_cache(
+                            "batch-1",
+                            use_message_batches=True,
+                            state=checkpoints[-1] if state else None,
+                            checkpoint=checkpoints.append,
+                        )
+                    )
+                )
+        finally:
+            (
+                batch_module.cache_service,
+                batch_module.message_batch_backend,
+                ai_service.test_mode,
+            ) = original
+            for cache in caches:
+                cache.store.close()
+            stub.close()
+
+    assert checkpoints == [
+        {"filenames": ["a.jpg"], "message_batch_ids": ["msgbatch_1"]}
+    ]
+    assert len(stub.submitted) == 1
+    assert [r["processed_count"] for r in results] == [1, 1]
+
+
+def test_poll_failure_keeps_job_resumable():
+    """提交後輪詢失敗時工作失敗但保留批次ID；重新執行時只輪詢，收據不會被標記為失敗"""
+    stub = StubBatchServer()
+    stub.poll_error = 400
+    original = (
+        batch_module.cache_service,
+        batch_module.csv_service,
+        batch_module.message_batch_backend,
+        ai_service.test_mode,
+    )
+
+    async def wait_for(queue, job_id):
+        for _ in range(500):
+            job = queue.get_job(job_id)
+            if job["status"] in (JOB_DONE, JOB_FAILED):
+                return dict(job)
+            await asyncio.sleep(0.01)
+        raise AssertionError("工作未在時限內完成")
+
+    async def run(jobs_dir):
+        queue = JobQueue(jobs_dir=jobs_dir)
+        queue.register_runner("message_batch", _run_message_batch)
+        await queue.start()
+        job = queue.submit("message_batch", {"batch_id": "batch-1"})
+        failed = await wait_for(queue, job["job_id"])
+        stub.poll_error = None
+        queue.retry(job["job_id"])
+        done = await wait_for(queue, job["job_id"])
+        await queue.stop()
+        return failed, done
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        csv = CSVService(output_dir=os.path.join(tmp, "output"))
+        key = content_hasher.key_for_digest("f" * 64, "ocr", PREPROCESS_ENHANCE)
+        cache.save_ocr_result(
+            "セブン.jpg", make_entry("セブン")["ocr_data"], cache_key=key
+        )
+        cache.save_processing_status(
+            "batch-1",
+            {
+                "batch_id": "batch-1",
+                "cache_files": [key],
+                "source_files": ["a.jpg"],
+                "preprocessing": PREPROCESS_ENHANCE,
+                "timestamp": time.time(),
+            },
+        )
+        batch_module.cache_service = cache
+        batch_module.csv_service = csv
+        batch_module.message_batch_backend = MessageBatchBackend(
+            base_url=stub.url, poll_interval=0.01, timeout=5
+        )
+        ai_service.test_mode = False
+        try:
+            failed, done = asyncio.run(run(os.path.join(tmp, "jobs")))
+        finally:
+            (
+                batch_module.cache_service,
+                batch_module.csv_service,
+                batch_module.message_batch_backend,
+                ai_service.test_mode,
+            ) = original
+            cache.store.close()
+            csv.store.close()
+            stub.close()
+
+    assert failed["status"] == JOB_FAILED
+    assert "msgbatch_1" in failed["error"]
+    assert failed["state"]["message_batch_ids"] == ["msgbatch_1"]
+    assert failed["file_results"] == []
+    assert done["status"] == JOB_DONE
+    assert done["result"]["processed_count"] == 1
+    assert len(stub.submitted) == 1
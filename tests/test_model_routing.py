@@ -0,0 +1,161 @@
+"""
+測試模型路由：簡單收據先用小模型，金額不一致時升級到大模型
+"""
+
+import sys
+import os
+import asyncio
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.receipt import ReceiptData, ReceiptItem
+from app.services.ai_service import AIService
+from app.services.model_router import ModelRouter
+
+SIMPLE_OCR = {
+    "text": "セブン\nおにぎり 150円\nお茶 120円\n合計 270円",
+    "confidence": 0.95,
+}
+CONSISTENT = {
+    "store_name": "セブン",
+    "date": "2024-08-17",
+    "total_amount": 270,
+    "items": [{"name": "おにぎり", "price": 150}, {"name": "お茶", "price": 120}],
+}
+MISMATCHED = dict(CONSISTENT, total_amount=2700)
+
+
+def make_receipt(total, prices, subtotal=None, tax=None):
+    return ReceiptData(
+        store_name="テスト",
+        date=datetime(2024, 8, 17),
+        total_amount=total,
+        subtotal=subtotal,
+        tax_amount=tax,
+        items=[
+            ReceiptItem(name=f"商品{i}", price=price) for i, price in enumerate(prices)
+        ],
+        confidence_score=0.9,
+        processing_time=0.0,
+        source_image="",
+    )
+
+
+def make_service(responses):
+    """建立以假Claude回應運作的AIService，返回 (服務, 呼叫使用的模型列表)"""
+    service = AIService()
+    service.test_mode = False
+    service.router = ModelRouter(
+        main_model="main-model", fast_model="fast-model", enabled=True
+    )
+    service.model = "main-model"
+    models = []
+
+    async def fake_call(
+        prompt, tool_name, max_tokens=2000, model=None, on_progress=None
+    ):
+        models.append(model)
+        response = responses[model]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    service._call_claude_tool = fake_call
+    return service, models
+
+
+def test_route_reasons():
+    """行數過多或OCR信心度過低的收據不使用小模型"""
+    router = ModelRouter(main_model="main-model", fast_model="fast-model", enabled=True)
+    long_text = "\n".join(f"商品{i} 100円" for i in range(router.max_lines + 1))
+
+    assert router.route_reasons(SIMPLE_OCR) == []
+    assert router.route_reasons({"text": long_text, "confidence": 0.95}) == [
+        "too_many_lines"
+    ]
+    assert router.route_reasons({"text": "セブン", "confidence": 0.3}) == [
+        "low_ocr_confidence"
+    ]
+    assert not ModelRouter(main_model="same", fast_model="same", enabled=True).enabled
+
+
+def test_check_receipt_arithmetic():
+    """商品合計需與總額、小計或稅前金額相符"""
+    router = ModelRouter(main_model="main-model", fast_model="fast-model", enabled=True)
+
+    assert router.check_receipt(make_receipt(270, [150, 120])) == []
+    assert (
+        router.check_receipt(make_receipt(297, [150, 120], subtotal=270, tax=27)) == []
+    )
+    assert router.check_receipt(make_receipt(297, [150, 120], tax=27)) == []
+    assert router.check_receipt(make_receipt(0, [150])) == ["missing_total"]
+    assert router.check_receipt(make_receipt(270, [])) == ["no_items"]
+    assert router.check_receipt(make_receipt(2700, [150, 120])) == [
+        "items_total_mismatch"
+    ]
+
+
+def test_simple_receipt_accepted_from_fast_model():
+    """簡單且金額一致的收據只呼叫小模型"""
+    service, models = make_service({"fast-model": CONSISTENT})
+    receipt = asyncio.run(service.process_receipt_text(SIMPLE_OCR, {}))
+
+    assert receipt.total_amount == 270
+    assert models == ["fast-model"]
+    assert service.get_usage_stats()["routing"]["decisions"]["fast"] == 1
+
+
+def test_mismatch_and_errors_escalate():
+    """金額不一致或小模型失敗時升級到大模型，並記錄原因"""
+    service, models = make_service({"fast-model": MISMATCHED, "main-model": CONSISTENT})
+    receipt = asyncio.run(service.process_receipt_text(SIMPLE_OCR, {}))
+    assert receipt.total_amount == 270
+    assert models == ["fast-model", "main-model"]
+
+    failing, failing_models = make_service(
+        {"fast-model": Exception("overloaded"), "main-model": CONSISTENT}
+    )
+    asyncio.run(failing.process_receipt_text(SIMPLE_OCR, {}))
+    assert failing_models == ["fast-model", "main-model"]
+
+    stats = service.router.get_stats()
+    assert stats["decisions"]["escalated"] == 1
+    assert stats["reasons"] == {"items_total_mismatch": 1}
+    assert failing.router.get_stats()["reasons"] == {"fast_model_error": 1}
+
+
+def test_complex_receipt_goes_to_main_model():
+    """信心度低的收據直接使用大模型"""
+    service, models = make_service({"main-model": CONSISTENT})
+    asyncio.run(
+        service.process_receipt_text(
+            {"text": SIMPLE_OCR["text"], "confidence": 0.4}, {}
+        )
+    )
+
+    assert models == ["main-model"]
+    assert service.router.get_stats()["decisions"]["main"] == 1
+
+
+def test_group_escalates_only_failing_receipts():
+    """分組處理時只有未通過檢查的收據以大模型重新處理"""
+    batch_response = {
+        "receipts": [
+            dict(CONSISTENT, id="R1"),
+            dict(MISMATCHED, id="R2"),
+        ]
+    }
+    service, models = make_service(
+        {"fast-model": batch_response, "main-model": CONSISTENT}
+    )
+    entries = [{"ocr_data": SIMPLE_OCR, "structured_data": {}} for _ in range(2)]
+    results = asyncio.run(service.process_receipt_group(entries))
+
+    assert [r.total_amount for r in results] == [270, 270]
+    assert models == ["fast-model", "main-model"]
+    assert service.router.get_stats()["decisions"] == {
+        "fast": 1,
+        "main": 0,
+        "escalated": 1,
+    }
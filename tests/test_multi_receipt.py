@@ -0,0 +1,144 @@
+"""
+測試單張照片多張收據的分割與處理
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+
+from app.config import settings
+from app.models.receipt import ReceiptData
+from app.services.ai_service import ai_service
+from app.services import multi_receipt
+from app.services.cache_service import CacheService
+from app.services.multi_receipt import MultiReceiptProcessor
+from app.services.ocr_service import ocr_service
+from app.utils.image_utils import image_utils
+
+# 三張收據在照片中的位置 (x, y, 寬, 高)
+RECEIPTS = [(100, 150, 300, 700), (550, 100, 300, 800), (1000, 200, 300, 600)]
+STORES = ["セブン-イレブン", "ローソン", "ファミリーマート"]
+
+
+def make_photo(path):
+    """深色桌面上並排三張白色收據"""
+    photo = np.full((1100, 1500, 3), 50, dtype=np.uint8)
+    for x, y, width, height in RECEIPTS:
+        photo[y : y + height, x : x + width] = 245
+        for row in range(y + 40, y + height - 40, 40):
+            cv2.rectangle(
+                photo, (x + 20, row), (x + width - 40, row + 10), (20, 20, 20), -1
+            )
+    cv2.imwrite(path, photo)
+
+
+def make_line(text, x, y):
+    box = [x, y, x + 200, y, x + 200, y + 20, x, y + 20]
+    return {
+        "text": text,
+        "boundingBox": box,
+        "words": [{"text": text, "confidence": 0.9, "boundingBox": box}],
+    }
+
+
+def make_ocr_result():
+    """三張收據的文字行，加上一行落在收據之間的雜訊"""
+    lines = []
+    for (x, y, _, _), store in zip(RECEIPTS, STORES):
+        lines.append(make_line(store, x + 30, y + 30))
+        lines.append(make_line("合計 500円", x + 30, y + 300))
+    lines.append(make_line("テーブル", 470, 500))
+    words = [word for line in lines for word in line["words"]]
+    return {
+        "success": True,
+        "text": "\n".join(line["text"] for line in lines),
+        "words": words,
+        "lines": lines,
+        "processing_time": 1.0,
+        "confidence": 0.9,
+    }
+
+
+def test_detects_receipt_regions_left_to_right():
+    """偵測到三個收據區域，並依由左至右排序"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "table.jpg")
+        make_photo(path)
+
+        prepared = image_utils.prepare_multi_receipt(path)
+
+        assert prepared["size"] == (1500, 1100)
+        assert len(prepared["regions"]) == 3
+        centers = [np.mean(region, axis=0)[0] for region in prepared["regions"]]
+        assert centers == sorted(centers)
+
+
+def test_split_ocr_lines_by_region():
+    """OCR文字行依區域拆分，落在區域之間的行歸到最近的區域"""
+    regions = [
+        [[x, y], [x + width, y], [x + width, y + height], [x, y + height]]
+        for x, y, width, height in RECEIPTS
+    ]
+    parts = ocr_service.split_by_regions(make_ocr_result(), regions)
+
+    assert [part["region"] for part in parts] == [0, 1, 2]
+    assert [part["text"].split("\n")[0] for part in parts] == STORES
+    assert sum(len(part["lines"]) for part in parts) == 7
+
+
+def test_one_ocr_call_for_all_receipts():
+    """整張照片只調用一次OCR，產生三筆收據資料，再次處理時使用暫存"""
+    calls = []
+    ocr_result = make_ocr_result()
+
+    async def fake_extract_text(image_path, image_data=None):
+        calls.append(image_path)
+        return ocr_result
+
+    async def fake_process_receipt_text(ocr_data, structured_data):
+        return ReceiptData(
+            store_name=ocr_data["text"].split("\n")[0],
+            date=datetime(2024, 8, 17),
+            total_amount=500,
+            confidence_score=ocr_data["confidence"],
+            processing_time=0.0,
+            source_image="",
+        )
+
+    original_extract = ocr_service.extract_text
+    original_process = ai_service.process_receipt_text
+    original_upload_dir = settings.upload_dir
+    original_cache = multi_receipt.cache_service
+    with tempfile.TemporaryDirectory() as tmp:
+        make_photo(os.path.join(tmp, "table.jpg"))
+        multi_receipt.cache_service = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        ocr_service.extract_text = fake_extract_text
+        ai_service.process_receipt_text = fake_process_receipt_text
+        settings.upload_dir = tmp
+        try:
+            processor = MultiReceiptProcessor()
+            result = asyncio.run(processor.process_image("table.jpg"))
+            again = asyncio.run(processor.process_image("table.jpg"))
+        finally:
+            ocr_service.extract_text = original_extract
+            ai_service.process_receipt_text = original_process
+            settings.upload_dir = original_upload_dir
+            multi_receipt.cache_service = original_cache
+
+    assert len(calls) == 1
+    assert "regions" not in ocr_result
+    assert result["ocr_calls"] == 1 and again["ocr_calls"] == 0
+    assert [r.source_image for r in result["receipts"]] == [
+        "table.jpg#1",
+        "table.jpg#2",
+        "table.jpg#3",
+    ]
+    assert [r.store_name for r in again["receipts"]] == STORES
@@ -57,9 +57,7 @@ async def test_optimized_batch_processor():
     # 測試單個項目處理
     print("\n🔄 測試單個項目處理...")
     try:
-        result = await optimized_batch_processor._process_single_item_optimized(
-            test_images[0]
-        )
+        result = await optimized_batch_processor.process_single(test_images[0])
 
         if result.get("success"):
             print("✅ 單個項目處理成功")
@@ -0,0 +1,72 @@
+"""
+測試OCR/AI分階段管線引擎
+"""
+
+import sys
+import os
+import asyncio
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.pipeline_engine import PipelineEngine, PipelineStage
+
+
+def test_results_keep_input_order():
+    """結果應依輸入順序返回，失敗項目不進入下一階段"""
+    ai_seen = []
+
+    async def ocr(item):
+        await asyncio.sleep(0.01 * (5 - item))
+        if item == 2:
+            return {"success": False, "error": "OCR失敗"}
+        return {"success": True, "value": item}
+
+    async def ai(payload):
+        ai_seen.append(payload["value"])
+        return {"success": True, "data": payload["value"] * 10}
+
+    engine = PipelineEngine(
+        [PipelineStage("ocr", ocr, 2), PipelineStage("ai", ai, 3)], queue_size=2
+    )
+    finished = []
+    results = asyncio.run(
+        engine.run([0, 1, 2, 3, 4], on_result=lambda i, r: finished.append(i))
+    )
+
+    assert [r.get("data") for r in results] == [0, 10, None, 30, 40]
+    assert results[2]["error"] == "OCR失敗"
+    assert 2 not in ai_seen
+    assert sorted(finished) == [0, 1, 2, 3, 4]
+
+
+def test_stages_overlap():
+    """OCR與AI應重疊執行，總耗時約為 max(OCR, AI) 而非兩者之和"""
+
+    async def ocr(item):
+        await asyncio.sleep(0.05)
+        return {"success": True}
+
+    async def ai(payload):
+        await asyncio.sleep(0.05)
+        return {"success": True}
+
+    engine = PipelineEngine([PipelineStage("ocr", ocr, 1), PipelineStage("ai", ai, 5)])
+    start = time.monotonic()
+    asyncio.run(engine.run(list(range(6))))
+    elapsed = time.monotonic() - start
+
+    # 序列化時為 6 * 0.1 = 0.6 秒；管線化約 6 * 0.05 + 0.05 = 0.35 秒
+    assert elapsed < 0.5
+
+
+def test_handler_exception_becomes_failure():
+    """階段拋出例外時應轉為失敗結果"""
+
+    async def boom(item):
+        raise RuntimeError("壞掉了")
+
+    engine = PipelineEngine([PipelineStage("ocr", boom, 1)])
+    results = asyncio.run(engine.run([1]))
+    assert results[0]["success"] is False
+    assert "壞掉了" in results[0]["error"]
@@ -0,0 +1,76 @@
+"""
+測試Azure Read自適應輪詢策略
+"""
+
+import sys
+import os
+import asyncio
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.polling_strategy import (
+    PollingStrategy,
+    PollingMetrics,
+    parse_retry_after,
+)
+
+
+def test_parse_retry_after():
+    """測試Retry-After標頭解析"""
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("0.5") == 0.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("invalid") is None
+    # 過去的HTTP日期應視為0秒
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_next_delay_backoff_and_hint():
+    """測試首次探測、指數退避與伺服器提示"""
+    strategy = PollingStrategy(
+        first_delay=0.2,
+        min_interval=0.5,
+        max_interval=4.0,
+        backoff_factor=2.0,
+        timeout=30,
+    )
+    assert strategy.next_delay(0) == 0.2
+    assert strategy.next_delay(1) == 0.5
+    assert strategy.next_delay(2) == 1.0
+    assert strategy.next_delay(10) == 4.0
+    # 伺服器提示優先，但仍受上下限約束
+    assert strategy.next_delay(3, retry_after=1.5) == 1.5
+    assert strategy.next_delay(3, retry_after=60) == 4.0
+
+
+def test_session_timeout():
+    """測試整體期限"""
+    strategy = PollingStrategy(
+        first_delay=0.01,
+        min_interval=0.01,
+        max_interval=0.01,
+        backoff_factor=1.0,
+        timeout=0.03,
+    )
+
+    async def run():
+        session = strategy.start()
+        while True:
+            await session.wait()
+
+    with pytest.raises(Exception, match="OCR_TIMEOUT"):
+        asyncio.run(run())
+
+
+def test_metrics_summary():
+    """測試輪詢次數統計"""
+    metrics = PollingMetrics()
+    metrics.record("a.jpg", 2, 1.0)
+    metrics.record("b.jpg", 4, 2.0, timed_out=True)
+    summary = metrics.get_summary()
+    assert summary["total_jobs"] == 2
+    assert summary["avg_polls_per_image"] == 3.0
+    assert summary["max_polls"] == 4
+    assert summary["timeouts"] == 1
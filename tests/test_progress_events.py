@@ -0,0 +1,144 @@
+"""
+測試批次工作的SSE進度推送
+"""
+
+import sys
+import os
+import asyncio
+import json
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.progress_events import ProgressEventBus, format_sse
+from app.services.job_queue import JobQueue
+
+
+def parse_sse(message):
+    """解析單一SSE訊息為 (事件類型, 資料)"""
+    event_type, data = None, None
+    for line in message.strip().split("\n"):
+        if line.startswith("event: "):
+            event_type = line[len("event: ") :]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: ") :])
+    return event_type, data
+
+
+def test_format_sse():
+    """SSE格式包含事件類型與JSON資料"""
+    message = format_sse("progress", {"filename": "收據.jpg"})
+    assert message.endswith("\n\n")
+    assert parse_sse(message) == ("progress", {"filename": "收據.jpg"})
+
+
+def test_slow_subscriber_drops_oldest_events():
+    """訂閱者佇列滿時丟棄最舊事件，不阻塞發布者"""
+    bus = ProgressEventBus(queue_size=2)
+    queue = bus.subscribe("job")
+    for i in range(5):
+        bus.publish("job", "progress", {"i": i})
+
+    assert queue.qsize() == 2
+    assert queue.get_nowait()[1] == {"i": 3}
+    bus.unsubscribe("job", queue)
+    assert not bus.has_subscribers("job")
+
+
+def test_job_streams_file_events_until_done():
+    """訂閱者收到目前狀態、每個檔案的進度事件與最終結果"""
+
+    async def runner(params, progress):
+        progress.start(len(params["filenames"]))
+        for filename in params["filenames"]:
+            await asyncio.sleep(0.01)
+            progress.advance(filename, True)
+        return {"success": True, "processed_count": len(params["filenames"])}
+
+    async def run(jobs_dir):
+        bus = ProgressEventBus()
+        queue = JobQueue(jobs_dir=jobs_dir, event_bus=bus)
+        queue.register_runner("fake", runner)
+        await queue.start()
+
+        job = queue.submit("fake", {"filenames": ["a.jpg", "b.jpg"]})
+        messages = [message async for message in queue.stream_events(job["job_id"])]
+        await queue.stop()
+        return [parse_sse(message) for message in messages]
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        events = asyncio.run(run(jobs_dir))
+
+    assert events[0][0] == "status"
+    files = [
+        data["last_file"]["filename"]
+        for kind, data in events
+        if kind == "progress" and data["last_file"]
+    ]
+    assert files[-2:] == ["a.jpg", "b.jpg"]
+    progress_event = [data for kind, data in events if kind == "progress"][-1]
+    assert progress_event["progress"]["percentage"] == 100.0
+    assert "limiter" in progress_event["rate_limit_info"]
+    assert events[-1][0] == "status"
+    assert events[-1][1]["status"] == "done"
+    assert events[-1][1]["result"]["processed_count"] == 2
+
+
+def test_partial_updates_publish_without_saving_job():
+    """串流中的部分進度只推送事件，不重寫工作檔案"""
+
+    async def runner(params, progress):
+        progress.start(1)
+        for count in (1, 2, 3):
+            await asyncio.sleep(0.01)
+            progress.update_partial("a.jpg", count)
+        progress.advance("a.jpg", True)
+        return {"success": True}
+
+    async def run(jobs_dir):
+        bus = ProgressEventBus()
+        queue = JobQueue(jobs_dir=jobs_dir, event_bus=bus)
+        queue.register_runner("fake", runner)
+        saved_streaming = []
+        original_save = queue.store.save
+
+        def save(job):
+            saved_streaming.append(job["progress"].get("streaming"))
+            original_save(job)
+
+        queue.store.save = save
+        await queue.start()
+
+        job = queue.submit("fake", {"filenames": ["a.jpg"]})
+        messages = [message async for message in queue.stream_events(job["job_id"])]
+        await queue.stop()
+        return [parse_sse(message) for message in messages], saved_streaming
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        events, saved_streaming = asyncio.run(run(jobs_dir))
+
+    partial = [
+        data
+        for kind, data in events
+        if kind == "progress" and data["progress"].get("streaming")
+    ]
+    assert [data["progress"]["streaming"][0]["items_parsed"] for data in partial] == [
+        1,
+        2,
+        3,
+    ]
+    assert all("limiter" in data["rate_limit_info"] for data in partial)
+    assert not any(saved_streaming)
+
+
+def test_finished_job_stream_sends_snapshot_only():
+    """已完成的工作只送出目前狀態後結束"""
+
+    async def run():
+        bus = ProgressEventBus()
+        snapshot = {"job_id": "old", "status": "done", "result": {"success": True}}
+        return [message async for message in bus.stream("old", snapshot=snapshot)]
+
+    messages = asyncio.run(run())
+    assert len(messages) == 1
+    assert parse_sse(messages[0])[1]["status"] == "done"
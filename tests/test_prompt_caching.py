@@ -0,0 +1,135 @@
+"""
+測試系統提示詞的prompt caching與快取token統計（使用本機模擬伺服器）
+"""
+
+import sys
+import os
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services.ai_service import (
+    ai_service,
+    prompt_cache_min_tokens,
+    RECEIPT_PREFIX_TOKENS,
+    RECEIPT_SYSTEM_PROMPT,
+)
+
+
+def start_stub_server(requests):
+    """模擬 /v1/messages：第一次回應寫入快取，之後回應讀取快取"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers["content-length"])
+            requests.append(json.loads(self.rfile.read(length)))
+            cached = len(requests) > 1
+            body = json.dumps(
+                {
+                    "content": [
+                        {
+                            "type": "tool_use",
+                            "name": "record_receipt",
+                            "input": {
+                                "store_name": "セブン",
+                                "date": "2024-08-17",
+                                "total_amount": 270,
+                            },
+                        }
+                    ],
+                    "usage": {
+                        "input_tokens": 80,
+                        "output_tokens": 120,
+                        "cache_creation_input_tokens": 0 if cached else 1500,
+                        "cache_read_input_tokens": 1500 if cached else 0,
+                    },
+                }
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_user_prompt_has_no_static_instructions():
+    """格式說明只在系統區塊中，使用者訊息只含收據內容"""
+    prompt = ai_service._build_receipt_prompt(
+        {"text": "セブン\n合計 270円", "confidence": 0.85}, {}
+    )
+    system = ai_service.receipt_system()
+
+    assert "セブン" in prompt
+    assert "store_name" not in prompt
+    assert system[0]["text"] == RECEIPT_SYSTEM_PROMPT
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_cache_control_only_when_prefix_reaches_minimum():
+    """工具與系統區塊的前綴達到模型的最小長度時才標記cache_control"""
+    # 主模型的前綴須達到最小長度，否則快取不會生效
+    assert RECEIPT_PREFIX_TOKENS >= prompt_cache_min_tokens(settings.claude_model)
+    assert prompt_cache_min_tokens("claude-haiku-4-5") == 4096
+    assert prompt_cache_min_tokens("claude-sonnet-4-5") == 1024
+
+    assert "cache_control" not in ai_service.receipt_system("claude-haiku-4-5")[0]
+    assert ai_service.prompt_cache_enabled("claude-haiku-4-5") is False
+    stats = ai_service.get_usage_stats()["prompt_cache"]
+    assert stats[ai_service.model]["enabled"] is True
+    assert stats[ai_service.model]["prefix_tokens"] == RECEIPT_PREFIX_TOKENS
+
+
+def test_requests_send_cached_system_block_and_record_usage():
+    """請求帶有cache_control的系統區塊，並累計API回報的快取寫入與讀取token（模擬伺服器的數值）"""
+    requests = []
+    server = start_stub_server(requests)
+    original = (
+        ai_service.base_url,
+        ai_service.test_mode,
+        ai_service.router.enabled,
+        dict(ai_service.usage),
+    )
+    ai_service.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+    ai_service.test_mode = False
+    ai_service.router.enabled = False
+    for field in ai_service.usage:
+        ai_service.usage[field] = 0
+    try:
+
+        async def run():
+            for text in ["セブン\n合計 270円", "ローソン\n合計 540円"]:
+                await ai_service.process_receipt_text(
+                    {"text": text, "confidence": 0.9}, {}
+                )
+
+        asyncio.run(run())
+        stats = ai_service.get_usage_stats()
+    finally:
+        ai_service.base_url, ai_service.test_mode, ai_service.router.enabled, usage = (
+            original
+        )
+        ai_service.usage.update(usage)
+        server.shutdown()
+        server.server_close()
+
+    assert requests[0]["system"] == requests[1]["system"]
+    assert requests[0]["tools"] == requests[1]["tools"]
+    assert requests[0]["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert (
+        requests[0]["messages"][0]["content"] != requests[1]["messages"][0]["content"]
+    )
+    assert stats["requests"] == 2
+    assert stats["cache_creation_input_tokens"] == 1500
+    assert stats["cache_read_input_tokens"] == 1500
+    assert stats["cache_hit_ratio"] == round(1500 / 3160, 3)
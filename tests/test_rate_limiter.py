@@ -0,0 +1,55 @@
+"""
+測試共用Token Bucket頻率限制器
+"""
+
+import sys
+import os
+import asyncio
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.rate_limiter import TokenBucket, RateLimiter
+
+
+def test_burst_then_paced():
+    """突發容量內不需等待，超出後依速率排隊"""
+    bucket = TokenBucket("test", rate_per_minute=600, capacity=2)  # 每秒10次
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    wait_third = bucket.reserve()
+    wait_fourth = bucket.reserve()
+    assert 0.05 < wait_third <= 0.1
+    assert 0.15 < wait_fourth <= 0.2
+
+
+def test_acquire_waits_for_capacity():
+    """acquire應實際等待可用配額"""
+    bucket = TokenBucket("test", rate_per_minute=1200, capacity=1)  # 每0.05秒1次
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    assert elapsed >= 0.14
+    assert bucket.total_acquired == 4
+
+
+def test_pause_blocks_callers():
+    """pause後應延後後續請求"""
+    bucket = TokenBucket("test", rate_per_minute=600, capacity=5)
+    bucket.pause(1.0)
+    assert bucket.reserve() > 0.9
+
+
+def test_tier_defaults():
+    """測試Azure層級預設值"""
+    limiter = RateLimiter()
+    assert limiter.rate_per_minute("azure") > 0
+    assert limiter.seconds_per_request("claude") > 0
+    status = limiter.get_status()
+    assert "azure" in status and "claude" in status
+    assert "tier" in status["azure"]
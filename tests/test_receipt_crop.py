@@ -0,0 +1,70 @@
+"""
+測試收據區域偵測、裁切與傾斜校正
+"""
+
+import sys
+import os
+import io
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.image_utils import image_utils
+
+
+def make_photo(angle=0.0, size=(1600, 1200), receipt=(360, 800)):
+    """深色桌面上放一張（可旋轉的）白色收據"""
+    width, height = size
+    photo = np.full((height, width, 3), 60, dtype=np.uint8)
+    paper = np.full((receipt[1], receipt[0], 3), 245, dtype=np.uint8)
+    for row in range(40, receipt[1] - 40, 30):
+        cv2.rectangle(paper, (30, row), (receipt[0] - 60, row + 8), (20, 20, 20), -1)
+
+    x = (width - receipt[0]) // 2
+    y = (height - receipt[1]) // 2
+    photo[y : y + receipt[1], x : x + receipt[0]] = paper
+    if angle:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        photo = cv2.warpAffine(photo, matrix, (width, height), borderValue=(60, 60, 60))
+    return photo
+
+
+def test_detects_and_deskews_rotated_receipt():
+    """旋轉的收據被裁切並拉正為直立的矩形"""
+    cropped, was_cropped = image_utils.crop_receipt(make_photo(angle=12))
+
+    assert was_cropped
+    height, width = cropped.shape[:2]
+    assert abs(width - 360) < 30 and abs(height - 800) < 30
+    # 拉正後四角應為紙張顏色而非桌面
+    assert cropped[10, 10].mean() > 200 and cropped[-10, -10].mean() > 200
+
+
+def test_no_crop_without_receipt():
+    """找不到收據或收據已佔滿畫面時不裁切"""
+    blank = np.full((600, 400, 3), 128, dtype=np.uint8)
+    assert image_utils.crop_receipt(blank)[1] is False
+
+    full = make_photo(size=(380, 820), receipt=(370, 810))
+    assert image_utils.crop_receipt(full)[1] is False
+
+
+def test_crop_shrinks_ocr_payload():
+    """裁切後上傳的位元組只包含收據區域"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "receipt.jpg")
+        cv2.imwrite(path, make_photo(angle=5))
+
+        data = image_utils.prepare_for_ocr(path, crop=True)
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.width < 500 and img.height < 900
+        assert len(data) < os.path.getsize(path)
+
+        processed = image_utils.preprocess_image(
+            path, os.path.join(tmp, "processed.jpg")
+        )
+        assert cv2.imread(processed, cv2.IMREAD_GRAYSCALE).shape[0] < 900
@@ -0,0 +1,200 @@
+"""
+測試僅追加的收據儲存：追加為執行紀錄、CSV按需匯出、舊版CSV快照匯入
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.receipt import ReceiptData, ReceiptItem
+from app.services.csv_service import CSVService
+
+
+def make_receipt(store_name, day, prices, source_image=""):
+    return ReceiptData(
+        store_name=store_name,
+        date=datetime(2024, 8, day),
+        total_amount=sum(prices),
+        items=[
+            ReceiptItem(name=f"商品{i}", price=price) for i, price in enumerate(prices)
+        ],
+        confidence_score=0.9,
+        processing_time=0.0,
+        source_image=source_image,
+    )
+
+
+def test_append_and_export_on_demand():
+    """追加不寫CSV；第一次讀取時才匯出，摘要由彙總表計算"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service = CSVService(output_dir=tmp)
+        try:
+            first = service.append_receipts(
+                [
+                    make_receipt("セブン", 17, [150, 120], "a.jpg"),
+                    make_receipt("ローソン", 18, [300]),
+                ]
+            )
+            second = service.append_receipts(
+                [
+                    make_receipt("セブン", 19, [500]),
+                    {
+                        "store_name": "skip",
+                        "date": "2024-08-20T00:00:00",
+                        "total_amount": 80,
+                    },
+                    "invalid",
+                ],
+                source="process",
+            )
+            files_before_export = sorted(
+                f for f in os.listdir(tmp) if f.endswith(".csv")
+            )
+
+            summary_name = os.path.basename(second["summary_csv"])
+            details_name = os.path.basename(second["details_csv"])
+            exported = service.ensure_export(summary_name)
+            exported_receipts = service.load_receipts_from_csv(second["summary_csv"])
+
+            listed = service.list_summary_files()
+            run_summary = service.get_run_summary(
+                os.path.basename(first["summary_csv"])
+            )
+            overall = service.store.summary()
+            newest = service.store.load_receipts(limit=2)
+            total = service.store.count()
+            unknown = service.ensure_export("receipts_summary_20000101_000000.csv")
+        finally:
+            service.store.close()
+
+    assert first["run_id"] != second["run_id"]
+    assert files_before_export == []
+    assert exported
+    assert [r.store_name for r in exported_receipts] == ["セブン", "skip"]
+    assert listed == [summary_name, os.path.basename(first["summary_csv"])]
+    assert details_name.endswith(f"{second['run_id']}.csv")
+    assert run_summary["total_receipts"] == 2
+    assert run_summary["total_amount"] == 570
+    assert run_summary["unique_stores"] == 2
+    assert overall["total_receipts"] == 4
+    assert overall["unique_stores"] == 3
+    assert overall["date_range"]["latest"] == datetime(2024, 8, 20)
+    assert [r.store_name for r in newest] == ["skip", "セブン"]
+    assert total == 4
+    assert not unknown
+
+
+def test_legacy_csv_snapshots_imported_once():
+    """既有的時間戳CSV快照在啟動時匯入為執行紀錄，明細對應回收據，重複啟動不重複匯入"""
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = CSVService(output_dir=os.path.join(tmp, "legacy"))
+        legacy.store.close()
+        receipts = [
+            make_receipt("セブン", 17, [150, 120]),
+            make_receipt("イオン", 18, [198]),
+        ]
+        legacy.save_receipts_to_csv(receipts, "receipts_summary_20240818_120000.csv")
+        legacy.save_detailed_items_csv(receipts, "receipts_details_20240818_120000.csv")
+
+        output_dir = os.path.join(tmp, "output")
+        os.makedirs(output_dir)
+        for name in os.listdir(legacy.output_dir):
+            if name.endswith(".csv"):
+                os.rename(
+                    os.path.join(legacy.output_dir, name),
+                    os.path.join(output_dir, name),
+                )
+
+        service = CSVService(output_dir=output_dir)
+        try:
+            imported = service.store.load_receipts("20240818_120000")
+            files = service.list_summary_files()
+        finally:
+            service.store.close()
+
+        restarted = CSVService(output_dir=output_dir)
+        try:
+            count_after_restart = restarted.store.count()
+        finally:
+            restarted.store.close()
+
+    assert files == ["receipts_summary_20240818_120000.csv"]
+    assert [r.store_name for r in imported] == ["セブン", "イオン"]
+    assert [item.price for item in imported[0].items] == [150, 120]
+    assert count_after_restart == 2
+
+
+def test_legacy_details_matched_by_row_order():
+    """同店同日的多張收據依列順序取回各自的明細，不互相合併"""
+    with tempfile.TemporaryDirectory() as tmp:
+        service = CSVService(output_dir=tmp)
+        try:
+            receipts = [
+                make_receipt("セブン", 17, [150, 120]),
+                make_receipt("イオン", 18, [198]),
+                make_receipt("セブン", 17, [500]),
+                make_receipt("セブン", 17, [80, 20]),
+            ]
+            service.save_receipts_to_csv(
+                receipts, "receipts_summary_20240818_120000.csv"
+            )
+            service.save_detailed_items_csv(
+                receipts, "receipts_details_20240818_120000.csv"
+            )
+            imported = service._assign_detail_items(
+                service.load_receipts_from_csv(
+                    os.path.join(tmp, "receipts_summary_20240818_120000.csv")
+                ),
+                service._load_detail_rows(
+                    os.path.join(tmp, "receipts_details_20240818_120000.csv")
+                ),
+            )
+        finally:
+            service.store.close()
+
+    assert [[item.price for item in receipt.items] for receipt in imported] == [
+        [150, 120],
+        [198],
+        [500],
+        [80, 20],
+    ]
+
+
+def test_download_exports_run_on_demand():
+    """下載尚未匯出的執行紀錄CSV時才產生檔案"""
+    from fastapi.testclient import TestClient
+    from app.config import settings
+
+    # 匯入app.main會建立上傳目錄，測試後移除以免影響其他測試
+    created_dir = not os.path.exists(settings.upload_dir)
+    from app import main
+
+    original_service, original_output_dir = main.csv_service, main.settings.output_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        service = CSVService(output_dir=tmp)
+        main.csv_service = service
+        main.settings.output_dir = tmp
+        try:
+            paths = service.append_receipts([make_receipt("セブン", 17, [150, 120])])
+            summary_name = os.path.basename(paths["summary_csv"])
+            exported_before = os.path.exists(paths["summary_csv"])
+
+            client = TestClient(main.app)
+            response = client.get(f"/download/{summary_name}")
+            missing = client.get("/download/receipts_summary_20000101_000000.csv")
+        finally:
+            main.csv_service, main.settings.output_dir = (
+                original_service,
+                original_output_dir,
+            )
+            service.store.close()
+            if created_dir and os.path.isdir(settings.upload_dir):
+                os.removedirs(settings.upload_dir)
+
+    assert not exported_before
+    assert response.status_code == 200
+    assert "セブン" in response.text
+    assert missing.status_code == 404
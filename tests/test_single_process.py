@@ -0,0 +1,95 @@
+"""
+測試單張處理（/process）經過與批量相同的管線與內容定址暫存
+"""
+
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services import optimized_batch_processor as optimized_module
+from app.services.ai_service import ai_service
+from app.services.cache_service import CacheService
+from app.services.content_hash import PREPROCESS_ENHANCE, PREPROCESS_RAW
+from app.services.image_worker_pool import image_worker_pool
+from app.services.ocr_service import ocr_service
+from app.services.optimized_batch_processor import optimized_batch_processor
+
+
+def test_process_single_uses_pipeline_and_cache():
+    """單張處理使用指定的預處理，相同內容的第二次上傳直接使用暫存並刪除成功的圖片"""
+    ocr_calls = []
+    prepare_calls = []
+
+    async def fake_extract_text(image_path, image_data=None):
+        ocr_calls.append(os.path.basename(image_path))
+        return ocr_service._get_mock_ocr_result(image_path)
+
+    async def fake_prepare(file_path, **kwargs):
+        prepare_calls.append(kwargs)
+        return b"prepared"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        upload_dir = os.path.join(tmp, "receipts")
+        os.makedirs(upload_dir)
+        Image.new("RGB", (60, 40), color="white").save(
+            os.path.join(upload_dir, "a.jpg")
+        )
+        shutil.copy(
+            os.path.join(upload_dir, "a.jpg"), os.path.join(upload_dir, "b.jpg")
+        )
+
+        cache = CacheService(cache_dir=os.path.join(tmp, "cache"))
+        original = (
+            settings.upload_dir,
+            optimized_module.cache_service,
+            ai_service.test_mode,
+            ocr_service.extract_text,
+            image_worker_pool.prepare_for_ocr,
+        )
+        settings.upload_dir = upload_dir
+        optimized_module.cache_service = cache
+        ai_service.test_mode = True
+        ocr_service.extract_text = fake_extract_text
+        image_worker_pool.prepare_for_ocr = fake_prepare
+        try:
+            first = asyncio.run(
+                optimized_batch_processor.process_single(
+                    "a.jpg", preprocessing=PREPROCESS_ENHANCE
+                )
+            )
+            second = asyncio.run(
+                optimized_batch_processor.process_single(
+                    "b.jpg", preprocessing=PREPROCESS_ENHANCE
+                )
+            )
+            missing = asyncio.run(
+                optimized_batch_processor.process_single(
+                    "missing.jpg", preprocessing=PREPROCESS_RAW
+                )
+            )
+            remaining = sorted(os.listdir(upload_dir))
+        finally:
+            (
+                settings.upload_dir,
+                optimized_module.cache_service,
+                ai_service.test_mode,
+                ocr_service.extract_text,
+                image_worker_pool.prepare_for_ocr,
+            ) = original
+            cache.store.close()
+
+    assert first["success"] and second["success"]
+    assert first["data"].source_image == "a.jpg"
+    assert second["data"].source_image == "b.jpg"
+    assert ocr_calls == ["a.jpg"]
+    assert prepare_calls == [{"enhance": True}]
+    assert remaining == []
+    assert not missing["success"]
+    assert first["processing_time"] >= 0
@@ -0,0 +1,218 @@
+"""
+測試Claude串流回應、商品逐項解析與閒置逾時（使用本機模擬伺服器）
+"""
+
+import sys
+import os
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings
+from app.services.ai_service import AIService
+from app.services.batch_progress import BatchProgress
+from app.services.retry_policy import CircuitBreaker, RetryPolicy
+from app.services.stream_parser import IncrementalItemParser
+
+ITEMS = [{"name": f"商品{i}", "price": 100 + i, "quantity": 1} for i in range(5)]
+TOOL_INPUT = json.dumps(
+    {"store_name": "イオン", "date": "2024-08-17", "total_amount": 510, "items": ITEMS},
+    ensure_ascii=False,
+)
+
+
+def sse_events(fragment_size=7, overloaded=False):
+    """組成串流事件（工具輸入切成小片段）"""
+    events = [
+        {
+            "type": "message_start",
+            "message": {
+                "id": "msg_1",
+                "role": "assistant",
+                "content": [],
+                "usage": {"input_tokens": 90, "output_tokens": 1},
+            },
+        },
+        {
+            "type": "content_block_start",
+            "index": 0,
+            "content_block": {
+                "type": "tool_use",
+                "id": "toolu_1",
+                "name": "record_receipt",
+                "input": {},
+            },
+        },
+    ]
+    for start in range(0, len(TOOL_INPUT), fragment_size):
+        events.append(
+            {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {
+                    "type": "input_json_delta",
+                    "partial_json": TOOL_INPUT[start : start + fragment_size],
+                },
+            }
+        )
+        if overloaded and start > len(TOOL_INPUT) // 2:
+            events.append(
+                {
+                    "type": "error",
+                    "error": {"type": "overloaded_error", "message": "Overloaded"},
+                }
+            )
+            return events
+    events += [
+        {"type": "content_block_stop", "index": 0},
+        {
+            "type": "message_delta",
+            "delta": {"stop_reason": "tool_use"},
+            "usage": {"output_tokens": 180},
+        },
+        {"type": "message_stop"},
+    ]
+    return events
+
+
+def start_stub_server(requests, delay=0.0, fail_first=False):
+    """以SSE回應 /v1/messages；delay為每個事件之間的間隔"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            requests.append(
+                json.loads(self.rfile.read(int(self.headers["content-length"])))
+            )
+            overloaded = fail_first and len(requests) == 1
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            for event in sse_events(overloaded=overloaded):
+                self.wfile.write(
+                    f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode(
+                        "utf-8"
+                    )
+                )
+                self.wfile.flush()
+                if delay:
+                    time.sleep(delay)
+            self.close_connection = True
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_service(server):
+    service = AIService()
+    service.test_mode = False
+    service.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+    service.retry_policy = RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.05)
+    service.circuit_breaker = CircuitBreaker("claude-test", 5, reset_seconds=60)
+    return service
+
+
+def test_parser_handles_arbitrary_fragments():
+    """任意切割的片段都能在商品完成時立即解析"""
+    for size in (1, 3, 50):
+        parser = IncrementalItemParser()
+        seen = []
+        for start in range(0, len(TOOL_INPUT), size):
+            seen.extend(parser.feed(TOOL_INPUT[start : start + size]))
+        assert seen == ITEMS
+
+    batch = json.dumps(
+        {
+            "receipts": [
+                {"id": "R1", "items": ITEMS[:2]},
+                {"id": "R2", "note": 'a}["items":', "items": ITEMS[2:]},
+            ]
+        }
+    )
+    parser = IncrementalItemParser()
+    parser.feed(batch)
+    assert parser.items == ITEMS
+
+
+def test_streamed_response_reports_items_and_usage():
+    """串流回應重組為工具輸入，逐項回報商品數並記錄token使用量"""
+    requests = []
+    server = start_stub_server(requests)
+    service = make_service(server)
+    progress = BatchProgress()
+    progress.start(1)
+    snapshots = []
+    progress.on_partial = lambda p: snapshots.append(p.get_progress()["streaming"])
+
+    def on_progress(count):
+        progress.update_partial("aeon.jpg", count)
+
+    try:
+
+        async def run():
+            receipt = await service.process_receipt_text(
+                {"text": "イオン", "confidence": 0.9}, {}, on_progress=on_progress
+            )
+            await service.aclose()
+            return receipt
+
+        receipt = asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert requests[0]["stream"] is True
+    assert [item.name for item in receipt.items] == [item["name"] for item in ITEMS]
+    assert [s[0]["items_parsed"] for s in snapshots] == [1, 2, 3, 4, 5]
+    assert service.usage["input_tokens"] == 90
+    assert service.usage["output_tokens"] == 180
+
+    progress.advance("aeon.jpg", True)
+    assert progress.get_progress()["streaming"] == []
+
+
+def test_idle_timeout_not_total_duration():
+    """總時間超過閒置逾時，但事件持續到達時不會逾時"""
+    requests = []
+    server = start_stub_server(requests, delay=0.02)
+    service = make_service(server)
+    original = settings.claude_stream_idle_timeout
+    settings.claude_stream_idle_timeout = 0.5
+    try:
+        start = time.monotonic()
+        receipt = asyncio.run(
+            service.process_receipt_text({"text": "イオン", "confidence": 0.9}, {})
+        )
+        elapsed = time.monotonic() - start
+    finally:
+        settings.claude_stream_idle_timeout = original
+        server.shutdown()
+        server.server_close()
+
+    assert elapsed > 0.5
+    assert len(receipt.items) == 5
+    assert len(requests) == 1
+
+
+def test_overloaded_mid_stream_is_retried():
+    """串流中途的overloaded錯誤會重試"""
+    requests = []
+    server = start_stub_server(requests, fail_first=True)
+    service = make_service(server)
+    try:
+        receipt = asyncio.run(
+            service.process_receipt_text({"text": "イオン", "confidence": 0.9}, {})
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert len(requests) == 2
+    assert receipt.total_amount == 510
@@ -0,0 +1,44 @@
+"""
+測試OCR結構化資料的單次掃描提取（全形正規化、日期、時間與日圓金額）
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ocr_service import ocr_service
+
+
+def extract(text):
+    return ocr_service.extract_structured_data(
+        {"success": True, "text": text, "words": []}
+    )
+
+
+def test_entities_in_text_order():
+    """日期、時間與金額依出現順序取出，日期統一為YYYY-MM-DD"""
+    data = extract("セブン-イレブン\n2024年8月7日 9:05\n10/20/2024\n2024-1-2 12時30分")
+
+    assert data["dates"] == ["2024-08-07", "2024-10-20", "2024-01-02"]
+    assert data["times"] == ["09:05", "12:30"]
+    assert data["store_names"] == ["セブン-イレブン"]
+
+
+def test_fullwidth_and_yen_symbols():
+    """全形數字、￥前綴與千分位都視為日圓金額"""
+    data = extract(
+        "ローソン\n２０２４／０８／１７ １４：３０\n弁当 ￥1,280\nお茶 １５０円\n合計 ¥1,430"
+    )
+
+    assert data["numbers"] == [1280, 150, 1430]
+    assert data["total_amount"] == 1430
+    assert data["items_count"] == 3
+    assert data["dates"] == ["2024-08-17"]
+    assert data["times"] == ["14:30"]
+
+
+def test_failed_ocr_returns_empty():
+    """OCR失敗時不提取"""
+    assert ocr_service.extract_structured_data({"success": False}) == {}
+    assert extract("")["numbers"] == []
@@ -0,0 +1,109 @@
+"""
+測試以工具輸入格式取得結構化輸出並以Pydantic模型驗證
+"""
+
+import sys
+import os
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.receipt import ReceiptExtraction
+from app.services.ai_service import ai_service, RECEIPT_TOOL, RECEIPT_BATCH_TOOL
+
+VALID_INPUT = {
+    "store_name": "セブン-イレブン",
+    "date": "2024-08-17",
+    "total_amount": 270,
+    "items": [
+        {"name": "おにぎり", "name_chinese": "飯糰", "price": "120", "quantity": None},
+        {"name": "コーヒー", "price": 150, "quantity": 1},
+    ],
+    "tax_type": "內含稅",
+}
+
+
+def reset_stats():
+    original = dict(ai_service.parse_stats)
+    ai_service.parse_stats.update({"parsed": 0, "parse_failures": 0})
+    return original
+
+
+def test_tool_schemas_generated_from_models():
+    """工具輸入格式由Pydantic模型產生"""
+    assert RECEIPT_TOOL["input_schema"] == ReceiptExtraction.model_json_schema()
+    schema = RECEIPT_TOOL["input_schema"]
+    assert {"store_name", "date", "total_amount"} <= set(schema["required"])
+    assert "ReceiptItem" in schema["$defs"]
+    assert "receipts" in RECEIPT_BATCH_TOOL["input_schema"]["properties"]
+
+
+def test_valid_tool_input_builds_receipt():
+    """工具輸入一次驗證後轉換為ReceiptData"""
+    original = reset_stats()
+    try:
+        receipt = ai_service._receipt_from_tool_input(VALID_INPUT, {"confidence": 0.9})
+        stats = dict(ai_service.parse_stats)
+    finally:
+        ai_service.parse_stats.update(original)
+
+    assert receipt.store_name == "セブン-イレブン"
+    assert receipt.date.year == 2024
+    assert receipt.items[0].price == 120.0
+    assert receipt.items[0].quantity == 1
+    assert receipt.confidence_score == 0.9
+    assert stats == {"parsed": 1, "parse_failures": 0}
+
+
+def test_invalid_tool_input_counts_failure():
+    """未通過驗證的輸入拋出例外並累計失敗次數"""
+    original = reset_stats()
+    invalid_inputs = [
+        {**VALID_INPUT, "total_amount": {"currency": "JPY"}},
+        {**VALID_INPUT, "date": "2024-13-45"},
+        {**VALID_INPUT, "tax_type": {"standard_rate": 10}},
+    ]
+    try:
+        failures = 0
+        for data in invalid_inputs:
+            try:
+                ai_service._receipt_from_tool_input(data, {"confidence": 0.9})
+            except Exception:
+                failures += 1
+        stats = ai_service.get_usage_stats()["structured_output"]
+    finally:
+        ai_service.parse_stats.update(original)
+
+    assert failures == 3
+    assert stats == {"parsed": 0, "parse_failures": 3}
+
+
+def test_process_receipt_forces_tool_choice():
+    """單張收據請求強制使用record_receipt工具"""
+    calls = []
+
+    async def fake_post(payload, on_progress=None):
+        calls.append(payload)
+        return {
+            "content": [
+                {"type": "tool_use", "name": "record_receipt", "input": VALID_INPUT}
+            ],
+            "stop_reason": "tool_use",
+        }
+
+    original = (ai_service._post_message, ai_service.test_mode)
+    ai_service._post_message = fake_post
+    ai_service.test_mode = False
+    try:
+        receipt = asyncio.run(
+            ai_service.process_receipt_text({"text": "セブン", "confidence": 0.8}, {})
+        )
+    finally:
+        ai_service._post_message, ai_service.test_mode = original
+
+    assert receipt.total_amount == 270
+    assert calls[0]["tool_choice"] == {"type": "tool", "name": "record_receipt"}
+    assert [tool["name"] for tool in calls[0]["tools"]] == [
+        "record_receipt",
+        "record_receipts",
+    ]